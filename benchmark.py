@@ -0,0 +1,67 @@
+"""
+Time the stages of the pipeline on a synthetic corpus and compare them with a stored baseline.
+    python benchmark.py --save_baseline True
+    python benchmark.py --stages tokenize,model_forward --fail_on_regression True
+"""
+
+import random
+import sys
+
+import numpy as np
+import torch
+
+from common.benchmark_util import save_baseline, load_baseline, compare_with_baseline, format_results, \
+    format_comparison
+from experiment.benchmark_stages import STAGES, run_benchmark_stages
+
+
+if __name__ == '__main__':
+    import argparse
+
+    torch.manual_seed(100)
+    random.seed(100)
+    np.random.seed(100)
+
+    def boolean_string(s):
+        if s not in {'False', 'True'}:
+            raise ValueError('Not a valid boolean string')
+        return s == 'True'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", type=str, default=','.join(STAGES))
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--length", type=int, default=150)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--hidden_size", type=int, default=128)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--baseline", type=str, default=None)
+    parser.add_argument("--save_baseline", type=boolean_string, default=False)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--fail_on_regression", type=boolean_string, default=False)
+    args = parser.parse_args()
+
+    baseline_path = args.baseline
+    if baseline_path is None:
+        from config import benchmark_baseline_path
+        baseline_path = benchmark_baseline_path
+    meta = {'count': args.count, 'length': args.length, 'batch_size': args.batch_size,
+            'hidden_size': args.hidden_size, 'torch_threads': torch.get_num_threads()}
+
+    results = run_benchmark_stages(stages=args.stages.split(','), count=args.count, length=args.length,
+                                   batch_size=args.batch_size, hidden_size=args.hidden_size, warmup=args.warmup)
+    print(format_results(results))
+
+    baseline_meta, baseline_results = load_baseline(baseline_path)
+    if args.save_baseline:
+        baseline_results.update({r['stage']: r for r in results})
+        save_baseline([baseline_results[s] for s in STAGES if s in baseline_results], baseline_path, meta)
+        print('save the baseline to {}'.format(baseline_path))
+    elif baseline_meta is None:
+        print('no baseline in {}, save one by --save_baseline True'.format(baseline_path))
+    else:
+        if baseline_meta != meta:
+            print('the baseline settings {} are different from {}'.format(baseline_meta, meta))
+        comparison = compare_with_baseline(results, baseline_results, threshold=args.threshold)
+        print(format_comparison(comparison))
+        if args.fail_on_regression and any(c[-1] for c in comparison):
+            sys.exit(1)
@@ -199,11 +199,19 @@ def ast_config():
     return ast_config.config
 
 
-def parse_ast_code_graph(token_list, ):
+def create_code_graph(token_list):
     ast, tokens = ast_parse("\n"+" ".join(token_list))
     return CodeGraph(tokens, ast, add_sequence_link=ast_config()['add_sequence_link'])
 
 
+def parse_ast_code_graph(token_list, ):
+    from common.args_util import get_code_graph_cache
+    code_graph_cache = get_code_graph_cache()
+    if code_graph_cache is not None:
+        return code_graph_cache.get_or_parse(token_list)
+    return create_code_graph(token_list)
+
+
 if __name__ == '__main__':
     # load_ast_parser()
     # code1 = """
@@ -0,0 +1,228 @@
+"""
+The cache of the ast code graphs. parse_ast_code_graph parses the code by pycparser and builds a CodeGraph every time,
+so a dataset with use_ast parses every sample in every epoch and the multi step fixing parses every step again.
+Here a code graph is saved as the node list and the typed edge arrays in a sqlite store keyed by the hash of the token
+list, and the recently used graphs are kept in a LRU in memory. The store can be filled by the worker processes in a
+precompute pass before the training.
+"""
+
+import collections
+import hashlib
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import threading
+
+import numpy as np
+
+from c_parser.ast_parser import create_code_graph, ast_config
+
+FORMAT_VERSION = 1
+
+CREATE_CODE_GRAPH_CACHE = r'''CREATE TABLE IF NOT EXISTS code_graph_cache (
+  key TEXT PRIMARY KEY,
+  graph BLOB
+)'''
+
+
+def code_graph_key(token_list, add_sequence_link=False):
+    key = '{}\x01{}\x01{}'.format(FORMAT_VERSION, int(add_sequence_link), '\x00'.join(token_list))
+    return hashlib.sha1(key.encode('utf-8', errors='replace')).hexdigest()
+
+
+def encode_code_graph(code_graph):
+    nodes, links = code_graph.graph
+    link_types = sorted(set(link[2] for link in links))
+    link_type_id = {t: i for i, t in enumerate(link_types)}
+    edges = np.array([(a, b) for a, b, _ in links], dtype=np.int32).reshape(-1, 2)
+    edge_types = np.array([link_type_id[t] for _, _, t in links], dtype=np.int16)
+    return pickle.dumps((code_graph.code_length, nodes, edges, edge_types, link_types),
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode_code_graph(data):
+    return CachedCodeGraph(*pickle.loads(data))
+
+
+class CachedCodeGraph(object):
+    """
+    a code graph read from the cache. It has the same properties as CodeGraph.
+    """
+    __slots__ = ('code_length', 'nodes', 'edges', 'edge_types', 'link_types', '_links')
+
+    def __init__(self, code_length, nodes, edges, edge_types, link_types):
+        self.code_length = code_length
+        self.nodes = nodes
+        self.edges = edges
+        self.edge_types = edge_types
+        self.link_types = link_types
+        self._links = None
+
+    @property
+    def graph_length(self):
+        return len(self.nodes)
+
+    @property
+    def graph(self):
+        """
+        :return: (the graph node list, the link tuple list (node1_id, node2_id, link_type)) as CodeGraph.graph
+        """
+        if self._links is None:
+            link_types = self.link_types
+            self._links = [(a, b, link_types[t]) for (a, b), t in zip(self.edges.tolist(), self.edge_types.tolist())]
+        return self.nodes, self._links
+
+    def __str__(self):
+        nodes, links = self.graph
+        res = "The graph nodes:{}\n".format(" ".join(nodes))
+        res += "\n".join(["{}:{}->{}:{} type:{}".format(a, nodes[a], b, nodes[b], t) for a, b, t in links])
+        return res
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def _encode_token_lists(token_lists):
+    res = []
+    for token_list in token_lists:
+        try:
+            res.append(encode_code_graph(create_code_graph(token_list)))
+        except Exception as e:
+            res.append(None)
+    return res
+
+
+class CodeGraphCache(object):
+    def __init__(self, db_path=None, lru_size=10000, core_num=0, shard_size=100):
+        """
+        :param db_path: the sqlite file path of the store. Only the LRU is used if it is None
+        :param lru_size: the max number of graphs kept in memory
+        :param core_num: the number of worker processes of precompute
+        """
+        self.db_path = db_path
+        self.lru_size = lru_size
+        self.core_num = core_num
+        self.shard_size = shard_size
+        self.owner_pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        self._lru = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self.con = None
+        if db_path is not None:
+            db_dir = os.path.dirname(os.path.abspath(db_path))
+            if not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            self.con = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+            self.con.execute('PRAGMA journal_mode=WAL')
+            self.con.execute('PRAGMA synchronous=NORMAL')
+            self.con.execute(CREATE_CODE_GRAPH_CACHE)
+            self.con.commit()
+
+    def _lru_get(self, key):
+        graph = self._lru.get(key, None)
+        if graph is not None:
+            self._lru.move_to_end(key)
+        return graph
+
+    def _lru_put(self, key, graph):
+        self._lru[key] = graph
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _store_get(self, key):
+        if self.con is None:
+            return None
+        with self._lock:
+            row = self.con.execute('SELECT graph FROM code_graph_cache WHERE key=?', (key, )).fetchone()
+        return row[0] if row is not None else None
+
+    def _store_keys(self, keys):
+        found = set()
+        if self.con is None:
+            return found
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i+500]
+                sql = 'SELECT key FROM code_graph_cache WHERE key IN ({})'.format(','.join('?' * len(part)))
+                found.update(r[0] for r in self.con.execute(sql, part))
+        return found
+
+    def _store_put_many(self, keys, encoded_list):
+        if self.con is None:
+            return
+        with self._lock:
+            self.con.executemany('INSERT OR REPLACE INTO code_graph_cache (key, graph) VALUES (?, ?)',
+                                 list(zip(keys, encoded_list)))
+            self.con.commit()
+
+    def get_or_parse(self, token_list):
+        """
+        :return: the CachedCodeGraph of the token list. It is parsed and saved if not in the cache. The exception of
+        parsing is raised as parse_ast_code_graph.
+        """
+        key = code_graph_key(token_list, ast_config()['add_sequence_link'])
+        with self._lock:
+            graph = self._lru_get(key)
+        if graph is None:
+            data = self._store_get(key)
+            if data is None:
+                self.misses += 1
+                data = encode_code_graph(create_code_graph(token_list))
+                self._store_put_many([key], [data])
+            else:
+                self.hits += 1
+            graph = decode_code_graph(data)
+            with self._lock:
+                self._lru_put(key, graph)
+        else:
+            self.hits += 1
+        return graph
+
+    def precompute(self, token_lists):
+        """
+        parse the code graphs of the token lists not in the store by the worker processes and save them.
+        :return: the number of the parsed token lists
+        """
+        add_sequence_link = ast_config()['add_sequence_link']
+        missed = collections.OrderedDict()
+        for token_list in token_lists:
+            missed[code_graph_key(token_list, add_sequence_link)] = token_list
+        for key in self._store_keys(list(missed.keys())):
+            del missed[key]
+        if len(missed) == 0:
+            return 0
+        token_lists = list(missed.values())
+        core_num = 0 if multiprocessing.current_process().daemon else self.core_num
+        if core_num <= 0 or len(token_lists) <= self.shard_size:
+            encoded_list = _encode_token_lists(token_lists)
+        else:
+            shards = [token_lists[i:i+self.shard_size] for i in range(0, len(token_lists), self.shard_size)]
+            with multiprocessing.Pool(core_num) as pool:
+                encoded_list = [encoded for res in pool.map(_encode_token_lists, shards) for encoded in res]
+        items = [(key, encoded) for key, encoded in zip(missed.keys(), encoded_list) if encoded is not None]
+        if self.con is None:
+            with self._lock:
+                for key, encoded in items:
+                    self._lru_put(key, decode_code_graph(encoded))
+        else:
+            self._store_put_many([k for k, _ in items], [e for _, e in items])
+        return len(token_lists)
+
+    def __len__(self):
+        if self.con is None:
+            return len(self._lru)
+        with self._lock:
+            return self.con.execute('SELECT COUNT(*) FROM code_graph_cache').fetchone()[0]
+
+    def __str__(self):
+        total = self.hits + self.misses
+        hit_ratio = self.hits / total if total > 0 else 0
+        return 'code graph cache hits: {}, misses: {}, hit ratio: {:.4f}'.format(self.hits, self.misses, hit_ratio)
+
+    def close(self):
+        if self.con is not None:
+            self.con.close()
+            self.con = None
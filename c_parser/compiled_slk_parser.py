@@ -0,0 +1,219 @@
+"""
+The SLK tables in C99SLKConstants compiled into NumPy arrays for the grammar mask of a whole known token sequence.
+DynamicSLKParser is a generator which waits for the next token and yields the compatible terminal set as python sets.
+CompiledSLKParser runs the same LL(k) algorithm over a whole sequence in one call: the parse and conflict tables are
+two dimension arrays indexed by (symbol, token), the productions are precomputed as reversed right hand sides and the
+compatible terminals are python int bitsets. It returns the same compatible terminals and typedef names as
+PackedDynamicSLKParser.get_all_compatible_token.
+"""
+
+import numpy as np
+
+from c_parser.slk_parser import C99SLKConstants, C99LabelVocabulary, SLKProductionVocabulary
+from common.constants import c_standard_library_defined_types
+
+
+class CompiledSLKTables(object):
+    def __init__(self, slk_constants: C99SLKConstants):
+        c = slk_constants
+        self.slk_constants = c
+        self.END_OF_SLK_INPUT_ = c.END_OF_SLK_INPUT_
+        self.START_SYMBOL = c.START_SYMBOL
+        self.START_ACTION = c.START_ACTION
+        self.END_ACTION = c.END_ACTION
+        self.START_CONFLICT = c.START_CONFLICT
+
+        parse_table = np.array(c.parse_table, dtype=np.int32)
+        parse_row = np.array(c.parse_row, dtype=np.int32)
+        conflict_table = np.array(c.conflict_table, dtype=np.int32)
+        conflict_row = np.array(c.conflict_row, dtype=np.int32)
+        tokens = np.arange(c.START_SYMBOL)
+        # [non terminal symbol - START_SYMBOL, token]
+        self.parse_matrix = parse_table[parse_row[1:c.START_ACTION - c.START_SYMBOL + 1, None] + tokens[None, :]]
+        # [conflict entry - START_CONFLICT, token]
+        self.conflict_matrix = conflict_table[conflict_row[1:c.TOTAL_CONFLICTS + 1, None] + tokens[None, :]]
+
+        # the first and the last items of production_row are 0
+        production_count = len(c.production_row) - 1
+        self.production_lhs = np.zeros(production_count, dtype=np.int32)
+        self.production_rhs_reversed = [()]
+        for p in range(1, production_count):
+            production_array = c.get_production_array(p)
+            self.production_lhs[p] = production_array[0]
+            self.production_rhs_reversed.append(tuple(reversed(production_array[1:])))
+
+        production_vocabulary = SLKProductionVocabulary(c)
+        # the symbol -> (bitset of the terminals which can follow the symbol when it is empty, bitset of the terminals
+        # which begin the symbol). It is None for the action symbols except the EMPTY symbol as _get_matched_terminal_node
+        self.compact_bitset = [None] * c.END_ACTION
+        for symbol in range(1, c.END_ACTION):
+            if c.is_terminal(symbol) or symbol == production_vocabulary.EMPTY_id:
+                self.compact_bitset[symbol] = (0, 1 << symbol)
+            elif c.is_non_terminal(symbol):
+                past, before = production_vocabulary._get_matched_terminal_node(symbol)
+                self.compact_bitset[symbol] = (to_bitset(past), to_bitset(before))
+        # the conflict entry - START_CONFLICT -> the bitset of the terminals with a nonzero entry
+        self.conflict_bitset = [to_bitset(np.nonzero(row[1:])[0] + 1) for row in self.conflict_matrix]
+
+    def matched_terminal_bitset(self, stack):
+        """
+        the same as SLKProductionVocabulary.get_matched_terminal_node but returns a bitset
+        """
+        compact_bitset = self.compact_bitset
+        candidate, res = compact_bitset[stack[-1]]
+        START_ACTION = self.START_ACTION
+        END_ACTION = self.END_ACTION
+        for i in range(len(stack) - 2, -1, -1):
+            symbol = stack[i]
+            if symbol == 0:
+                break
+            if START_ACTION <= symbol < END_ACTION:
+                continue
+            past, before = compact_bitset[symbol]
+            res |= before & candidate
+            candidate &= past
+            if not candidate:
+                break
+        if candidate >> self.END_OF_SLK_INPUT_ & 1:
+            res |= 1 << self.END_OF_SLK_INPUT_
+        return res
+
+
+def to_bitset(symbols):
+    res = 0
+    for s in symbols:
+        res |= 1 << int(s)
+    return res
+
+
+def iter_bitset(bitset):
+    while bitset:
+        low = bitset & -bitset
+        yield low.bit_length() - 1
+        bitset ^= low
+
+
+class CompiledSLKParser(object):
+    def __init__(self, slk_constants: C99SLKConstants=None, label_vocabulary: C99LabelVocabulary=None):
+        if slk_constants is None:
+            slk_constants = C99SLKConstants()
+        if label_vocabulary is None:
+            label_vocabulary = C99LabelVocabulary(slk_constants)
+        self.tables = CompiledSLKTables(slk_constants)
+        self.label_vocabulary = label_vocabulary
+        self.ID = label_vocabulary.get_label_id('ID')
+        self.TYPEID = label_vocabulary.get_label_id('TYPEID')
+        # the matrices are only indexed by python int in the parse loop, the lists are much faster than the arrays
+        self._parse_rows = self.tables.parse_matrix.tolist()
+        self._conflict_rows = self.tables.conflict_matrix.tolist()
+        self._production_lhs = self.tables.production_lhs.tolist()
+        self._label_tuple_cache = {}
+
+    def _report_error(self, symbol, token):
+        raise ValueError("Now symbol is {} and now token is {}".format(self.label_vocabulary.get_symbol_name(symbol),
+                                                                       self.label_vocabulary.get_symbol_name(token)))
+
+    def bitset_to_labels(self, bitset):
+        if bitset not in self._label_tuple_cache:
+            self._label_tuple_cache[bitset] = tuple(self.label_vocabulary.get_label_by_id(t)
+                                                    for t in iter_bitset(bitset))
+        return self._label_tuple_cache[bitset]
+
+    def parse(self, labels, values):
+        """
+        :param labels: the label id of each token, such as label_vocabulary.get_label_id(token.type)
+        :param values: the value of each token
+        :return: (a list of the compatible terminal bitset, a list of the frozenset of the typedef names defined in
+        the code) of the len(labels)+1 positions. The typedef names don't contain c_standard_library_defined_types.
+        """
+        t = self.tables
+        parse_rows = self._parse_rows
+        conflict_rows = self._conflict_rows
+        production_lhs = self._production_lhs
+        production_rhs_reversed = t.production_rhs_reversed
+        conflict_bitset = t.conflict_bitset
+        START_SYMBOL = t.START_SYMBOL
+        START_ACTION = t.START_ACTION
+        END_ACTION = t.END_ACTION
+        START_CONFLICT = t.START_CONFLICT
+        ID = self.ID
+        TYPEID = self.TYPEID
+
+        total = len(labels) + 1
+        res_bits = []
+        res_names = []
+        # the same as the scopes of CAction
+        scopes = [c_standard_library_defined_types, set()]
+        names_cache = [None]
+        is_typeid = [False] * len(labels)
+
+        def record(bitset):
+            if names_cache[0] is None:
+                names = set()
+                for scope in scopes[1:]:
+                    names |= scope
+                names_cache[0] = frozenset(names)
+            res_bits.append(bitset)
+            res_names.append(names_cache[0])
+            return len(res_bits) >= total
+
+        def label_of(i):
+            # the same as DynamicLexTokens._typename_to_id. A token is TYPEID forever once it is found as TYPEID.
+            if is_typeid[i]:
+                return TYPEID
+            label = labels[i]
+            if label == ID:
+                v = values[i]
+                for scope in reversed(scopes):
+                    if v in scope:
+                        is_typeid[i] = True
+                        return TYPEID
+            return label
+
+        stack = [0, START_SYMBOL]
+        pos = 0
+        last_value = None
+        if record(t.matched_terminal_bitset(stack)):
+            return res_bits, res_names
+        token = label_of(pos)
+        pos += 1
+        while stack[-1] != 0:
+            symbol = stack.pop()
+            if START_ACTION <= symbol < END_ACTION:
+                action_id = symbol - (START_ACTION - 1)
+                if action_id == 2:
+                    scopes[-1].add(last_value)
+                    names_cache[0] = None
+                elif action_id == 3:
+                    scopes.append(set())
+                    names_cache[0] = None
+                elif action_id == 4:
+                    scopes.pop()
+                    names_cache[0] = None
+            elif START_SYMBOL <= symbol < START_ACTION:
+                entry = parse_rows[symbol - START_SYMBOL][token]
+                level = 1
+                while entry >= START_CONFLICT:
+                    index = pos + level - 1
+                    if index >= len(res_bits):
+                        if record(conflict_bitset[entry - START_CONFLICT]):
+                            return res_bits, res_names
+                    entry = conflict_rows[entry - START_CONFLICT][label_of(index)]
+                    level += 1
+                if entry != 0 and production_lhs[entry] == symbol:
+                    stack.extend(production_rhs_reversed[entry])
+                else:
+                    self._report_error(symbol, token)
+            elif 0 < symbol < START_SYMBOL:
+                if symbol == token:
+                    last_value = values[pos - 1]
+                    if pos >= len(res_bits):
+                        if record(t.matched_terminal_bitset(stack)):
+                            return res_bits, res_names
+                    token = label_of(pos)
+                    pos += 1
+                else:
+                    self._report_error(symbol, token)
+            else:
+                raise ValueError("The symbol should not in the grammar")
+        raise ValueError("The input too short")
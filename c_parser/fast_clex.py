@@ -0,0 +1,274 @@
+"""
+A table driven backend of BufferedCLex. BufferedCLex lexes the whole code by the PLY token loop, which matches the
+master regex of all the rules at every token and creates a LexToken and calls a rule function for it. The master regex
+enters all the alternatives before the matched rule, so it is the most of the time.
+Here the rules which can start with a character are found from the parsed rule regexes and a small regex of these
+rules in the PLY order is compiled for every ascii character. The scan loop looks up the regex by the first character
+and the token type by the matched group in the tables, and writes the tokens into arrays (type id, lexpos, end, line).
+The _tokens_buffer read by BufferedCLex.token and tokenize_by_clex is a thin view creating the LexToken of a position
+on demand.
+The rules with side effects (the preprocessor line states and the error rules) are not run here. The code falls back
+to the PLY lexer if it contains '#' or reaches an error, so the tokens and the errors are the same as BufferedCLex.
+"""
+
+import re
+
+import numpy as np
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from c_parser.buffered_clex import BufferedCLex
+from c_parser.pycparser.pycparser.c_lexer import CLexer
+from c_parser.pycparser.pycparser.ply.lex import LexToken
+
+TOKEN_TYPES = list(CLexer.tokens)
+TOKEN_TYPE_ID = {t: i for i, t in enumerate(TOKEN_TYPES)}
+
+# the actions of the match groups which are not a token type id
+SKIP_ACTION = -1
+NEWLINE_ACTION = -2
+ID_ACTION = -3
+FALLBACK_ACTION = -4
+
+# the rule functions which do more than returning the token
+NEWLINE_RULE = 't_NEWLINE'
+ID_RULE = 't_ID'
+FALLBACK_RULES = {'t_PPHASH', 't_BAD_CONST_OCT', 't_UNMATCHED_QUOTE', 't_BAD_CHAR_CONST', 't_BAD_STRING_LITERAL'}
+
+ASCII_SIZE = 128
+ALL_ASCII = frozenset(range(ASCII_SIZE))
+
+
+def _in_first_chars(items):
+    chars = set()
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            chars.add(av)
+        elif op is sre_parse.RANGE:
+            chars.update(range(av[0], min(av[1] + 1, ASCII_SIZE)))
+        else:
+            # NEGATE and CATEGORY may match any character
+            return set(ALL_ASCII)
+    return chars
+
+
+def _first_chars(items):
+    """
+    :param items: the items of a parsed regex
+    :return: (the ascii characters a match can start with, whether it matches the empty string). It may contain
+    more characters than the exact set, which only costs a failed alternative.
+    """
+    chars = set()
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            chars.add(av)
+            return chars, False
+        elif op is sre_parse.IN:
+            chars |= _in_first_chars(av)
+            return chars, False
+        elif op is sre_parse.SUBPATTERN:
+            sub_chars, nullable = _first_chars(av[-1])
+            chars |= sub_chars
+            if not nullable:
+                return chars, False
+        elif op is sre_parse.BRANCH:
+            nullable = False
+            for branch in av[1]:
+                sub_chars, sub_nullable = _first_chars(branch)
+                chars |= sub_chars
+                nullable = nullable or sub_nullable
+            if not nullable:
+                return chars, False
+        elif op is sre_parse.MAX_REPEAT or op is sre_parse.MIN_REPEAT:
+            sub_chars, nullable = _first_chars(av[2])
+            chars |= sub_chars
+            if av[0] > 0 and not nullable:
+                return chars, False
+        else:
+            return set(ALL_ASCII), True
+    return chars, True
+
+
+class CLexTables(object):
+    """
+    the dispatch tables built from the rules of the INITIAL state of a built CLexer
+    """
+    def __init__(self, clex):
+        ply_lexer = clex.lexer
+        self.flags = ply_lexer.lexstatere['INITIAL'][0][0].flags
+        rules = []
+        for lexre, lexindexfunc in ply_lexer.lexstatere['INITIAL']:
+            names = {index: name for name, index in lexre.groupindex.items()}
+            for index, item in enumerate(lexindexfunc):
+                if item is None:
+                    continue
+                func, type_name = item
+                pattern = getattr(func, 'regex', func.__doc__) if func is not None else getattr(clex, names[index])
+                rules.append((pattern, self._rule_action(func, type_name)))
+        self.ignore = ply_lexer.lexstateignore.get('INITIAL', '')
+        first_chars = [_first_chars(sre_parse.parse(pattern, self.flags))[0] for pattern, _ in rules]
+
+        # the characters with the same rules share one regex
+        regex_of_rules = {}
+        self.char_regexes = []
+        for c in range(ASCII_SIZE):
+            rule_indexes = tuple(i for i, chars in enumerate(first_chars) if c in chars)
+            if rule_indexes not in regex_of_rules:
+                regex_of_rules[rule_indexes] = self._compile([rules[i] for i in rule_indexes])
+            self.char_regexes.append(regex_of_rules[rule_indexes])
+        # a non ascii character is matched by all the rules
+        self.default_regex = self._compile(rules)
+        self.keyword_type_id = {k: TOKEN_TYPE_ID[v] for k, v in clex.keyword_map.items()}
+        self.id_type_id = TOKEN_TYPE_ID['ID']
+
+    @staticmethod
+    def _rule_action(func, type_name):
+        name = func.__name__ if func is not None else None
+        if name == NEWLINE_RULE:
+            return NEWLINE_ACTION
+        if name == ID_RULE:
+            return ID_ACTION
+        if name in FALLBACK_RULES or (func is not None and type_name not in TOKEN_TYPE_ID):
+            return FALLBACK_ACTION
+        if type_name is None:
+            return SKIP_ACTION
+        return TOKEN_TYPE_ID[type_name]
+
+    def _compile(self, rules):
+        """
+        :return: (the regex of the rules, the action list indexed by the lastindex of a match). None if no rule.
+        """
+        if len(rules) == 0:
+            return None
+        patterns = []
+        actions = [FALLBACK_ACTION]
+        for pattern, action in rules:
+            patterns.append('({})'.format(pattern))
+            actions += [action] + [FALLBACK_ACTION] * re.compile(pattern, self.flags).groups
+        return re.compile('|'.join(patterns), self.flags), actions
+
+    def scan(self, text, lineno=1):
+        """
+        :return: (type ids, lexpos, end positions, lines, the line number after the text) of the tokens. None if the
+        text needs the PLY lexer.
+        """
+        char_regexes = self.char_regexes
+        default_regex = self.default_regex
+        ignore = self.ignore
+        keyword_type_id = self.keyword_type_id
+        id_type_id = self.id_type_id
+        types = []
+        lexpos = []
+        ends = []
+        lines = []
+        pos = 0
+        length = len(text)
+        while pos < length:
+            c = text[pos]
+            if c in ignore:
+                pos += 1
+                continue
+            code = ord(c)
+            regex_actions = char_regexes[code] if code < ASCII_SIZE else default_regex
+            if regex_actions is None:
+                return None
+            m = regex_actions[0].match(text, pos)
+            if m is None:
+                return None
+            end = m.end()
+            action = regex_actions[1][m.lastindex]
+            if action >= 0:
+                types.append(action)
+            elif action == ID_ACTION:
+                types.append(keyword_type_id.get(text[pos:end], id_type_id))
+            elif action == NEWLINE_ACTION:
+                lineno += end - pos
+                pos = end
+                continue
+            elif action == SKIP_ACTION:
+                pos = end
+                continue
+            else:
+                return None
+            lexpos.append(pos)
+            ends.append(end)
+            lines.append(lineno)
+            pos = end
+        return (np.array(types, dtype=np.int16), np.array(lexpos, dtype=np.int32), np.array(ends, dtype=np.int32),
+                np.array(lines, dtype=np.int32), lineno)
+
+
+class TokenBufferView(object):
+    """
+    the (LexToken, filename) sequence of BufferedCLex._tokens_buffer over the token arrays. The LexTokens are created
+    when the buffer is read first and kept, so the TYPEID set by BufferedCLex.token is not lost.
+    """
+    def __init__(self, text, types, lexpos, ends, lines, filename=''):
+        self.text = text
+        self.types = types
+        self.lexpos = lexpos
+        self.ends = ends
+        self.lines = lines
+        self.filename = filename
+        self._items = None
+
+    def __len__(self):
+        return len(self.types)
+
+    def _create_items(self):
+        text = self.text
+        filename = self.filename
+        items = []
+        for type_id, start, end, line in zip(self.types.tolist(), self.lexpos.tolist(), self.ends.tolist(),
+                                             self.lines.tolist()):
+            tok = LexToken()
+            tok.type = TOKEN_TYPES[type_id]
+            tok.value = text[start:end]
+            tok.lineno = line
+            tok.lexpos = start
+            items.append((tok, filename))
+        self._items = items
+
+    def __getitem__(self, i):
+        if self._items is None:
+            self._create_items()
+        return self._items[i]
+
+    def __iter__(self):
+        if self._items is None:
+            self._create_items()
+        return iter(self._items)
+
+    def values(self):
+        text = self.text
+        return [text[s:e] for s, e in zip(self.lexpos.tolist(), self.ends.tolist())]
+
+
+class FastBufferedCLex(BufferedCLex):
+    """
+    BufferedCLex lexing by the CLexTables. It can be used as the lexer of init_pycparser.
+    """
+    _tables = None
+
+    def build(self, **kwargs):
+        super().build(**kwargs)
+        # the tables only depend on the lexer rules, they are built once in a process
+        if FastBufferedCLex._tables is None:
+            FastBufferedCLex._tables = CLexTables(self)
+        self.tables = FastBufferedCLex._tables
+
+    def input(self, text):
+        res = None if '#' in text else self.tables.scan(text, self.lexer.lineno)
+        if res is None:
+            super().input(text)
+            return
+        types, lexpos, ends, lines, lineno = res
+        self.lexer.input(text)
+        self.lexer.lexpos = len(text)
+        self.lexer.lineno = lineno
+        self._tokens_buffer = TokenBufferView(text, types, lexpos, ends, lines, self.filename)
+        self._tokens_index = 0
+        self.filename = ''
@@ -0,0 +1,178 @@
+"""
+The active sub batch of the multi step fixing. multi_step_one_batch ran the model and built the next input for the
+whole batch at every step, though the samples which are finished (compiled or stopped) are reverted to their last
+input. Here the unfinished samples are selected into a compact sub batch before a step and the outputs of the step are
+written back to their positions in the whole batch, so a later step only processes the unfinished programs.
+The input ids may be kept in the padded device tensors between the steps (the create_multi_step_next_input_batch_fn of
+EncoderSampleModel does so), the rows of those tensors are selected and written back on the device. The sub batch is
+padded to the length of the whole batch, so its model outputs are the same as in the whole batch.
+"""
+
+import contextlib
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def active_index_list(continue_list, batch_size):
+    return [i for i, c in zip(range(batch_size), continue_list) if c]
+
+
+def select_values(values, index_list):
+    """
+    :param values: a list, or a tensor or a numpy array whose first dim is the batch
+    :return: the values of the samples in index_list, of the same type as values
+    """
+    if isinstance(values, torch.Tensor):
+        return values.index_select(0, torch.tensor(index_list, dtype=torch.long, device=values.device))
+    if isinstance(values, np.ndarray):
+        return values[np.asarray(index_list, dtype=np.int64)]
+    return [values[i] for i in index_list]
+
+
+def select_batch(batch, index_list):
+    """
+    :param batch: a batch dict of {key: the values of the samples}. A value is a list, a tensor or a numpy array
+    :return: the sub batch dict of the samples in index_list
+    """
+    return {k: select_values(v, index_list) for k, v in batch.items()}
+
+
+def scatter_list(values, sub_values, index_list):
+    """
+    :return: a copy of values with values[index_list[j]] replaced by sub_values[j]
+    """
+    values = list(values)
+    for i, v in zip(index_list, sub_values):
+        values[i] = v
+    return values
+
+
+def pad_tensor_rows(values, shape, fill_value=0):
+    """
+    pad the rows of a tensor to shape at the end of every dim
+    """
+    pad = []
+    for size, target in reversed(list(zip(values.shape[1:], shape))):
+        pad += [0, target - size]
+    return F.pad(values, pad, value=fill_value) if any(pad) else values
+
+
+def scatter_values(values, sub_values, index_list, fill_value=None):
+    """
+    scatter_list for the lists, tensors and numpy arrays. The rows of a tensor or an array must have the same shape
+    as the rows of sub_values.
+    :param fill_value: the rows of the tensors of different shapes are padded by fill_value to the larger shape
+    :return: a copy of values of its own type
+    """
+    if isinstance(values, torch.Tensor):
+        if tuple(values.shape[1:]) != tuple(sub_values.shape[1:]):
+            if fill_value is None or values.dim() != sub_values.dim():
+                raise ValueError('can not scatter the rows of shape {} to the rows of shape {}'.format(
+                    tuple(sub_values.shape[1:]), tuple(values.shape[1:])))
+            shape = [max(a, b) for a, b in zip(values.shape[1:], sub_values.shape[1:])]
+            values = pad_tensor_rows(values, shape, fill_value)
+            sub_values = pad_tensor_rows(sub_values, shape, fill_value)
+        res = values.clone()
+        res[torch.tensor(index_list, dtype=torch.long, device=values.device)] = sub_values.to(values.device)
+        return res
+    if isinstance(values, np.ndarray):
+        if values.shape[1:] != np.shape(sub_values)[1:]:
+            raise ValueError('can not scatter the rows of shape {} to the rows of shape {}'.format(
+                np.shape(sub_values)[1:], values.shape[1:]))
+        res = values.copy()
+        res[np.asarray(index_list, dtype=np.int64)] = sub_values
+        return res
+    return scatter_list(values, sub_values, index_list)
+
+
+def scatter_batch(batch, sub_batch, index_list, fill_value=None):
+    """
+    :return: the batch dict with the samples of index_list replaced by the ones of sub_batch
+    """
+    res = dict(batch)
+    for k, v in sub_batch.items():
+        res[k] = scatter_values(batch[k], v, index_list, fill_value) if k in batch else v
+    return res
+
+
+def max_length(lengths):
+    return int(lengths.max()) if isinstance(lengths, torch.Tensor) else max(lengths)
+
+
+def unpad_batch(batch, length_keys):
+    """
+    convert the device tensors of a batch back to the lists of the data loader
+    :param length_keys: {the key of a padded tensor: the key of its row lengths}
+    """
+    res = dict(batch)
+    for k, v in batch.items():
+        if not isinstance(v, torch.Tensor):
+            continue
+        if k in length_keys:
+            lengths = batch[length_keys[k]]
+            lengths = lengths.tolist() if isinstance(lengths, torch.Tensor) else lengths
+            res[k] = [row[:l] for row, l in zip(v.tolist(), lengths)]
+        else:
+            res[k] = v.tolist()
+    return res
+
+
+def expand_sub_batch_output(sub_output, index_list, batch_size):
+    """
+    expand the tensors (or lists) of a sub batch output to the whole batch. The rows of the finished samples are zero
+    (or None), they are not read after the sample is finished.
+    """
+    if isinstance(sub_output, (tuple, list)) and not isinstance(sub_output, torch.Tensor):
+        if len(sub_output) == len(index_list) and not any(isinstance(o, torch.Tensor) for o in sub_output):
+            return scatter_list([None] * batch_size, sub_output, index_list)
+        return type(sub_output)(expand_sub_batch_output(o, index_list, batch_size) for o in sub_output)
+    if isinstance(sub_output, torch.Tensor) and sub_output.dim() > 0 and sub_output.shape[0] == len(index_list):
+        res = sub_output.new_zeros((batch_size, ) + tuple(sub_output.shape[1:]))
+        res[torch.tensor(index_list, dtype=torch.long, device=sub_output.device)] = sub_output
+        return res
+    return sub_output
+
+
+def multi_step_next_batch(model, input_data, continue_list, parse_input_batch_data_fn,
+                          create_multi_step_next_input_batch_fn, do_beam_search=False, last_final_output=None,
+                          last_final_output_name_list=None, incremental=False, stage_timer=None):
+    """
+    run the model and create the next input of one step of the multi step fixing.
+    :param incremental: run only the unfinished samples. last_final_output and last_final_output_name_list are the
+    outputs of the last step, the whole batch is run in the first step. The sub batch gets the pad_length of the
+    whole batch if the batch has input_length.
+    :return: (input_data, final_output, output_records, final_output_name_list, continue_list) of the whole batch as
+    create_multi_step_next_input_batch_fn
+    """
+    timer = stage_timer if stage_timer is not None else (lambda name: contextlib.nullcontext())
+    batch_size = len(input_data['input_seq'])
+    active_index = None
+    if incremental and last_final_output is not None:
+        active_index = active_index_list(continue_list, batch_size)
+        step_input_data = select_batch(input_data, active_index)
+        step_continue_list = [True for _ in active_index]
+    else:
+        step_input_data = input_data
+        step_continue_list = continue_list
+
+    with timer('forward'):
+        if active_index is not None and 'input_length' in input_data:
+            model_input = parse_input_batch_data_fn(
+                dict(step_input_data, pad_length=max_length(input_data['input_length'])), do_sample=True)
+        else:
+            model_input = parse_input_batch_data_fn(step_input_data, do_sample=True)
+        model_output = model.forward(*model_input, do_sample=True, do_beam_search=do_beam_search)
+
+    with timer('next_input'):
+        step_input_data, final_output, output_records, final_output_name_list, step_continue_list = \
+            create_multi_step_next_input_batch_fn(step_input_data, model_input, model_output, step_continue_list,
+                                                  do_beam_search)
+    if active_index is None:
+        return step_input_data, final_output, output_records, final_output_name_list, step_continue_list
+    return scatter_batch(input_data, step_input_data, active_index, fill_value=0), \
+        scatter_list(last_final_output, final_output, active_index), \
+        expand_sub_batch_output(output_records, active_index, batch_size), \
+        scatter_list(last_final_output_name_list, final_output_name_list, active_index), \
+        scatter_list(continue_list, step_continue_list, active_index)
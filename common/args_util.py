@@ -1,31 +1,100 @@
-import torch.nn as nn
+import os
+
 import torch.multiprocessing as mp
 
+from common import problem_util
 from config import num_processes
 
-GPU_INDEX = 0
-Parallel = False
-
 
 def get_model(m):
-    if Parallel:
-        m = nn.DataParallel(m.cuda(), device_ids=[1])
-    elif GPU_INDEX is not None:
-        m = nn.DataParallel(m.cuda(), device_ids=[GPU_INDEX])
-    return m
+    return problem_util.prepare_model(m)
+
 
 def to_cuda(x):
-    if Parallel:
-        return x.cuda()
-    elif GPU_INDEX is not None:
-        x = x.cuda(GPU_INDEX)
-    return x
+    return problem_util.to_cuda(x)
 
 
+# compile by the warm CompileServer workers instead of forking a shell in every compile
+use_compile_server = False
+# look up the compile result in the persistent CompileCache before compiling
+use_compile_cache = False
+# pass the ast graph to GGNNLayer as a GraphEdges edge list instead of a dense adjacency matrix
+use_sparse_graph = False
+# lex by the table driven FastBufferedCLex instead of the PLY token loop of BufferedCLex
+use_fast_lexer = False
+# keep the dataset samples in a memory mapped ColumnarStore instead of a list of pandas Series
+use_columnar_dataset = False
+# read the ast code graphs from the CodeGraphCache instead of parsing the code at every sample access
+use_code_graph_cache = False
+# load the batches of data_loader by the worker processes of common.prefetch_loader
+use_prefetch_loader = False
+# bucket the shuffled samples of the prefetch loader by length to cut the padding
+use_length_bucket = False
+# run only the unfinished samples of a batch in the later steps of multi_step_evaluate. They are padded as the whole
+# batch, so the outputs are the same as running the whole batch
+use_incremental_multi_step = True
+# create the edits of the sensibility baseline FixModel for the whole batch by LSTMFixerUpper.fix_batch
+use_batch_sensibility_fix = False
+# build the grammar masks of TransformVocabularyAndSLK.get_all_token_mask_train by the compiled slk parser instead of
+# the token by token dynamic parser
+use_compiled_slk = False
+# read the token tables of TransformVocabularyAndSLK from the memory mapped CompiledVocabulary instead of tokenizing
+# every vocabulary word behind disk_cache
+use_compiled_vocabulary = False
+
 compile_pool = None
 def get_compile_pool():
     global compile_pool
+    if use_compile_server:
+        return get_compile_server()
     if compile_pool is None:
         compile_pool = mp.Pool(num_processes)
     return compile_pool
 
+
+compile_server = None
+def get_compile_server(create=True):
+    global compile_server
+    if compile_server is None and create:
+        from common.compile_server import CompileServer
+        compile_server = CompileServer(num_processes)
+    return compile_server
+
+
+
+compile_cache = None
+def get_compile_cache():
+    global compile_cache
+    if not use_compile_cache:
+        return None
+    # sqlite connection can't be shared with the forked processes
+    if compile_cache is None or compile_cache.owner_pid != os.getpid():
+        from common.compile_cache import CompileCache
+        from config import compile_cache_path, compile_cache_max_entries
+        compile_cache = CompileCache(compile_cache_path, max_entries=compile_cache_max_entries)
+    return compile_cache
+
+
+code_graph_cache = None
+def get_code_graph_cache():
+    global code_graph_cache
+    if not use_code_graph_cache:
+        return None
+    # sqlite connection can't be shared with the forked processes
+    if code_graph_cache is None or code_graph_cache.owner_pid != os.getpid():
+        from c_parser.code_graph_cache import CodeGraphCache
+        from config import code_graph_cache_path, code_graph_lru_size
+        code_graph_cache = CodeGraphCache(code_graph_cache_path, lru_size=code_graph_lru_size,
+                                          core_num=num_processes)
+    return code_graph_cache
+
+
+tokenize_service = None
+def get_tokenize_service():
+    global tokenize_service
+    # sqlite connection can't be shared with the forked processes
+    if tokenize_service is None or tokenize_service.owner_pid != os.getpid():
+        from common.tokenize_service import TokenizeService
+        from config import tokenize_cache_path
+        tokenize_service = TokenizeService(num_processes, cache_path=tokenize_cache_path)
+    return tokenize_service
@@ -0,0 +1,146 @@
+"""
+A small benchmark harness. A stage is a function called once for every batch of a corpus. run_stage records the
+latency of every call and reports the throughput in items per second, the latency percentiles and the peak RSS of the
+process. The results of a run can be saved as a baseline json file and the later runs are compared with it.
+"""
+
+import collections
+import json
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+LATENCY_PERCENTILES = (50, 90, 99)
+# metric name -> True if a larger value is better
+COMPARED_METRICS = collections.OrderedDict([
+    ('throughput', True),
+    ('p50_ms', False),
+    ('p90_ms', False),
+    ('peak_rss_mb', False),
+])
+
+
+def peak_rss_mb():
+    """
+    the peak resident set size of this process. It never decreases, so the value of a stage includes the stages before.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes in macOS and KiB in linux
+        return rss / 1024 / 1024
+    return rss / 1024
+
+
+def latency_percentiles(latencies, percentiles=LATENCY_PERCENTILES):
+    """
+    :param latencies: the seconds of every call
+    :return: an OrderedDict of 'p{percentile}_ms' -> milliseconds
+    """
+    res = collections.OrderedDict()
+    values = np.percentile(np.array(latencies, dtype=np.float64) * 1000, percentiles) if len(latencies) > 0 else \
+        [0.0 for _ in percentiles]
+    for p, v in zip(percentiles, values):
+        res['p{}_ms'.format(p)] = float(v)
+    return res
+
+
+def run_stage(name, fn, batches, item_count_fn=len, warmup=1):
+    """
+    call fn on every batch and time every call
+    :param fn: the stage function. It is called as fn(batch)
+    :param batches: a list of batches
+    :param item_count_fn: the number of items in a batch, the throughput is items per second
+    :param warmup: the first warmup batches are called once more before timing to fill the caches and the lazy states
+    :return: (the result dict of this stage, the list of the outputs of fn)
+    """
+    for batch in batches[:warmup]:
+        fn(batch)
+    rss_before = peak_rss_mb()
+    latencies = []
+    outputs = []
+    items = 0
+    for batch in batches:
+        begin = time.perf_counter()
+        outputs.append(fn(batch))
+        latencies.append(time.perf_counter() - begin)
+        items += item_count_fn(batch)
+    total_time = sum(latencies)
+    res = collections.OrderedDict([
+        ('stage', name),
+        ('calls', len(latencies)),
+        ('items', items),
+        ('total_time', total_time),
+        ('throughput', items / total_time if total_time > 0 else 0.0),
+    ])
+    res.update(latency_percentiles(latencies))
+    res['peak_rss_mb'] = peak_rss_mb()
+    res['rss_increase_mb'] = res['peak_rss_mb'] - rss_before
+    return res, outputs
+
+
+def save_baseline(results, path, meta=None):
+    """
+    :param results: a list of the result dicts of run_stage
+    :param meta: a dict of the run settings, such as the corpus size. The results of different settings are not
+    comparable.
+    """
+    dir_path = os.path.dirname(path)
+    if dir_path != '' and not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    with open(path, 'w') as f:
+        json.dump({'meta': meta if meta is not None else {}, 'results': results}, f, indent=2)
+
+
+def load_baseline(path):
+    """
+    :return: (meta, {stage name: result dict}) or (None, {}) if the baseline file does not exist
+    """
+    if not os.path.exists(path):
+        return None, {}
+    with open(path) as f:
+        baseline = json.load(f)
+    return baseline['meta'], {r['stage']: r for r in baseline['results']}
+
+
+def compare_with_baseline(results, baseline_results, threshold=0.2):
+    """
+    :param baseline_results: {stage name: result dict} of load_baseline
+    :param threshold: a metric is a regression if it is worse than the baseline by more than this ratio
+    :return: a list of (stage, metric, baseline value, value, change ratio, is regression). A positive change ratio
+    means better.
+    """
+    comparison = []
+    for r in results:
+        base = baseline_results.get(r['stage'], None)
+        if base is None:
+            continue
+        for metric, larger_is_better in COMPARED_METRICS.items():
+            if metric not in base or base[metric] == 0:
+                continue
+            change = (r[metric] - base[metric]) / base[metric]
+            if not larger_is_better:
+                change = -change
+            comparison.append((r['stage'], metric, base[metric], r[metric], change, change < -threshold))
+    return comparison
+
+
+def format_results(results):
+    columns = ['stage', 'calls', 'items', 'total_time', 'throughput'] + \
+              ['p{}_ms'.format(p) for p in LATENCY_PERCENTILES] + ['peak_rss_mb', 'rss_increase_mb']
+    lines = ['{:<28}'.format(columns[0]) + ''.join('{:>16}'.format(c) for c in columns[1:])]
+    for r in results:
+        values = [r[c] for c in columns[1:]]
+        lines.append('{:<28}'.format(r['stage']) +
+                     ''.join('{:>16}'.format(v) if isinstance(v, int) else '{:>16.3f}'.format(v) for v in values))
+    return '\n'.join(lines)
+
+
+def format_comparison(comparison):
+    lines = ['{:<28}{:>16}{:>16}{:>16}{:>10}'.format('stage', 'metric', 'baseline', 'now', 'change')]
+    for stage, metric, base, now, change, is_regression in comparison:
+        lines.append('{:<28}{:>16}{:>16.3f}{:>16.3f}{:>+9.1f}%{}'.format(stage, metric, base, now, change * 100,
+                                                                        ' REGRESSION' if is_regression else ''))
+    return '\n'.join(lines)
@@ -0,0 +1,322 @@
+"""
+A columnar read only store of the dataset samples. CustomerDataSet kept every sample as a pandas Series of python
+lists, so a training run held millions of small python objects which are copied to every DataLoader worker when their
+reference counts are touched. Here every column of the DataFrame is saved once as numpy arrays:
+    a column of (nested) int lists is a flat int buffer and one offset array for every nesting level, in the
+    smallest int type of the values,
+    a column of (nested) str lists is the same over the ids of a string table,
+    the other columns are pickled value by value into one byte buffer with an offset array.
+The arrays are memory mapped read only, so the workers share the pages and a row is decoded by slicing the arrays.
+"""
+
+import collections.abc
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+META_NAME = 'meta.json'
+FORMAT_VERSION = 1
+
+INT_KIND = 'int'
+STR_KIND = 'str'
+OBJECT_KIND = 'object'
+
+# the leaves and the offsets are saved in the smallest of these types
+INT_DTYPES = [np.int16, np.int32, np.int64]
+
+
+def _is_sequence(value):
+    # a numpy array is pickled to keep its type
+    return isinstance(value, (list, tuple))
+
+
+def _leaf_kind(value):
+    if isinstance(value, (bool, np.bool_)):
+        return None
+    if isinstance(value, (int, np.integer)):
+        return INT_KIND
+    if isinstance(value, str):
+        return STR_KIND
+    return None
+
+
+def _small_int_array(values):
+    res = np.array(values, dtype=np.int64)
+    if len(res) == 0:
+        return res.astype(INT_DTYPES[0])
+    low, high = res.min(), res.max()
+    for dtype in INT_DTYPES:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return res.astype(dtype)
+
+
+def _column_depth(values):
+    """
+    :return: the nesting depth of the column found by the first non empty values
+    """
+    depth = 0
+    items = values
+    while True:
+        item = next((v for v in items if not _is_sequence(v) or len(v) > 0), None)
+        if item is None:
+            # only empty sequences in this level
+            return depth + 1 if any(_is_sequence(v) for v in items) else depth
+        if not _is_sequence(item):
+            return depth
+        depth += 1
+        items = [i for v in items if _is_sequence(v) for i in v]
+
+
+class _Column(object):
+    """
+    the arrays of a column. offsets[k] is the offset array of the level k items into the level k+1 items, leaves are
+    the ids of the strings if kind is STR_KIND or the pickled bytes if kind is OBJECT_KIND.
+    """
+    def __init__(self, kind, offsets, leaves, tuple_levels, strings=None):
+        self.kind = kind
+        self.offsets = offsets
+        self.leaves = leaves
+        self.tuple_levels = tuple_levels
+        self.strings = strings
+
+    @staticmethod
+    def encode(values):
+        values = list(values)
+        column = _Column._encode_nested(values)
+        if column is None:
+            column = _Column._encode_object(values)
+        return column
+
+    @staticmethod
+    def _encode_nested(values):
+        depth = _column_depth(values)
+        offsets = []
+        tuple_levels = []
+        items = values
+        for level in range(depth):
+            if not all(_is_sequence(v) for v in items):
+                return None
+            offsets.append(_small_int_array(np.cumsum([0] + [len(v) for v in items])))
+            tuple_levels.append(len(items) > 0 and all(isinstance(v, tuple) for v in items))
+            items = [i for v in items for i in v]
+        kinds = set(_leaf_kind(v) for v in items)
+        if None in kinds or len(kinds) > 1:
+            return None
+        kind = kinds.pop() if len(kinds) > 0 else INT_KIND
+        strings = None
+        if kind == STR_KIND:
+            strings = sorted(set(items))
+            string_id = {s: i for i, s in enumerate(strings)}
+            leaves = _small_int_array([string_id[v] for v in items])
+        else:
+            leaves = _small_int_array(items)
+        return _Column(kind, offsets, leaves, tuple_levels, strings)
+
+    @staticmethod
+    def _encode_object(values):
+        pickled = [pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL) for v in values]
+        offsets = np.cumsum([0] + [len(p) for p in pickled], dtype=np.int64)
+        leaves = np.frombuffer(b''.join(pickled), dtype=np.uint8)
+        return _Column(OBJECT_KIND, [offsets], leaves, [False])
+
+    def _decode_leaves(self, start, end):
+        res = self.leaves[start:end].tolist()
+        if self.kind == STR_KIND:
+            strings = self.strings
+            res = [strings[i] for i in res]
+        return res
+
+    def _decode_range(self, level, start, end):
+        """
+        :return: the list of the level items in [start, end)
+        """
+        if level == len(self.offsets):
+            return self._decode_leaves(start, end)
+        offsets = self.offsets[level][start:end + 1].tolist()
+        inner = self._decode_range(level + 1, offsets[0], offsets[-1])
+        base = offsets[0]
+        if self.tuple_levels[level]:
+            return [tuple(inner[s - base:e - base]) for s, e in zip(offsets[:-1], offsets[1:])]
+        return [inner[s - base:e - base] for s, e in zip(offsets[:-1], offsets[1:])]
+
+    def get(self, index):
+        if self.kind == OBJECT_KIND:
+            offsets = self.offsets[0]
+            return pickle.loads(self.leaves[offsets[index]:offsets[index + 1]].tobytes())
+        if len(self.offsets) == 0:
+            return self._decode_leaves(index, index + 1)[0]
+        return self._decode_range(0, index, index + 1)[0]
+
+    def nbytes(self):
+        return sum(o.nbytes for o in self.offsets) + self.leaves.nbytes
+
+    def save(self, dir_path, prefix):
+        for k, offsets in enumerate(self.offsets):
+            np.save(os.path.join(dir_path, '{}.offsets{}.npy'.format(prefix, k)), offsets)
+        np.save(os.path.join(dir_path, '{}.leaves.npy'.format(prefix)), self.leaves)
+        return {'kind': self.kind, 'depth': len(self.offsets), 'tuple_levels': self.tuple_levels,
+                'strings': self.strings}
+
+    @staticmethod
+    def load(dir_path, prefix, meta, mmap_mode='r'):
+        offsets = [np.load(os.path.join(dir_path, '{}.offsets{}.npy'.format(prefix, k)), mmap_mode=mmap_mode)
+                   for k in range(meta['depth'])]
+        leaves = np.load(os.path.join(dir_path, '{}.leaves.npy'.format(prefix)), mmap_mode=mmap_mode)
+        return _Column(meta['kind'], offsets, leaves, meta['tuple_levels'], meta['strings'])
+
+
+class ColumnarStore(object):
+    def __init__(self, columns, length):
+        """
+        :param columns: an OrderedDict of {column name: _Column}
+        """
+        self.columns = columns
+        self.length = length
+
+    @staticmethod
+    def from_df(df, columns=None):
+        columns = list(df.columns) if columns is None else columns
+        return ColumnarStore(collections.OrderedDict((name, _Column.encode(df[name])) for name in columns), len(df))
+
+    def save(self, dir_path, fingerprint=None):
+        """
+        save the store to a new directory. The arrays are written to a temporary directory which is renamed at last,
+        so a reader never sees a half written store.
+        :param fingerprint: the content hash of the source DataFrame saved in the meta and checked by
+        load_or_create_columnar_store
+        """
+        tmp_path = '{}.tmp{}'.format(dir_path, os.getpid())
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        metas = []
+        for i, (name, column) in enumerate(self.columns.items()):
+            meta = column.save(tmp_path, 'c{}'.format(i))
+            meta['name'] = name
+            metas.append(meta)
+        with open(os.path.join(tmp_path, META_NAME), 'w') as f:
+            json.dump({'version': FORMAT_VERSION, 'length': self.length, 'fingerprint': fingerprint,
+                       'columns': metas}, f)
+        try:
+            os.rename(tmp_path, dir_path)
+        except OSError:
+            # the same store is saved by another process
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @staticmethod
+    def load_meta(dir_path):
+        with open(os.path.join(dir_path, META_NAME)) as f:
+            return json.load(f)
+
+    @staticmethod
+    def load(dir_path, mmap_mode='r'):
+        meta = ColumnarStore.load_meta(dir_path)
+        columns = collections.OrderedDict((m['name'], _Column.load(dir_path, 'c{}'.format(i), m, mmap_mode))
+                                          for i, m in enumerate(meta['columns']))
+        # the mtime of the meta is the last access time used by evict_columnar_stores
+        os.utime(os.path.join(dir_path, META_NAME), None)
+        return ColumnarStore(columns, meta['length'])
+
+    @staticmethod
+    def exists(dir_path):
+        return os.path.exists(os.path.join(dir_path, META_NAME))
+
+    def get(self, index, name):
+        return self.columns[name].get(index)
+
+    def nbytes(self):
+        return sum(c.nbytes() for c in self.columns.values())
+
+    def __len__(self):
+        return self.length
+
+
+class ColumnarRow(object):
+    """
+    a row of the ColumnarStore used as the pandas Series row of a sample. A value is decoded when it is read.
+    """
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.store.columns[name].get(self.index)
+
+    def __contains__(self, name):
+        return name in self.store.columns
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def keys(self):
+        return list(self.store.columns.keys())
+
+    def to_dict(self):
+        return {name: self[name] for name in self.store.columns}
+
+
+class ColumnarRows(collections.abc.Sequence):
+    """
+    the sample list of a dataset over a ColumnarStore. The positions are an int array, so a subset of the rows costs
+    no python object for each row.
+    """
+    def __init__(self, store, positions=None):
+        self.store = store
+        self.positions = np.arange(len(store), dtype=np.int64) if positions is None else np.asarray(positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ColumnarRows(self.store, self.positions[index])
+        return ColumnarRow(self.store, int(self.positions[index]))
+
+    def __add__(self, other):
+        if isinstance(other, ColumnarRows) and other.store is self.store:
+            return ColumnarRows(self.store, np.concatenate([self.positions, other.positions]))
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+
+def load_or_create_columnar_store(df, dir_path, fingerprint=None):
+    """
+    :param fingerprint: the content hash of df. A saved store of another fingerprint is created again.
+    :return: the ColumnarStore of the df memory mapped from dir_path. It is saved to dir_path if not exists.
+    """
+    if ColumnarStore.exists(dir_path) and fingerprint is not None and \
+            ColumnarStore.load_meta(dir_path).get('fingerprint') != fingerprint:
+        shutil.rmtree(dir_path, ignore_errors=True)
+    if not ColumnarStore.exists(dir_path):
+        ColumnarStore.from_df(df).save(dir_path, fingerprint)
+    return ColumnarStore.load(dir_path)
+
+
+def evict_columnar_stores(directory, prefix, max_count, keep_paths=()):
+    """
+    remove the least recently loaded stores named with prefix in directory until at most max_count of them are left.
+    The arrays of a loaded store stay readable after it is removed because they are memory mapped.
+    :return: the removed store paths
+    """
+    stores = []
+    for name in os.listdir(directory):
+        dir_path = os.path.join(directory, name)
+        if name.startswith(prefix) and ColumnarStore.exists(dir_path):
+            try:
+                stores.append((os.path.getmtime(os.path.join(dir_path, META_NAME)), dir_path))
+            except OSError:
+                continue
+    removed = []
+    for _, dir_path in sorted(stores)[:max(len(stores) - max_count, 0)]:
+        if dir_path in keep_paths:
+            continue
+        shutil.rmtree(dir_path, ignore_errors=True)
+        removed.append(dir_path)
+    return removed
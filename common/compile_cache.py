@@ -0,0 +1,145 @@
+"""
+A persistent compile outcome cache shared across runs. The key is the hash of the normalized source code and the
+compiler flags. The value is the compile result and the error messages parsed by extract_error_message. Entries are
+evicted by last access time when the cache holds more than max_entries records.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from common.compile_server import compile_mode_key
+
+CREATE_COMPILE_CACHE = r'''CREATE TABLE IF NOT EXISTS compile_cache (
+  key TEXT PRIMARY KEY,
+  result INTEGER,
+  errors TEXT,
+  last_access REAL
+)'''
+CREATE_COMPILE_CACHE_INDEX = r'''CREATE INDEX IF NOT EXISTS compile_cache_last_access ON compile_cache (last_access)'''
+
+
+def normalize_code(code):
+    """
+    remove the blank lines and the blank at the begin and the end of each line. The compile result and the error
+    messages without line number don't change.
+    """
+    return '\n'.join(line.strip() for line in code.split('\n') if line.strip() != '')
+
+
+def compile_cache_key(code, mode='c'):
+    key = compile_mode_key(mode) + '\n' + normalize_code(code)
+    return hashlib.sha1(key.encode('utf-8', errors='replace')).hexdigest()
+
+
+class CompileCache(object):
+    def __init__(self, db_path, max_entries=1000000, evict_check_steps=1000):
+        """
+        :param db_path: the sqlite file path of the cache
+        :param max_entries: the max number of records remained after eviction
+        :param evict_check_steps: check the size of cache after every evict_check_steps records are put
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.evict_check_steps = evict_check_steps
+        self.owner_pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        self._put_count = 0
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        # the cache is shared by the main thread and the pipelined compile thread in multi_step_evaluate
+        self._lock = threading.RLock()
+        self.con = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.execute('PRAGMA synchronous=NORMAL')
+        self.con.execute(CREATE_COMPILE_CACHE)
+        self.con.execute(CREATE_COMPILE_CACHE_INDEX)
+        self.con.commit()
+
+    def get_many(self, code_list, mode='c', need_errors=True):
+        """
+        :param need_errors: if True, the records saved without error messages are treated as missed
+        :return: a list of (compile result, error list) or None if missed
+        """
+        keys = [compile_cache_key(code, mode) for code in code_list]
+        with self._lock:
+            return self._get_many_by_keys(keys, need_errors)
+
+    def _get_many_by_keys(self, keys, need_errors):
+        found = {}
+        unique_keys = list(set(keys))
+        for i in range(0, len(unique_keys), 500):
+            part = unique_keys[i:i+500]
+            sql = 'SELECT key, result, errors FROM compile_cache WHERE key IN ({})'.format(','.join('?' * len(part)))
+            for key, result, errors in self.con.execute(sql, part):
+                if need_errors and errors is None:
+                    continue
+                found[key] = (result == 1, json.loads(errors) if errors is not None else None)
+
+        res = [found.get(key, None) for key in keys]
+        hit_count = sum(1 for r in res if r is not None)
+        self.hits += hit_count
+        self.misses += len(res) - hit_count
+        if len(found) > 0:
+            now = time.time()
+            self.con.executemany('UPDATE compile_cache SET last_access=? WHERE key=?', [(now, k) for k in found])
+            self.con.commit()
+        return res
+
+    def get(self, code, mode='c', need_errors=True):
+        return self.get_many([code], mode, need_errors)[0]
+
+    def put_many(self, code_list, result_list, errors_list=None, mode='c'):
+        if errors_list is None:
+            errors_list = [None for _ in range(len(code_list))]
+        now = time.time()
+        records = [(compile_cache_key(code, mode), 1 if res else 0,
+                    json.dumps(errors) if errors is not None else None, now)
+                   for code, res, errors in zip(code_list, result_list, errors_list)]
+        with self._lock:
+            self._put_records(records)
+
+    def _put_records(self, records):
+        # do not replace a record which has error messages by the one without error messages
+        self.con.executemany('INSERT INTO compile_cache (key, result, errors, last_access) VALUES (?, ?, ?, ?) '
+                             'ON CONFLICT(key) DO UPDATE SET result=excluded.result, '
+                             'errors=COALESCE(excluded.errors, compile_cache.errors), '
+                             'last_access=excluded.last_access', records)
+        self.con.commit()
+        self._put_count += len(records)
+        if self._put_count >= self.evict_check_steps:
+            self._put_count = 0
+            self._evict()
+
+    def put(self, code, result, errors=None, mode='c'):
+        self.put_many([code], [result], [errors], mode)
+
+    def evict(self):
+        with self._lock:
+            return self._evict()
+
+    def _evict(self):
+        count = self.con.execute('SELECT COUNT(*) FROM compile_cache').fetchone()[0]
+        if count <= self.max_entries:
+            return 0
+        remove_count = count - self.max_entries
+        self.con.execute('DELETE FROM compile_cache WHERE key IN '
+                         '(SELECT key FROM compile_cache ORDER BY last_access LIMIT ?)', (remove_count, ))
+        self.con.commit()
+        return remove_count
+
+    def __len__(self):
+        return self.con.execute('SELECT COUNT(*) FROM compile_cache').fetchone()[0]
+
+    def __str__(self):
+        total = self.hits + self.misses
+        hit_ratio = self.hits / total if total > 0 else 0
+        return 'compile cache hits: {}, misses: {}, hit ratio: {:.4f}'.format(self.hits, self.misses, hit_ratio)
+
+    def close(self):
+        self.con.close()
@@ -0,0 +1,286 @@
+"""
+A long-lived local compile service. Every compile helper in common/util.py used to write a pid-named file and fork
+a shell through os.system. The CompileServer keeps a pool of warm worker processes. The source code is sent to the
+workers over a pipe and fed to gcc through stdin, the worker returns the compile status and the diagnostics. The
+workers also accept arbitrary picklable (fn, args) tasks so the server can stand in for the multiprocessing pool
+returned by get_compile_pool().
+"""
+
+import multiprocessing
+import os
+import queue
+import subprocess
+import threading
+import time
+
+# compile mode -> (compiler, language, flags). The flags are the same as the os.system commands in common/util.py
+COMPILE_MODE_FLAGS = {
+    'c': ('gcc', 'c', ['-std=gnu99']),
+    'syntax': ('gcc', 'c', ['-fsyntax-only', '-pedantic-errors', '-std=gnu99']),
+    'c89': ('gcc', 'c', ['-pedantic-errors', '-std=gnu89']),
+    'cpp': ('g++', 'c++', []),
+}
+
+SOURCE_NAME = {'c': 'main.c', 'c++': 'main.cpp'}
+
+_COMPILE_TASK = '<COMPILE>'
+_STOP_TASK = '<STOP>'
+
+
+def compile_mode_key(mode):
+    """
+    a string describe the compiler and flags used by the mode. It is used as part of the compile cache key.
+    """
+    compiler, language, flags = COMPILE_MODE_FLAGS[mode]
+    return ' '.join([compiler, '-x', language] + flags)
+
+
+def add_pid_to_file_path(file_path):
+    # the same as common.util.add_pid_to_file_path, which can't be imported by the worker processes cheaply
+    file_name, ext = os.path.splitext(file_path)
+    return '{}_{}{}'.format(file_name, os.getpid(), ext)
+
+
+class GccCompiler(object):
+    """
+    Compile code from stdin without a shell. One target file is reused for all the compile in a process unless the
+    caller gives a target_file_path.
+    """
+    def __init__(self, target_dir='/dev/shm', timeout=None):
+        if not os.path.isdir(target_dir):
+            import tempfile
+            target_dir = tempfile.gettempdir()
+        self.target_file_path = os.path.join(target_dir, 'compile_server_{}.out'.format(os.getpid()))
+        self.timeout = timeout
+        self._argv_cache = {}
+
+    def _argv(self, mode, target_file_path):
+        key = (mode, target_file_path)
+        if key not in self._argv_cache:
+            compiler, language, flags = COMPILE_MODE_FLAGS[mode]
+            if mode == 'syntax':
+                output = []
+            else:
+                output = ['-o', target_file_path]
+            self._argv_cache[key] = [compiler] + output + flags + ['-x', language, '-']
+        return self._argv_cache[key]
+
+    def compile(self, code, mode='c', target_file_path=None):
+        """
+        :param code: the source code string
+        :param mode: a key of COMPILE_MODE_FLAGS
+        :param target_file_path: the output file of gcc. The reused file of this compiler if it is None
+        :return: (compile success, compile diagnostics)
+        """
+        language = COMPILE_MODE_FLAGS[mode][1]
+        if target_file_path is None:
+            target_file_path = self.target_file_path
+        try:
+            proc = subprocess.run(self._argv(mode, target_file_path), input=code.encode('utf-8', errors='replace'),
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=self.timeout)
+        except subprocess.TimeoutExpired as e:
+            return False, 'compile timeout after {} seconds'.format(self.timeout)
+        texts = proc.stdout.decode('utf-8', errors='replace')
+        # keep the diagnostics the same as compiling a file so that extract_error_message still works
+        texts = texts.replace('<stdin>', SOURCE_NAME[language])
+        texts = texts.replace(u"‘", "'").replace(u"’", "'")
+        return proc.returncode == 0, texts
+
+
+_local_compiler = None
+
+
+def get_local_compiler():
+    global _local_compiler
+    if _local_compiler is None or not _local_compiler.target_file_path.endswith('_{}.out'.format(os.getpid())):
+        _local_compiler = GccCompiler()
+    return _local_compiler
+
+
+def _compile_worker_loop(task_queue, result_queue, compile_timeout=None):
+    compiler = GccCompiler(timeout=compile_timeout)
+    while True:
+        task = task_queue.get()
+        if task == _STOP_TASK:
+            break
+        batch_id, index, fn, args = task
+        try:
+            if fn == _COMPILE_TASK:
+                code, mode, target_file_path = args
+                if target_file_path is not None:
+                    # the workers compile at the same time, so every worker writes its own target file
+                    target_file_path = add_pid_to_file_path(target_file_path)
+                res = compiler.compile(code, mode, target_file_path)
+            else:
+                res = fn(*args)
+            result_queue.put((batch_id, index, True, res))
+        except Exception as e:
+            result_queue.put((batch_id, index, False, e))
+
+
+class CompileServer(object):
+    def __init__(self, num_processes=4, compile_timeout=60, result_timeout=None, poll_seconds=1.0,
+                 max_resubmit_count=2):
+        """
+        :param num_processes: the number of warm worker processes
+        :param compile_timeout: the seconds a gcc process may run in a worker before it is failed
+        :param result_timeout: the seconds to wait for the next result of a batch. TimeoutError if no result comes in
+        time. None means no limit, the dead workers are still found.
+        :param poll_seconds: the interval to check the workers are alive while waiting for the results
+        :param max_resubmit_count: the times the unfinished tasks of a batch are resubmitted after a worker died
+        """
+        self.num_processes = num_processes
+        self.compile_timeout = compile_timeout
+        self.result_timeout = result_timeout
+        self.poll_seconds = poll_seconds
+        self.max_resubmit_count = max_resubmit_count
+        self.owner_pid = os.getpid()
+        self._task_queue = multiprocessing.Queue()
+        self._result_queue = multiprocessing.Queue()
+        self._batch_id = 0
+        self._lock = threading.Lock()
+        self._workers = [self._start_worker() for _ in range(num_processes)]
+
+    def _start_worker(self):
+        p = multiprocessing.Process(target=_compile_worker_loop,
+                                    args=(self._task_queue, self._result_queue, self.compile_timeout))
+        p.daemon = True
+        p.start()
+        return p
+
+    def _restart_dead_workers(self):
+        """
+        :return: the number of the dead workers replaced by new ones
+        """
+        dead = [i for i, p in enumerate(self._workers) if not p.is_alive()]
+        for i in dead:
+            self._workers[i] = self._start_worker()
+        return len(dead)
+
+    def _run(self, fn, args_list):
+        with self._lock:
+            self._batch_id += 1
+            batch_id = self._batch_id
+            for i, args in enumerate(args_list):
+                self._task_queue.put((batch_id, i, fn, tuple(args)))
+            res = [None for _ in range(len(args_list))]
+            done = [False for _ in range(len(args_list))]
+            received = 0
+            error = None
+            resubmit_count = 0
+            last_result_time = time.time()
+            while received < len(args_list):
+                try:
+                    b_id, i, success, r = self._result_queue.get(timeout=self.poll_seconds)
+                except queue.Empty:
+                    if self._restart_dead_workers() > 0:
+                        # the task of a dead worker is lost. The unfinished tasks are sent again and the duplicated
+                        # results are skipped.
+                        if resubmit_count >= self.max_resubmit_count:
+                            raise RuntimeError('compile server workers died {} times in a batch'.format(
+                                resubmit_count + 1))
+                        resubmit_count += 1
+                        for k, args in enumerate(args_list):
+                            if not done[k]:
+                                self._task_queue.put((batch_id, k, fn, tuple(args)))
+                        last_result_time = time.time()
+                    elif self.result_timeout is not None and time.time() - last_result_time > self.result_timeout:
+                        raise TimeoutError('no compile server result in {} seconds, {} of {} tasks are '
+                                           'unfinished'.format(self.result_timeout, len(args_list) - received,
+                                                               len(args_list)))
+                    continue
+                # skip the results left by a previous failed batch and the duplicated results
+                if b_id != batch_id or done[i]:
+                    continue
+                last_result_time = time.time()
+                done[i] = True
+                received += 1
+                if not success and error is None:
+                    error = r
+                res[i] = r
+            if error is not None:
+                raise error
+            return res
+
+    def compile(self, code, mode='c', target_file_path=None):
+        return self._run(_COMPILE_TASK, [(code, mode, target_file_path)])[0]
+
+    def compile_many(self, code_list, mode='c', target_file_path=None):
+        """
+        :param target_file_path: the output file of gcc with the pid of the worker added. A file of the worker if it
+        is None
+        :return: a list of (compile success, compile diagnostics) in the same order of code_list
+        """
+        return self._run(_COMPILE_TASK, [(code, mode, target_file_path) for code in code_list])
+
+    # ------------------- the same interface as multiprocessing.Pool ------------------------ #
+    def starmap(self, fn, iterable):
+        return self._run(fn, list(iterable))
+
+    def map(self, fn, iterable):
+        return self._run(fn, [(one, ) for one in iterable])
+
+    def close(self):
+        for _ in self._workers:
+            self._task_queue.put(_STOP_TASK)
+
+    def join(self):
+        for p in self._workers:
+            p.join()
+
+    def terminate(self):
+        for p in self._workers:
+            p.terminate()
+
+    def is_owner_process(self):
+        return os.getpid() == self.owner_pid
+
+
+def compile_code_by_backend(code, mode='c', target_file_path=None):
+    """
+    compile one code in the current process without a shell. A round trip to the server workers costs more than it
+    saves for a single code, so the server is only used for the batch compile in compile_code_ids_list.
+    :param target_file_path: the output file of gcc, used as it is. A file of the current process if it is None
+    """
+    return get_local_compiler().compile(code, mode, target_file_path)
+
+
+def benchmark_compile(code_list, num_processes=4, repeat=1):
+    """
+    compare the programs per second of the os.system compile path and the compile server.
+    """
+    from multiprocessing import Pool
+
+    res = {}
+    args = [(code, '/dev/shm/main.c', '/dev/shm/main.out', '/dev/shm/main.log') for code in code_list] * repeat
+    pool = Pool(num_processes)
+    begin = time.time()
+    pool.starmap(_os_system_compile, args)
+    res['os_system'] = len(args) / (time.time() - begin)
+    pool.close()
+    pool.join()
+
+    server = CompileServer(num_processes)
+    # warm up the worker processes
+    server.compile_many(code_list[:num_processes])
+    begin = time.time()
+    server.compile_many([a[0] for a in args])
+    res['compile_server'] = len(args) / (time.time() - begin)
+    server.close()
+    server.join()
+    return res
+
+
+def _os_system_compile(code, file_path, target_file_path, log_file_path):
+    # a copy of the original compile_and_read_error_info path. It doesn't import common.util to keep the benchmark
+    # runnable without the training dependencies.
+    file_name, ext = os.path.splitext(file_path)
+    file_path = file_name + '_' + str(os.getpid()) + ext
+    file_name, ext = os.path.splitext(log_file_path)
+    log_file_path = file_name + '_' + str(os.getpid()) + ext
+    with open(file_path, 'w') as f:
+        f.write(code)
+    res = os.system('gcc -o {} -std=gnu99 {} >{} 2>&1'.format(target_file_path, file_path, log_file_path))
+    with open(log_file_path, encoding='utf-8') as f:
+        texts = f.read()
+    return res == 0, texts
@@ -32,6 +32,7 @@ SLK_SAMPLE_COMMON_C_ERROR_RECORDS_VALID = 'slk_sample_common_c_error_records_val
 SLK_SAMPLE_COMMON_C_ERROR_RECORDS_TEST = 'slk_sample_common_c_error_records_test'
 COMMON_DEEPFIX_ERROR_RECORDS = 'common_deepfix_error_records'
 DATA_RECORDS_DEEPFIX = 'data_records_deepfix'
+STREAM_CHECKPOINT_RECORDS = 'stream_checkpoint_records'
 
 # code status and language transform dict
 verdict = {'OK': 1, 'REJECTED': 2, 'WRONG_ANSWER': 3, 'RUNTIME_ERROR': 4, 'TIME_LIMIT_EXCEEDED': 5, 'MEMORY_LIMIT_EXCEEDED': 6,
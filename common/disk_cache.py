@@ -0,0 +1,412 @@
+"""
+The disk cache of the data loaders. The key is made of the fingerprint of the argument values and the version of
+the decorated function. Every cache entry is a directory 'directory/basename-key' with a manifest and one or more
+item files:
+    a tuple or list result is saved item by item so that one item can be loaded alone,
+    a DataFrame item is saved in row chunks which can be iterated one by one,
+    a numpy array item is saved as .npy which can be memory mapped,
+    the other items are pickled.
+The entries are evicted by the last access time when the total size is larger than max_bytes.
+"""
+
+import errno
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import shutil
+import time
+
+import more_itertools
+import numpy as np
+import pandas as pd
+
+MANIFEST_NAME = 'manifest.pickle'
+FORMAT_VERSION = 1
+
+
+def ensure_directory(directory):
+    """
+    Create the directories along the provided directory path that do not exist.
+    """
+    directory = os.path.expanduser(directory)
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise e
+
+
+# ================================================================
+# fingerprint
+# ================================================================
+
+def _update_frame_fingerprint(h, item):
+    is_frame = isinstance(item, pd.DataFrame)
+    columns = list(item.columns) if is_frame else [item.name]
+    dtypes = [str(t) for t in item.dtypes] if is_frame else [str(item.dtype)]
+    h.update(repr((type(item).__name__, item.shape, columns, dtypes)).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(item.index, index=False).values.tobytes())
+    for _, column in (item.items() if is_frame else [(item.name, item)]):
+        try:
+            column_hash = pd.util.hash_pandas_object(column, index=False)
+        except TypeError:
+            # the cells are not hashable, such as list. repr of the value cells is stable across processes
+            column_hash = pd.util.hash_pandas_object(column.map(repr), index=False)
+        h.update(column_hash.values.tobytes())
+
+
+def _update_array_fingerprint(h, item):
+    h.update(repr(('ndarray', item.shape, str(item.dtype))).encode('utf-8'))
+    if item.dtype == object:
+        h.update(repr(item.reshape(-1).tolist()).encode('utf-8'))
+    else:
+        h.update(np.ascontiguousarray(item).tobytes())
+
+
+def _item_fingerprint(item):
+    h = hashlib.sha1()
+    _update_fingerprint(h, item)
+    return h.digest()
+
+
+def _update_fingerprint(h, item):
+    if isinstance(item, (pd.DataFrame, pd.Series)):
+        _update_frame_fingerprint(h, item)
+    elif isinstance(item, np.ndarray):
+        _update_array_fingerprint(h, item)
+    elif item is None or isinstance(item, (bool, int, float, str, bytes)):
+        h.update(repr((type(item).__name__, item)).encode('utf-8'))
+    elif isinstance(item, (list, tuple)):
+        h.update(repr((type(item).__name__, len(item))).encode('utf-8'))
+        for one in item:
+            _update_fingerprint(h, one)
+    elif isinstance(item, (set, frozenset)):
+        # the order of a set is not stable, so the fingerprints of the elements are sorted
+        h.update(repr((type(item).__name__, len(item))).encode('utf-8'))
+        for one in sorted(_item_fingerprint(one) for one in item):
+            h.update(one)
+    elif isinstance(item, dict):
+        h.update(repr(('dict', len(item))).encode('utf-8'))
+        for k, v in sorted((_item_fingerprint(k), _item_fingerprint(v)) for k, v in item.items()):
+            h.update(k)
+            h.update(v)
+    elif callable(item) and hasattr(item, '__qualname__'):
+        h.update(repr(('function', getattr(item, '__module__', ''), item.__qualname__)).encode('utf-8'))
+    else:
+        raise TypeError('{}.{} is not a value to fingerprint, pass the key function of disk_cache'.format(
+            type(item).__module__, type(item).__qualname__))
+
+
+def data_fingerprint(*items):
+    """
+    A fingerprint of the values in items. Every row of a DataFrame and every element of an array is hashed.
+    TypeError if an item is not made of values, such as a vocabulary object.
+    """
+    h = hashlib.sha1()
+    for item in items:
+        _update_fingerprint(h, item)
+    return h.hexdigest()
+
+
+def function_version(func):
+    """
+    the hash of the function source. The cache is invalidated when the decorated function is changed.
+    """
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = func.__qualname__
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]
+
+
+def data_hash(key):
+    """
+    The old cache key. It hashes every element of the key and it is kept to find the old cache files.
+    """
+
+    def hash_value(hash_item):
+        v = 0
+        try:
+            v = int(hashlib.md5(str(hash_item).encode('utf-8')).hexdigest(), 16)
+        except Exception as e:
+            print('error occur while hash item {} '.format(type(hash_item)))
+        return v
+
+    hash_val = 0
+    key = list(more_itertools.flatten(key))
+    for item in key:
+        if isinstance(item, pd.DataFrame):
+            serlist = [item.itertuples(index=False, name=None)]
+            serlist = list(more_itertools.collapse(serlist))
+            for ser in serlist:
+                val = hash_value(ser)
+                hash_val += val
+        elif isinstance(item, pd.Series):
+            serlist = item.tolist()
+            serlist = list(more_itertools.collapse(serlist))
+            for ser in serlist:
+                val = hash_value(ser)
+                hash_val += val
+        elif isinstance(item, int) or isinstance(item, float) or isinstance(item, str):
+            val = hash_value(item)
+            hash_val += val
+        elif isinstance(item, list) or isinstance(item, set) or isinstance(item, tuple):
+            serlist = list(more_itertools.collapse(item))
+            for ser in serlist:
+                val = hash_value(ser)
+                hash_val += val
+        elif isinstance(item, dict):
+            serlist = list(more_itertools.collapse(item.items()))
+            for ser in serlist:
+                val = hash_value(ser)
+                hash_val += val
+        else:
+            print('type {} cant be hashed.'.format(type(item)))
+    return str(hash_val)
+
+
+# ================================================================
+# chunked storage
+# ================================================================
+
+def _dump_pickle(obj, path):
+    with open(path, 'wb') as handle:
+        pickle.dump(obj, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load_pickle(path):
+    with open(path, 'rb') as handle:
+        return pickle.load(handle)
+
+
+def _save_item(item, entry_path, name, chunk_rows):
+    if isinstance(item, pd.DataFrame):
+        files = []
+        for i, begin in enumerate(range(0, max(len(item), 1), chunk_rows)):
+            file_name = '{}_chunk{}.pickle'.format(name, i)
+            _dump_pickle(item.iloc[begin:begin + chunk_rows], os.path.join(entry_path, file_name))
+            files.append(file_name)
+        return {'kind': 'dataframe', 'files': files}
+    elif isinstance(item, np.ndarray) and item.dtype != object:
+        file_name = '{}.npy'.format(name)
+        np.save(os.path.join(entry_path, file_name), item, allow_pickle=False)
+        return {'kind': 'ndarray', 'files': [file_name]}
+    else:
+        file_name = '{}.pickle'.format(name)
+        _dump_pickle(item, os.path.join(entry_path, file_name))
+        return {'kind': 'pickle', 'files': [file_name]}
+
+
+def _iter_item_chunks(item_meta, entry_path, mmap_mode=None):
+    for file_name in item_meta['files']:
+        path = os.path.join(entry_path, file_name)
+        if item_meta['kind'] == 'ndarray':
+            yield np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+        else:
+            yield _load_pickle(path)
+
+
+def _load_item(item_meta, entry_path, mmap_mode=None):
+    chunks = list(_iter_item_chunks(item_meta, entry_path, mmap_mode))
+    if item_meta['kind'] == 'dataframe':
+        return chunks[0] if len(chunks) == 1 else pd.concat(chunks)
+    return chunks[0]
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+class DiskCacheEntry(object):
+    def __init__(self, entry_path):
+        self.entry_path = entry_path
+        self.manifest_path = os.path.join(entry_path, MANIFEST_NAME)
+        self._manifest = None
+
+    def exists(self):
+        return os.path.isfile(self.manifest_path)
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            self._manifest = _load_pickle(self.manifest_path)
+        return self._manifest
+
+    def touch(self):
+        # the mtime of the manifest is the last access time used by the LRU eviction
+        os.utime(self.manifest_path, None)
+
+    def save(self, result, chunk_rows):
+        """
+        write to a temp directory then rename it, so a half written entry is never read
+        """
+        tmp_path = '{}.tmp{}'.format(self.entry_path, os.getpid())
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        if type(result) in (tuple, list):
+            container = type(result).__name__
+            items = [_save_item(item, tmp_path, 'item{}'.format(i), chunk_rows) for i, item in enumerate(result)]
+        else:
+            container = None
+            items = [_save_item(result, tmp_path, 'item0', chunk_rows)]
+        manifest = {'format_version': FORMAT_VERSION, 'container': container, 'items': items,
+                    'size': _directory_size(tmp_path), 'create_time': time.time()}
+        _dump_pickle(manifest, os.path.join(tmp_path, MANIFEST_NAME))
+        if os.path.exists(self.entry_path):
+            shutil.rmtree(self.entry_path)
+        os.rename(tmp_path, self.entry_path)
+        self._manifest = manifest
+
+    def load(self, mmap_mode=None):
+        self.touch()
+        manifest = self.manifest
+        items = [_load_item(item_meta, self.entry_path, mmap_mode) for item_meta in manifest['items']]
+        if manifest['container'] == 'tuple':
+            return tuple(items)
+        elif manifest['container'] == 'list':
+            return items
+        return items[0]
+
+    def load_item(self, index, mmap_mode=None):
+        self.touch()
+        return _load_item(self.manifest['items'][index], self.entry_path, mmap_mode)
+
+    def iter_chunks(self, index, mmap_mode=None):
+        self.touch()
+        return _iter_item_chunks(self.manifest['items'][index], self.entry_path, mmap_mode)
+
+
+def evict_disk_cache(directory, max_bytes, keep_paths=()):
+    """
+    remove the least recently used cache entries in the directory until the total size is not larger than max_bytes.
+    Only the entries created by disk_cache are counted and removed.
+    :return: the removed entry paths
+    """
+    entries = []
+    for name in os.listdir(directory):
+        entry = DiskCacheEntry(os.path.join(directory, name))
+        if os.path.isdir(entry.entry_path) and entry.exists():
+            try:
+                entries.append((os.path.getmtime(entry.manifest_path), entry.manifest['size'], entry.entry_path))
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+    total_size = sum(e[1] for e in entries)
+    removed = []
+    for _, size, entry_path in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        if entry_path in keep_paths:
+            continue
+        shutil.rmtree(entry_path, ignore_errors=True)
+        total_size -= size
+        removed.append(entry_path)
+    return removed
+
+
+def _default_max_bytes():
+    try:
+        from config import disk_cache_max_bytes
+    except ImportError:
+        return None
+    return disk_cache_max_bytes
+
+
+def disk_cache(basename, directory, method=False, version=None, key=None, chunk_rows=100000, mmap_mode=None,
+               max_bytes=-1):
+    """
+    Function decorator for caching pickleable return values on disk.
+    :param method: skip the first argument, usually being self or cls.
+    :param version: the code version in the key. The hash of the function source is used if it is None.
+    :param key: a function of the arguments (without self or cls) returning the values fingerprinted in place of the
+    arguments. It is required when an argument is not a value, such as a vocabulary object.
+    :param chunk_rows: the number of rows in one chunk file of a DataFrame
+    :param mmap_mode: the mmap_mode used to load the numpy arrays, such as 'r'
+    :param max_bytes: the max total size of the entries in directory. -1 means disk_cache_max_bytes in config and
+    None means no limit.
+    The decorated function has the methods cache_entry_path(*args, **kwargs), load_item(index, *args, **kwargs) and
+    iter_chunks(index, *args, **kwargs) to load one item of a tuple result or iterate the chunks of a DataFrame item.
+    """
+    directory = os.path.expanduser(directory)
+    ensure_directory(directory)
+
+    def wrapper(func):
+        func_version = version if version is not None else function_version(func)
+
+        def split_key(args, kwargs):
+            # Don't use self or cls for the invalidation hash.
+            if method and args:
+                args = args[1:]
+            return args, kwargs
+
+        def cache_entry(args, kwargs):
+            args, kwargs = split_key(args, kwargs)
+            if key is not None:
+                fingerprint = data_fingerprint(func_version, key(*args, **kwargs))
+            else:
+                fingerprint = data_fingerprint(func_version, args, sorted(kwargs.items()))
+            return DiskCacheEntry(os.path.join(directory, '{}-{}'.format(basename, fingerprint)))
+
+        def load_legacy(args, kwargs):
+            """
+            the cache file written by the old disk_cache. data_hash is slow for DataFrames and it ignored the
+            non-value arguments, so both are skipped.
+            :return: (found, result)
+            """
+            legacy_key = (tuple(args), tuple(kwargs.items()))
+            # the old key of a method dropped the whole args tuple, not only self or cls
+            if method and legacy_key:
+                legacy_key = legacy_key[1:]
+            values = [v for part in legacy_key for v in part]
+            if key is not None or any(isinstance(v, (pd.DataFrame, pd.Series)) for v in values):
+                return False, None
+            filepath = os.path.join(directory, '{}-{}.pickle'.format(basename, data_hash(legacy_key)))
+            if not os.path.isfile(filepath):
+                return False, None
+            print("load old cache file from:{}".format(filepath))
+            return True, _load_pickle(filepath)
+
+        def compute_entry(args, kwargs):
+            """
+            :return: (entry, hit, result). result is None if hit, the entry is loaded lazily then
+            """
+            entry = cache_entry(args, kwargs)
+            if entry.exists():
+                return entry, True, None
+            found, result = load_legacy(args, kwargs)
+            if not found:
+                result = func(*args, **kwargs)
+            print("write cache to: {}".format(entry.entry_path))
+            entry.save(result, chunk_rows)
+            limit = _default_max_bytes() if max_bytes == -1 else max_bytes
+            if limit is not None:
+                evict_disk_cache(directory, limit, keep_paths=(entry.entry_path, ))
+            return entry, False, result
+
+        @functools.wraps(func)
+        def wrapped(*args, **kwargs):
+            entry, hit, result = compute_entry(args, kwargs)
+            if not hit:
+                return result
+            print("load cache from:{}".format(entry.entry_path))
+            return entry.load(mmap_mode)
+
+        def cache_entry_path(*args, **kwargs):
+            return cache_entry(args, kwargs).entry_path
+
+        def load_item(index, *args, **kwargs):
+            entry, _, _ = compute_entry(args, kwargs)
+            return entry.load_item(index, mmap_mode)
+
+        def iter_chunks(index, *args, **kwargs):
+            entry, _, _ = compute_entry(args, kwargs)
+            return entry.iter_chunks(index, mmap_mode)
+
+        wrapped.cache_entry_path = cache_entry_path
+        wrapped.load_item = load_item
+        wrapped.iter_chunks = iter_chunks
+        return wrapped
+
+    return wrapper
@@ -0,0 +1,338 @@
+"""
+Resolve a --config_name without building every config. The old entry points imported parameters_config before
+parsing the arguments and called the config function at once, so even --help paid for the config module and an
+unknown name failed only after the import.
+    1. ExperimentRegistry lists the config names by scanning the source of parameters_config, it imports nothing.
+    2. ExperimentRegistry.get checks the name and returns a LazyConfig without importing parameters_config. The
+       config function is split into its statements and a key is computed by only the statements its value depends
+       on. The top level imports and functions of parameters_config are executed only for the names those statements
+       use. So reading 'name' runs nothing, reading 'model_dict' builds the vocabulary but not the datasets, and only
+       reading 'data' (or a value computed from the datasets) loads the datasets.
+    3. StartupTimer records the wall time of every startup phase and report() prints it in one line.
+This module only imports the standard library, so it can be imported before torch to time the imports.
+"""
+
+import ast
+import collections
+import contextlib
+import copy
+import importlib
+import os
+import re
+import time
+from collections.abc import MutableMapping
+
+PARAMETERS_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      'parameters_config.py')
+
+# every config function of parameters_config takes only is_debug
+_config_fn_pattern = re.compile(r'^def (\w+)\(is_debug\):', re.MULTILINE)
+
+
+class StartupTimer(object):
+    """
+    the wall time of the ordered startup phases
+        startup_timer = StartupTimer(begin_time)
+        with startup_timer('import parameters_config'):
+            ...
+    """
+    def __init__(self, begin_time=None):
+        self.begin_time = time.time() if begin_time is None else begin_time
+        self.phase_time = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        begin = time.time()
+        try:
+            yield
+        finally:
+            self.phase_time[name] = self.phase_time.get(name, 0) + time.time() - begin
+
+    def mark(self, name):
+        """
+        record the time from the end of the last phase (or begin_time) to now as the phase name
+        """
+        self.phase_time[name] = time.time() - self.begin_time - sum(self.phase_time.values())
+
+    def total(self):
+        return time.time() - self.begin_time
+
+    def __str__(self):
+        phase_str = ', '.join('{}: {:.3f}s'.format(name, t) for name, t in self.phase_time.items())
+        return 'startup time: {}, total: {:.3f}s'.format(phase_str, self.total())
+
+    def report(self):
+        print(str(self))
+
+
+def _phase(startup_timer, name):
+    return startup_timer(name) if startup_timer is not None else contextlib.nullcontext()
+
+
+def _base_name(node):
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Starred)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _loaded_names(node):
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Load)}
+
+
+def _stored_names(stmt):
+    """
+    the names a statement binds or changes. The base name of an assigned attribute or item is changed. An assignment
+    is taken as not changing the objects it reads, but an expression statement such as vocabulary.add_token(...) is
+    taken as changing every name it reads.
+    """
+    if isinstance(stmt, ast.Expr):
+        return _loaded_names(stmt)
+    names = set()
+    for n in ast.walk(stmt):
+        if isinstance(n, ast.Name) and isinstance(n.ctx, (ast.Store, ast.Del)):
+            names.add(n.id)
+        elif isinstance(n, (ast.Attribute, ast.Subscript)) and isinstance(n.ctx, (ast.Store, ast.Del)):
+            names.add(_base_name(n))
+        elif isinstance(n, (ast.Import, ast.ImportFrom)):
+            names.update((a.asname or a.name).split('.')[0] for a in n.names)
+        elif isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(n.name)
+    names.discard(None)
+    return names
+
+
+def _compile_statement(stmt, path):
+    return compile(ast.Module(body=[stmt], type_ignores=[]), path, 'exec')
+
+
+class ConfigSource(object):
+    """
+    the parsed source of a config module. Its top level statements are executed only for the names asked by resolve,
+    an import statement only for the asked alias.
+    """
+    def __init__(self, module_name, path):
+        self.module_name = module_name
+        self.path = path
+        with open(path, 'r', encoding='utf-8') as f:
+            self.tree = ast.parse(f.read(), path)
+        self.functions = {}
+        self._definitions = {}
+        for stmt in self.tree.body:
+            if isinstance(stmt, (ast.Import, ast.ImportFrom)):
+                for alias in stmt.names:
+                    one_import = ast.copy_location(copy.copy(stmt), stmt)
+                    one_import.names = [alias]
+                    self._definitions[(alias.asname or alias.name).split('.')[0]] = one_import
+            elif isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                self.functions[stmt.name] = stmt
+                self._definitions[stmt.name] = stmt
+            elif isinstance(stmt, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+                for name in _stored_names(stmt):
+                    self._definitions[name] = stmt
+        self.namespace = {'__name__': module_name, '__file__': path}
+        self._resolving = set()
+
+    def resolve(self, names):
+        """
+        execute the top level statements defining names and the names they use
+        :return: the module namespace
+        """
+        for name in sorted(names):
+            if name in self.namespace or name in self._resolving or name not in self._definitions:
+                continue
+            self._resolving.add(name)
+            stmt = self._definitions[name]
+            self.resolve(_loaded_names(stmt))
+            exec(_compile_statement(stmt, self.path), self.namespace)
+        return self.namespace
+
+
+class LazyConfig(MutableMapping):
+    """
+    the dict returned by a config function, whose values are computed at the first read. The statements before the
+    return are run on demand, each once and in the namespace it had in the function: a statement reads the values
+    set by the statements before it. The keys set by the caller override the keys of the config.
+    """
+    def __init__(self, source, name, is_debug, startup_timer=None):
+        self.source = source
+        self.name = name
+        self.startup_timer = startup_timer
+        fn_node = source.functions[name]
+        self._params = {fn_node.args.args[0].arg: is_debug}
+        self._statements = fn_node.body[:-1]
+        self._value_nodes = collections.OrderedDict((k.value, v) for k, v in zip(fn_node.body[-1].value.keys,
+                                                                                  fn_node.body[-1].value.values))
+        self._stored = [_stored_names(stmt) for stmt in self._statements]
+        # the values of the stored names after every executed statement, None if it has not been executed
+        self._results = [None] * len(self._statements)
+        self._values = {}
+
+    @staticmethod
+    def supports(fn_node):
+        """
+        a config function can be lazy if it ends with returning a dict of constant keys and returns nowhere else
+        """
+        ret = fn_node.body[-1]
+        if not isinstance(ret, ast.Return) or not isinstance(ret.value, ast.Dict) or len(fn_node.args.args) != 1:
+            return False
+        if any(k is None or not isinstance(k, ast.Constant) for k in ret.value.keys):
+            return False
+        return not any(isinstance(n, (ast.Return, ast.Yield, ast.YieldFrom, ast.Global, ast.Nonlocal))
+                       for stmt in fn_node.body[:-1] for n in ast.walk(stmt))
+
+    @property
+    def executed_statements(self):
+        """
+        :return: the indexes of the executed statements of the config function
+        """
+        return [i for i, res in enumerate(self._results) if res is not None]
+
+    def dependencies(self, key):
+        """
+        :return: the sorted indexes of the statements run to compute the value of key
+        """
+        found = set()
+        pending = [(_loaded_names(self._value_nodes[key]), len(self._statements))]
+        while pending:
+            names, position = pending.pop()
+            for i in range(position):
+                if i not in found and self._stored[i] & names:
+                    found.add(i)
+                    pending.append((_loaded_names(self._statements[i]) | self._stored[i], i))
+        return sorted(found)
+
+    def _value_before(self, name, position):
+        for i in range(position - 1, -1, -1):
+            res = self._results[i]
+            if res is not None and name in res:
+                return True, res[name]
+        if name in self._params:
+            return True, self._params[name]
+        namespace = self.source.resolve([name])
+        if name in namespace:
+            return True, namespace[name]
+        return False, None
+
+    def _namespace(self, names, position):
+        for name in names:
+            for i in range(position):
+                if name in self._stored[i]:
+                    self._run(i)
+        namespace = dict(self.source.namespace)
+        for name in names:
+            found, value = self._value_before(name, position)
+            if found:
+                namespace[name] = value
+        return namespace
+
+    def _run(self, position):
+        if self._results[position] is not None:
+            return
+        stmt = self._statements[position]
+        stored = self._stored[position]
+        namespace = self._namespace(_loaded_names(stmt) | stored, position)
+        exec(_compile_statement(stmt, self.source.path), namespace)
+        self._results[position] = {name: namespace[name] for name in stored if name in namespace}
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            value_node = self._value_nodes[key]
+            with _phase(self.startup_timer, 'config {}'.format(self.name)):
+                namespace = self._namespace(_loaded_names(value_node), len(self._statements))
+                expression = ast.fix_missing_locations(ast.Expression(body=value_node))
+                self._values[key] = eval(compile(expression, self.source.path, 'eval'), namespace)
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if key not in self._values and key not in self._value_nodes:
+            raise KeyError(key)
+        self._values.pop(key, None)
+        self._value_nodes.pop(key, None)
+
+    def __iter__(self):
+        yield from self._value_nodes
+        for key in self._values:
+            if key not in self._value_nodes:
+                yield key
+
+    def __len__(self):
+        return len(set(self._value_nodes) | set(self._values))
+
+    def __contains__(self, key):
+        return key in self._value_nodes or key in self._values
+
+    def __repr__(self):
+        return 'LazyConfig({}, executed statements: {}/{})'.format(self.name, len(self.executed_statements),
+                                                                    len(self._statements))
+
+
+class ExperimentRegistry(object):
+    def __init__(self, module_name='parameters_config', path=PARAMETERS_CONFIG_PATH):
+        self.module_name = module_name
+        self.path = path
+        self._names = None
+        self._source = None
+
+    def source(self, startup_timer=None):
+        if self._source is None:
+            with _phase(startup_timer, 'parse {}'.format(self.module_name)):
+                self._source = ConfigSource(self.module_name, self.path)
+        return self._source
+
+    def names(self):
+        """
+        :return: the sorted names of the config functions, found in the source without importing it
+        """
+        if self._names is None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._names = sorted(set(_config_fn_pattern.findall(f.read())))
+        return self._names
+
+    def __contains__(self, name):
+        return name in self.names()
+
+    def check_name(self, name):
+        if name not in self:
+            raise ValueError('unknown config name {}, the configs are: {}'.format(name, ', '.join(self.names())))
+
+    def config_fn(self, name, startup_timer=None):
+        """
+        import the config module and return the config function of name
+        """
+        self.check_name(name)
+        with _phase(startup_timer, 'import {}'.format(self.module_name)):
+            module = importlib.import_module(self.module_name)
+        return getattr(module, name)
+
+    def get(self, name, is_debug, startup_timer=None):
+        """
+        :return: the LazyConfig of name, or the config dict if the config function can't be split. ValueError if
+        there is no config of name
+        """
+        self.check_name(name)
+        source = self.source(startup_timer)
+        if LazyConfig.supports(source.functions[name]):
+            return LazyConfig(source, name, is_debug, startup_timer)
+        config_fn = self.config_fn(name, startup_timer)
+        with _phase(startup_timer, 'config {}'.format(name)):
+            return config_fn(is_debug)
+
+
+_default_registry = None
+
+
+def get_experiment_registry():
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = ExperimentRegistry()
+    return _default_registry
+
+
+def load_config(name, is_debug, startup_timer=None):
+    """
+    :return: the LazyConfig of the parameters_config config name
+    """
+    return get_experiment_registry().get(name, is_debug, startup_timer)
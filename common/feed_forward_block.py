@@ -5,7 +5,6 @@ import torch.nn.functional as F
 import torch.optim as optim
 from toolz.sandbox import unzip
 from torch.utils.data import Dataset
-from torchvision import transforms
 import more_itertools
 import numpy as np
 
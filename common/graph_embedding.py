@@ -1,3 +1,4 @@
+import itertools
 import os
 import random
 
@@ -7,6 +8,61 @@ import math
 import torch.nn.functional as F
 
 
+class GraphEdges(object):
+    """
+    The edge list of a batch of graphs. It is the sparse version of the adjacency matrix [batch_size, seq, seq] used by
+    GGNNLayer, adj[b, i, j] is the number of the edges (b, i, j). The memory is linear in the number of edges instead of
+    quadratic in the sequence length.
+    The edges are not split between devices, so it can't be used with the multi gpu DataParallel model.
+    """
+    def __init__(self, index):
+        """
+        :param index: LongTensor [3, edge_count]. Each column is (batch index, target node, source node)
+        """
+        self.index = index
+        self._flat_index_cache = {}
+
+    @staticmethod
+    def from_adjacent_list(adj_list):
+        """
+        :param adj_list: the 'adj' of a batch data. A list of [target node, source node] pairs for each graph
+        """
+        batch_index = list(itertools.chain.from_iterable([i] * len(adj) for i, adj in enumerate(adj_list)))
+        edges = torch.LongTensor(list(itertools.chain.from_iterable(adj_list))).view(-1, 2)
+        index = torch.cat((torch.LongTensor(batch_index).unsqueeze(0), edges.t()), dim=0)
+        return GraphEdges(index)
+
+    def _flat_index(self, seq):
+        if seq not in self._flat_index_cache:
+            batch_offset = self.index[0] * seq
+            self._flat_index_cache[seq] = (batch_offset + self.index[1], batch_offset + self.index[2])
+        return self._flat_index_cache[seq]
+
+    def propagate(self, x):
+        """
+        The same as torch.bmm(adj, x). The messages of the source nodes are scatter added to the target nodes.
+        :param x: shape [batch_size, seq, dim]
+        """
+        batch_size, seq, dim = x.shape
+        target, source = self._flat_index(seq)
+        flat_x = x.contiguous().view(-1, dim)
+        o = torch.zeros_like(flat_x).index_add_(0, target, flat_x.index_select(0, source))
+        return o.view(batch_size, seq, dim)
+
+    def to_dense(self, batch_size, seq):
+        values = torch.ones(self.index.shape[1], device=self.index.device)
+        return torch.sparse_coo_tensor(self.index, values, torch.Size([batch_size, seq, seq])).to_dense()
+
+    def to(self, device):
+        return GraphEdges(self.index.to(device))
+
+    def cuda(self, device=None):
+        return GraphEdges(self.index.cuda(device))
+
+    def cpu(self):
+        return GraphEdges(self.index.cpu())
+
+
 class GGNNLayer(nn.Module):
     def __init__(self, hidden_state_size):
         super().__init__()
@@ -16,10 +72,13 @@ class GGNNLayer(nn.Module):
     def forward(self, x, adj):
         """
         :param x: shape [batch_size, seq, dim]
-        :param adj: [batch_size, seq, seq]
+        :param adj: [batch_size, seq, seq] or a GraphEdges
         :return:
         """
-        a = torch.bmm(adj, x) + self.b
+        if isinstance(adj, GraphEdges):
+            a = adj.propagate(x) + self.b
+        else:
+            a = torch.bmm(adj, x) + self.b
         batch_size, seq, dim = x.shape
         o = self.gru_cell(a.view(-1, dim), x.view(-1, dim))
         return o.view(batch_size, seq, dim)
@@ -0,0 +1,151 @@
+"""
+A multi worker prefetching version of common.util.data_loader. data_loader gets the samples of a batch and merges them
+on the main process, queued_data_loader moves this to one process. Here the index batches are cut on the main process
+and sent to N forked worker processes, which get the samples and merge them into the batch dict. At most
+prefetch_depth batches are in flight and the batches are yielded in the order they are cut.
+Every batch draws its samples from a random.Random seeded by (seed, batch number), so the batches under a seed are the
+same for any number of workers and the global random state of the main process is untouched. If the dataset has a sample_length method the shuffled samples are sorted by length in
+buckets of bucket_batch_count batches, so the samples of a batch have near lengths and less padding.
+"""
+
+import contextlib
+import queue
+import random
+import traceback
+
+import numpy as np
+import toolz
+import torch
+import torch.multiprocessing as mp
+
+_STOP_TASK = None
+# seconds to wait for a batch before checking the workers are alive
+_POLL_SECONDS = 5
+
+
+def cut_index_batches(dataset, batch_size, is_shuffle=True, drop_last=False, epoch_ratio=1.0, seed=0,
+                      length_fn=None, bucket_batch_count=50):
+    """
+    :param length_fn: index -> the sample length. The samples are bucketed by it if not None and is_shuffle
+    :return: a list of index lists
+    """
+    rng = random.Random(seed)
+    idxs = list(range(len(dataset)))
+    if is_shuffle:
+        rng.shuffle(idxs)
+    idxs = idxs[0: int(len(idxs)*epoch_ratio)]
+    if is_shuffle and length_fn is not None:
+        bucket_size = batch_size * bucket_batch_count
+        idxs = [i for b in range(0, len(idxs), bucket_size) for i in sorted(idxs[b:b+bucket_size], key=length_fn)]
+    batches = [idxs[b:b+batch_size] for b in range(0, len(idxs), batch_size)]
+    if drop_last and len(batches) > 0 and len(batches[-1]) != batch_size:
+        batches = batches[:-1]
+    if is_shuffle and length_fn is not None:
+        # the buckets are sorted, don't feed the batches from short to long
+        rng.shuffle(batches)
+    return batches
+
+
+@contextlib.contextmanager
+def _seeded_global_random(rng, np_rng):
+    """
+    draw random and np.random from the states of rng and np_rng, and restore their states after
+    """
+    state = random.getstate()
+    np_state = np.random.get_state()
+    random.setstate(rng.getstate())
+    np.random.set_state(np_rng.get_state())
+    try:
+        yield
+    finally:
+        random.setstate(state)
+        np.random.set_state(np_state)
+
+
+def create_batch(dataset, idx, seed):
+    """
+    get the samples by dataset.get_sample(index, rng) with a random.Random of seed. A dataset without get_sample
+    draws from random and np.random seeded by seed, their states are restored after the batch
+    """
+    rng = random.Random(seed)
+    get_sample = getattr(dataset, 'get_sample', None)
+    if get_sample is not None:
+        samples = [get_sample(i, rng) for i in idx]
+    else:
+        with _seeded_global_random(rng, np.random.RandomState(seed % 2 ** 32)):
+            samples = [dataset[i] for i in idx]
+    return toolz.merge_with(lambda x: x, samples)
+
+
+def pin_batch(batch):
+    return {k: v.pin_memory() if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+
+
+def _batch_worker(dataset, task_queue, result_queue):
+    while True:
+        task = task_queue.get()
+        if task is _STOP_TASK:
+            break
+        batch_no, idx, seed = task
+        try:
+            result_queue.put((batch_no, create_batch(dataset, idx, seed), None))
+        except Exception as e:
+            result_queue.put((batch_no, None, traceback.format_exc()))
+
+
+def prefetch_data_loader(dataset, batch_size, is_shuffle=True, drop_last=False, epoch_ratio=1.0, num_workers=4,
+                         prefetch_depth=8, seed=None, length_bucket=False, bucket_batch_count=50, pin_memory=False):
+    """
+    :param seed: the seed of the shuffle and the samples. It is drawn from random if None, so it follows random.seed
+    :param length_bucket: bucket the samples by dataset.sample_length when shuffling
+    :param pin_memory: pin the tensor values of the batch dict
+    :return: a generator of the batch dicts {key: the value list of the samples} as data_loader
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    length_fn = getattr(dataset, 'sample_length', None) if length_bucket else None
+    batches = cut_index_batches(dataset, batch_size, is_shuffle=is_shuffle, drop_last=drop_last,
+                                epoch_ratio=epoch_ratio, seed=seed, length_fn=length_fn,
+                                bucket_batch_count=bucket_batch_count)
+    pin_memory = pin_memory and torch.cuda.is_available()
+
+    if num_workers <= 0 or mp.current_process().daemon:
+        for batch_no, idx in enumerate(batches):
+            batch = create_batch(dataset, idx, seed + batch_no)
+            yield pin_batch(batch) if pin_memory else batch
+        return
+
+    # the forked workers share the dataset with the main process
+    ctx = mp.get_context('fork')
+    task_queue = ctx.Queue()
+    result_queue = ctx.Queue()
+    workers = [ctx.Process(target=_batch_worker, args=(dataset, task_queue, result_queue), daemon=True)
+               for _ in range(num_workers)]
+    for w in workers:
+        w.start()
+    try:
+        sent_count = 0
+        ready = {}
+        for batch_no in range(len(batches)):
+            while sent_count < len(batches) and sent_count < batch_no + prefetch_depth:
+                task_queue.put((sent_count, batches[sent_count], seed + sent_count))
+                sent_count += 1
+            while batch_no not in ready:
+                try:
+                    no, batch, error = result_queue.get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    if not all(w.is_alive() for w in workers):
+                        raise Exception('a prefetch data loader worker exited')
+                    continue
+                if error is not None:
+                    raise Exception('create the batch {} failed in the worker:\n{}'.format(no, error))
+                ready[no] = batch
+            batch = ready.pop(batch_no)
+            yield pin_batch(batch) if pin_memory else batch
+    finally:
+        for _ in workers:
+            task_queue.put(_STOP_TASK)
+        for w in workers:
+            w.join(timeout=1)
+            if w.is_alive():
+                w.terminate()
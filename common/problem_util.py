@@ -1,16 +1,33 @@
 import os
 
+import torch
+from torch import nn
+
 
 GPU_INDEX = 0
 Parallel = False
 
+# the prefix of the parameter names of a nn.DataParallel model. The checkpoints are saved with it.
+MODULE_PREFIX = 'module.'
 
-def to_cuda(x):
+
+def get_device():
+    """
+    :return: the torch.device of the model and the batch tensors. It is cpu if GPU_INDEX is None or no gpu exists.
+    """
+    if GPU_INDEX is None or not torch.cuda.is_available():
+        return torch.device('cpu')
     if Parallel:
-        return x.cuda()
-    elif GPU_INDEX is None:
+        return torch.device('cuda')
+    return torch.device('cuda', GPU_INDEX)
+
+
+def to_cuda(x):
+    if get_device().type == 'cpu':
         return x.cpu()
-    elif not Parallel:
+    elif Parallel:
+        return x.cuda()
+    else:
         return x.cuda(GPU_INDEX)
 
 
@@ -18,4 +35,51 @@ def get_gpu_index():
     return GPU_INDEX
 
 
+def set_num_threads(num_threads=None, num_interop_threads=None):
+    """
+    set the intra op and inter op thread numbers of torch on cpu. None keeps the torch default.
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads is not None:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            # it can only be set before the first inter op parallel work
+            print('set num interop threads failed: {}'.format(e))
+
+
+def prepare_model(m):
+    """
+    move the model to get_device(). It is wrapped by nn.DataParallel only if Parallel and more than one gpu exists.
+    """
+    device = get_device()
+    m = m.to(device)
+    if device.type == 'cuda' and Parallel and torch.cuda.device_count() > 1:
+        m = nn.DataParallel(m)
+    return m
+
+
+def unwrap_model(m):
+    return m.module if isinstance(m, nn.DataParallel) else m
+
+
+def save_model(m, path):
+    """
+    save the state dict with the nn.DataParallel parameter names, the same as the checkpoints saved before
+    """
+    print('save model: {}'.format(path))
+    state_dict = unwrap_model(m).state_dict()
+    torch.save({MODULE_PREFIX + k: v for k, v in state_dict.items()}, path)
+
+
+def load_model(m, path):
+    """
+    load a checkpoint saved with or without the nn.DataParallel parameter names to the device of get_device()
+    """
+    state_dict = torch.load(path, map_location=get_device())
+    state_dict = {k[len(MODULE_PREFIX):] if k.startswith(MODULE_PREFIX) else k: v for k, v in state_dict.items()}
+    unwrap_model(m).load_state_dict(state_dict)
+
+
 PAD_VALUE = -1
@@ -2,8 +2,10 @@ import os
 from parser import ParserError
 
 from c_parser.buffered_clex import BufferedCLex
+from c_parser.fast_clex import FastBufferedCLex
 from c_parser.pycparser.pycparser import CParser
 from c_parser.pycparser.pycparser.c_lexer import CLexer
+from common import args_util
 
 
 class ValueToken:
@@ -21,6 +23,8 @@ class ValueToken:
 
 
 def init_pycparser(lexer=CLexer):
+    if lexer is BufferedCLex and args_util.use_fast_lexer:
+        lexer = FastBufferedCLex
     c_parser = CParser()
     c_parser.build(lexer=lexer)
     return c_parser
@@ -0,0 +1,520 @@
+"""
+A long-lived local repair service. The only way to repair programs was the multi_step_evaluate of train.py, which
+builds the datasets of a config and runs the whole test set. The RepairServer loads a model once and repairs the C
+programs posted to a local HTTP endpoint:
+    1. the program is tokenized in the thread of the request and waits in the bucket of its token length.
+    2. the batching thread runs a bucket as one batch when it has max_batch_size programs or its oldest program has
+       waited max_batch_delay seconds, so the concurrent requests of similar lengths share the model steps.
+    3. the batch goes through the same multi step compile loop as multi_step_evaluate (multi_step_one_batch), and every
+       request gets the last output code and whether it compiles. The configs without a multi step input fn
+       (RNNPointerNetworkModelWithSLKMask) sample the program once and compile it once by SingleStepRepairEngine.
+The latency of every request is recorded in LatencyHistogram and reported by GET /stats.
+"""
+
+import collections
+import itertools
+import json
+import logging
+import math
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+from common import problem_util
+from common.analyse_include_util import extract_include, replace_include_with_blank
+from common.benchmark_util import latency_percentiles
+from common.util import StageTimer, compile_code_ids_list, filter_token_ids
+
+repair_logger = logging.getLogger('repair_server')
+
+
+class LatencyHistogram(object):
+    """
+    A histogram of the latency in log spaced buckets, so the memory doesn't grow with the request count.
+    """
+    def __init__(self, min_latency=0.001, max_latency=600.0, factor=1.2):
+        self.min_latency = min_latency
+        self.factor = factor
+        self.bucket_count = int(math.ceil(math.log(max_latency / min_latency, factor))) + 1
+        self.counts = [0 for _ in range(self.bucket_count + 1)]
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def _bucket(self, latency):
+        if latency <= self.min_latency:
+            return 0
+        return min(int(math.log(latency / self.min_latency, self.factor)) + 1, self.bucket_count)
+
+    def _bucket_upper(self, bucket):
+        return self.min_latency * self.factor ** bucket
+
+    def add(self, latency):
+        with self._lock:
+            self.counts[self._bucket(latency)] += 1
+            self.count += 1
+            self.total += latency
+            self.max = max(self.max, latency)
+
+    def percentile(self, p):
+        """
+        :return: the upper bound seconds of the bucket of the p-th percentile
+        """
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            rank = p / 100 * self.count
+            seen = 0
+            for bucket, c in enumerate(self.counts):
+                seen += c
+                if seen >= rank and c > 0:
+                    return min(self._bucket_upper(bucket), self.max)
+            return self.max
+
+    def to_dict(self, percentiles=(50, 90, 99)):
+        res = collections.OrderedDict()
+        res['count'] = self.count
+        res['mean_ms'] = self.total / self.count * 1000 if self.count > 0 else 0.0
+        for p in percentiles:
+            res['p{}_ms'.format(p)] = self.percentile(p) * 1000
+        res['max_ms'] = self.max * 1000
+        return res
+
+
+class RepairEngine(object):
+    """
+    Run the multi step repair of a batch of programs. The model only needs the interface of multi_step_one_batch,
+    so it is a model with a create_multi_step_next_input_batch_fn such as EncoderSampleModel.
+    """
+    def __init__(self, model, vocabulary, parse_input_batch_data_fn, create_multi_step_next_input_batch_fn,
+                 max_step_times=5, use_ast=False, tokenize_fn=None, do_compile_pool=True,
+                 compile_file_path='/dev/shm/repair_server.c', target_file_path='/dev/shm/repair_server.out',
+                 log_file_path='/dev/shm/repair_server.log'):
+        if tokenize_fn is None:
+            from common.pycparser_util import tokenize_by_clex_fn
+            tokenize_fn = tokenize_by_clex_fn()
+        self.model = model
+        self.vocabulary = vocabulary
+        self.parse_input_batch_data_fn = parse_input_batch_data_fn
+        self.create_multi_step_next_input_batch_fn = create_multi_step_next_input_batch_fn
+        self.max_step_times = max_step_times
+        self.use_ast = use_ast
+        self.tokenize_fn = tokenize_fn
+        self.do_compile_pool = do_compile_pool
+        self.compile_file_path = compile_file_path
+        self.target_file_path = target_file_path
+        self.log_file_path = log_file_path
+        self.stage_timer = StageTimer()
+        # the lexer of tokenize_fn keeps its state, the request threads take turns
+        self._tokenize_lock = threading.Lock()
+        self._begin_id = vocabulary.word_to_id(vocabulary.begin_tokens[0])
+        self._end_id = vocabulary.word_to_id(vocabulary.end_tokens[0])
+
+    def _tokenize(self, code):
+        """
+        :return: (the include lines, the token names of the code without includes). ValueError if the program can't
+        be tokenized
+        """
+        from experiment.parse_xy_util import create_name_list_by_LexToken
+        includes = extract_include(code)
+        with self._tokenize_lock:
+            tokens = self.tokenize_fn(replace_include_with_blank(code))
+        if tokens is None or len(tokens) == 0:
+            raise ValueError('the code can not be tokenized')
+        return includes, create_name_list_by_LexToken(tokens)
+
+    def create_sample(self, code, sample_id=None):
+        """
+        create the sample of a program as IterateErrorDataSet with do_multi_step_sample
+        :return: the sample dict. ValueError if the program can't be tokenized
+        """
+        includes, names = self._tokenize(code)
+        sample = {'id': sample_id, 'includes': includes, 'input_seq_name': names,
+                  'input_seq': [self._begin_id] + self.vocabulary.parse_text_without_pad([names])[0] + [self._end_id]}
+        sample['input_length'] = len(sample['input_seq'])
+        sample['copy_length'] = sample['input_length']
+        sample['last_input_seq_name'] = names
+        # only the oracle error stop reads the error count
+        sample['error_count'] = 0
+        sample['adj'] = 0
+        if self.use_ast:
+            from c_parser.ast_parser import parse_ast_code_graph
+            code_graph = parse_ast_code_graph(names)
+            sample['input_length'] = code_graph.graph_length + 2
+            in_seq, graph = code_graph.graph
+            sample['input_seq'] = [self._begin_id] + [self.vocabulary.word_to_id(t) for t in in_seq] + [self._end_id]
+            sample['adj'] = [[a+1, b+1] for a, b, _ in graph] + [[b+1, a+1] for a, b, _ in graph]
+        return sample
+
+    def repair(self, samples):
+        """
+        :param samples: the samples created by create_sample
+        :return: a list of {'code': the repaired code, 'compile': whether it compiles, 'steps': the sample steps}
+        """
+        from train import multi_step_one_batch
+        batch_data = {k: [s[k] for s in samples] for k in samples[0].keys()}
+        self.model.eval()
+        with torch.no_grad():
+            generator = multi_step_one_batch(self.model, batch_data, len(samples), self.parse_input_batch_data_fn,
+                                             self.max_step_times, self.vocabulary, self.compile_file_path,
+                                             self.create_multi_step_next_input_batch_fn, lambda x: x['includes'],
+                                             False, self.target_file_path, self.log_file_path, 'normal',
+                                             self.stage_timer)
+            try:
+                compile_kwargs = next(generator)
+                while True:
+                    compile_kwargs['do_compile_pool'] = self.do_compile_pool
+                    with self.stage_timer('compile'):
+                        compile_res = compile_code_ids_list(**compile_kwargs)
+                    compile_kwargs = generator.send(compile_res)
+            except StopIteration as e:
+                input_data, _, _, _, final_output_name_list, result_list, sample_steps = e.value
+        return self._create_results(final_output_name_list, batch_data['includes'], result_list, sample_steps)
+
+    @staticmethod
+    def _create_results(output_name_list, includes_list, result_list, sample_steps):
+        res = []
+        for names, includes, compiled, steps in zip(output_name_list, includes_list, result_list, sample_steps):
+            # the same code as compile_code_ids_list compiles
+            code = ' '.join(names)
+            for inc in includes:
+                code = inc + '\n' + code
+            res.append({'code': code, 'compile': bool(compiled), 'steps': steps})
+        return res
+
+
+class SingleStepRepairEngine(RepairEngine):
+    """
+    Repair a batch of programs by a model without create_multi_step_next_input_batch_fn such as
+    RNNPointerNetworkModelWithSLKMask. The model samples the whole repaired program at once, so the output is
+    compiled once and steps is always 1.
+    """
+    def __init__(self, model, vocabulary, parse_input_batch_data_fn, create_output_ids_fn, use_ast=False, **kwargs):
+        super().__init__(model, vocabulary, parse_input_batch_data_fn, None, max_step_times=1, use_ast=use_ast,
+                         **kwargs)
+        self.create_output_ids_fn = create_output_ids_fn
+        self._unk_id = vocabulary.word_to_id(vocabulary.unk)
+
+    def create_sample(self, code, sample_id=None):
+        """
+        create the sample of a program as the test set of CCodeErrorDataSet
+        :return: the sample dict. ValueError if the program can't be tokenized
+        """
+        includes, names = self._tokenize(code)
+        error_tokens = self.vocabulary.parse_text_without_pad([names])[0]
+        sample = {'id': sample_id, 'includes': includes, 'error_tokens_name': names, 'error_tokens': error_tokens,
+                  'error_length': len(error_tokens), 'copy_length': len(error_tokens), 'adj': 0}
+        # the sampling creates the token masks step by step, the parse fn only needs one placeholder step
+        sample['grammar_mask_list'] = [[self._end_id]]
+        sample['grammar_mask_length'] = [1]
+        if self.use_ast:
+            from c_parser.ast_parser import parse_ast_code_graph
+            code_graph = parse_ast_code_graph(names)
+            sample['error_length'] = code_graph.graph_length
+            in_seq, graph = code_graph.graph
+            sample['error_tokens'] = [self.vocabulary.word_to_id(t) for t in in_seq]
+            sample['adj'] = [[a, b] for a, b, _ in graph] + [[b, a] for a, b, _ in graph]
+        # the RepairServer buckets the samples by input_length
+        sample['input_length'] = sample['error_length']
+        return sample
+
+    def repair(self, samples):
+        """
+        :param samples: the samples created by create_sample
+        :return: a list of {'code': the repaired code, 'compile': whether it compiles, 'steps': 1}
+        """
+        batch_data = {k: [s[k] for s in samples] for k in samples[0].keys()}
+        self.model.eval()
+        with torch.no_grad():
+            with self.stage_timer('forward'):
+                model_input = self.parse_input_batch_data_fn(batch_data, do_sample=True)
+                model_output = self.model.forward(*model_input, do_sample=True)
+                output_ids = self.create_output_ids_fn(model_output, model_input, True)
+        output_name_list = [[self.vocabulary.id_to_word(i) for i in
+                             filter_token_ids(ids, self._begin_id, self._end_id, self._unk_id)[0]]
+                            for ids in output_ids.tolist()]
+        with self.stage_timer('compile'):
+            _, result_list, _ = compile_code_ids_list(output_name_list, [True for _ in samples],
+                                                      [False for _ in samples], self.vocabulary,
+                                                      batch_data['includes'], file_path=self.compile_file_path,
+                                                      target_file_path=self.target_file_path,
+                                                      log_file_path=self.log_file_path,
+                                                      do_compile_pool=self.do_compile_pool, need_transform=False)
+        return self._create_results(output_name_list, batch_data['includes'], result_list, [1 for _ in samples])
+
+
+class RepairRequest(object):
+    def __init__(self, sample):
+        self.sample = sample
+        self.future = Future()
+        self.arrive_time = time.time()
+
+
+class RepairServer(object):
+    def __init__(self, engine, max_batch_size=16, max_batch_delay=0.02, bucket_width=64):
+        """
+        :param max_batch_size: the max number of programs in a batch
+        :param max_batch_delay: the max seconds a program waits for the other programs of its bucket
+        :param bucket_width: the programs whose input length // bucket_width are the same are batched together
+        """
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.bucket_width = bucket_width
+        self.latency = LatencyHistogram()
+        self.queue_latency = LatencyHistogram()
+        self.batch_size_count = collections.Counter()
+        self._buckets = collections.OrderedDict()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._request_ids = itertools.count(1)
+        self._thread = threading.Thread(target=self._batch_loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, code):
+        """
+        :return: a Future of the result dict of RepairEngine.repair. The exception of a bad program is set to it
+        """
+        try:
+            request = RepairRequest(self.engine.create_sample(code, sample_id=next(self._request_ids)))
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+            return future
+        key = request.sample['input_length'] // self.bucket_width
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('the repair server is closed')
+            self._buckets.setdefault(key, []).append(request)
+            self._cond.notify()
+        return request.future
+
+    def repair(self, code, timeout=None):
+        return self.submit(code).result(timeout)
+
+    def _next_batch(self):
+        """
+        wait until a bucket is full or its oldest request is older than max_batch_delay
+        :return: the list of RepairRequest, None if the server is closed
+        """
+        with self._cond:
+            while True:
+                now = time.time()
+                wait = None
+                ready_key = None
+                for key, requests in self._buckets.items():
+                    age = now - requests[0].arrive_time
+                    if len(requests) >= self.max_batch_size or age >= self.max_batch_delay or self._closed:
+                        if ready_key is None or requests[0].arrive_time < self._buckets[ready_key][0].arrive_time:
+                            ready_key = key
+                    else:
+                        remain = self.max_batch_delay - age
+                        wait = remain if wait is None else min(wait, remain)
+                if ready_key is not None:
+                    requests = self._buckets[ready_key]
+                    batch = requests[:self.max_batch_size]
+                    if len(requests) > self.max_batch_size:
+                        self._buckets[ready_key] = requests[self.max_batch_size:]
+                    else:
+                        del self._buckets[ready_key]
+                    return batch
+                if self._closed:
+                    return None
+                self._cond.wait(wait)
+
+    def _batch_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            begin = time.time()
+            for request in batch:
+                self.queue_latency.add(begin - request.arrive_time)
+            self.batch_size_count[len(batch)] += 1
+            try:
+                res = self.engine.repair([request.sample for request in batch])
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            end = time.time()
+            for request, one in zip(batch, res):
+                one['latency'] = end - request.arrive_time
+                self.latency.add(one['latency'])
+                request.future.set_result(one)
+
+    def stats(self):
+        return {'latency': self.latency.to_dict(), 'queue_latency': self.queue_latency.to_dict(),
+                'batch_size_count': {str(k): v for k, v in sorted(self.batch_size_count.items())},
+                'stage_time': str(self.engine.stage_timer)}
+
+    def close(self):
+        """
+        repair the waiting requests and stop the batching thread
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+
+def create_http_handler(repair_server):
+    class RepairHandler(BaseHTTPRequestHandler):
+        """
+        POST /repair with {"code": ...} returns {"code": ..., "compile": ..., "steps": ..., "latency": ...}
+        GET /stats returns RepairServer.stats()
+        """
+        def _send_json(self, status, obj):
+            body = json.dumps(obj).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._send_json(200, repair_server.stats())
+            else:
+                self._send_json(404, {'error': 'unknown path {}'.format(self.path)})
+
+        def do_POST(self):
+            if self.path != '/repair':
+                self._send_json(404, {'error': 'unknown path {}'.format(self.path)})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+                res = repair_server.repair(request['code'])
+            except (ValueError, KeyError) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            except Exception as e:
+                # a failed batch must not drop the connection without a response
+                repair_logger.exception('repair request failed')
+                self._send_json(500, {'error': '{}: {}'.format(type(e).__name__, e)})
+                return
+            self._send_json(200, res)
+
+        def log_message(self, format, *args):
+            pass
+
+    return RepairHandler
+
+
+def start_http_server(repair_server, host='127.0.0.1', port=8765):
+    """
+    serve the repair_server in a background thread. port 0 picks a free port.
+    :return: the ThreadingHTTPServer. Its server_address is the (host, port) served
+    """
+    httpd = ThreadingHTTPServer((host, port), create_http_handler(repair_server))
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def post_repair(url, code, timeout=600):
+    request = urllib.request.Request(url.rstrip('/') + '/repair', data=json.dumps({'code': code}).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def run_load_generator(url, codes, concurrency_list=(1, 4, 16), request_count=64):
+    """
+    post request_count programs (cycling codes) to the server with every concurrency
+    :return: a list of OrderedDict of the concurrency, the throughput in requests per second and the p50/p99 latency
+    """
+    results = []
+    for concurrency in concurrency_list:
+        latencies = []
+
+        def one(i):
+            begin = time.time()
+            post_repair(url, codes[i % len(codes)])
+            latencies.append(time.time() - begin)
+
+        begin = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(one, range(request_count)))
+        res = collections.OrderedDict([('concurrency', concurrency),
+                                       ('throughput', request_count / (time.time() - begin))])
+        res.update(latency_percentiles(latencies, percentiles=(50, 99)))
+        results.append(res)
+        print('concurrency {concurrency}: {throughput:.2f} requests/s, p50 {p50_ms:.1f}ms, '
+              'p99 {p99_ms:.1f}ms'.format(**res))
+    return results
+
+
+def create_repair_engine_from_config(config_name, load_model_name=None, is_debug=True, **kwargs):
+    """
+    load the model of a parameters_config config the same as train.py
+    :param kwargs: the other arguments of RepairEngine
+    :return: a RepairEngine, or a SingleStepRepairEngine if the config has no create_multi_step_next_input_batch_fn
+    """
+    import config
+    from common.experiment_registry import load_config
+    from train import get_model
+    p_config = load_config(config_name, is_debug)
+    single_step = p_config.get('create_multi_step_next_input_batch_fn') is None
+    if single_step and p_config.get('create_output_ids_fn') is None:
+        raise ValueError('the config {} has neither create_multi_step_next_input_batch_fn nor create_output_ids_fn'
+                         .format(config_name))
+    load_model_name = p_config['load_model_name'] if load_model_name is None else load_model_name
+    model_path = os.path.join(config.save_model_root, p_config.get('name'), load_model_name)
+    model = get_model(p_config['model_fn'], p_config['model_dict'], model_path, load_previous=True)
+    if single_step:
+        return SingleStepRepairEngine(model, p_config['vocabulary'], p_config['parse_input_batch_data_fn'],
+                                      p_config['create_output_ids_fn'], use_ast=p_config.get('use_ast', False),
+                                      **kwargs)
+    return RepairEngine(model, p_config['vocabulary'], p_config['parse_input_batch_data_fn'],
+                        p_config['create_multi_step_next_input_batch_fn'],
+                        max_step_times=p_config['max_step_times'], use_ast=p_config.get('use_ast', False), **kwargs)
+
+
+if __name__ == '__main__':
+    import argparse
+    from common import args_util
+
+    def boolean_string(s):
+        if s not in {'False', 'True'}:
+            raise ValueError('Not a valid boolean string')
+        return s == 'True'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config_name", type=str)
+    parser.add_argument("--load_model_name", type=str, default=None)
+    parser.add_argument("--debug", type=boolean_string, default=True)
+    parser.add_argument("--gpu", type=int, default=None)
+    parser.add_argument("--host", type=str, default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max_batch_size", type=int, default=16)
+    parser.add_argument("--max_batch_delay", type=float, default=0.02)
+    parser.add_argument("--bucket_width", type=int, default=64)
+    parser.add_argument("--compile_server", type=boolean_string, default=False)
+    parser.add_argument("--compile_cache", type=boolean_string, default=False)
+    parser.add_argument("--incremental_multi_step", type=boolean_string, default=True)
+    parser.add_argument("--num_threads", type=int, default=None)
+    args = parser.parse_args()
+    problem_util.GPU_INDEX = args.gpu
+    problem_util.set_num_threads(args.num_threads)
+    args_util.use_compile_server = args.compile_server
+    args_util.use_compile_cache = args.compile_cache
+    args_util.use_incremental_multi_step = args.incremental_multi_step
+
+    server = RepairServer(create_repair_engine_from_config(args.config_name, args.load_model_name, args.debug),
+                          max_batch_size=args.max_batch_size, max_batch_delay=args.max_batch_delay,
+                          bucket_width=args.bucket_width)
+    httpd = start_http_server(server, args.host, args.port)
+    print('repair server on http://{}:{}'.format(*httpd.server_address))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        httpd.shutdown()
+        server.close()
@@ -0,0 +1,274 @@
+"""
+A batch C tokenization service. tokenize_by_clex lexes one code in the calling process and prints a counter. Here a
+batch of code is split into shards and lexed by worker processes, each worker builds the PLY lexer once. A code is
+returned as a TokenArray of int arrays (type id, value id, line, column, lexpos) instead of a list of LexToken. The
+tokens of every code are saved in a sqlite TokenCache keyed by the hash of the lexer version and the code, so the same
+code is never lexed again by a later run of the same lexer. The codes which can't be tokenized are cached too. The
+values of the TokenArrays of one batch index one value list, a new list is started for every batch.
+"""
+
+import functools
+import hashlib
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import threading
+
+import numpy as np
+
+from c_parser.buffered_clex import BufferedCLex
+from c_parser.fast_clex import FastBufferedCLex
+from c_parser.pycparser.pycparser import CParser
+from c_parser.pycparser.pycparser.c_lexer import CLexer
+from common import args_util
+from common.pycparser_util import ValueToken
+
+TOKEN_TYPES = list(CLexer.tokens)
+TOKEN_TYPE_ID = {t: i for i, t in enumerate(TOKEN_TYPES)}
+# change it when the lexing or the encoding of the tokens changes, the cached tokens of the old version are not read
+FORMAT_VERSION = 1
+
+CREATE_TOKEN_CACHE = r'''CREATE TABLE IF NOT EXISTS token_cache (
+  key TEXT PRIMARY KEY,
+  tokens BLOB
+)'''
+
+
+def lexer_class(use_fast_lexer):
+    return FastBufferedCLex if use_fast_lexer else BufferedCLex
+
+
+def lexer_version(use_fast_lexer):
+    return '{}:{}'.format(FORMAT_VERSION, lexer_class(use_fast_lexer).__name__)
+
+
+def code_hash(code, version=''):
+    return hashlib.sha1('{}\x00{}'.format(version, code).encode('utf-8', errors='replace')).hexdigest()
+
+
+def lex_code(code, lexer):
+    """
+    the same as pycparser_util.tokenize_by_clex without the global counters
+    :return: a list of LexToken or None if the code can't be tokenized
+    """
+    if '#' in code:
+        return None
+    try:
+        lexer.reset_lineno()
+        lexer.input(code)
+        if len(lexer.tokens_buffer) == 0:
+            # tokenize_by_clex fails with an IndexError
+            return None
+        return [t[0] for t in lexer.tokens_buffer]
+    except Exception as e:
+        return None
+
+
+def encode_tokens(code, tokens):
+    """
+    :return: the compact bytes of the tokens saved in the TokenCache and sent from the workers. None if tokens is None
+    """
+    if tokens is None:
+        return None
+    values = [tok.value for tok in tokens]
+    unique_values = sorted(set(values))
+    value_index = {v: i for i, v in enumerate(unique_values)}
+    lexpos = np.array([tok.lexpos for tok in tokens], dtype=np.int32)
+    # the column of a token is 1 based as gcc
+    columns = np.array([tok.lexpos - code.rfind('\n', 0, tok.lexpos) for tok in tokens], dtype=np.int32)
+    return pickle.dumps((np.array([TOKEN_TYPE_ID[tok.type] for tok in tokens], dtype=np.int16),
+                         unique_values,
+                         np.array([value_index[v] for v in values], dtype=np.int32),
+                         np.array([tok.lineno for tok in tokens], dtype=np.int32),
+                         columns, lexpos), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class TokenArray(object):
+    """
+    the tokens of a code. values are the ids in value_list, which is shared by the TokenArrays of one batch.
+    """
+    __slots__ = ('types', 'values', 'lines', 'columns', 'lexpos', 'value_list')
+
+    def __init__(self, types, values, lines, columns, lexpos, value_list):
+        self.types = types
+        self.values = values
+        self.lines = lines
+        self.columns = columns
+        self.lexpos = lexpos
+        self.value_list = value_list
+
+    def __len__(self):
+        return len(self.types)
+
+    def type_names(self):
+        return [TOKEN_TYPES[t] for t in self.types]
+
+    def value_names(self):
+        value_list = self.value_list
+        return [value_list[v] for v in self.values]
+
+    def to_tokens(self):
+        """
+        :return: a list of ValueToken which can be used as the result of tokenize_by_clex
+        """
+        return [ValueToken(v, t, int(l), int(p)) for v, t, l, p in zip(self.value_names(), self.type_names(),
+                                                                     self.lines, self.lexpos)]
+
+
+class TokenCache(object):
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.owner_pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._lock = threading.RLock()
+        self.con = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.execute('PRAGMA synchronous=NORMAL')
+        self.con.execute(CREATE_TOKEN_CACHE)
+        self.con.commit()
+
+    def get_many(self, keys):
+        """
+        :return: {key: the encoded tokens or None if the code can't be tokenized} of the cached keys
+        """
+        found = {}
+        unique_keys = list(set(keys))
+        with self._lock:
+            for i in range(0, len(unique_keys), 500):
+                part = unique_keys[i:i+500]
+                sql = 'SELECT key, tokens FROM token_cache WHERE key IN ({})'.format(','.join('?' * len(part)))
+                for key, tokens in self.con.execute(sql, part):
+                    found[key] = tokens
+        self.hits += len(found)
+        self.misses += len(unique_keys) - len(found)
+        return found
+
+    def put_many(self, keys, encoded_list):
+        with self._lock:
+            self.con.executemany('INSERT OR REPLACE INTO token_cache (key, tokens) VALUES (?, ?)',
+                                 list(zip(keys, encoded_list)))
+            self.con.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self.con.execute('SELECT COUNT(*) FROM token_cache').fetchone()[0]
+
+    def __str__(self):
+        total = self.hits + self.misses
+        hit_ratio = self.hits / total if total > 0 else 0
+        return 'token cache hits: {}, misses: {}, hit ratio: {:.4f}'.format(self.hits, self.misses, hit_ratio)
+
+    def close(self):
+        self.con.close()
+
+
+_worker_lexers = {}
+
+
+def _get_lexer(use_fast_lexer):
+    # the lexer of this process is built once for each lexer version
+    if use_fast_lexer not in _worker_lexers:
+        c_parser = CParser()
+        c_parser.build(lexer=lexer_class(use_fast_lexer))
+        _worker_lexers[use_fast_lexer] = c_parser.clex
+    return _worker_lexers[use_fast_lexer]
+
+
+def _lex_shard(code_list, use_fast_lexer=False):
+    lexer = _get_lexer(use_fast_lexer)
+    return [encode_tokens(code, lex_code(code, lexer)) for code in code_list]
+
+
+class TokenizeService(object):
+    def __init__(self, core_num=0, cache_path=None, shard_size=100):
+        """
+        :param core_num: the number of worker processes. The codes are lexed in this process if it is 0 or this
+        process is a daemon process such as a worker of multiprocessing.Pool
+        :param cache_path: the sqlite file path of the TokenCache. No cache if it is None
+        :param shard_size: the max number of codes sent to a worker in one task
+        """
+        if multiprocessing.current_process().daemon:
+            core_num = 0
+        self.core_num = core_num
+        self.shard_size = shard_size
+        self.cache = TokenCache(cache_path) if cache_path is not None else None
+        self.owner_pid = os.getpid()
+        self._pool = None
+
+    def _lex(self, code_list, use_fast_lexer=False):
+        if self.core_num <= 0 or len(code_list) <= self.shard_size:
+            return _lex_shard(code_list, use_fast_lexer)
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.core_num)
+        # about 4 shards for each worker to balance the long codes
+        shard_size = min(self.shard_size, max(1, len(code_list) // (4 * self.core_num)))
+        shards = [code_list[i:i+shard_size] for i in range(0, len(code_list), shard_size)]
+        lex_shard = functools.partial(_lex_shard, use_fast_lexer=use_fast_lexer)
+        return [encoded for res in self._pool.map(lex_shard, shards) for encoded in res]
+
+    def _decode(self, encoded, value_list, value_to_id):
+        if encoded is None:
+            return None
+        types, unique_values, value_index, lines, columns, lexpos = pickle.loads(encoded)
+        ids = []
+        for v in unique_values:
+            if v not in value_to_id:
+                value_to_id[v] = len(value_list)
+                value_list.append(v)
+            ids.append(value_to_id[v])
+        values = np.array(ids, dtype=np.int32)[value_index] if len(ids) > 0 else value_index
+        return TokenArray(types, values, lines, columns, lexpos, value_list)
+
+    def tokenize_batch(self, code_list):
+        """
+        :return: a list of TokenArray, None for the code can't be tokenized. The codes are lexed by the fast lexer if
+        args_util.use_fast_lexer is True
+        """
+        use_fast_lexer = args_util.use_fast_lexer
+        version = lexer_version(use_fast_lexer)
+        keys = [code_hash(code, version) for code in code_list]
+        found = self.cache.get_many(keys) if self.cache is not None else {}
+        missed = {}
+        for key, code in zip(keys, code_list):
+            if key not in found and key not in missed:
+                missed[key] = code
+        if len(missed) > 0:
+            missed_keys = list(missed.keys())
+            encoded_list = self._lex(list(missed.values()), use_fast_lexer)
+            found.update(zip(missed_keys, encoded_list))
+            if self.cache is not None:
+                self.cache.put_many(missed_keys, encoded_list)
+        decoded = {}
+        res = []
+        value_list = []
+        value_to_id = {}
+        for key in keys:
+            if key not in decoded:
+                decoded[key] = self._decode(found[key], value_list, value_to_id)
+            res.append(decoded[key])
+        return res
+
+    def tokenize_tokens_batch(self, code_list):
+        """
+        :return: a list of ValueToken lists as the results of tokenize_by_clex
+        """
+        return [t.to_tokens() if t is not None else None for t in self.tokenize_batch(code_list)]
+
+    def tokenize_fn(self):
+        """
+        :return: a function of one code as tokenize_by_clex_fn
+        """
+        return lambda code: self.tokenize_tokens_batch([code])[0]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self.cache is not None:
+            self.cache.close()
@@ -2,6 +2,7 @@ import operator
 from collections import OrderedDict
 from itertools import islice
 
+import numpy as np
 import torch.nn.functional as F
 from torch import nn, nn as nn
 import torch
@@ -10,7 +11,7 @@ from torch.nn.modules.rnn import RNNCellBase
 from torch.nn.utils.rnn import PackedSequence
 
 from common.problem_util import to_cuda
-from common.util import transform_id_to_token
+from common.util import transform_id_to_token, padded_array
 
 
 def save_model(model: torch.nn.Module, path):
@@ -54,7 +55,7 @@ def pack_padded_sequence(padded_sequence, length, batch_firse=False,GPU_INDEX=0)
     _, idx_unsort = torch.sort(idx_sort, dim=0)
     length = torch.index_select(length, 0, idx_sort)
     if padded_sequence.is_cuda:
-        padded_sequence = torch.index_select(padded_sequence, 0, idx_sort.cuda(GPU_INDEX))
+        padded_sequence = torch.index_select(padded_sequence, 0, idx_sort.to(padded_sequence.device))
     else:
         padded_sequence = torch.index_select(padded_sequence, 0, idx_sort)
     return torch.nn.utils.rnn.pack_padded_sequence(padded_sequence, list(length), batch_first=batch_firse), idx_unsort
@@ -64,7 +65,7 @@ def pad_packed_sequence(packed_sequence, idx_unsort, pad_value, batch_firse=Fals
     padded_sequence, length = torch.nn.utils.rnn.pad_packed_sequence(packed_sequence, batch_first=batch_firse,
                                                                 padding_value=pad_value)
     if padded_sequence.is_cuda:
-        return torch.index_select(padded_sequence, 0, torch.autograd.Variable(idx_unsort).cuda(GPU_INDEX)), length
+        return torch.index_select(padded_sequence, 0, idx_unsort.to(padded_sequence.device)), length
     else:
         return torch.index_select(padded_sequence, 0, torch.autograd.Variable(idx_unsort)), length
 
@@ -375,7 +376,15 @@ class DynamicDecoder(object):
 
 
 class BeamSearchDynamicDecoder(object):
-    def __init__(self, start_label, end_label, pad_label, decoder_fn, create_beam_next_output_fn, max_length, beam_size=5):
+    def __init__(self, start_label, end_label, pad_label, decoder_fn, create_beam_next_output_fn, max_length, beam_size=5,
+                 length_penalty=0.0):
+        """
+        The beams are folded into the batch dim, so decoder_fn is called once in each step with batch_size * beam_size
+        inputs. A finished beam is kept as one candidate with its score. A batch item is removed from the decoder inputs
+        when all the beams of it are finished.
+        :param length_penalty: alpha of the length normalization ((5 + length) / 6) ** alpha used to sort the final
+        beams. 0 means sorting by the total log probs.
+        """
         self.start_label = start_label
         self.end_label = end_label
         self.pad_label = pad_label
@@ -383,112 +392,173 @@ class BeamSearchDynamicDecoder(object):
         self.create_beam_next_output_fn = create_beam_next_output_fn
         self.max_length = max_length
         self.beam_size = beam_size
+        self.length_penalty = length_penalty
 
     def decoder(self, encoder_output, endocer_hidden, encoder_mask, **kwargs):
+        """
+        :return: decoder_output_list: a list of decoder outputs in each step. Each decoder output is a list of tensor
+        [batch, beam, ...] and the beams of all the steps are aligned to the final beams.
+        outputs_list: a list of [batch, beam, 1] output ids in each step.
+        error_stack: [batch, beam]
+        """
         batch_size = encoder_output.shape[0]
-        continue_mask_stack = to_cuda(torch.ByteTensor([[1 for _ in range(self.beam_size)] for i in range(batch_size)]))
-        beam_outputs = to_cuda(torch.LongTensor([[[self.start_label] for _ in range(self.beam_size)] for i in range(batch_size)]))
-        # outputs_stack = [to_cuda(torch.LongTensor([[self.start_label] for i in range(batch_size)])) for _ in range(self.beam_size)]
-        probability_stack = to_cuda(torch.FloatTensor([[0.0 for _ in range(self.beam_size)] for _ in range(batch_size)]))
-        decoder_output_list = []
-        outputs_list = []
-        hidden_stack = [endocer_hidden for _ in range(self.beam_size)]
-        error_stack = to_cuda(torch.ByteTensor([[0 for _ in range(self.beam_size)] for i in range(batch_size)]))
+        beam_size = self.beam_size
+        device = encoder_output.device
+
+        # the states of the whole batch. [batch, beam]
+        probability_stack = torch.zeros(batch_size, beam_size, device=device)
+        continue_mask_stack = torch.ones(batch_size, beam_size, device=device) > 0
+        error_stack = torch.zeros(batch_size, beam_size, device=device) > 0
+        length_stack = torch.zeros(batch_size, beam_size, dtype=torch.long, device=device)
+
+        # the decoder inputs of the active batch items. [active_batch * cur_beam, ...]
+        active_index = torch.arange(batch_size, dtype=torch.long, device=device)
+        cur_beam = 1
+        outputs = torch.full((batch_size, 1), self.start_label, dtype=torch.long, device=device)
+        continue_mask = continue_mask_stack[:, 0]
+        hidden = endocer_hidden
+        step_encoder_output, step_encoder_mask, step_kwargs = encoder_output, encoder_mask, kwargs
 
+        step_outputs_list = []
+        step_decoder_output_list = []
+        step_parent_list = []
         for i in range(self.max_length):
-            # beam * (output * [batch, 1, ...])
-            # beam_one_step_decoder_output = []
-            beam_outputs_list = []
-            beam_log_probs_list = []
-            beam_decoder_output_list = []
-            # beam * [batch, hidden]
-            beam_hidden_list = []
-            # beam * [batch, error_count]
-            beam_error_ids = []
-            for b in range(self.beam_size):
-                outputs = beam_outputs[:, b]
-                continue_mask = continue_mask_stack[:, b]
-                hidden = hidden_stack[b]
-                one_step_decoder_output, hidden, error_ids = self.decoder_fn(outputs, continue_mask, start_index=i,
-                                                                             hidden=hidden,
-                                                                             encoder_output=encoder_output,
-                                                                             encoder_mask=encoder_mask,
-                                                                             **kwargs)
-
-                # if (error_ids is not None) and len(error_ids) != 0:
-                error_ids_list = [0 for i in range(batch_size)]
-                for err in error_ids:
-                    error_ids_list[err] = 1
-                error_ids_tensor = to_cuda(torch.ByteTensor(error_ids_list))
-                beam_error_ids += [error_ids_tensor]
+            active_batch_size = active_index.shape[0]
+            one_step_decoder_output, hidden, error_ids = self.decoder_fn(outputs, continue_mask, start_index=i,
+                                                                         hidden=hidden,
+                                                                         encoder_output=step_encoder_output,
+                                                                         encoder_mask=step_encoder_mask,
+                                                                         **step_kwargs)
+            # one_beam_outputs: [active_batch * cur_beam, beam, seq]
+            # one_beam_log_probs: [active_batch * cur_beam, beam, 1]
+            # one_beam_decoder_output: tuple of [active_batch * cur_beam, beam, ...]
+            one_beam_outputs, one_beam_log_probs, one_beam_decoder_output = \
+                self.create_beam_next_output_fn(one_step_decoder_output, continue_mask=continue_mask,
+                                                beam_size=beam_size, **step_kwargs)
+
+            parent_probs = probability_stack[active_index, :cur_beam]
+            parent_continue = continue_mask_stack[active_index, :cur_beam]
+            total_log_probs = parent_probs.unsqueeze(-1) + one_beam_log_probs.view(active_batch_size, cur_beam, beam_size)
+            # keep only the first candidate of a finished beam and do not add the log probs to it
+            finished_mask = (~parent_continue).unsqueeze(-1)
+            first_candidate_mask = torch.arange(beam_size, device=device).view(1, 1, beam_size) == 0
+            total_log_probs = torch.where(finished_mask & first_candidate_mask,
+                                          parent_probs.unsqueeze(-1).expand_as(total_log_probs), total_log_probs)
+            total_log_probs = total_log_probs.masked_fill(finished_mask & ~first_candidate_mask, -float('inf'))
+
+            step_probs, sort_index = torch.topk(total_log_probs.view(active_batch_size, cur_beam * beam_size),
+                                                k=beam_size, dim=-1)
+            parent_index = sort_index // beam_size
+
+            def select_candidate(t):
+                return batch_index_select(t.view(active_batch_size, cur_beam * beam_size, *t.shape[2:]), sort_index)
+
+            beam_outputs = select_candidate(one_beam_outputs)
+            beam_decoder_output = [select_candidate(one_output) for one_output in one_beam_decoder_output]
+
+            step_error = torch.zeros(active_batch_size * cur_beam, device=device)
+            if len(error_ids) > 0:
+                step_error[torch.LongTensor(list(error_ids)).to(device)] = 1
+            beam_error = batch_index_select(step_error.view(active_batch_size, cur_beam) > 0, parent_index)
+            beam_parent_continue = batch_index_select(parent_continue, parent_index)
+            beam_continue = beam_parent_continue & \
+                            torch.ne(beam_outputs.view(active_batch_size, beam_size), self.end_label) & ~beam_error
+
+            probability_stack[active_index] = step_probs
+            continue_mask_stack[active_index] = beam_continue
+            error_stack[active_index] = batch_index_select(error_stack[active_index, :cur_beam], parent_index) | beam_error
+            length_stack[active_index] = batch_index_select(length_stack[active_index, :cur_beam], parent_index) + \
+                                         beam_parent_continue.long()
+
+            step_parent = torch.arange(beam_size, dtype=torch.long, device=device).unsqueeze(0).repeat(batch_size, 1)
+            step_parent[active_index] = parent_index
+            step_parent_list += [step_parent]
+            step_outputs_list += [self._to_batch(beam_outputs, active_index, batch_size)]
+            step_decoder_output_list += [[self._to_batch(one_output, active_index, batch_size)
+                                          for one_output in beam_decoder_output]]
+
+            if torch.sum(beam_continue) == 0:
+                break
 
-                beam_hidden_list += [hidden]
+            # reorder the decoder inputs by the selected beams
+            parent_rows = (torch.arange(active_batch_size, device=device).unsqueeze(1) * cur_beam +
+                           parent_index).view(-1)
+            hidden = _select_hidden_rows(hidden, parent_rows)
+            outputs = beam_outputs.view(active_batch_size * beam_size, *beam_outputs.shape[2:])
+            continue_mask = beam_continue.view(-1)
+            if cur_beam == 1:
+                expand_rows = torch.arange(active_batch_size, device=device).unsqueeze(1)\
+                    .expand(active_batch_size, beam_size).contiguous().view(-1)
+                step_encoder_output, step_encoder_mask, step_kwargs = \
+                    _select_batch_rows((step_encoder_output, step_encoder_mask, step_kwargs), expand_rows,
+                                       active_batch_size)
+                cur_beam = beam_size
+
+            # remove the batch items whose beams are all finished
+            batch_continue = torch.sum(beam_continue.long(), dim=1) > 0
+            if torch.sum(batch_continue.long()) < active_batch_size:
+                keep = torch.nonzero(batch_continue).view(-1)
+                keep_rows = (keep.unsqueeze(1) * beam_size +
+                             torch.arange(beam_size, device=device).unsqueeze(0)).view(-1)
+                active_index = active_index[keep]
+                hidden = _select_hidden_rows(hidden, keep_rows)
+                outputs = outputs[keep_rows]
+                continue_mask = continue_mask[keep_rows]
+                step_encoder_output, step_encoder_mask, step_kwargs = \
+                    _select_batch_rows((step_encoder_output, step_encoder_mask, step_kwargs), keep_rows,
+                                       active_batch_size * beam_size)
+
+        if self.length_penalty > 0:
+            length_norm = ((5.0 + length_stack.float()) / 6.0) ** self.length_penalty
+            _, final_index = torch.sort(probability_stack / length_norm, dim=-1, descending=True)
+        else:
+            final_index = torch.arange(beam_size, dtype=torch.long, device=device).unsqueeze(0).repeat(batch_size, 1)
 
-                # one_beam_outputs: [batch, beam, seq]
-                # beam_probs: [batch, beam]
-                # one_beam_decoder_output: tuple of [batch, beam, seq]
-                one_beam_outputs, one_beam_log_probs, one_beam_decoder_output = self.create_beam_next_output_fn(one_step_decoder_output, continue_mask=continue_mask, beam_size=self.beam_size, **kwargs)
-                beam_outputs_list += [one_beam_outputs]
-                beam_log_probs_list += [one_beam_log_probs]
-                beam_decoder_output_list += [one_beam_decoder_output]
+        # follow the parents back from the final beams to align the outputs of all the steps
+        decoder_output_list = []
+        outputs_list = []
+        beam_index = final_index
+        for step_outputs, step_decoder_output, step_parent in zip(reversed(step_outputs_list),
+                                                                  reversed(step_decoder_output_list),
+                                                                  reversed(step_parent_list)):
+            outputs_list += [batch_index_select(step_outputs, beam_index)]
+            decoder_output_list += [[batch_index_select(one_output, beam_index) for one_output in step_decoder_output]]
+            beam_index = batch_index_select(step_parent, beam_index)
+        decoder_output_list.reverse()
+        outputs_list.reverse()
+        error_stack = batch_index_select(error_stack, final_index)
+        return decoder_output_list, outputs_list, error_stack
 
-                if i == 0:
-                    break
+    @staticmethod
+    def _to_batch(t, active_index, batch_size):
+        """
+        scatter the tensor of active batch items [active_batch, ...] to the whole batch. The finished items are zero.
+        """
+        if active_index.shape[0] == batch_size:
+            return t
+        res = t.new_zeros((batch_size, ) + tuple(t.shape[1:]))
+        res[active_index] = t
+        return res
 
-            # beam_step_log_probs: [batch, outer_beam, inner_beam]
-            beam_step_log_probs = torch.stack(beam_log_probs_list, dim=1)
-            if i != 0:
-                beam_total_log_probs = torch.unsqueeze(probability_stack, dim=-1) + torch.squeeze(beam_step_log_probs, dim=-1)
-            else:
-                beam_total_log_probs = torch.squeeze(beam_step_log_probs, dim=-1)
-            probability_stack, sort_index = torch.topk(
-                beam_total_log_probs.view(batch_size, beam_total_log_probs.shape[1] * beam_total_log_probs.shape[2]),
-                k=self.beam_size, dim=-1)
-            stack_sort_index = sort_index / self.beam_size
-
-            # beam_outputs: [batch, outer_beam * inner_beam, seq]
-            beam_outputs = beam_stack_and_reshape(beam_outputs_list)
-            beam_outputs = batch_index_select(beam_outputs, sort_index, batch_size)
-            outputs_list = [batch_index_select(outputs, stack_sort_index, batch_size)
-                            for outputs in outputs_list]
-            outputs_list += [beam_outputs]
-
-            beam_decoder_output = [beam_stack_and_reshape(one_output_list)
-                                   for one_output_list in zip(*beam_decoder_output_list)]
-            beam_decoder_output = [batch_index_select(one_output, sort_index, batch_size)
-                                   for one_output in beam_decoder_output]
-
-            decoder_output_list = [[batch_index_select(one_output, stack_sort_index, batch_size)
-                                    for one_output in decoder_output]
-                                   for decoder_output in decoder_output_list]
-            decoder_output_list += [beam_decoder_output]
-
-            # beam_error = beam_stack_and_reshape(beam_error_ids)
-            beam_error = torch.stack(beam_error_ids, dim=1)
-            beam_error = batch_index_select(beam_error, stack_sort_index, batch_size=batch_size)
-            beam_continue = torch.ne(beam_outputs, self.end_label).view(batch_size, self.beam_size)
-            beam_continue = beam_continue & ~beam_error
-            continue_mask_stack = batch_index_select(continue_mask_stack, stack_sort_index, batch_size) & beam_continue
-            error_stack = batch_index_select(error_stack, stack_sort_index, batch_size) | beam_error
-
-            if isinstance(beam_hidden_list[0], list):
-                one_hidden_list = zip(*beam_hidden_list)
-                hidden_stack = list(zip(*[deal_beam_hidden(one_hidden_beam_list, stack_sort_index, batch_size)
-                                          for one_hidden_beam_list in one_hidden_list]))
-            else:
-                hidden_stack = deal_beam_hidden(beam_hidden_list, stack_sort_index, batch_size)
 
-            # try:
-            if torch.sum(continue_mask_stack) == 0:
-                break
-            # except Exception as e:
-            #     print(e)
-            #     print(error_list)
-            #     print(outputs)
-            #     print(step_continue)
-            #     print(continue_mask)
-            #     raise Exception(e)
-        return decoder_output_list, outputs_list, error_stack
+def _select_hidden_rows(hidden, rows):
+    # hidden: [layer, batch, hidden] or a list of it
+    if isinstance(hidden, (list, tuple)):
+        return type(hidden)(_select_hidden_rows(h, rows) for h in hidden)
+    return hidden.index_select(1, rows)
+
+
+def _select_batch_rows(inputs, rows, batch_size):
+    """
+    select the rows of all the tensors whose first dim is batch_size in the nested inputs
+    """
+    if isinstance(inputs, dict):
+        return {k: _select_batch_rows(v, rows, batch_size) for k, v in inputs.items()}
+    if isinstance(inputs, (list, tuple)):
+        return type(inputs)(_select_batch_rows(v, rows, batch_size) for v in inputs)
+    if isinstance(inputs, torch.Tensor) and inputs.dim() > 0 and inputs.shape[0] == batch_size:
+        return inputs.index_select(0, rows)
+    return inputs
 
 
 def deal_beam_hidden(hidden_list, stack_sort_index, batch_size):
@@ -514,21 +584,17 @@ def beam_stack_and_reshape(beam_outputs_list):
     return beam_outputs
 
 
-def batch_index_select(beam_outputs, sort_index, batch_size):
+def batch_index_select(beam_outputs, sort_index, batch_size=None):
     """
 
     :param beam_outputs_list: Tensor [batch, outer_beam * inner_beam, ...].
     :param sort_index: [batch, beam]. top beam-th index of log probs tensor [batch, beam * beam]
     :return:
     """
-    tensor_list = []
     # beam_outputs: [batch, outer_beam * inner_beam, seq]
-    for b_idx in range(batch_size):
-        tmp_tensor = torch.index_select(beam_outputs[b_idx], dim=0, index=sort_index[b_idx])
-        tensor_list += [tmp_tensor]
+    batch_index = torch.arange(sort_index.shape[0], device=sort_index.device).unsqueeze(1).expand_as(sort_index)
     # beam_output: [batch, beam, seq]
-    beam_outputs = torch.stack(tensor_list, dim=0)
-    return beam_outputs
+    return beam_outputs[batch_index, sort_index]
 
 
 def pad_last_dim_of_tensor_list(tensor_list, max_len=None, fill_value=0):
@@ -541,6 +607,25 @@ def pad_last_dim_of_tensor_list(tensor_list, max_len=None, fill_value=0):
     return padded_tensor_list
 
 
+_TORCH_TO_NUMPY_DTYPE = {
+    torch.long: np.int64,
+    torch.int: np.int32,
+    torch.float: np.float32,
+    torch.double: np.float64,
+    torch.uint8: np.uint8,
+    torch.bool: np.bool_,
+}
+
+
+def padded_tensor(l, fill_value=0, shape=None, dtype=torch.long, out=None):
+    """
+    pad a ragged nested list to a tensor. It replaces torch.LongTensor(PaddedList(l)) in the parse batch data functions.
+    :param out: a preallocated numpy array reused as the buffer of the result
+    """
+    res = padded_array(l, fill_value=fill_value, shape=shape, dtype=_TORCH_TO_NUMPY_DTYPE[dtype], out=out)
+    return torch.from_numpy(res)
+
+
 class Update(nn.Module):
     def __init__(self, hidden_size):
         super().__init__()
@@ -9,26 +9,31 @@ import types
 from multiprocessing import Pool
 import typing
 import hashlib
+import inspect
 
 import copy
 from typing import Iterator
 
 import more_itertools
-import sklearn
+import numpy as np
 import pandas as pd
 import sys
 # import cytoolz as toolz
 import toolz
 import collections
+import contextlib
 
 import time
 
-from sklearn.utils import shuffle
 from torch.utils.data import Dataset
 import torch.multiprocessing as mp
 
-from common.args_util import get_compile_pool
+from common import args_util
+from common.args_util import get_compile_pool, get_compile_server
+from common.columnar_store import ColumnarRows, load_or_create_columnar_store, evict_columnar_stores
+from common.compile_server import compile_code_by_backend
 from common.logger import info
+from common.prefetch_loader import prefetch_data_loader
 from common.new_tokenizer import tokenize
 from config import num_processes
 
@@ -70,93 +75,10 @@ def format_dict_to_string(to_format_dict: dict) -> str:
     return '__'.join(to_str(a)+to_str(b) for a, b in to_format_dict.items())
 
 
-def ensure_directory(directory):
-    """
-    Create the directories along the provided directory path that do not exist.
-    """
-    directory = os.path.expanduser(directory)
-    try:
-        os.makedirs(directory)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise e
-
-def disk_cache(basename, directory, method=False):
-    """
-    Function decorator for caching pickleable return values on disk. Uses a
-    hash computed from the function arguments for invalidation. If 'method',
-    skip the first argument, usually being self or cls. The cache filepath is
-    'directory/basename-hash.pickle'.
-    """
-    directory = os.path.expanduser(directory)
-    ensure_directory(directory)
-
-    def wrapper(func):
-        @functools.wraps(func)
-        def wrapped(*args, **kwargs):
-            key = (tuple(args), tuple(kwargs.items()))
-            # Don't use self or cls for the invalidation hash.
-            if method and key:
-                key = key[1:]
-            filename = '{}-{}.pickle'.format(basename, data_hash(key))
-            print("the cache name is {}".format(filename))
-            filepath = os.path.join(directory, filename)
-            if os.path.isfile(filepath):
-                print("load file from:{}".format(filepath))
-                with open(filepath, 'rb') as handle:
-                    return pickle.load(handle)
-            result = func(*args, **kwargs)
-            with open(filepath, 'wb') as handle:
-                print("write cache to: {}".format(filepath))
-                pickle.dump(result, handle)
-            return result
-        return wrapped
-
-    return wrapper
+# the disk cache is kept in common/disk_cache.py, they are imported here for the old import path
+from common.disk_cache import ensure_directory, disk_cache, data_hash, data_fingerprint, evict_disk_cache
 
 
-def data_hash(key):
-
-    def hash_value(hash_item):
-        v = 0
-        try:
-            v = int(hashlib.md5(str(hash_item).encode('utf-8')).hexdigest(), 16)
-        except Exception as e:
-            print('error occur while hash item {} '.format(type(hash_item)))
-        return v
-
-    hash_val = 0
-    key = list(more_itertools.flatten(key))
-    for item in key:
-        if isinstance(item, pd.DataFrame):
-            serlist = [item.itertuples(index=False, name=None)]
-            serlist = list(more_itertools.collapse(serlist))
-            for ser in serlist:
-                val = hash_value(ser)
-                hash_val += val
-        elif isinstance(item, pd.Series):
-            serlist = item.tolist()
-            serlist = list(more_itertools.collapse(serlist))
-            for ser in serlist:
-                val = hash_value(ser)
-                hash_val += val
-        elif isinstance(item, int) or isinstance(item, float) or isinstance(item, str):
-            val = hash_value(item)
-            hash_val += val
-        elif isinstance(item, list) or isinstance(item, set) or isinstance(item, tuple):
-            serlist = list(more_itertools.collapse(item))
-            for ser in serlist:
-                val = hash_value(ser)
-                hash_val += val
-        elif isinstance(item, dict):
-            serlist = list(more_itertools.collapse(item.items()))
-            for ser in serlist:
-                val = hash_value(ser)
-                hash_val += val
-        else:
-            print('type {} cant be hashed.'.format(type(item)))
-    return str(hash_val)
-
 # ================================================================
 # multiprocess function
 # ================================================================
@@ -173,6 +95,28 @@ def parallel_map(core_num, f, args):
         r = p.map(f, args)
         return r
 
+
+def bounded_parallel_imap(core_num, f, args, max_pending=None):
+    """
+    the same as parallel_map but yield the results in order. Pool.imap reads all the args into its task queue, here
+    at most max_pending args are sent to the workers, so the args can be a generator larger than the memory.
+    :param core_num: the cpu number. f is called in this process if it is 0
+    :param max_pending: the max number of tasks not yielded. 4 * core_num if it is None
+    """
+    if core_num <= 0:
+        for arg in args:
+            yield f(arg)
+        return
+    max_pending = 4 * core_num if max_pending is None else max_pending
+    with Pool(core_num) as p:
+        pending = collections.deque()
+        for arg in args:
+            pending.append(p.apply_async(f, (arg, )))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+
 # ================================================================
 # dict function
 # ================================================================
@@ -330,8 +274,15 @@ def group_df_to_grouped_list(data_df, groupby_key):
     return group_list
 
 
-def filter_length(df, limit_length, tokenize_fn, code_key='similar_code'):
-    df['tokens'] = df[code_key].map(tokenize_fn)
+def filter_length(df, limit_length, tokenize_fn=None, code_key='similar_code', batch_tokenize_fn=None):
+    """
+    :param batch_tokenize_fn: a function tokenizes a list of codes, such as TokenizeService.tokenize_batch. It is used
+    instead of tokenize_fn if it is not None.
+    """
+    if batch_tokenize_fn is not None:
+        df['tokens'] = batch_tokenize_fn(list(df[code_key]))
+    else:
+        df['tokens'] = df[code_key].map(tokenize_fn)
     df = df[df['tokens'].map(lambda x: x is not None and len(x) < limit_length)].copy()
     df = df.drop(columns=['tokens'], axis=1)
     return df
@@ -427,8 +378,17 @@ def _get_dataset_item(x):
 
 
 def data_loader(dataset, batch_size, is_shuffle=True, drop_last=False, epoch_ratio=1.0, multi_process=False):
+    if args_util.use_prefetch_loader:
+        from config import prefetch_loader_workers, prefetch_loader_depth, prefetch_loader_pin_memory
+        yield from prefetch_data_loader(dataset, batch_size, is_shuffle=is_shuffle, drop_last=drop_last,
+                                        epoch_ratio=epoch_ratio, num_workers=prefetch_loader_workers,
+                                        prefetch_depth=prefetch_loader_depth, length_bucket=args_util.use_length_bucket,
+                                        pin_memory=prefetch_loader_pin_memory)
+        return
     idxs = list(range(len(dataset)))
     if is_shuffle:
+        # sklearn takes more than a second to import
+        from sklearn.utils import shuffle
         idxs = shuffle(idxs)
     idxs = idxs[0: int(len(idxs)*epoch_ratio)]
     # print("the idxs length:{}".format(len(idxs)))
@@ -475,6 +435,33 @@ def queued_data_loader(dataset, batch_size, is_shuffle=True, drop_last=False, ep
         else:
             yield t
 
+class StageTimer(object):
+    """
+    Accumulate the wall time of named stages. It is safe to time different stages in different threads.
+        stage_timer = StageTimer()
+        with stage_timer('forward'):
+            ...
+    """
+    def __init__(self):
+        self.begin_time = time.time()
+        self.stage_time = collections.OrderedDict()
+        self.stage_count = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        begin = time.time()
+        try:
+            yield
+        finally:
+            self.stage_time[name] = self.stage_time.get(name, 0) + time.time() - begin
+            self.stage_count[name] = self.stage_count.get(name, 0) + 1
+
+    def __str__(self):
+        stage_str = ', '.join('{}: {:.3f}s/{}'.format(name, t, self.stage_count[name])
+                              for name, t in self.stage_time.items())
+        return 'stage time: {}, total wall time: {:.3f}s'.format(stage_str, time.time() - self.begin_time)
+
+
 # ---------------------------------- PaddedList ------------------------------------------- #
 
 class PaddedList(collections.Sequence):
@@ -634,6 +621,72 @@ class ListShapeErrorException(Exception):
     pass
 
 
+_PADDED_SEQUENCE_TYPES = (list, tuple, np.ndarray)
+
+
+def padded_array(l, fill_value=0, shape=None, dtype=np.int64, out=None):
+    """
+    The vectorized version of PaddedList. The nested list is flattened level by level and all the leaves are scattered
+    into a preallocated array at once, instead of iterating the PaddedList element by element.
+    :param l: a ragged nested list. All the leaves should be in the same depth.
+    :param fill_value: the value filled at the end of each dim
+    :param shape: the shape of result. It is the max length of each depth if it is None. The same as PaddedList.
+    :param dtype: the numpy dtype of the result
+    :param out: a preallocated array reused as the result. The shape of out is used if shape is None.
+    :return: a numpy array
+    """
+    if shape is None and out is not None:
+        shape = out.shape
+
+    level_lens = []
+    leaves = None
+    nodes = [l]
+    while True:
+        level_lens.append([len(n) for n in nodes])
+        children = list(itertools.chain.from_iterable(nodes))
+        if len(children) == 0:
+            break
+        sequence_count = sum(1 for c in children if isinstance(c, _PADDED_SEQUENCE_TYPES))
+        if sequence_count == 0:
+            leaves = children
+            break
+        elif sequence_count != len(children):
+            raise ShapeDifferentException('Shape error. There are different depth in list at depth {}'
+                                          .format(len(level_lens)))
+        nodes = children
+
+    l_shape = [max(lens) if len(lens) > 0 else 0 for lens in level_lens]
+    if shape is None:
+        shape = l_shape
+    shape = list(shape)
+    # an empty list can be padded to a deeper shape, otherwise the depth of list should be the same as shape
+    if len(shape) < len(l_shape) or (leaves is not None and len(shape) != len(l_shape)):
+        raise ListShapeErrorException('the depth of list {} is different from the shape {}'.format(l_shape, shape))
+    for l_len, s in zip(l_shape, shape):
+        if l_len > s:
+            raise ListShapeErrorException('dim of list is larger than shape. l_shape: {}, shape: {}'
+                                          .format(l_shape, shape))
+
+    if out is None:
+        out = np.full(shape, fill_value, dtype=dtype)
+    else:
+        if list(out.shape) != shape:
+            raise ListShapeErrorException('the shape of out {} is different from shape {}'.format(out.shape, shape))
+        out.fill(fill_value)
+    if leaves is None:
+        return out
+
+    # calculate the flat index of each node level by level: index(child) = index(parent) * shape[d] + offset
+    index = np.zeros(1, dtype=np.int64)
+    for d, lens in enumerate(level_lens):
+        lens = np.asarray(lens, dtype=np.int64)
+        starts = np.cumsum(lens) - lens
+        offsets = np.arange(int(lens.sum()), dtype=np.int64) - np.repeat(starts, lens)
+        index = np.repeat(index * shape[d], lens) + offsets
+    np.put(out, index, np.asarray(leaves, dtype=out.dtype))
+    return out
+
+
 def key_transform(transform, *key, ):
     def transform_fn(sample):
         if len(key) == 1:
@@ -714,7 +767,36 @@ def convert_one_token_ids_to_code(token_ids, id_to_word_fn, start, end, unk, inc
     return code, end_pos
 
 
+def compile_result_cache(mode):
+    """
+    Function decorator to look up the compile result of the code (the first argument) in the compile cache before
+    compiling. The compile which writes a log file is not cached because the caller reads the log.
+    """
+    def wrapper(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapped(code, *args, **kwargs):
+            compile_cache = args_util.get_compile_cache()
+            if compile_cache is None:
+                return func(code, *args, **kwargs)
+            bound = signature.bind(code, *args, **kwargs)
+            if bound.arguments.get('log_file_path', None) is not None:
+                return func(code, *args, **kwargs)
+            cached = compile_cache.get(code, mode=mode, need_errors=False)
+            if cached is not None:
+                return cached[0]
+            res = func(code, *args, **kwargs)
+            compile_cache.put(code, res, mode=mode)
+            return res
+        return wrapped
+    return wrapper
+
+
+@compile_result_cache(mode='syntax')
 def compile_syntax_c_code_by_gcc(code, file_path):
+    if args_util.use_compile_server:
+        return compile_code_by_backend(code, mode='syntax')[0]
     file_path = add_pid_to_file_path(file_path)
     # target_file_path = add_pid_to_file_path(target_file_path)
     write_code_to_file(code, file_path)
@@ -725,7 +807,15 @@ def compile_syntax_c_code_by_gcc(code, file_path):
     return False
 
 
+@compile_result_cache(mode='c')
 def compile_c_code_by_gcc(code, file_path, target_file_path='main.out', add_pid=True, log_file_path=None):
+    if args_util.use_compile_server:
+        res, texts = compile_code_by_backend(
+            code, mode='c', target_file_path=add_pid_to_file_path(target_file_path) if add_pid else target_file_path)
+        if log_file_path is not None:
+            log_file_path = add_pid_to_file_path(log_file_path) if add_pid else log_file_path
+            write_code_to_file(texts, log_file_path)
+        return res
     if add_pid:
         file_path = add_pid_to_file_path(file_path)
         target_file_path = add_pid_to_file_path(target_file_path)
@@ -746,7 +836,10 @@ def compile_c_code_by_gcc(code, file_path, target_file_path='main.out', add_pid=
     return False
 
 
+@compile_result_cache(mode='c89')
 def compile_c_code_by_gcc_c89(code, file_path):
+    if args_util.use_compile_server:
+        return compile_code_by_backend(code, mode='c89')[0]
     file_path = add_pid_to_file_path(file_path)
     # target_file_path = add_pid_to_file_path(target_file_path)
     write_code_to_file(code, file_path)
@@ -757,7 +850,10 @@ def compile_c_code_by_gcc_c89(code, file_path):
     return False
 
 
+@compile_result_cache(mode='cpp')
 def compile_cpp_code_by_gcc(code, file_path):
+    if args_util.use_compile_server:
+        return compile_code_by_backend(code, mode='cpp')[0]
     file_path = add_pid_to_file_path(file_path)
     # target_file_path = add_pid_to_file_path(target_file_path)
     write_code_to_file(code, file_path)
@@ -998,6 +1094,14 @@ def iterate_directory(root_path, extensions=None, recursive=False):
                     yield os.path.join(dir_path, file), file
 
 
+def _columnar_dataset_max_stores():
+    try:
+        from config import columnar_dataset_max_stores
+    except ImportError:
+        return 4
+    return columnar_dataset_max_stores
+
+
 class CustomerDataSet(Dataset):
 
     def __init__(self,
@@ -1015,7 +1119,7 @@ class CustomerDataSet(Dataset):
                 self.data_df = self.filter_df(data_df)
             else:
                 self.data_df = data_df
-            self._samples = [row for i, row in self.data_df.iterrows()]
+            self._samples = self._create_samples(self.data_df)
             if self.transform:
                 self._samples = show_process_map(self.transform, self._samples)
             # for s in self._samples:
@@ -1028,9 +1132,25 @@ class CustomerDataSet(Dataset):
     def _get_raw_sample(self, row):
         raise NotImplementedError
 
+    def _create_samples(self, df):
+        """
+        :return: the rows of df. They are the rows of a memory mapped ColumnarStore saved once for the same df if
+        args_util.use_columnar_dataset is True, else the pandas Series. The store is named by the content hash of df
+        and only the last columnar_dataset_max_stores stores of the dataset class and set type are kept.
+        """
+        if not args_util.use_columnar_dataset:
+            return [row for i, row in df.iterrows()]
+        from config import columnar_dataset_path
+        prefix = '{}-{}-'.format(type(self).__name__, self.set_type)
+        fingerprint = data_fingerprint(df)
+        dir_path = os.path.join(columnar_dataset_path, prefix + fingerprint)
+        store = load_or_create_columnar_store(df, dir_path, fingerprint)
+        evict_columnar_stores(columnar_dataset_path, prefix, _columnar_dataset_max_stores(), keep_paths=(dir_path, ))
+        return ColumnarRows(store)
+
     def add_samples(self, df):
         df = self.filter_df(df)
-        self._samples += [row for i, row in df.iterrows()]
+        self._samples += self._create_samples(df)
 
     def remain_samples(self, count=0, frac=1.0):
         if count != 0:
@@ -1050,12 +1170,31 @@ class CustomerDataSet(Dataset):
         d.remain_samples(count=count, frac=frac)
         return d
 
+    def get_sample(self, index, rng=random):
+        """
+        :param rng: the random.Random the sample draws from. The datasets sampling at random override it
+        """
+        return self[index]
+
     def __getitem__(self, index):
         return self._get_raw_sample(self._samples[index])
 
     def __len__(self):
         return len(self._samples)
 
+    def sample_length(self, index):
+        """
+        :return: the token length of the sample used to bucket the batches by the prefetch data loader. 0 if the row
+        has no error_token_id_list.
+        """
+        try:
+            ids = self._samples[index]['error_token_id_list']
+        except (KeyError, TypeError, IndexError):
+            return 0
+        if len(ids) > 0 and isinstance(ids[0], list):
+            ids = ids[0]
+        return len(ids)
+
 
 class OrderedList(list):
     def __init__(self, s: set):
@@ -1106,16 +1245,32 @@ def compile_code_ids_list(final_output, continue_list, result_list, vocabulary,
         compile_args_list += [(code, file_path, target_file_path, log_file_path)]
         code_index_dict += [count_i]
         count_i += 1
-    if do_compile_pool:
-        # part_res_list = list(compile_pool.starmap(compile_c_code_by_gcc, compile_args_list))
-        part_res_list = list(compile_pool.starmap(compile_and_read_error_info, compile_args_list))
+    compile_cache = args_util.get_compile_cache()
+    if compile_cache is not None and len(compile_args_list) > 0:
+        compile_outcome_list = compile_cache.get_many([args[0] for args in compile_args_list], mode='c')
+    else:
+        compile_outcome_list = [None for _ in range(len(compile_args_list))]
+    miss_index_list = [i for i, outcome in enumerate(compile_outcome_list) if outcome is None]
+    miss_args_list = [compile_args_list[i] for i in miss_index_list]
+
+    if do_compile_pool and args_util.use_compile_server:
+        part_res_list = get_compile_server().compile_many([args[0] for args in miss_args_list], mode='c',
+                                                          target_file_path=target_file_path)
+    elif do_compile_pool:
+        # part_res_list = list(compile_pool.starmap(compile_c_code_by_gcc, miss_args_list))
+        part_res_list = list(compile_pool.starmap(compile_and_read_error_info, miss_args_list))
     else:
-        # part_res_list = map(compile_c_code_by_gcc_one_arg, compile_args_list)
-        part_res_list = map(compile_and_read_error_info_one_arg, compile_args_list)
+        # part_res_list = map(compile_c_code_by_gcc_one_arg, miss_args_list)
+        part_res_list = list(map(compile_and_read_error_info_one_arg, miss_args_list))
+    miss_outcome_list = [(res, extract_error_message(msg)) for res, msg in part_res_list]
+    for i, outcome in zip(miss_index_list, miss_outcome_list):
+        compile_outcome_list[i] = outcome
+    if compile_cache is not None and len(miss_args_list) > 0:
+        miss_res_list, miss_error_list = list(zip(*miss_outcome_list))
+        compile_cache.put_many([args[0] for args in miss_args_list], miss_res_list, miss_error_list, mode='c')
 
     error_count_list = [-1 for _ in range(batch_size)]
-    for i, (res, msg) in enumerate(part_res_list):
-        error_list = extract_error_message(msg)
+    for i, (res, error_list) in enumerate(compile_outcome_list):
         act_i = code_index_dict[i]
         cur_result_list[act_i] = res
         c = not res
@@ -1282,6 +1437,8 @@ def compile_and_read_error_info(code, file_path='/dev/shm/main.c', target_file_p
     # file_path = '/dev/shm/main.c'
     # target_file_path = '/dev/shm/main.out'
     # log_file_path = '/dev/shm/main.log'
+    if args_util.use_compile_server:
+        return compile_code_by_backend(code, mode='c', target_file_path=add_pid_to_file_path(target_file_path))
     res = compile_c_code_by_gcc(code, file_path=file_path, target_file_path=target_file_path,
                                 log_file_path=log_file_path, add_pid=True)
     pid_log_file_path = add_pid_to_file_path(log_file_path)
@@ -10,6 +10,8 @@ temp_code_write_path = r'tmp'
 scrapyOJ_path = r'/home/lf/new_disk/data_store/codeforces/scrapyOJ.db'
 # cache path
 cache_path = r'/home/lf/Project/GrammaLanguageModel/data/cache_data'
+# the max total bytes of the disk_cache entries in cache_path. None means no limit
+disk_cache_max_bytes = None
 save_model_root = os.path.join(root, 'trained_model')
 util.make_dir(save_model_root)
 summarization_source_code_to_method_name_path = r'/home/lf/Project/GrammaLanguageModel/data/summarization_method_name/json'
@@ -17,5 +19,22 @@ DEEPFIX_DB = '/home/lf/new_disk/data_store/deepfix/deepfix.db'
 SLK_SAMPLE_DBPATH = os.path.join(root, 'data', 'slk_sample_data.db')
 FAKE_DEEPFIX_ERROR_DATA_DBPATH = os.path.join(root, 'data', 'fake_deepfix_error_data.db')
 num_processes = 6
+compile_cache_path = os.path.join(root, 'data', 'compile_cache.db')
+compile_cache_max_entries = 2000000
+# the tokens of the codes lexed by common.tokenize_service.TokenizeService
+tokenize_cache_path = os.path.join(root, 'data', 'tokenize_cache.db')
+# the directory of the ColumnarStore of the dataset samples
+columnar_dataset_path = os.path.join(root, 'data', 'columnar_dataset')
+# the number of the stores kept for a dataset class and set type, the older ones are removed
+columnar_dataset_max_stores = 4
+# the ast code graphs of the token lists saved by c_parser.code_graph_cache.CodeGraphCache
+code_graph_cache_path = os.path.join(root, 'data', 'code_graph_cache.db')
+code_graph_lru_size = 20000
+# the worker number and the max batches in flight of common.prefetch_loader.prefetch_data_loader
+prefetch_loader_workers = 4
+prefetch_loader_depth = 8
+prefetch_loader_pin_memory = False
 DATA_RECORDS_DEEPFIX_DBPATH = os.path.join(root, 'data', 'data_records_deepfix.db')
 DATA_RECORDS_DEEPFIX_CODEFORCES_TRAIN_DBPATH = os.path.join(root, 'data', 'data_records_deepfix_codeforces_train.db')
+# the stage timings saved by benchmark.py --save_baseline True
+benchmark_baseline_path = os.path.join(root, 'data', 'benchmark_baseline.json')
@@ -1,7 +1,128 @@
+"""
+The sqlite access layer. The connections are pooled by (process, thread, db path) instead of being opened and closed
+in every call, and every connection is configured by DB_PRAGMAS once. The sqlite3 module keeps a prepared statement
+cache in each connection, so the statements in sql_dict are parsed only once for a pooled connection.
+"""
+
+import contextlib
+import os
 import sqlite3
+import threading
 
 from database.sql_statment import sql_dict
 
+# the pragmas executed when a connection is opened. Change it by set_pragmas before the first connection.
+DB_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    # negative means KiB
+    'cache_size': -64000,
+    'busy_timeout': 60000,
+}
+# the max number of variables in one sql. The old sqlite versions allow 999 at most
+MAX_SQL_VARIABLES = 900
+INSERT_BATCH_SIZE = 10000
+FETCH_BATCH_SIZE = 10000
+STATEMENT_CACHE_SIZE = 256
+
+
+def set_pragmas(**pragmas):
+    """
+    update DB_PRAGMAS, the connections opened before are closed so that the new pragmas are used.
+    a pragma whose value is None is removed.
+    """
+    for k, v in pragmas.items():
+        if v is None:
+            DB_PRAGMAS.pop(k, None)
+        else:
+            DB_PRAGMAS[k] = v
+    close_connections()
+
+
+class ConnectionPool(object):
+    """
+    One connection for each (thread, db path). sqlite3 connections can not be shared by threads or forked
+    processes, the pool is cleared when it is used in a forked process.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all_connections = []
+        self._pid = os.getpid()
+
+    def _connections(self):
+        if self._pid != os.getpid():
+            # the connections are inherited from the parent process, they must not be used or closed here
+            self._local = threading.local()
+            self._all_connections = []
+            self._pid = os.getpid()
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        return self._local.connections
+
+    def get(self, db_path):
+        db_path = os.path.abspath(db_path)
+        connections = self._connections()
+        if db_path not in connections:
+            # check_same_thread is off so that close() can close the connections of the other threads
+            con = sqlite3.connect(db_path, timeout=60, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+            for k, v in DB_PRAGMAS.items():
+                con.execute('PRAGMA {}={}'.format(k, v))
+            connections[db_path] = con
+            with self._lock:
+                self._all_connections.append((connections, db_path, con))
+        return connections[db_path]
+
+    def close(self, db_path=None):
+        """
+        close the connections of all threads in this process. Only the db_path ones are closed if it is not None.
+        """
+        self._connections()
+        if db_path is not None:
+            db_path = os.path.abspath(db_path)
+        with self._lock:
+            remain = []
+            for connections, path, con in self._all_connections:
+                if db_path is None or path == db_path:
+                    con.close()
+                    connections.pop(path, None)
+                else:
+                    remain.append((connections, path, con))
+            self._all_connections = remain
+
+
+_pool = ConnectionPool()
+
+
+def get_connection(db_path):
+    return _pool.get(db_path)
+
+
+def close_connections(db_path=None):
+    _pool.close(db_path)
+
+
+@contextlib.contextmanager
+def transaction(db_path):
+    """
+    run the statements in the with block in one transaction. The functions in this module called in the block don't
+    commit by themselves, so a group of inserts costs one commit.
+    """
+    con = get_connection(db_path)
+    if con.in_transaction:
+        # nested transaction is committed by the outermost one
+        yield con
+        return
+    con.execute('BEGIN')
+    try:
+        yield con
+    except BaseException:
+        con.rollback()
+        raise
+    else:
+        con.commit()
+
 
 def with_connect():
     def wrapper(func):
@@ -11,59 +132,118 @@ def with_connect():
                 db_path = args[0]
             if 'db_full_path' in kwargs.keys():
                 db_path = kwargs['db_full_path']
-            con = sqlite3.connect(db_path)
+            con = get_connection(db_path)
             kwargs['con'] = con
-            res = func(*args, **kwargs)
-            con.close()
-            return res
+            return func(*args, **kwargs)
         return sub_wrapper
     return wrapper
 
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _execute_many(con, sql, params, batch_size):
+    """
+    executemany in batches. It is committed once at the end if it is not in a transaction block.
+    params can be a generator so the records are not kept in memory.
+    """
+    own_transaction = not con.in_transaction
+    if own_transaction:
+        con.execute('BEGIN')
+    try:
+        for chunk in _chunks(params, batch_size):
+            con.executemany(sql, chunk)
+    except BaseException:
+        if own_transaction:
+            con.rollback()
+        raise
+    if own_transaction:
+        con.commit()
+
+
+def _get_sql(table_name, sql_name, replace_table_name=None):
+    sql = sql_dict[table_name][sql_name]
+    if replace_table_name is not None:
+        sql = sql.replace('TABLENAME', replace_table_name)
+    return sql
+
+
 @with_connect()
 def create_table(db_full_path, table_name, replace_table_name=None, **kwargs):
     assert 'con' in kwargs.keys()
 
-    sql = sql_dict[table_name]['create']
-    if replace_table_name is not None:
-        sql = sql.replace('TABLENAME', replace_table_name)
+    sql = _get_sql(table_name, 'create', replace_table_name)
     con = kwargs['con']
     con.execute(sql)
-    con.commit()
+    if not con.in_transaction:
+        con.commit()
+
 
 @with_connect()
-def insert_items(db_full_path, table_name, params, **kwargs):
+def insert_items(db_full_path, table_name, params, replace_table_name=None, batch_size=INSERT_BATCH_SIZE, **kwargs):
     assert 'con' in kwargs.keys()
 
-    sql = sql_dict[table_name]['insert_ignore']
-    con = kwargs['con']
-    con.executemany(sql, params)
-    con.commit()
+    sql = _get_sql(table_name, 'insert_ignore', replace_table_name)
+    _execute_many(kwargs['con'], sql, params, batch_size)
 
 
 @with_connect()
-def run_sql_statment(db_full_path, table_name, sql_name, params, replace_table_name=None,  **kwargs):
+def run_sql_statment(db_full_path, table_name, sql_name, params, replace_table_name=None,
+                     batch_size=INSERT_BATCH_SIZE, **kwargs):
     assert 'con' in kwargs.keys()
 
-    sql = sql_dict[table_name][sql_name]
-    if replace_table_name is not None:
-        sql = sql.replace('TABLENAME', replace_table_name)
-    con = kwargs['con']
-    con.executemany(sql, params)
-    con.commit()
+    sql = _get_sql(table_name, sql_name, replace_table_name)
+    _execute_many(kwargs['con'], sql, params, batch_size)
 
 
 @with_connect()
-def run_sql_select_statment(db_full_path, table_name, sql_name, replace_table_name=None, **kwargs):
+def run_sql_select_statment(db_full_path, table_name, sql_name, replace_table_name=None, params=(), **kwargs):
     assert 'con' in kwargs.keys()
 
-    sql = sql_dict[table_name][sql_name]
-    if replace_table_name is not None:
-        sql = sql.replace('TABLENAME', replace_table_name)
+    sql = _get_sql(table_name, sql_name, replace_table_name)
     con = kwargs['con']
-    cur = con.cursor()
-    cur.execute(sql)
-    res = cur.fetchall()
-    return res
+    return con.execute(sql, params).fetchall()
+
+
+def iter_sql_select_statment(db_full_path, table_name, sql_name, replace_table_name=None, params=(),
+                             batch_size=FETCH_BATCH_SIZE):
+    """
+    the same as run_sql_select_statment but yield the rows by a streaming cursor instead of fetching all of them.
+    """
+    sql = _get_sql(table_name, sql_name, replace_table_name)
+    cur = get_connection(db_full_path).execute(sql, params)
+    cur.arraysize = batch_size
+    try:
+        while True:
+            rows = cur.fetchmany()
+            if len(rows) == 0:
+                break
+            for row in rows:
+                yield row
+    finally:
+        cur.close()
+
+
+def iter_in_statment(con, sql, values, other_params=()):
+    """
+    run a sql with 'IN ({})' for a lot of values. The values are split into chunks and bound as parameters.
+    :param sql: a sql with one '{}' to be formatted by the placeholders
+    :param other_params: the parameters before the IN values
+    """
+    values = list(values)
+    chunk_size = MAX_SQL_VARIABLES - len(other_params)
+    for i in range(0, len(values), chunk_size):
+        part = values[i:i+chunk_size]
+        for row in con.execute(sql.format(','.join('?' * len(part))), tuple(other_params) + tuple(part)):
+            yield row
 
 
 @with_connect()
@@ -71,8 +251,4 @@ def find_ids_by_user_problem_id(db_full_path, table_name, ids, **kwargs):
     assert 'con' in kwargs.keys()
 
     sql = sql_dict[table_name]['find_ids_by_user_problem_id']
-    con = kwargs['con']
-    cur = con.cursor()
-    cur.execute(sql.format(",".join(ids)))
-    res = cur.fetchall()
-    return res
+    return list(iter_in_statment(kwargs['con'], sql, ids))
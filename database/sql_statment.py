@@ -1,7 +1,7 @@
 from common.constants import ACTUAL_C_ERROR_RECORDS, CPP_TESTCASE_ERROR_RECORDS, C_COMPILE_SUCCESS_RECORDS, \
     RANDOM_C_ERROR_RECORDS, COMMON_C_ERROR_RECORDS, SLK_SAMPLE_COMMON_C_ERROR_RECORDS_TRAIN, \
     SLK_SAMPLE_COMMON_C_ERROR_RECORDS_VALID, SLK_SAMPLE_COMMON_C_ERROR_RECORDS_TEST, COMMON_DEEPFIX_ERROR_RECORDS, \
-    DATA_RECORDS_DEEPFIX
+    DATA_RECORDS_DEEPFIX, STREAM_CHECKPOINT_RECORDS
 
 CREATE_ACTUAL_C_ERROR_RECORDS = r'''CREATE TABLE IF NOT EXISTS actual_c_error_records (
   id TEXT PRIMARY KEY,
@@ -178,6 +178,15 @@ CREATE_MULTISTEP_SAMPLE_OUTPUT_RECORDS = r'''CREATE TABLE IF NOT EXISTS TABLENAM
 # '''
 
 
+CREATE_STREAM_CHECKPOINT_RECORDS = r'''CREATE TABLE IF NOT EXISTS stream_checkpoint_records (
+  name TEXT PRIMARY KEY,
+  last_key TEXT,
+  group_count INTEGER DEFAULT 0,
+  item_count INTEGER DEFAULT 0
+)'''
+FIND_STREAM_CHECKPOINT_BY_NAME = r'''SELECT last_key, group_count, item_count from stream_checkpoint_records where name=?'''
+REPLACE_STREAM_CHECKPOINT_RECORDS = r'''INSERT OR REPLACE INTO stream_checkpoint_records (name, last_key, group_count, item_count) VALUES (?, ?, ?, ?)'''
+
 FIND_CPP_TESTCASE_DISTINCT_PROBLEM_USER_ID = r'''SELECT DISTINCT problem_user_id from cpp_testcase_error_records'''
 FIND_RANDOM_C_ERROR_RECORDS_DISTINCT_PROBLEM_USER_ID = r'''SELECT DISTINCT problem_user_id from random_c_error_records'''
 FIND_COMMON_C_ERROR_RECORDS_DISTINCT_PROBLEM_USER_ID = r'''SELECT DISTINCT problem_user_id from common_c_error_records'''
@@ -224,6 +233,9 @@ sql_dict = {ACTUAL_C_ERROR_RECORDS: {'create': CREATE_ACTUAL_C_ERROR_RECORDS,
                                    'insert_ignore': INSERT_IGNORE_MULTISTEP_SAMPLE_OUTPUT_RECORDS,
                                    'update_sample_compile_info': UPDATE_SAMPLE_COMPILE_INFO,
                                    'update_original_compile_info': UPDATE_ORIGINAL_COMPILE_INFO,
-            }
+            },
+            STREAM_CHECKPOINT_RECORDS: {'create': CREATE_STREAM_CHECKPOINT_RECORDS,
+                                        'find_by_name': FIND_STREAM_CHECKPOINT_BY_NAME,
+                                        'replace': REPLACE_STREAM_CHECKPOINT_RECORDS},
 
 }
@@ -0,0 +1,223 @@
+"""
+An iterative token level levenshtein distance. The tokens are interned to int ids and the dp matrix is computed row by
+row. Only the cells in the Ukkonen band |i - j| <= max_distance are computed, and the computation stops as soon as a
+whole row of the band is larger than max_distance.
+
+A row is computed without a python loop over the columns:
+    cand[j] = min(row[i-1][j-1] + (a[i-1] != b[j-1]), row[i-1][j] + 1)
+    row[i][j] = min(cand[j], row[i][j-1] + 1) = min over k <= j of (cand[k] + j - k)
+so row[i] is np.minimum.accumulate(cand - j) + j.
+
+The cells larger than max_distance are stored as max_distance + 1. A cell whose value is not larger than max_distance
+is exact, so the traceback of a distance in the band is the same as the one of the full matrix. BandedMatrix keeps
+the rows of the band only and can be indexed as matrix[i][j] by produce_actions.cal_action_list.
+
+If only the distance is needed, the common prefix and suffix are skipped and a small max_distance uses the diagonal
+(furthest reaching) form of Ukkonen's algorithm, which slides along the equal tokens by numpy comparisons.
+"""
+
+import numpy as np
+
+
+class TokenInterner(object):
+    def __init__(self, value_fn=None):
+        """
+        :param value_fn: the value of a token to be compared, such as token_level_closest_text.get_token_value.
+        The tokens are compared by themselves if it is None.
+        """
+        self.value_fn = value_fn
+        self.value_to_id = {}
+
+    def intern(self, tokens):
+        value_to_id = self.value_to_id
+        values = tokens if self.value_fn is None else map(self.value_fn, tokens)
+        ids = [value_to_id.setdefault(v, len(value_to_id)) for v in values]
+        return np.array(ids, dtype=np.int32)
+
+
+class _BandedRow(object):
+    def __init__(self, values, lo, hi, inf):
+        self.values = values
+        self.lo = lo
+        self.hi = hi
+        self.inf = inf
+
+    def __getitem__(self, j):
+        if self.lo <= j <= self.hi:
+            return int(self.values[j - self.lo])
+        return self.inf
+
+
+class BandedMatrix(object):
+    """
+    the rows of the band. matrix[i][j] is max_distance + 1 out of the band as levenshtenin_distance.
+    """
+    def __init__(self, values, row_lo, row_hi, inf):
+        self.values = values
+        self.row_lo = row_lo
+        self.row_hi = row_hi
+        self.inf = inf
+
+    def __getitem__(self, i):
+        return _BandedRow(self.values[i], self.row_lo[i], self.row_hi[i], self.inf)
+
+    def __len__(self):
+        return len(self.values)
+
+
+def _band(i, m, max_distance):
+    if max_distance is None:
+        return 0, m
+    return max(0, i - max_distance), min(m, i + max_distance)
+
+
+def _iterate_rows(a_ids, b_ids, max_distance):
+    """
+    yield (i, lo, hi, row) of the dp matrix. row is an array of m + 1 values and only row[lo:hi+1] is valid. It stops
+    early if all the values of a row are larger than max_distance.
+    """
+    n = len(a_ids)
+    m = len(b_ids)
+    inf = (n + m + 1) if max_distance is None else max_distance + 1
+    columns = np.arange(m + 1, dtype=np.int32)
+    prev = np.full(m + 1, inf, dtype=np.int32)
+    cur = np.full(m + 1, inf, dtype=np.int32)
+    lo, hi = _band(0, m, max_distance)
+    prev[lo:hi+1] = columns[lo:hi+1]
+    yield 0, lo, hi, prev
+    for i in range(1, n + 1):
+        lo, hi = _band(i, m, max_distance)
+        cur.fill(inf)
+        start = max(lo, 1)
+        cand = np.minimum(prev[start-1:hi] + (b_ids[start-1:hi] != a_ids[i-1]), prev[start:hi+1] + 1)
+        if lo == 0:
+            cand = np.concatenate(([i], cand))
+        row = np.minimum.accumulate(cand - columns[lo:hi+1]) + columns[lo:hi+1]
+        np.minimum(row, inf, out=cur[lo:hi+1])
+        yield i, lo, hi, cur
+        if max_distance is not None and cur[lo:hi+1].min() > max_distance:
+            return
+        prev, cur = cur, prev
+
+
+def _common_affix_length(a_ids, b_ids):
+    length = min(len(a_ids), len(b_ids))
+    diff = np.flatnonzero(a_ids[:length] != b_ids[:length])
+    prefix = diff[0] if len(diff) > 0 else length
+    diff = np.flatnonzero(a_ids[::-1][:length - prefix] != b_ids[::-1][:length - prefix])
+    suffix = diff[0] if len(diff) > 0 else length - prefix
+    return int(prefix), int(suffix)
+
+
+def _slide(a_ids, b_ids, i, j):
+    """
+    :return: the first i' >= i that a_ids[i'] != b_ids[j + i' - i], compared by chunks of growing length
+    """
+    n = len(a_ids)
+    m = len(b_ids)
+    length = 16
+    while i < n and j < m:
+        length = min(length, n - i, m - j)
+        diff = np.flatnonzero(a_ids[i:i+length] != b_ids[j:j+length])
+        if len(diff) > 0:
+            return i + int(diff[0])
+        i += length
+        j += length
+        length *= 4
+    return i
+
+
+def _furthest_reaching_distance(a_ids, b_ids, max_distance):
+    """
+    the diagonal version of Ukkonen's algorithm. furthest[k] is the last row reached on the diagonal j - i = k with e
+    edits. It costs O(max_distance ** 2) slides instead of O(len(a_ids) * max_distance) cells.
+    """
+    n = len(a_ids)
+    m = len(b_ids)
+    target = m - n
+    furthest = {0: _slide(a_ids, b_ids, 0, 0)}
+    if target == 0 and furthest[0] >= n:
+        return 0
+    for e in range(1, max_distance + 1):
+        reached = {}
+        for k in range(max(-e, -n), min(e, m) + 1):
+            # change on the diagonal k, delete from the diagonal k + 1 and insert from the diagonal k - 1
+            i = max(furthest.get(k, -1) + 1, furthest.get(k + 1, -1) + 1, furthest.get(k - 1, -1))
+            i = min(i, n, m - k)
+            if i < max(0, -k):
+                continue
+            i = _slide(a_ids, b_ids, i, i + k)
+            reached[k] = i
+            if k == target and i >= n:
+                return e
+        furthest = reached
+    return max_distance + 1
+
+
+# the diagonal algorithm is faster than the band rows when max_distance is small
+FURTHEST_REACHING_MAX_DISTANCE = 32
+
+
+def banded_levenshtein_distance(a_ids, b_ids, max_distance=None):
+    """
+    :param a_ids: the interned ids of TokenInterner.intern
+    :return: the distance, or max_distance + 1 if the distance is larger than max_distance
+    """
+    prefix, suffix = _common_affix_length(a_ids, b_ids)
+    # the common prefix and suffix don't change the distance
+    a_ids = a_ids[prefix:len(a_ids) - suffix]
+    b_ids = b_ids[prefix:len(b_ids) - suffix]
+    n = len(a_ids)
+    m = len(b_ids)
+    if max_distance is not None and abs(n - m) > max_distance:
+        return max_distance + 1
+    if n == 0 or m == 0:
+        return max(n, m)
+    if max_distance is not None and max_distance <= FURTHEST_REACHING_MAX_DISTANCE:
+        return _furthest_reaching_distance(a_ids, b_ids, max_distance)
+    for i, lo, hi, row in _iterate_rows(a_ids, b_ids, max_distance):
+        if i == n:
+            return int(row[m]) if lo <= m <= hi else max_distance + 1
+    return max_distance + 1
+
+
+def banded_levenshtein_matrix(a_ids, b_ids, max_distance=None):
+    """
+    the same as banded_levenshtein_distance but keep the band for the traceback. The common prefix and suffix are not
+    skipped so the traceback is the same as the one of levenshtenin_distance.
+    :return: (distance, BandedMatrix)
+    """
+    n = len(a_ids)
+    m = len(b_ids)
+    width = m + 1 if max_distance is None else min(m + 1, 2 * max_distance + 1)
+    inf = (n + m + 1) if max_distance is None else max_distance + 1
+    values = np.full((n + 1, width), inf, dtype=np.int32)
+    row_lo = [0] * (n + 1)
+    row_hi = [-1] * (n + 1)
+    distance = inf
+    if max_distance is None or abs(n - m) <= max_distance:
+        for i, lo, hi, row in _iterate_rows(a_ids, b_ids, max_distance):
+            values[i, :hi - lo + 1] = row[lo:hi+1]
+            row_lo[i] = lo
+            row_hi[i] = hi
+            if i == n and lo <= m <= hi:
+                distance = int(row[m])
+    return distance, BandedMatrix(values, row_lo, row_hi, inf)
+
+
+def token_level_distance(a_tokens, b_tokens, value_fn=None, max_distance=None, interner=None):
+    """
+    :param interner: a TokenInterner shared by the calls to compare one code with many codes
+    :return: the distance, or max_distance + 1 if the distance is larger than max_distance
+    """
+    interner = TokenInterner(value_fn) if interner is None else interner
+    return banded_levenshtein_distance(interner.intern(a_tokens), interner.intern(b_tokens), max_distance)
+
+
+def token_level_distance_and_matrix(a_tokens, b_tokens, value_fn=None, max_distance=None, interner=None):
+    """
+    a replacement of levenshtenin_distance. The matrix can be used in produce_actions.cal_action_list.
+    :return: (distance, BandedMatrix)
+    """
+    interner = TokenInterner(value_fn) if interner is None else interner
+    return banded_levenshtein_matrix(interner.intern(a_tokens), interner.intern(b_tokens), max_distance)
@@ -0,0 +1,111 @@
+"""
+A nearest neighbor index of the accepted codes of a group. find_closest_token_text compares an error code with every
+accepted code, so a group costs O(error count * ac count) edit distances. The index keeps some cheap lower bounds of
+the token level levenshtein distance for every accepted code:
+    length: |len(a) - len(b)|
+    bag: the larger of the two multiset differences of the tokens, an edit changes at most one token of each side
+    q-gram: L1(q-gram counts of a - q-gram counts of b) / 2q, an edit breaks at most q q-grams and makes at most q
+The token ids and the q-grams are counted in a fixed number of bins. Two values in one bin can only decrease the
+differences, so the bounds are still lower bounds.
+
+The candidates are visited in the order of the lower bound, and the exact distance is computed with the current best
+distance as max_distance. The search stops when the lower bound is larger than the current best. The result is the
+same as computing all the distances and taking the first min one (pandas idxmin).
+"""
+
+import numpy as np
+
+from error_generation.find_closest_group_data.banded_levenshtein import TokenInterner, banded_levenshtein_distance
+
+
+def _qgram_keys(ids, q):
+    keys = np.zeros(max(len(ids) - q + 1, 0), dtype=np.int64)
+    for k in range(q):
+        keys = keys * 1000003 + ids[k:len(ids) - q + 1 + k]
+    return keys
+
+
+class ClosestCandidateIndex(object):
+    def __init__(self, tokenize_list, value_fn=None, interner=None, q=2, token_bins=1024, qgram_bins=1024):
+        """
+        :param tokenize_list: the token lists of the candidates, such as ac_df['tokenize']
+        :param value_fn: the value of a token to be compared, such as token_level_closest_text.get_token_value
+        :param interner: a TokenInterner shared with the queries. A new one of value_fn is created if it is None.
+        :param q: the length of the q-grams
+        """
+        self.interner = TokenInterner(value_fn) if interner is None else interner
+        self.q = q
+        self.token_bins = token_bins
+        self.qgram_bins = qgram_bins
+        self.candidate_ids = [self.interner.intern(tokens) for tokens in tokenize_list]
+        self.lengths = np.array([len(ids) for ids in self.candidate_ids], dtype=np.int64)
+        self.token_counts = np.array([self._token_count(ids) for ids in self.candidate_ids], dtype=np.int32)\
+            .reshape(len(self.candidate_ids), token_bins)
+        self.qgram_counts = np.array([self._qgram_count(ids) for ids in self.candidate_ids], dtype=np.int32)\
+            .reshape(len(self.candidate_ids), qgram_bins)
+        # the number of exact distance computed and skipped by all the queries
+        self.evaluated_count = 0
+        self.pruned_count = 0
+
+    def __len__(self):
+        return len(self.candidate_ids)
+
+    def _token_count(self, ids):
+        return np.bincount(ids % self.token_bins, minlength=self.token_bins)
+
+    def _qgram_count(self, ids):
+        return np.bincount(_qgram_keys(ids, self.q) % self.qgram_bins, minlength=self.qgram_bins)
+
+    def lower_bounds(self, ids):
+        """
+        :param ids: the interned ids of the query
+        :return: an int array of the lower bound of the distance between the query and every candidate
+        """
+        bound = np.abs(self.lengths - len(ids))
+        diff = self.token_counts - self._token_count(ids)
+        bag = np.maximum(np.maximum(diff, 0).sum(axis=1), np.maximum(-diff, 0).sum(axis=1))
+        qgram = np.abs(self.qgram_counts - self._qgram_count(ids)).sum(axis=1)
+        qgram = (qgram + 2 * self.q - 1) // (2 * self.q)
+        return np.maximum(np.maximum(bound, bag), qgram)
+
+    def closest(self, tokens, max_distance=None, candidate_mask=None):
+        """
+        :param tokens: the token list of the query
+        :param max_distance: the distances larger than max_distance are max_distance + 1 as banded_levenshtein_distance
+        :param candidate_mask: a bool array of the candidates to be compared. All candidates if it is None.
+        :return: (the position of the closest candidate, the distance). The first one of the min distance is returned
+        and the distance is max_distance + 1 if no candidate is in max_distance. (None, None) if no candidate.
+        """
+        ids = self.interner.intern(tokens)
+        positions = np.arange(len(self.candidate_ids)) if candidate_mask is None else \
+            np.flatnonzero(np.asarray(candidate_mask, dtype=bool))
+        if len(positions) == 0:
+            return None, None
+        cap = np.inf if max_distance is None else max_distance + 1
+        bounds = np.minimum(self.lower_bounds(ids)[positions], cap)
+        order = np.argsort(bounds, kind='stable')
+
+        best_position = None
+        best_distance = cap
+        evaluated = 0
+        for k in order:
+            bound = bounds[k]
+            position = int(positions[k])
+            if bound > best_distance:
+                break
+            if bound == best_distance and best_position is not None and position > best_position:
+                # it is a tie at most, and the first one of the ties is kept
+                continue
+            if bound >= cap:
+                distance = cap
+            else:
+                limit = max_distance if best_position is None else int(min(best_distance, cap - 1))
+                distance = min(banded_levenshtein_distance(ids, self.candidate_ids[position], max_distance=limit), cap)
+                evaluated += 1
+            if distance < best_distance or (distance == best_distance and
+                                            (best_position is None or position < best_position)):
+                best_distance = distance
+                best_position = position
+        self.evaluated_count += evaluated
+        self.pruned_count += len(positions) - evaluated
+        return best_position, int(best_distance)
@@ -9,6 +9,7 @@ import pandas as pd
 
 from c_parser.buffered_clex import BufferedCLex
 from common.analyse_include_util import remove_include
+from common.args_util import get_tokenize_service
 from config import SLK_SAMPLE_DBPATH
 from read_data.read_data_from_db import read_all_c_records, read_all_cpp_records, read_slk_grammar_sample_train_records, \
     read_slk_grammar_sample_valid_records, read_slk_grammar_sample_test_records
@@ -17,12 +18,14 @@ from common.pycparser_util import init_pycparser, tokenize_by_clex, tokenize_err
 from common.util import parallel_map, compile_cpp_code_by_gcc, \
     group_df_to_grouped_list, chunks, compile_c_code_by_gcc, tokenize_cpp_code_by_new_tokenize, init_code, \
     check_ascii_character
+from error_generation.find_closest_group_data.closest_candidate_index import ClosestCandidateIndex
+from error_generation.find_closest_group_data.closest_group_stream import run_closest_group_stream
 from error_generation.find_closest_group_data.token_level_closest_text import find_closest_token_text, init_c_code, \
     save_train_data, \
-    filter_repeat_ids, calculate_distance_and_action_between_two_code
+    filter_repeat_ids, calculate_distance_and_action_between_two_code, get_token_value
 from common.constants import verdict, SLK_SAMPLE_COMMON_C_ERROR_RECORDS_TRAIN, SLK_SAMPLE_COMMON_C_ERROR_RECORDS_VALID, \
     SLK_SAMPLE_COMMON_C_ERROR_RECORDS_TEST
-from common.constants import TRAIN_DATA_DBPATH, ACTUAL_C_ERROR_RECORDS, CPP_TESTCASE_ERROR_RECORDS
+from common.constants import TRAIN_DATA_DBPATH, ACTUAL_C_ERROR_RECORDS, CPP_TESTCASE_ERROR_RECORDS, scrapyOJ_DB_PATH
 from database.database_util import run_sql_select_statment
 
 count = 0
@@ -42,19 +45,19 @@ def find_closest_group(one_group: pd.DataFrame):
     # if not check_group_has_both(one_group):
     #     return None
 
-    c_parser = init_pycparser(lexer=BufferedCLex)
     file_path = '/dev/shm/tmp_file_{}.c'.format(current.pid)
     one_group['gcc_compile_result'] = one_group['code'].apply(compile_c_code_by_gcc, file_path=file_path)
     # one_group['pycparser_result'] = one_group['code'].apply(parse_c_code_by_pycparser, file_path=file_path, c_parser=c_parser, print_exception=False)
     one_group['pycparser_result'] = False
     one_group['code_without_include'] = one_group['code'].map(remove_include).map(lambda x: x.replace('\r', ''))
-    one_group['tokenize'] = one_group['code_without_include'].apply(tokenize_by_clex, lexer=c_parser.clex)
+    one_group['tokenize'] = get_tokenize_service().tokenize_tokens_batch(list(one_group['code_without_include']))
     one_group = one_group[one_group['tokenize'].map(lambda x: x is not None)]
 
     ac_df = one_group[one_group['gcc_compile_result']]
     error_df = one_group[one_group['gcc_compile_result'].map(lambda x: not x)]
 
-    error_df = error_df.apply(find_closest_token_text, axis=1, raw=True, ac_df=ac_df)
+    index = ClosestCandidateIndex(ac_df['tokenize'], get_token_value)
+    error_df = error_df.apply(find_closest_token_text, axis=1, raw=True, ac_df=ac_df, index=index)
     # error_df = error_df[error_df['res'].map(lambda x: x is not None)]
     if 'tokenize' in error_df.columns.values.tolist():
         error_df = error_df.drop(['tokenize'], axis=1)
@@ -79,26 +82,11 @@ def check_group_has_both(df):
 
 def find_c_compile_error_closest_code_main():
     sys.setrecursionlimit(5000)
-    data_df = read_all_c_records()
-    # data_df = data_df.sample(100000)
-    print('finish read code: {}'.format(len(data_df.index)))
-    data_df = init_c_code(data_df)
-    print('finish init code: {}'.format(len(data_df.index)))
-    # data_df = data_df.sample(10000)
-    group_list = group_df_to_grouped_list(data_df, 'problem_user_id')
-    print('group list length: {}'.format(len(group_list)))
-    group_list = list(filter(check_group_has_both, group_list))
-    print('after filter both group list length: {}'.format(len(group_list)))
-    res = list(parallel_map(8, find_closest_group, group_list))
-    # res = [find_closest_group(group) for group in group_list]
-    res = list(filter(lambda x: x is not None, res))
-    error_df_list, ac_df_list = list(zip(*res))
-    total = 0
-    for df in error_df_list:
-        total += len(df)
-    print('final train code: {}'.format(total))
-    # save records
-    save_train_data(error_df_list, ac_df_list, TRAIN_DATA_DBPATH, ACTUAL_C_ERROR_RECORDS, transform_data_list)
+    # the groups are read, mined and saved by streaming, a stopped run continues from the checkpoint
+    group_count, total = run_closest_group_stream(find_closest_group, transform_data_list, TRAIN_DATA_DBPATH,
+                                                  ACTUAL_C_ERROR_RECORDS, scrapyOJ_DB_PATH, 'GNU C',
+                                                  group_filter=check_group_has_both, core_num=8)
+    print('final train code: {} in {} groups'.format(total, group_count))
 
 
 def transform_data_list(one):
@@ -170,7 +158,8 @@ def find_closest_cpp_testcase_group(one_group: pd.DataFrame):
     error_df = one_group[one_group['status'].map(filter_reject_records)]
     print('[{}] after filter ac_df: {}, error_df: {}. count: {}, process: {}, {}, puid: {}'.format(now_time, len(ac_df), len(error_df), count, current.pid, current.name, puid))
 
-    error_df = error_df.apply(find_closest_token_text, axis=1, raw=True, ac_df=ac_df, max_distance=101)
+    index = ClosestCandidateIndex(ac_df['tokenize'], get_token_value)
+    error_df = error_df.apply(find_closest_token_text, axis=1, raw=True, ac_df=ac_df, max_distance=101, index=index)
     print('[{}] after find_closest token text error_df: {}. count: {}, process: {}, {}, puid: {}'.format(now_time, len(error_df), count, current.pid, current.name, puid))
     # error_df = error_df[error_df['res'].map(lambda x: x is not None)]
     if 'tokenize' in error_df.columns.values.tolist():
@@ -222,58 +211,22 @@ def find_cpp_testcase_error_closest_code_main():
     import sqlite3
     try:
         res = run_sql_select_statment(TRAIN_DATA_DBPATH, CPP_TESTCASE_ERROR_RECORDS, 'find_distinct_problem_user_id')
-        problem_user_ids = [r[0] for r in res]
+        problem_user_ids = set(r[0] for r in res)
     except sqlite3.OperationalError as e:
-        problem_user_ids = []
-    data_df = read_all_cpp_records()
-    # from common.read_data.read_data import read_special_cpp_records
-    # data_df = read_special_cpp_records("288E", "10544191")
-    print('finish read code: {}'.format(len(data_df.index)))
-    data_df = data_df[data_df['status'].map(lambda x: x in [1, 3, 4, 5, 6])]
-    # data_df = data_df.sample(100000)
-    print('finish filter status: {}'.format(len(data_df.index)))
-    data_df = init_c_code(data_df)
-    print('finish init code: {}'.format(len(data_df.index)))
-    data_df = filter_repeat_ids(data_df, problem_user_ids)
-    print('after filter repeat records: {}'.format(len(data_df.index)))
-    # data_df = data_df.sample(10000)
-
-    group_list = group_df_to_grouped_list(data_df, 'problem_user_id')
-    print('group list length: {}'.format(len(group_list)))
-    group_list = list(filter(check_both_have_ac_and_testcase_error, group_list))
-    print('after filter both group list length: {}'.format(len(group_list)))
-    sys.stdout.flush()
-
-    total = 0
-    chunk_count = 0
-    for chunk_group in chunks(group_list, 5000):
-        total += parallel_and_save_group(chunk_group, chunk_count)
-        chunk_count += 1
-    print('final train code: {}'.format(total))
-
-
-def parallel_and_save_group(chunk_group, chunk_count):
-    print('chunk {} start groups: {}'.format(chunk_count, len(chunk_group)))
-    res = list(parallel_map(10, find_closest_cpp_testcase_group, chunk_group))
-    # res = [find_closest_cpp_testcase_group(group) for group in chunk_group]
-    res = list(filter(lambda x: x is not None, res))
-    if len(res) <= 0:
-        return 0
-    if len(res) == 1:
-        error_df_list = [res[0][0]]
-        ac_df_list = [res[0][1]]
-    else:
-        error_df_list, ac_df_list = list(zip(*res))
-    total = 0
-    for df in error_df_list:
-        total += len(df)
-    print('chunk {} end train code: {}'.format(chunk_count, total))
-    # save records
-    save_train_data(error_df_list, ac_df_list, TRAIN_DATA_DBPATH, CPP_TESTCASE_ERROR_RECORDS,
-                    transform_cpp_testcase_error_data_list)
-    sys.stdout.flush()
-    sys.stderr.flush()
-    return total
+        problem_user_ids = set()
+
+    def group_filter(one_group):
+        # the groups saved before the checkpoint was added
+        if one_group['problem_user_id'].iloc[0] in problem_user_ids:
+            return False
+        return check_both_have_ac_and_testcase_error(one_group)
+
+    status_list = ['OK', 'WRONG_ANSWER', 'RUNTIME_ERROR', 'TIME_LIMIT_EXCEEDED', 'MEMORY_LIMIT_EXCEEDED']
+    group_count, total = run_closest_group_stream(find_closest_cpp_testcase_group,
+                                                  transform_cpp_testcase_error_data_list, TRAIN_DATA_DBPATH,
+                                                  CPP_TESTCASE_ERROR_RECORDS, scrapyOJ_DB_PATH, 'GNU C++',
+                                                  status_list=status_list, group_filter=group_filter, core_num=10)
+    print('final train code: {} in {} groups'.format(total, group_count))
 
 
 def calculate_distance_between_two_code_main():
@@ -288,10 +241,10 @@ def calculate_distance_between_two_code_main():
         return df
 
     def tokenize_code(df):
-        tokenize_fn = tokenize_by_clex_fn()
-        df['similar_tokenize'] = df['similar_code_without_include'].map(tokenize_fn)
+        tokenize_batch = get_tokenize_service().tokenize_tokens_batch
+        df['similar_tokenize'] = tokenize_batch(list(df['similar_code_without_include']))
         df = df[df['similar_tokenize'].map(lambda x: x is not None)]
-        df['sample_tokenize'] = df['sample_code'].map(tokenize_fn)
+        df['sample_tokenize'] = tokenize_batch(list(df['sample_code']))
         df = df[df['sample_tokenize'].map(lambda x: x is not None)]
         return df
 
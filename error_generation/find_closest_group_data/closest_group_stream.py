@@ -0,0 +1,183 @@
+"""
+A streaming version of the closest group mining. The old main functions read all the submits into one DataFrame,
+pickled a DataFrame of every group to the workers and kept all the results until the end. Here:
+    1. the submits are read from the scrapyOJ db by a cursor in (problem_name, user_id) order and the rows of one
+       problem_user_id are yielded as a compact group tuple.
+    2. at most max_pending groups are sent to the worker processes, the results come back in the group order.
+    3. the result items are inserted in batched transactions. The key of the last saved group is written to the
+       stream_checkpoint_records table in the same transaction, so a restarted run skips the saved groups.
+So the memory is bounded by the size of a few groups instead of the corpus.
+"""
+
+import json
+import sqlite3
+import sys
+import time
+
+import pandas as pd
+
+from common.constants import verdict, STREAM_CHECKPOINT_RECORDS
+from common.util import init_code, check_ascii_character, bounded_parallel_imap
+from database.database_util import create_table, insert_items, transaction, run_sql_statment, \
+    run_sql_select_statment
+
+# the columns of a submit record in a group tuple
+SUBMIT_COLUMNS = ['id', 'submit_url', 'problem_id', 'user_id', 'problem_name', 'status', 'code']
+
+SELECT_SUBMIT_SQL = r'''SELECT id, submit_url, problem_id, user_id, problem_name, status, code FROM submit
+WHERE language=? {} ORDER BY problem_name, user_id, id'''
+AFTER_KEY_CONDITION = r'''AND (problem_name > ? OR (problem_name = ? AND user_id > ?))'''
+
+
+def load_checkpoint(db_path, name):
+    """
+    :return: (last key, group count, item count) of the checkpoint name. (None, 0, 0) if the run is not started.
+    """
+    create_table(db_path, STREAM_CHECKPOINT_RECORDS)
+    res = run_sql_select_statment(db_path, STREAM_CHECKPOINT_RECORDS, 'find_by_name', params=(name, ))
+    if len(res) == 0:
+        return None, 0, 0
+    last_key, group_count, item_count = res[0]
+    return tuple(json.loads(last_key)), group_count, item_count
+
+
+def save_checkpoint(db_path, name, last_key, group_count, item_count):
+    run_sql_statment(db_path, STREAM_CHECKPOINT_RECORDS, 'replace',
+                     [(name, json.dumps(list(last_key)), group_count, item_count)])
+
+
+def init_submit_record(record):
+    """
+    do the same as read_data_from_db.merge_and_deal_submit_table and init_c_code to one record.
+    :return: the record tuple of SUBMIT_COLUMNS or None if the code is filtered
+    """
+    record = list(record)
+    code = init_code(record[-1][1:-1])
+    if code == '' or not check_ascii_character(code):
+        return None
+    record[-2] = verdict.get(record[-2], record[-2])
+    record[-1] = code
+    return tuple(record)
+
+
+def iter_submit_groups(db_path, language, status_list=None, after_key=None, fetch_size=1000):
+    """
+    read the submits of the language group by group.
+    :param status_list: the verdict names of the submits to read. all if it is None
+    :param after_key: (problem_name, user_id) of the last group read before. the groups before it are skipped
+    :return: a generator of (problem_name, user_id, list of record tuples of SUBMIT_COLUMNS)
+    """
+    conditions = ''
+    params = [language]
+    if status_list is not None:
+        conditions += 'AND status IN ({}) '.format(','.join('?' * len(status_list)))
+        params += list(status_list)
+    if after_key is not None:
+        conditions += AFTER_KEY_CONDITION
+        params += [after_key[0], after_key[0], after_key[1]]
+    con = sqlite3.connect("file:{}?mode=ro".format(db_path), uri=True)
+    try:
+        cur = con.execute(SELECT_SUBMIT_SQL.format(conditions), params)
+        key = None
+        records = []
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                row_key = (row[4], row[3])
+                if row_key != key:
+                    if key is not None:
+                        yield key[0], key[1], records
+                    key = row_key
+                    records = []
+                record = init_submit_record(row)
+                if record is not None:
+                    records.append(record)
+        if key is not None:
+            yield key[0], key[1], records
+    finally:
+        con.close()
+
+
+def group_to_df(problem_name, user_id, records):
+    df = pd.DataFrame(records, columns=SUBMIT_COLUMNS)
+    df['problem_user_id'] = problem_name + '_' + user_id
+    return df
+
+
+def mine_closest_group(task):
+    """
+    run in the worker process. Only the group tuple is pickled and the DataFrame is created here.
+    :param task: (group_fn, transform_fn, problem_name, user_id, records). group_fn is a function such as
+    find_closest_group which returns (error_df, ac_df) or None, transform_fn transforms an error row to an item of the
+    result table.
+    :return: (problem_name, user_id, the list of items)
+    """
+    group_fn, transform_fn, problem_name, user_id, records = task
+    res = group_fn(group_to_df(problem_name, user_id, records))
+    items = []
+    if res is not None:
+        error_df = res[0]
+        items = [transform_fn(row) for index, row in error_df.iterrows()]
+    return problem_name, user_id, items
+
+
+def run_closest_group_stream(group_fn, transform_fn, db_path, table_name, source_db_path, language,
+                             status_list=None, group_filter=None, core_num=8, max_pending=None,
+                             commit_group_count=200, checkpoint_name=None):
+    """
+    :param group_fn: the function mines a group DataFrame, such as find_closest_group
+    :param transform_fn: the function transforms an error row to an item of table_name
+    :param source_db_path: the scrapyOJ db path
+    :param group_filter: a function of a group DataFrame. The group is skipped if it returns False
+    :param commit_group_count: the results of these groups are saved in one transaction with the checkpoint
+    :param checkpoint_name: the name of the checkpoint record, it is table_name if it is None
+    :return: (the total group count, the total item count) saved by this and the previous runs
+    """
+    checkpoint_name = table_name if checkpoint_name is None else checkpoint_name
+    create_table(db_path, table_name)
+    last_key, group_count, item_count = load_checkpoint(db_path, checkpoint_name)
+    if last_key is not None:
+        print('resume from {} after {} groups, {} items'.format(last_key, group_count, item_count))
+
+    after_key = last_key
+
+    def tasks():
+        for problem_name, user_id, records in iter_submit_groups(source_db_path, language, status_list,
+                                                                 after_key=after_key):
+            if len(records) == 0:
+                continue
+            if group_filter is not None and not group_filter(group_to_df(problem_name, user_id, records)):
+                continue
+            yield group_fn, transform_fn, problem_name, user_id, records
+
+    begin = time.time()
+    run_group_count = 0
+    batch_items = []
+    batch_group_count = 0
+    for problem_name, user_id, items in bounded_parallel_imap(core_num, mine_closest_group, tasks(), max_pending):
+        batch_items += items
+        batch_group_count += 1
+        run_group_count += 1
+        last_key = (problem_name, user_id)
+        if batch_group_count >= commit_group_count:
+            group_count, item_count = _save_batch(db_path, table_name, checkpoint_name, batch_items, last_key,
+                                                  group_count + batch_group_count, item_count)
+            batch_items = []
+            batch_group_count = 0
+            print('{} groups, {} items, {:.1f} groups/s'.format(group_count, item_count,
+                                                                 run_group_count / (time.time() - begin)))
+            sys.stdout.flush()
+    if batch_group_count > 0:
+        group_count, item_count = _save_batch(db_path, table_name, checkpoint_name, batch_items, last_key,
+                                              group_count + batch_group_count, item_count)
+    return group_count, item_count
+
+
+def _save_batch(db_path, table_name, checkpoint_name, items, last_key, group_count, item_count):
+    item_count += len(items)
+    with transaction(db_path):
+        insert_items(db_path, table_name, items)
+        save_checkpoint(db_path, checkpoint_name, last_key, group_count, item_count)
+    return group_count, item_count
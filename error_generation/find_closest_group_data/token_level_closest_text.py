@@ -2,9 +2,10 @@ from common.analyse_include_util import check_include_between_two_code
 from common.constants import CACHE_DATA_PATH
 from common.action_constants import ActionType
 from common.util import init_code, check_ascii_character, disk_cache
-from error_generation.find_closest_group_data.levenshtenin_token_level import levenshtenin_distance
+from error_generation.find_closest_group_data.banded_levenshtein import TokenInterner, banded_levenshtein_distance, \
+    banded_levenshtein_matrix, token_level_distance_and_matrix
 from error_generation.find_closest_group_data.produce_actions import cal_action_list
-from database.database_util import create_table, insert_items
+from database.database_util import create_table, insert_items, transaction
 
 
 def generate_equal_fn(token_value_fn=lambda x:x):
@@ -25,12 +26,17 @@ a_tokenize_error_count = 0
 ac_df_length_error = 0
 distance_series_error = 0
 
-def find_closest_token_text(one, ac_df, max_distance=None):
+def find_closest_token_text(one, ac_df, max_distance=None, index=None):
+    """
+    :param index: a ClosestCandidateIndex of ac_df['tokenize']. The distance is computed to the candidates that
+    can still be the closest only.
+    """
     global a_tokenize_error_count, ac_df_length_error, distance_series_error
     equal_fn = generate_equal_fn(get_token_value)
     a_tokenize = one['tokenize']
     a_code = one['code']
-    ac_df = ac_df[ac_df['code'].map(lambda x: check_include_between_two_code(a_code, x))]
+    include_mask = ac_df['code'].map(lambda x: check_include_between_two_code(a_code, x))
+    ac_df = ac_df[include_mask]
 
     if a_tokenize is None or len(ac_df) == 0:
         one['similar_code'] = ''
@@ -43,12 +49,24 @@ def find_closest_token_text(one, ac_df, max_distance=None):
         elif len(ac_df) == 0:
             ac_df_length_error += 1
         return one
-    cal_distance_fn = lambda x: levenshtenin_distance(a_tokenize, x, equal_fn=equal_fn, max_distance=max_distance)[0]
-    distance_series = ac_df['tokenize'].map(cal_distance_fn)
-    distance_series = distance_series[distance_series >= 0]
-    if max_distance is not None and max_distance >= 1:
-        distance_series = distance_series[distance_series < max_distance]
-    if len(distance_series.index) <= 0:
+    if index is not None:
+        interner = index.interner
+        position, min_value = index.closest(a_tokenize, max_distance=max_distance, candidate_mask=include_mask.values)
+        # the same filter as the distance series below
+        found = max_distance is None or max_distance < 1 or min_value < max_distance
+        min_id = include_mask.index[position]
+    else:
+        interner = TokenInterner(get_token_value)
+        a_ids = interner.intern(a_tokenize)
+        cal_distance_fn = lambda x: banded_levenshtein_distance(a_ids, interner.intern(x), max_distance=max_distance)
+        distance_series = ac_df['tokenize'].map(cal_distance_fn)
+        if max_distance is not None and max_distance >= 1:
+            distance_series = distance_series[distance_series < max_distance]
+        found = len(distance_series.index) > 0
+        if found:
+            min_id = distance_series.idxmin()
+            min_value = distance_series.loc[min_id]
+    if not found:
         one['similar_code'] = ''
         one['action_list'] = []
         one['distance'] = -1
@@ -56,18 +74,12 @@ def find_closest_token_text(one, ac_df, max_distance=None):
         # print('distance series len is {}'.format(len(distance_series)))
         distance_series_error += 1
         return one
-    min_id = distance_series.idxmin()
-    min_value = distance_series.loc[min_id]
 
     b_tokenize = ac_df['tokenize'].loc[min_id]
     try:
-        dis, matrix = levenshtenin_distance(a_tokenize, b_tokenize, equal_fn=equal_fn)
-        if dis == -1:
-            one['similar_code'] = ''
-            one['action_list'] = []
-            one['distance'] = -1
-            one['similar_id'] = ''
-            return one
+        # the band of the min distance is enough for the traceback
+        dis, matrix = token_level_distance_and_matrix(a_tokenize, b_tokenize, max_distance=int(min_value),
+                                                      interner=interner)
         action_list = cal_action_list(matrix, a_tokenize, b_tokenize, left_move_action, top_move_action, left_top_move_action, equal_fn, get_token_value)
     except Exception as e:
         print(e)
@@ -89,11 +101,16 @@ def calculate_distance_and_action_between_two_code(error_tokenize, ac_tokenize,
     if get_value is not None:
         get_token_value_fn = get_value
     equal_fn = generate_equal_fn(get_token_value_fn)
-    distance, matrix = levenshtenin_distance(error_tokenize, ac_tokenize, equal_fn=equal_fn, max_distance=max_distance)
-    if max_distance is not None and (distance < 0 or distance >= max_distance):
+    interner = TokenInterner(get_token_value_fn)
+    error_ids = interner.intern(error_tokenize)
+    ac_ids = interner.intern(ac_tokenize)
+    distance = banded_levenshtein_distance(error_ids, ac_ids, max_distance=max_distance)
+    if max_distance is not None and distance >= max_distance:
         distance = -1
         action_list = []
         return distance, action_list
+    # the band of the distance is enough for the traceback
+    distance, matrix = banded_levenshtein_matrix(error_ids, ac_ids, max_distance=distance)
     action_list = cal_action_list(matrix, error_tokenize, ac_tokenize, left_move_action, top_move_action,
                                   left_top_move_action, equal_fn, get_token_value_fn)
     return distance, action_list
@@ -160,13 +177,10 @@ def filter_repeat_ids(data_df, problem_user_ids):
 def save_train_data(error_df_list, ac_df_list, db_path, table_name, transform_fn):
     create_table(db_path, table_name)
 
-    def trans(error_df):
-        res = [transform_fn(row) for index, row in error_df.iterrows()]
-        return res
-
-    error_items_list = [trans(error_df) for error_df in error_df_list]
-    for error_items in error_items_list:
-        insert_items(db_path, table_name, error_items)
+    # the items are transformed lazily and inserted in one transaction
+    with transaction(db_path):
+        for error_df in error_df_list:
+            insert_items(db_path, table_name, (transform_fn(row) for index, row in error_df.iterrows()))
     # ac_items_list = [list(ac_df.apply(transform_data_list, raw=True, axis=1)) for ac_df in ac_df_list]
     # for ac_items in ac_items_list:
     #     insert_items(TRAIN_DATA_DBPATH, ACTUAL_C_ERROR_RECORDS, ac_items)
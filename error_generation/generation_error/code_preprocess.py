@@ -1,3 +1,4 @@
+import copy
 import json
 import logging
 import multiprocessing as mp
@@ -11,7 +12,7 @@ from common.token_operation_util import generate_token_action
 from common.pycparser_util import tokenize_by_clex_fn
 from error_generation.generation_error.action_mapitem import ACTION_MAPITEM, ERROR_CHARACTER_MAPITEM
 from common.constants import COMPILE_TMP_PATH, RANDOM_C_ERROR_RECORDS, FAKE_C_COMPILE_ERROR_DATA_DBPATH, \
-    COMMON_C_ERROR_RECORDS, COMMON_DEEPFIX_ERROR_RECORDS
+    COMMON_C_ERROR_RECORDS, COMMON_DEEPFIX_ERROR_RECORDS, ROOT_PATH
 from config import FAKE_DEEPFIX_ERROR_DATA_DBPATH
 from error_generation.generation_error.error_action_reducer import create_error_action_fn
 from read_data.read_experiment_data import read_deepfix_ac_data
@@ -27,13 +28,27 @@ preprocess_logger = logging.getLogger('code_preprocess')
 
 preprocess_logger.setLevel(logging.DEBUG)
 preprocess_logger.__setattr__('propagate', False)
-# 创建一个输出日志到控制台的StreamHandler
-# hdr = logging.StreamHandler()
-hdr = logging.FileHandler("log/generate_deepfix_common_error.log")
-formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
-hdr.setFormatter(formatter)
-# 给logger添加上handler
-preprocess_logger.addHandler(hdr)
+
+PREPROCESS_LOG_PATH = os.path.join(ROOT_PATH, 'log', 'generate_deepfix_common_error.log')
+
+
+def init_preprocess_logger(log_path=PREPROCESS_LOG_PATH):
+    """
+    add the file handler of log_path to preprocess_logger once. It is called by the entry points, so importing this
+    module writes nothing.
+    """
+    if preprocess_logger.handlers:
+        return preprocess_logger
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    # 创建一个输出日志到控制台的StreamHandler
+    # hdr = logging.StreamHandler()
+    hdr = logging.FileHandler(log_path)
+    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
+    hdr.setFormatter(formatter)
+    # 给logger添加上handler
+    preprocess_logger.addHandler(hdr)
+    return preprocess_logger
+
 
 compile_max_count = 1
 error_max_count = 1
@@ -44,6 +59,7 @@ db_name = FAKE_DEEPFIX_ERROR_DATA_DBPATH
 
 def preprocess():
     # initLogging()
+    init_preprocess_logger()
     preprocess_logger.info("Start Read Code Data")
     code_df = read_deepfix_ac_data()
     preprocess_logger.info("Code Data Read Finish. Total: {}".format(code_df.shape[0]))
@@ -294,23 +310,30 @@ def fill_blank_to_error_code(error_character_maplist, ac_i, err_i):
     return error_character_maplist
 
 
-def create_error_code(code, error_type_list=(5, 1, 4), error_count_range=(1, 5), tokenize_fn = None):
+def create_error_code(code, error_type_list=(5, 1, 4), error_count_range=(1, 5), tokenize_fn = None, code_tokens=None):
+    """
+    :param code_tokens: the tokens of the code without include lines. The code is tokenized again if it is None
+    """
     code_without_include = replace_include_with_blank(code)
     include_lines = extract_include(code)
     include_line_nos = analyse_include_line_no(code, include_lines)
 
-    try:
-        if tokenize_fn is None:
-            tokenize_fn = tokenize_by_clex_fn()
-        code_tokens = tokenize_fn(code_without_include)
-        if code_tokens is None or len(code_tokens) > 1000:
-            # preprocess_logger.info('code tokens is None: {}'.format(code_without_include))
-            preprocess_logger.info('code tokens is None')
-            return None, None, None, None, None
+    if code_tokens is not None:
+        # generate_token_action shifts the lexpos of the tokens in place
+        code_tokens = [copy.copy(tok) for tok in code_tokens]
+    else:
+        try:
+            if tokenize_fn is None:
+                tokenize_fn = tokenize_by_clex_fn()
+            code_tokens = tokenize_fn(code_without_include)
+            if code_tokens is None or len(code_tokens) > 1000:
+                # preprocess_logger.info('code tokens is None: {}'.format(code_without_include))
+                preprocess_logger.info('code tokens is None')
+                return None, None, None, None, None
 
-    except Exception as e:
-        preprocess_logger.info('tokenize code error.')
-        return None, None, None, None, None
+        except Exception as e:
+            preprocess_logger.info('tokenize code error.')
+            return None, None, None, None, None
 
     error_count = random.randint(*error_count_range)
     action_maplist = create_multi_error(code_without_include, code_tokens, error_type_list, error_count)
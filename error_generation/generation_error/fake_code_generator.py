@@ -0,0 +1,266 @@
+"""
+A batched version of the code_preprocess fake code generation. preprocess fed the programs one by one to the
+make_fake_code processes through unbounded mp.Queue, tokenized the program again for every mutant, compiled every
+mutant by gcc and save_fake_code polled the queue and logged every item. Here:
+    1. a program is compiled and tokenized once, then up to max_try_count mutants are created from the same tokens
+       until mutants_per_program of them fail to compile.
+    2. precheck_mutant rejects the mutants which are the same tokens as the original or a mutant tried before without
+       compiling them, and accepts the ones with unbalanced brackets, which never compile, without gcc either.
+    3. the programs are sent to the workers in chunks by bounded_parallel_imap, so at most max_pending chunks are in
+       flight and the reader blocks when the writer falls behind.
+    4. the results are inserted commit_count items a transaction.
+"""
+
+import random
+import sys
+import time
+
+from common.compile_server import get_local_compiler
+from common.pycparser_util import tokenize_by_clex_fn
+from common.util import init_code, bounded_parallel_imap
+from common.analyse_include_util import replace_include_with_blank
+from database.database_util import create_table, insert_items, run_sql_select_statment, transaction
+from error_generation.generation_error.code_preprocess import create_error_code, dict_to_list, create_deepfix_item, \
+    init_preprocess_logger
+
+PRECHECK_COMPILE = 'compile'
+PRECHECK_ERROR = 'error'
+PRECHECK_UNKNOWN = 'unknown'
+
+BRACKET_PAIRS = {')': '(', ']': '[', '}': '{'}
+OPEN_BRACKETS = set(BRACKET_PAIRS.values())
+
+
+def bracket_balanced(token_values):
+    stack = []
+    for v in token_values:
+        if v in OPEN_BRACKETS:
+            stack.append(v)
+        elif v in BRACKET_PAIRS:
+            if len(stack) == 0 or stack.pop() != BRACKET_PAIRS[v]:
+                return False
+    return len(stack) == 0
+
+
+def precheck_mutant(ac_token_values, error_token_values, tried_set=None):
+    """
+    a syntactic check of a mutant before gcc. The tokens are the ones of the code without the include lines, which
+    has no other preprocessor lines because tokenize_by_clex refuses the code with '#'.
+    :param tried_set: the token value tuples of the mutants tried before
+    :return: PRECHECK_COMPILE if the mutant is known to compile or has been tried, PRECHECK_ERROR if it can't
+    compile, else PRECHECK_UNKNOWN
+    """
+    error_token_values = tuple(error_token_values)
+    if error_token_values == tuple(ac_token_values):
+        return PRECHECK_COMPILE
+    if tried_set is not None:
+        if error_token_values in tried_set:
+            return PRECHECK_COMPILE
+        tried_set.add(error_token_values)
+    if not bracket_balanced(error_token_values):
+        return PRECHECK_ERROR
+    return PRECHECK_UNKNOWN
+
+
+class GenerateStatistics(object):
+    def __init__(self):
+        self.program_count = 0
+        self.failed_program_count = 0
+        self.mutant_count = 0
+        self.accepted_count = 0
+        self.gcc_count = 0
+        self.precheck_compile_count = 0
+        self.precheck_error_count = 0
+        self.begin = time.time()
+
+    def merge(self, other):
+        for k in ['program_count', 'failed_program_count', 'mutant_count', 'accepted_count', 'gcc_count',
+                  'precheck_compile_count', 'precheck_error_count']:
+            setattr(self, k, getattr(self, k) + getattr(other, k))
+        return self
+
+    def mutants_per_second(self):
+        return self.accepted_count / max(time.time() - self.begin, 1e-6)
+
+    def gcc_per_accepted(self):
+        return self.gcc_count / max(self.accepted_count, 1)
+
+    def __str__(self):
+        return 'programs: {}, failed programs: {}, mutants: {}, accepted: {}, precheck compile: {}, ' \
+               'precheck error: {}, gcc calls: {}, gcc calls per accepted mutant: {:.2f}, mutants/s: {:.2f}'.format(
+                self.program_count, self.failed_program_count, self.mutant_count, self.accepted_count,
+                self.precheck_compile_count, self.precheck_error_count, self.gcc_count, self.gcc_per_accepted(),
+                self.mutants_per_second())
+
+
+def _compile(code, statistics):
+    statistics.gcc_count += 1
+    return get_local_compiler().compile(code, mode='c')[0]
+
+
+_tokenize_fn = None
+
+
+def _get_tokenize_fn():
+    global _tokenize_fn
+    if _tokenize_fn is None:
+        _tokenize_fn = tokenize_by_clex_fn()
+    return _tokenize_fn
+
+
+def generate_program_mutants(item, mutants_per_program=1, max_try_count=4, error_count_range=(1, 9),
+                             statistics=None, tokenize_fn=None):
+    """
+    create the compile error mutants of one program
+    :param item: a dict created by create_deepfix_item
+    :param max_try_count: the max number of mutants created for the program
+    :return: the list of result items as make_fake_code. The id of the k-th mutant is suffixed by '_k' if k > 0
+    """
+    statistics = GenerateStatistics() if statistics is None else statistics
+    tokenize_fn = _get_tokenize_fn() if tokenize_fn is None else tokenize_fn
+    statistics.program_count += 1
+    code = item['originalcode']
+    if not _compile(code, statistics):
+        statistics.failed_program_count += 1
+        return []
+    ac_code = init_code(code)
+    if ac_code != code and not _compile(ac_code, statistics):
+        statistics.failed_program_count += 1
+        return []
+    try:
+        code_tokens = tokenize_fn(replace_include_with_blank(ac_code))
+    except Exception as e:
+        code_tokens = None
+    if code_tokens is None or len(code_tokens) > 1000:
+        statistics.failed_program_count += 1
+        return []
+    ac_token_values = [tok.value for tok in code_tokens]
+
+    res = []
+    tried_set = set()
+    for _ in range(max_try_count):
+        if len(res) >= mutants_per_program:
+            break
+        try:
+            _, error_code, action_maplist, _, error_count = create_error_code(
+                ac_code, error_count_range=error_count_range, code_tokens=code_tokens)
+        except Exception as e:
+            error_code = None
+        if error_code is None:
+            continue
+        statistics.mutant_count += 1
+        try:
+            error_tokens = tokenize_fn(replace_include_with_blank(error_code))
+        except Exception as e:
+            error_tokens = None
+        if error_tokens is None:
+            check = PRECHECK_UNKNOWN
+        else:
+            check = precheck_mutant(ac_token_values, [tok.value for tok in error_tokens], tried_set)
+        if check == PRECHECK_COMPILE:
+            statistics.precheck_compile_count += 1
+            continue
+        elif check == PRECHECK_ERROR:
+            statistics.precheck_error_count += 1
+        elif _compile(error_code, statistics):
+            continue
+        one = dict(item)
+        if len(res) > 0:
+            one['id'] = '{}_{}'.format(item['id'], len(res))
+        one['ac_code'] = ac_code
+        one['code'] = error_code
+        one['error_count'] = error_count
+        one['error_character_maplist'] = []
+        one['action_maplist'] = [act.__dict__() for act in action_maplist]
+        res.append(one)
+    statistics.accepted_count += len(res)
+    if len(res) == 0:
+        statistics.failed_program_count += 1
+    return res
+
+
+def generate_chunk_mutants(task):
+    """
+    run in the worker process.
+    :param task: (item list, seed, the kwargs of generate_program_mutants). The random state is seeded by the seed
+    and the id of every item if the seed is not None, so the result doesn't depend on the worker number.
+    :return: (result item list, GenerateStatistics)
+    """
+    items, seed, kwargs = task
+    statistics = GenerateStatistics()
+    res = []
+    for item in items:
+        if seed is not None:
+            random.seed('{}_{}'.format(seed, item['id']))
+        res += generate_program_mutants(item, statistics=statistics, **kwargs)
+    return res, statistics
+
+
+def _chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def run_fake_code_generator(items, db_path, table_name, core_num=6, chunk_size=20, max_pending=None,
+                            commit_count=2000, seed=None, log_count=10000, **kwargs):
+    """
+    :param items: an iterable of the dicts created by create_deepfix_item. The problem_user_ids already in the table
+    are skipped
+    :param chunk_size: the number of programs sent to a worker at a time
+    :param max_pending: the max number of chunks in flight, 4 * core_num if it is None
+    :param commit_count: the number of result items inserted in one transaction
+    :param kwargs: the kwargs of generate_program_mutants
+    :return: GenerateStatistics
+    """
+    create_table(db_full_path=db_path, table_name=table_name)
+    exist_ids = set(row[0] for row in run_sql_select_statment(db_full_path=db_path, table_name=table_name,
+                                                                 sql_name='find_distinct_problem_user_id'))
+
+    def tasks():
+        for chunk in _chunks((it for it in items if it['problem_user_id'] not in exist_ids), chunk_size):
+            yield chunk, seed, kwargs
+
+    statistics = GenerateStatistics()
+    param = []
+    last_log = 0
+    for res, chunk_statistics in bounded_parallel_imap(core_num, generate_chunk_mutants, tasks(), max_pending):
+        statistics.merge(chunk_statistics)
+        param += res
+        if len(param) >= commit_count:
+            _save_items(db_path, table_name, param)
+            param = []
+        if statistics.program_count - last_log >= log_count:
+            last_log = statistics.program_count
+            print(statistics)
+            sys.stdout.flush()
+    if len(param) > 0:
+        _save_items(db_path, table_name, param)
+    print(statistics)
+    return statistics
+
+
+def _save_items(db_path, table_name, param):
+    with transaction(db_path):
+        insert_items(db_full_path=db_path, table_name=table_name, params=dict_to_list(param))
+
+
+def generate_deepfix_fake_code(core_num=6, mutants_per_program=1, max_try_count=4):
+    from common.constants import COMMON_DEEPFIX_ERROR_RECORDS
+    from config import FAKE_DEEPFIX_ERROR_DATA_DBPATH
+    from read_data.read_experiment_data import read_deepfix_ac_data
+    init_preprocess_logger()
+    code_df = read_deepfix_ac_data()
+    items = (create_deepfix_item(row) for index, row in code_df.iterrows())
+    return run_fake_code_generator(items, FAKE_DEEPFIX_ERROR_DATA_DBPATH, COMMON_DEEPFIX_ERROR_RECORDS,
+                                   core_num=core_num, mutants_per_program=mutants_per_program,
+                                   max_try_count=max_try_count)
+
+
+if __name__ == '__main__':
+    generate_deepfix_fake_code()
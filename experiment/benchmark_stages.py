@@ -0,0 +1,229 @@
+"""
+The stages of the training and the evaluation pipeline on a synthetic C program corpus, for common.benchmark_util.
+Every stage uses the output of the stage before it:
+tokenize -> parse_iterative_sample -> dataset_getitem -> parse_input_batch -> model_forward, and the batches of
+dataset_getitem are also compiled (compile) and saved (insert_items) as multi_step_evaluate does.
+"""
+
+import json
+import os
+import random
+import tempfile
+
+import pandas as pd
+import toolz
+
+from common.benchmark_util import run_stage
+from common.constants import pre_defined_c_tokens, DATA_RECORDS_DEEPFIX
+from experiment.parse_xy_util import CHANGE, INSERT, DELETE
+from vocabulary.word_vocabulary import Vocabulary
+
+STAGES = ['tokenize', 'parse_iterative_sample', 'dataset_getitem', 'parse_input_batch', 'model_forward', 'compile',
+          'insert_items']
+
+_insert_or_change_tokens = [';', ')', '(', '{', '}', ',', '=']
+
+
+def _random_expression(r, names, depth=0):
+    if depth > 1 or r.random() < 0.4:
+        return [r.choice(names)] if r.random() < 0.6 else [str(r.randint(0, 99))]
+    return _random_expression(r, names, depth + 1) + [r.choice(['+', '-', '*', '%'])] + \
+           _random_expression(r, names, depth + 1)
+
+
+def _random_statement(r, names, depth=0):
+    k = r.random()
+    if depth < 2 and k < 0.2:
+        body = sum([_random_statement(r, names, depth + 1) for _ in range(r.randint(1, 3))], [])
+        return ['for', '(', names[0], '=', '0', ';', names[0], '<', r.choice(names), ';', names[0], '++', ')',
+                '{'] + body + ['}']
+    if depth < 2 and k < 0.4:
+        body = sum([_random_statement(r, names, depth + 1) for _ in range(r.randint(1, 3))], [])
+        return ['if', '('] + _random_expression(r, names) + ['>', '0', ')', '{'] + body + ['}']
+    if k < 0.5:
+        return ['printf', '(', '"%d\\n"', ',', r.choice(names), ')', ';']
+    return [r.choice(names), '='] + _random_expression(r, names) + [';']
+
+
+def create_synthetic_program(r, length):
+    """
+    a compilable C program of about length tokens
+    :param r: a random.Random
+    :return: the token list
+    """
+    names = sorted({'v{}'.format(r.randint(0, 200)) for _ in range(4)})
+    tokens = ['int', 'main', '(', ')', '{', 'int'] + sum([[n, ','] for n in names], [])[:-1] + [';']
+    tokens += ['scanf', '(', '"%d"', ',', '&', names[0], ')', ';']
+    while len(tokens) < length:
+        tokens += _random_statement(r, names)
+    tokens += ['return', '0', ';', '}']
+    return tokens
+
+
+def create_synthetic_actions(r, tokens, action_count):
+    """
+    the ac code to error code actions in the format of the action_character_list column
+    """
+    actions = []
+    for pos in sorted(r.sample(range(len(tokens)), action_count)):
+        act_type = r.choice([CHANGE, INSERT, DELETE])
+        if act_type == INSERT:
+            actions.append({'act_type': INSERT, 'from_char': '', 'to_char': r.choice(_insert_or_change_tokens),
+                            'token_pos': pos})
+        elif act_type == DELETE:
+            actions.append({'act_type': DELETE, 'from_char': tokens[pos], 'to_char': '', 'token_pos': pos})
+        else:
+            actions.append({'act_type': CHANGE, 'from_char': tokens[pos],
+                            'to_char': r.choice(_insert_or_change_tokens), 'token_pos': pos})
+    return actions
+
+
+def create_synthetic_corpus(count, length=150, max_action_count=3, seed=100):
+    """
+    :return: (a DataFrame with the columns of the fake deepfix error dataset, the Vocabulary of the corpus)
+    """
+    r = random.Random(seed)
+    programs = [create_synthetic_program(r, length) for _ in range(count)]
+    action_lists = [create_synthetic_actions(r, p, r.randint(1, max_action_count)) for p in programs]
+    df = pd.DataFrame({
+        'id': ['synthetic_{}'.format(i) for i in range(count)],
+        'ac_code': [' '.join(p) for p in programs],
+        # the actions are json strings in the database
+        'action_character_list': [json.dumps(a) for a in action_lists],
+        'includes': [['#include <stdio.h>'] for _ in range(count)],
+        'distance': [len(a) for a in action_lists],
+    })
+
+    words = set(pre_defined_c_tokens) | set(_insert_or_change_tokens)
+    for p in programs:
+        words |= set(p)
+    words = sorted(words)
+    vocabulary = Vocabulary(set(words), {w: i for i, w in enumerate(words)}, ['<BEGIN>', '<INNER_BEGIN>'],
+                            ['<END>', '<INNER_END>'], '<UNK>', ['<PAD>'])
+    return df, vocabulary
+
+
+def create_benchmark_model(vocabulary, hidden_size=128):
+    from model.encoder_sample_model import EncoderSampleModel
+    w = vocabulary.word_to_id
+    # the same as encoder_sample_config1 in parameters_config except the size
+    return EncoderSampleModel(start_label=w(vocabulary.begin_tokens[0]), end_label=w(vocabulary.end_tokens[0]),
+                              inner_start_label=w(vocabulary.begin_tokens[1]),
+                              inner_end_label=w(vocabulary.end_tokens[1]),
+                              vocabulary_size=vocabulary.vocabulary_size, embedding_size=hidden_size,
+                              hidden_size=hidden_size, max_sample_length=10,
+                              graph_parameter={'vocab_size': vocabulary.vocabulary_size, 'max_len': 500,
+                                               'input_size': hidden_size, 'input_dropout_p': 0.2, 'dropout_p': 0.2,
+                                               'n_layers': 3, 'bidirectional': True, 'rnn_cell': 'gru',
+                                               'variable_lengths': False, 'embedding': None,
+                                               'update_embedding': True},
+                              graph_embedding='rnn', pointer_type='query', rnn_type='gru', rnn_layer_number=3,
+                              max_length=500, dropout_p=0.2, pad_label=w(vocabulary.addition_tokens[0]),
+                              vocabulary=vocabulary, mask_type='static', beam_size=1, p2_type='static',
+                              p2_step_length=5)
+
+
+def _chunks(items, size):
+    return [items[i:i+size] for i in range(0, len(items), size)]
+
+
+def run_benchmark_stages(stages=None, count=200, length=150, batch_size=8, parse_chunk_size=50, hidden_size=128,
+                         warmup=1, seed=100, db_path=None):
+    """
+    run the pipeline up to the last stage in stages and time the stages in it.
+    :param stages: a list of the names in STAGES. None means all stages.
+    :return: a list of the result dicts of common.benchmark_util.run_stage in the order of STAGES
+    """
+    import torch
+    from common import problem_util
+    from common.pycparser_util import tokenize_by_clex_fn
+    from common.util import compile_code_ids_list
+    from database.database_util import create_table, insert_items
+    from experiment.experiment_dataset import IterateErrorDataSet
+    from experiment.experiment_util import action_list_sorted_no_reverse, flatten_iterative_data
+    from experiment.parse_xy_util import parse_iterative_sample_action_error_code
+    from model.encoder_sample_model import create_parse_input_batch_data_fn, create_save_database_records
+    from vocabulary.transform_vocabulary_and_parser import TransformVocabularyAndSLK
+
+    stages = STAGES if stages is None else stages
+    for s in stages:
+        if s not in STAGES:
+            raise ValueError('unknown stage {}, the stages are {}'.format(s, STAGES))
+    last_stage = max(STAGES.index(s) for s in stages)
+    results = []
+
+    def run(name, fn, batches, item_count_fn=len):
+        if name in stages:
+            res, outputs = run_stage(name, fn, batches, item_count_fn=item_count_fn, warmup=warmup)
+            results.append(res)
+            return outputs
+        return [fn(b) for b in batches]
+
+    def need(name):
+        return STAGES.index(name) <= last_stage
+
+    # the model runs on cpu
+    problem_util.GPU_INDEX = None
+    df, vocabulary = create_synthetic_corpus(count, length=length, seed=seed)
+    tokenize_fn = tokenize_by_clex_fn()
+
+    run('tokenize', lambda code: list(tokenize_fn(code)), list(df['ac_code']), item_count_fn=lambda code: 1)
+    if not need('parse_iterative_sample'):
+        return results
+
+    parse_param = [vocabulary, action_list_sorted_no_reverse, tokenize_fn, True, False]
+    parse_outputs = run('parse_iterative_sample',
+                        lambda part: parse_iterative_sample_action_error_code(part.copy(), 'train', *parse_param),
+                        _chunks(df, parse_chunk_size))
+    keys = ['error_token_id_list', 'sample_error_id_list', 'sample_ac_id_list', 'ac_pos_list', 'error_pos_list',
+            'ac_code_ids', 'is_copy_list', 'copy_pos_list', 'sample_mask_list', 'error_token_name_list',
+            'target_ac_token_id_list', 'ac_code_name_with_labels']
+    data_dict = {k: pd.concat([o[i] for o in parse_outputs]) for i, k in enumerate(keys)}
+    parsed_df = df.loc[data_dict['error_token_id_list'].index.values]
+    for k in ['includes', 'distance', 'id']:
+        data_dict[k] = parsed_df[k]
+    if not need('dataset_getitem'):
+        return results
+
+    transformer = TransformVocabularyAndSLK(vocabulary, tokenize_fn)
+    dataset = IterateErrorDataSet(pd.DataFrame(flatten_iterative_data(data_dict)), vocabulary, 'train', transformer,
+                                  do_flatten=True)
+    items = run('dataset_getitem', lambda i: dataset[i], list(range(len(dataset))), item_count_fn=lambda i: 1)
+    # the same as common.util.data_loader without shuffle
+    batches = [toolz.merge_with(lambda x: x, b) for b in _chunks(items, batch_size) if len(b) == batch_size]
+
+    if need('parse_input_batch'):
+        parse_input_batch_data_fn = create_parse_input_batch_data_fn()
+        model_inputs = run('parse_input_batch', lambda b: parse_input_batch_data_fn(b, do_sample=False), batches,
+                           item_count_fn=lambda b: len(b['id']))
+        if need('model_forward'):
+            model = create_benchmark_model(vocabulary, hidden_size=hidden_size)
+            model.eval()
+            with torch.no_grad():
+                run('model_forward', lambda model_input: model.forward(*model_input), model_inputs,
+                    item_count_fn=lambda model_input: model_input[1].shape[0])
+
+    tmp_dir = tempfile.mkdtemp()
+    if need('compile'):
+        run('compile', lambda b: compile_code_ids_list([ids[1:-1] for ids in b['final_output']],
+                                                       [True for _ in b['id']], [False for _ in b['id']],
+                                                       vocabulary, b['includes'],
+                                                       file_path=os.path.join(tmp_dir, 'main.c'),
+                                                       target_file_path=os.path.join(tmp_dir, 'main.out'),
+                                                       log_file_path=os.path.join(tmp_dir, 'main.log')),
+            batches, item_count_fn=lambda b: len(b['id']))
+
+    if need('insert_items'):
+        db_path = os.path.join(tmp_dir, 'benchmark.db') if db_path is None else db_path
+        table_name = 'benchmark_records'
+        create_table(db_path, DATA_RECORDS_DEEPFIX, replace_table_name=table_name)
+        records_list = []
+        for i, b in enumerate(batches):
+            records = create_save_database_records(b, [1 for _ in b['id']], b['input_seq_name'],
+                                                   [False for _ in b['id']], [[] for _ in b['id']], None)
+            # the flatten items of one program have the same id
+            records_list.append([('{}_{}_{}'.format(r[0], i, j), ) + r[1:] for j, r in enumerate(records)])
+        run('insert_items', lambda records: insert_items(db_path, DATA_RECORDS_DEEPFIX, records,
+                                                         replace_table_name=table_name),
+            records_list)
+    return results
@@ -2,6 +2,8 @@ import random
 
 from c_parser.ast_parser import parse_ast_code_graph
 from c_parser.pycparser.pycparser import c_ast
+from common import args_util
+from common.columnar_store import ColumnarRows
 from common.pycparser_util import tokenize_by_clex_fn
 from common.util import CustomerDataSet, show_process_map, OrderedList
 from experiment.experiment_util import load_fake_deepfix_dataset_iterate_error_data_sample_100, \
@@ -18,6 +20,28 @@ import pandas as pd
 
 MAX_LENGTH = 500
 
+
+def precompute_code_graphs(error_token_name_lists):
+    """
+    parse the code graphs of the samples into the CodeGraphCache before the training, so the epochs only read them.
+    :param error_token_name_lists: the error_token_name_list column. A value is the name list of a code or the list of
+    the name lists of the steps.
+    """
+    code_graph_cache = args_util.get_code_graph_cache()
+    if code_graph_cache is None:
+        return
+    token_lists = []
+    for names in error_token_name_lists:
+        if names is None or len(names) == 0:
+            continue
+        if isinstance(names[0], list):
+            token_lists += [n[1:-1] for n in names]
+        else:
+            token_lists.append(names[1:-1])
+    parsed_count = code_graph_cache.precompute(token_lists)
+    print('precompute code graphs: {} token lists, {} parsed'.format(len(token_lists), parsed_count))
+
+
 class IterateErrorDataSet(CustomerDataSet):
     def __init__(self,
                  data_df: pd.DataFrame,
@@ -45,6 +69,8 @@ class IterateErrorDataSet(CustomerDataSet):
         #     self.do_sample = True
         self.do_multi_step_sample = do_multi_step_sample
         if data_df is not None:
+            if self.use_ast:
+                precompute_code_graphs(data_df['error_token_name_list'])
             if not no_filter:
                 self.data_df = self.filter_df(data_df)
             else:
@@ -52,7 +78,10 @@ class IterateErrorDataSet(CustomerDataSet):
             print("before filter p2 out, dataset size is:{}".format(len(self.data_df)))
             self.data_df = self._filter_p2_out(self.data_df)
             print("after filter p2 out, dataset size is:{}".format(len(self.data_df)))
-            self._samples = [row for i, row in self.data_df.iterrows()]
+            self._samples = self._create_samples(self.data_df)
+            if isinstance(self._samples, ColumnarRows):
+                # the samples are read from the ColumnarStore, don't keep the DataFrame in memory
+                self.data_df = None
             if self.transform:
                 self._samples = show_process_map(self.transform, self._samples)
             # for s in self._samples:
@@ -134,7 +163,7 @@ class IterateErrorDataSet(CustomerDataSet):
                 return False
             else:
                 return True
-        return df[df.apply(is_no, raw=True, axis=1)]
+        return df[df.apply(is_no, axis=1)]
 
     def _get_raw_sample(self, row):
         # error_tokens = self.vocabulary.parse_text_without_pad([[k.value for k in self.data_df.iloc[index]["tokens"]]],
@@ -232,7 +261,7 @@ class IterateErrorDataSet(CustomerDataSet):
 
     def add_samples(self, df):
         df = self.filter_df(df)
-        self._samples += [row for i, row in df.iterrows()]
+        self._samples += self._create_samples(df)
 
     def remain_samples(self, count=0, frac=1.0):
         if count != 0:
@@ -291,6 +320,8 @@ class CombineNodeIterateErrorDataSet(CustomerDataSet):
         #     self.do_sample = True
         self.do_multi_step_sample = do_multi_step_sample
         if data_df is not None:
+            if self.use_ast:
+                precompute_code_graphs(data_df['error_token_name_list'])
             if not no_filter:
                 self.data_df = self.filter_df(data_df)
             else:
@@ -303,13 +334,16 @@ class CombineNodeIterateErrorDataSet(CustomerDataSet):
             if no_id_to_program_dict:
                 self.id_to_program_dict = None
             self.only_first = do_multi_step_sample
+            rows = self._create_samples(self.data_df)
             self._samples = [FlattenRandomIterateRecords(row, is_flatten=do_flatten, only_first=do_multi_step_sample)
-                             for i, row in self.data_df.iterrows()]
+                             for row in rows]
             # c = 0
             # for i, (index, row) in self.data_df.iterrows():
             #     print(i)
             #     print(row['id'])
             self.program_to_position_dict = {row['id']: i for i, (index, row) in enumerate(self.data_df.iterrows())}
+            if isinstance(rows, ColumnarRows):
+                self.data_df = None
 
             if self.transform:
                 self._samples = show_process_map(self.transform, self._samples)
@@ -384,9 +418,9 @@ class CombineNodeIterateErrorDataSet(CustomerDataSet):
     def set_only_first(self, only_first):
         self.only_first = only_first
 
-    def _get_raw_sample(self, row):
+    def _get_raw_sample(self, row, rng=random):
         # sample = dict(row)
-        row.select_random_i(only_first=self.only_first)
+        row.select_random_i(only_first=self.only_first, rng=rng)
         sample = {}
         sample['id'] = row['id']
         sample['includes'] = row['includes']
@@ -449,7 +483,7 @@ class CombineNodeIterateErrorDataSet(CustomerDataSet):
 
     def add_samples(self, df):
         df = self.filter_df(df)
-        self._samples += [row for i, row in df.iterrows()]
+        self._samples += self._create_samples(df)
 
     def remain_samples(self, count=0, frac=1.0):
         if count != 0:
@@ -471,14 +505,17 @@ class CombineNodeIterateErrorDataSet(CustomerDataSet):
         d.remain_samples(count=count, frac=frac)
         return d
 
-    def __getitem__(self, index):
+    def get_sample(self, index, rng=random):
         if self.id_to_program_dict is not None:
             prog_id = self.id_to_program_dict[index]
             real_position = self.program_to_position_dict[prog_id]
         else:
             real_position = index
         row = self._samples[real_position]
-        return self._get_raw_sample(row)
+        return self._get_raw_sample(row, rng)
+
+    def __getitem__(self, index):
+        return self.get_sample(index)
 
     def __setitem__(self, key, value):
         if self.id_to_program_dict is not None:
@@ -491,6 +528,11 @@ class CombineNodeIterateErrorDataSet(CustomerDataSet):
     def __len__(self):
         return len(self._samples)
 
+    def sample_length(self, index):
+        if self.id_to_program_dict is not None:
+            index = self.program_to_position_dict[self.id_to_program_dict[index]]
+        return super().sample_length(index)
+
 
 class CombineDataset:
 
@@ -528,10 +570,13 @@ class CombineDataset:
         self.right_dataset = None
         return self.left_dataset
 
+    def get_sample(self, index, rng=random):
+        if rng.random() > 0.5 and self.dataset_count > 0:
+            return self.right_dataset.get_sample(index, rng)
+        return self.left_dataset.get_sample(index, rng)
+
     def __getitem__(self, index):
-        if random.random() > 0.5 and self.dataset_count > 0:
-            return self.right_dataset[index]
-        return self.left_dataset[index]
+        return self.get_sample(index)
 
     def __setitem__(self, key, value):
         raise Exception('set item to a combine dataset')
@@ -561,11 +606,11 @@ class FlattenRandomIterateRecords:
             return self.row[item][self.random_i]
         return self.row[item]
 
-    def select_random_i(self, only_first=None):
+    def select_random_i(self, only_first=None, rng=random):
         if (only_first is not None and only_first) or \
                 (only_first is None and self.only_first):
             self.random_i = 0
-        self.random_i = random.randint(0, self.iterate_num - 1)
+        self.random_i = rng.randint(0, self.iterate_num - 1)
         # self.random_i = 0
 
 
@@ -581,10 +626,13 @@ class SamplePackedDataset(CustomerDataSet):
             return self.total_len
         return self.data_len
 
-    def __getitem__(self, index):
-        rand_i = random.randint(0, self.total_len-1)
+    def get_sample(self, index, rng=random):
+        rand_i = rng.randint(0, self.total_len-1)
         return self.datasets[rand_i]
 
+    def __getitem__(self, index):
+        return self.get_sample(index)
+
     def add_dataset(self, dataset):
         new_dataset = self.datasets + dataset
         new_packed_dataset = SamplePackedDataset(new_dataset, self.data_len)
@@ -1,4 +1,5 @@
-from error_generation.find_closest_group_data.levenshtenin_token_level import levenshtenin_distance
+from error_generation.find_closest_group_data.banded_levenshtein import TokenInterner, banded_levenshtein_distance, \
+    banded_levenshtein_matrix
 from error_generation.find_closest_group_data.produce_actions import cal_action_list
 
 CHANGE = 0
@@ -42,9 +43,14 @@ def recovery_code(tokens, action_list):
 
 
 def generate_actions_from_ac_to_error_by_code(error_ids, ac_ids, max_distance=10):
-    dis, matrix = levenshtenin_distance(error_ids, ac_ids, max_distance=max_distance)
+    interner = TokenInterner()
+    error_interned = interner.intern(error_ids)
+    ac_interned = interner.intern(ac_ids)
+    dis = banded_levenshtein_distance(error_interned, ac_interned, max_distance=max_distance)
     if dis > max_distance:
         return dis, None
+    # the band of the distance is enough for the traceback
+    dis, matrix = banded_levenshtein_matrix(error_interned, ac_interned, max_distance=dis)
     action_list = cal_action_list(matrix, error_ids, ac_ids, left_move_action, top_move_action,
                                   left_top_move_action)
     return dis, action_list
@@ -1,3 +1,4 @@
+import itertools
 import json
 import random
 
@@ -387,7 +388,7 @@ def parse_iterative_sample_action_error_code(df, data_type, keyword_vocab, sort_
     print('after extract_action_part_start_pos_fn : {}'.format(len(df)))
 
     # create input code and sample code according to action part and ac pos and error pos
-    df = df.apply(create_sample_error_position_with_iterate, raw=True, axis=1, sequence_output=sequence_output)
+    df = df.apply(create_sample_error_position_with_iterate, axis=1, sequence_output=sequence_output)
     print('after create_sample_error_position_with_iterate : {}'.format(len(df)))
 
     if sequence_output:
@@ -398,7 +399,7 @@ def parse_iterative_sample_action_error_code(df, data_type, keyword_vocab, sort_
             one['error_pos_list'] = error_pos_list
             return one
 
-        df = df.apply(set_pos_to_begin_and_end, raw=True, axis=1)
+        df = df.apply(set_pos_to_begin_and_end, axis=1)
 
     # do check multi token action
     check_multi_token_action = True
@@ -410,22 +411,20 @@ def parse_iterative_sample_action_error_code(df, data_type, keyword_vocab, sort_
         print('after check_multi_token_action: {}'.format(len(df)))
 
     # convert input code to id
-    df = df.apply(create_token_id_input, raw=True, axis=1, keyword_voc=keyword_vocab)
+    df['token_id_list'], df['token_length_list'] = create_token_ids_of_rows(keyword_vocab, df['token_name_list'])
     df = df[df['res'].map(lambda x: x is not None)]
     print('after create_token_id_input : {}'.format(len(df)))
 
     # convert sample code to id
-    sample_res = df['sample_ac_code_list'].map(create_token_ids_by_name_fn(keyword_voc=keyword_vocab))
-    sample_ac_id_list, sample_ac_len_list = list(zip(*sample_res))
-    df['sample_ac_id_list'] = list(sample_ac_id_list)
-    df['sample_ac_len_list'] = list(sample_ac_len_list)
+    sample_ac_id_list, sample_ac_len_list = create_token_ids_of_rows(keyword_vocab, df['sample_ac_code_list'])
+    df['sample_ac_id_list'] = sample_ac_id_list
+    df['sample_ac_len_list'] = sample_ac_len_list
     df = df[df['sample_ac_id_list'].map(lambda x: x is not None)]
     print('after sample_ac_id_list : {}'.format(len(df)))
 
-    sample_res = df['sample_error_code_list'].map(create_token_ids_by_name_fn(keyword_voc=keyword_vocab))
-    sample_error_id_list, sample_error_len_list = list(zip(*sample_res))
-    df['sample_error_id_list'] = list(sample_error_id_list)
-    df['sample_error_len_list'] = list(sample_error_len_list)
+    sample_error_id_list, sample_error_len_list = create_token_ids_of_rows(keyword_vocab, df['sample_error_code_list'])
+    df['sample_error_id_list'] = sample_error_id_list
+    df['sample_error_len_list'] = sample_error_len_list
     df = df[df['sample_error_id_list'].map(lambda x: x is not None)]
     print('after sample_error_id_list : {}'.format(len(df)))
 
@@ -434,10 +433,10 @@ def parse_iterative_sample_action_error_code(df, data_type, keyword_vocab, sort_
     create_input_ids_set_fn = lambda x: list(keyword_ids | set(x[1:-1]))
     df['sample_mask_list'] = df['ac_code_id_with_labels'].map(create_input_ids_set_fn)
 
-    df = df.apply(create_sample_is_copy, raw=True, axis=1, keyword_ids=keyword_ids)
+    df = df.apply(create_sample_is_copy, axis=1, keyword_ids=keyword_ids)
     print('after create_sample_is_copy : {}'.format(len(df)))
 
-    df = df.apply(create_target_ac_token_id_list, raw=True, axis=1)
+    df = df.apply(create_target_ac_token_id_list, axis=1)
 
     return df['token_id_list'], df['sample_error_id_list'], df['sample_ac_id_list'], df['ac_pos_list'], \
            df['error_pos_list'], df['ac_code_id_with_labels'], df['is_copy_list'], df['copy_pos_list'], \
@@ -716,6 +715,27 @@ def create_token_ids_by_name_fn(keyword_voc):
     return create_token_ids_by_name
 
 
+def create_token_ids_of_rows(keyword_voc, token_name_lists):
+    """
+    create_token_ids_by_name of every row. The name lists of all the rows are parsed by one parse_text_to_array call
+    :param token_name_lists: the name lists of every row
+    :return: (the token id lists of every row, the token length lists of every row)
+    """
+    row_counts = [len(name_lists) for name_lists in token_name_lists]
+    ids, offsets = keyword_voc.parse_text_to_array(list(itertools.chain.from_iterable(token_name_lists)))
+    ids = ids.tolist()
+    offsets = offsets.tolist()
+    id_lists = [ids[b:e] for b, e in zip(offsets[:-1], offsets[1:])]
+    token_id_list = []
+    len_list = []
+    begin = 0
+    for count in row_counts:
+        token_id_list.append(id_lists[begin:begin+count])
+        len_list.append([offsets[i+1] - offsets[i] for i in range(begin, begin+count)])
+        begin += count
+    return token_id_list, len_list
+
+
 def create_one_token_id_by_name_fn(keyword_voc):
     def create_one_token_id_by_name(name_list):
         id_list = keyword_voc.parse_text([name_list], False)[0]
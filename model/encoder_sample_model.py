@@ -14,14 +14,14 @@ import more_itertools
 
 from c_parser.ast_parser import parse_ast_code_graph
 from common.feed_forward_block import MultiLayerFeedForwardLayer
-from common.graph_embedding import GGNNLayer, MultiIterationGraph
-from common import torch_util, util
+from common.graph_embedding import GGNNLayer, MultiIterationGraph, GraphEdges
+from common import torch_util, util, args_util
 from common.logger import info
 from common.problem_util import to_cuda
 from common.torch_util import create_sequence_length_mask, Update, MaskOutput, expand_tensor_sequence_list_to_same, \
     SequenceMaskOutput, expand_tensor_sequence_len, expand_tensor_sequence_to_same, DynamicDecoder, \
-    pad_last_dim_of_tensor_list, BeamSearchDynamicDecoder
-from common.util import PaddedList, create_effect_keyword_ids_set
+    pad_last_dim_of_tensor_list, BeamSearchDynamicDecoder, padded_tensor
+from common.util import create_effect_keyword_ids_set
 from model.base_attention import record_is_nan
 from seq2seq.models import EncoderRNN, DecoderRNN
 from seq2seq.models.attention import Attention
@@ -357,6 +357,7 @@ class EncoderSampleModel(nn.Module):
                  p2_type='static',
                  p2_step_length=0,
                  feedforward_output=False,
+                 beam_length_penalty=0.0,
                  ):
         """
         :param vocabulary_size: The size of token vocabulary
@@ -372,6 +373,7 @@ class EncoderSampleModel(nn.Module):
         'step' means p2 express the delete token length. True end position = p1 + p2 + 1
         :param p2_step_length: if p2_type is 'step', p2_step_length means max token length it can delete. if p2_type is
         'static', p2_step_length no use.
+        :param beam_length_penalty: the length normalization alpha used to sort the final beams in beam search
         """
         super().__init__()
         self.max_sample_length = max_sample_length
@@ -412,7 +414,8 @@ class EncoderSampleModel(nn.Module):
                                               self.max_sample_length)
         self.beam_dynamic_decoder = BeamSearchDynamicDecoder(self.inner_start_label, self.inner_end_label, self.pad_label,
                                               self.decoder_one_step, self.beam_create_next_output_input,
-                                              self.max_sample_length, self.beam_size)
+                                              self.max_sample_length, self.beam_size,
+                                              length_penalty=beam_length_penalty)
         self.vocabulary = vocabulary
         self.keyword_ids_set = create_effect_keyword_ids_set(vocabulary)
         self.mask_type = mask_type
@@ -521,9 +524,16 @@ class EncoderSampleModel(nn.Module):
             .permute(1, 0, 2) \
             .contiguous()
         encoder_mask = create_sequence_length_mask(input_length, )
+        compatible_tokens, compatible_tokens_length = None, None
+        if self.mask_type == 'static':
+            # create the mask before decoding. The beam search decoder folds it with the other batch inputs
+            compatible_tokens, compatible_tokens_length = self.create_static_token_mask(ori_input_seq, input_length,
+                                                                                        copy_length)
 
         decoder_output_list, _, _ = self.beam_dynamic_decoder.decoder(encoder_output=input_seq, endocer_hidden=slice_state, encoder_mask=encoder_mask,
-                                     copy_length=copy_length, ori_input_seq=ori_input_seq, input_length=input_length)
+                                     copy_length=copy_length, ori_input_seq=ori_input_seq, input_length=input_length,
+                                     compatible_tokens=compatible_tokens,
+                                     compatible_tokens_length=compatible_tokens_length)
         is_copy_list, copy_output_list, sample_output_list, compatible_tokens_list = list(zip(*decoder_output_list))
 
         is_copy = torch.cat(is_copy_list, dim=2)
@@ -560,12 +570,12 @@ class EncoderSampleModel(nn.Module):
             input_set = self.keyword_ids_set | set(inp[1:c-1]) | {self.inner_end_label}
             mask_list += [[sorted(input_set)]]
         mask_len_list = [[len(j) for j in i] for i in mask_list]
-        compatible_tokens = torch.LongTensor(PaddedList(mask_list)).to(ori_input_seq.device)
-        compatible_tokens_length = torch.LongTensor(PaddedList(mask_len_list)).to(ori_input_seq.device)
+        compatible_tokens = padded_tensor(mask_list).to(ori_input_seq.device)
+        compatible_tokens_length = padded_tensor(mask_len_list).to(ori_input_seq.device)
         return compatible_tokens, compatible_tokens_length
 
     def decoder_one_step(self, decoder_inputs, continue_mask, start_index, hidden, encoder_output, encoder_mask, copy_length,
-                         ori_input_seq=None, input_length=None):
+                         ori_input_seq=None, input_length=None, compatible_tokens=None, compatible_tokens_length=None):
         if self.feedforward_output:
             decoder_output = self.decoder(o=hidden, context=encoder_output, mask=~encoder_mask)
         else:
@@ -575,9 +585,10 @@ class EncoderSampleModel(nn.Module):
             decoder_output = torch.stack(decoder_output, dim=1)
         copy_mask = create_sequence_length_mask(copy_length, max_len=encoder_output.shape[1])
 
-        compatible_tokens, compatible_tokens_length = \
-            self.create_one_step_token_masks(ori_input_seq=ori_input_seq, input_length=input_length, continue_mask=continue_mask,
-                                             copy_length=copy_length)
+        if compatible_tokens is None:
+            compatible_tokens, compatible_tokens_length = \
+                self.create_one_step_token_masks(ori_input_seq=ori_input_seq, input_length=input_length,
+                                                 continue_mask=continue_mask, copy_length=copy_length)
 
         # record_is_nan(decoder_output, 'decoder_output in one step decoder')
         is_copy, copy_output, sample_output = self.output(decoder_output, encoder_output, copy_mask, compatible_tokens,
@@ -700,10 +711,10 @@ def create_parse_target_batch_data(ignore_token, p2_type='static', feedforward_o
         p2 = to_cuda(torch.LongTensor(batch_data['p2_target']))
         if p2_type == 'step':
             p2 = p2 - p1 - 1
-        is_copy = to_cuda(torch.FloatTensor(PaddedList(batch_data['is_copy_target'], fill_value=ignore_token)))
-        copy_target = to_cuda(torch.LongTensor(PaddedList(batch_data['copy_target'], fill_value=ignore_token)))
-        sample_target = to_cuda(torch.LongTensor(PaddedList(batch_data['sample_target'], fill_value=ignore_token)))
-        sample_small_target = to_cuda(torch.LongTensor(PaddedList(batch_data['sample_small_target'])))
+        is_copy = to_cuda(padded_tensor(batch_data['is_copy_target'], fill_value=ignore_token, dtype=torch.float))
+        copy_target = to_cuda(padded_tensor(batch_data['copy_target'], fill_value=ignore_token))
+        sample_target = to_cuda(padded_tensor(batch_data['sample_target'], fill_value=ignore_token))
+        sample_small_target = to_cuda(padded_tensor(batch_data['sample_small_target']))
         if feedforward_output:
             def first_token(t):
                 return t[:, 0].unsqueeze(-1)
@@ -716,15 +727,25 @@ def create_parse_target_batch_data(ignore_token, p2_type='static', feedforward_o
 
 def create_parse_input_batch_data_fn(use_ast=False, p2_type='static', feedforward_output=False):
     def parse_input_batch_data_fn(batch_data, do_sample):
+        """
+        input_seq, input_length and copy_length may be the device tensors kept by create_multi_step_next_input_batch.
+        The input is padded to batch_data['pad_length'] if it is given, else to the max input_length
+        """
         def to_long(x):
-            return to_cuda(torch.LongTensor(x))
+            return to_cuda(x if isinstance(x, torch.Tensor) else torch.LongTensor(x))
 
+        if isinstance(batch_data['input_length'], torch.Tensor):
+            max_input_length = int(batch_data['input_length'].max())
+        else:
+            max_input_length = max(batch_data['input_length'])
+        size = batch_data.get('pad_length', max_input_length)
         if not use_ast:
             adjacent_matrix = to_long(batch_data['adj'])
+        elif args_util.use_sparse_graph:
+            adjacent_matrix = to_cuda(GraphEdges.from_adjacent_list(batch_data['adj']))
         else:
             adjacent_tuple = [[[i]+tt for tt in t] for i, t in enumerate(batch_data['adj'])]
             adjacent_tuple = [list(t) for t in unzip(more_itertools.flatten(adjacent_tuple))]
-            size = max(batch_data['input_length'])
             # print("max length in this batch:{}".format(size))
             adjacent_tuple = torch.LongTensor(adjacent_tuple)
             adjacent_values = torch.ones(adjacent_tuple.shape[1]).long()
@@ -740,7 +761,14 @@ def create_parse_input_batch_data_fn(use_ast=False, p2_type='static', feedforwar
                     adjacent_size,
                 ).float().to_dense()
             )
-        input_seq = to_long(PaddedList(batch_data['input_seq']))
+        if isinstance(batch_data['input_seq'], torch.Tensor):
+            input_seq = to_cuda(batch_data['input_seq'][:, :size])
+            if input_seq.shape[1] < size:
+                input_seq = F.pad(input_seq, [0, size - input_seq.shape[1]])
+        elif 'pad_length' in batch_data:
+            input_seq = to_cuda(padded_tensor(batch_data['input_seq'], shape=[len(batch_data['input_seq']), size]))
+        else:
+            input_seq = to_cuda(padded_tensor(batch_data['input_seq']))
         input_length = to_long(batch_data['input_length'])
         copy_length = to_long(batch_data['copy_length'])
         if not do_sample:
@@ -748,13 +776,13 @@ def create_parse_input_batch_data_fn(use_ast=False, p2_type='static', feedforwar
             p2_target = to_long(batch_data['p2_target'])
             if p2_type == 'step':
                 p2_target = p2_target - p1_target - 1
-            target = to_long(PaddedList(batch_data['target']))
-            is_copy_target = to_long(PaddedList(batch_data['is_copy_target']))
+            target = to_cuda(padded_tensor(batch_data['target']))
+            is_copy_target = to_cuda(padded_tensor(batch_data['is_copy_target']))
             batch_size = len(batch_data['is_copy_target'])
             seq_len = is_copy_target.shape[1]
             max_mask_len = max(max(batch_data['compatible_tokens_length']))
-            compatible_tokens = to_long(PaddedList(batch_data['compatible_tokens'], shape=[batch_size, seq_len, max_mask_len]))
-            compatible_tokens_length = to_long(PaddedList(batch_data['compatible_tokens_length']))
+            compatible_tokens = to_cuda(padded_tensor(batch_data['compatible_tokens'], shape=[batch_size, seq_len, max_mask_len]))
+            compatible_tokens_length = to_cuda(padded_tensor(batch_data['compatible_tokens_length']))
             if feedforward_output:
                 is_copy_target = is_copy_target[:, 0].unsqueeze(-1)
                 target = target[:, 0].unsqueeze(-1)
@@ -822,13 +850,80 @@ def expand_output_and_target_fn(ignore_token):
     return expand_output_and_target
 
 
+def splice_input_seq(input_seq, copy_length, p1, p2, sample_ids, sample_length, fill_value=0):
+    """
+    the tensor version of input_seq[i][:p1[i]+1] + sample_ids[i][:sample_length[i]] + input_seq[i][p2[i]:copy_length[i]]
+    of every sample, computed by gather on the device of input_seq.
+    :param input_seq: LongTensor [batch, seq]
+    :param sample_ids: LongTensor [batch, sample_seq]
+    :param copy_length, p1, p2, sample_length: LongTensor [batch]
+    :return: (the spliced LongTensor [batch, max next length] padded by fill_value, the next lengths LongTensor [batch])
+    """
+    next_length = p1 + 1 + sample_length + copy_length - p2
+    position = torch.arange(int(next_length.max()), device=input_seq.device).unsqueeze(0)
+    sample_begin = (p1 + 1).unsqueeze(1)
+    sample_end = sample_begin + sample_length.unsqueeze(1)
+    input_index = torch.where(position < sample_begin, position, position - sample_end + p2.unsqueeze(1))
+    input_part = torch.gather(input_seq, 1, input_index.clamp(0, input_seq.shape[1] - 1))
+    sample_part = torch.gather(sample_ids, 1, (position - sample_begin).clamp(0, sample_ids.shape[1] - 1))
+    res = torch.where((position >= sample_begin) & (position < sample_end), sample_part, input_part)
+    return res.masked_fill(position >= next_length.unsqueeze(1), fill_value), next_length
+
+
 def create_multi_step_next_input_batch_fn(begin_id, end_id, inner_end_id, vocabulary=None, use_ast=False, p2_type='static',
                                           only_sample=False, one_step=False):
+    def create_next_input_tensor_batch(input_data, model_input, output_record_list, continue_list):
+        """
+        the next input without the ast. The ids are edited on the device and kept in the padded tensors of
+        input_data, only the token names are spliced in python for the compiler.
+        """
+        p1, p2, is_copy, copy_ids, sample_output, sample_output_ids = output_record_list
+        continue_list = [c and not err for c, err in zip(continue_list, torch.ge(p1, p2).tolist())]
+        _, input_seq, input_length, copy_length = model_input[:4]
+
+        is_end = torch.eq(sample_output_ids, inner_end_id)
+        sample_length = torch.where(torch.any(is_end, dim=1), torch.argmax(is_end.long(), dim=1),
+                                    torch.full_like(p1, sample_output_ids.shape[1]))
+        next_input_seq, next_length = splice_input_seq(input_seq, copy_length, p1, p2, sample_output_ids,
+                                                       sample_length)
+        # the samples which don't continue keep their input
+        continue_tensor = torch.tensor(continue_list, dtype=torch.bool, device=input_seq.device)
+        width = max(next_input_seq.shape[1], input_seq.shape[1])
+        next_input_seq = F.pad(next_input_seq, [0, width - next_input_seq.shape[1]])
+        next_input_seq = torch.where(continue_tensor.unsqueeze(1), next_input_seq,
+                                     F.pad(input_seq, [0, width - input_seq.shape[1]]))
+        next_length = torch.where(continue_tensor, next_length, input_length)
+
+        p1_list, p2_list, sample_length_list = p1.tolist(), p2.tolist(), sample_length.tolist()
+        sample_output_ids_list = sample_output_ids.tolist()
+        input_seq_name = input_data['input_seq_name']
+        final_output_name_list = []
+        for i, code_name_list in enumerate(input_seq_name):
+            if not continue_list[i]:
+                final_output_name_list += [code_name_list]
+                continue
+            effect_sample_name = [vocabulary.id_to_word(word_id) for word_id in
+                                  sample_output_ids_list[i][:sample_length_list[i]]]
+            final_output_name_list += [code_name_list[:p1_list[i]] + effect_sample_name +
+                                       code_name_list[p2_list[i]-1:]]
+
+        input_data = input_data.copy()
+        input_data['input_seq'] = next_input_seq
+        input_data['input_length'] = next_length
+        input_data['copy_length'] = next_length
+        input_data['last_input_seq_name'] = [n if c else last for n, last, c in
+                                             zip(input_seq_name, input_data['last_input_seq_name'], continue_list)]
+        input_data['input_seq_name'] = final_output_name_list
+        final_output = [ids[1:l-1] for ids, l in zip(next_input_seq.tolist(), next_length.tolist())]
+        return input_data, final_output, output_record_list, final_output_name_list, continue_list
+
     def create_multi_step_next_input_batch(input_data, model_input, model_output, continue_list, direct_output=False):
         # output_record_list = create_records_all_output(model_input=model_input, model_output=model_output, do_sample=True)
         output_record_list = create_records_all_output_for_beam(model_input=model_input, model_output=model_output,
                                                                 do_sample=True, direct_output=direct_output, p2_type=p2_type,
                                                                 only_sample=only_sample)
+        if not use_ast and not one_step:
+            return create_next_input_tensor_batch(input_data, model_input, output_record_list, continue_list)
         p1, p2, is_copy, copy_ids, sample_output, sample_output_ids = output_record_list
 
         cur_error_position_data = torch.ge(p1, p2).tolist()
@@ -854,9 +949,15 @@ def create_multi_step_next_input_batch_fn(begin_id, end_id, inner_end_id, vocabu
         input_seq_name = input_data['input_seq_name']
 
         input_seq = [inp[:cpy] for inp, cpy in zip(input_seq, copy_length)]
+        # the samples which don't continue are reverted to the original input at last, don't build and parse them
+        is_changed = [one_step or c for c, _ in zip(continue_list, input_seq)]
         final_output = []
         final_output_name_list = []
         for i, one_input in enumerate(input_seq):
+            if not is_changed[i]:
+                final_output += [one_input[1:-1]]
+                final_output_name_list += [input_seq_name[i]]
+                continue
             effect_sample = effect_sample_output_list[i]
             one_output = one_input[1:p1[i] + 1] + effect_sample + one_input[p2[i]:-1]
             final_output += [one_output]
@@ -879,7 +980,9 @@ def create_multi_step_next_input_batch_fn(begin_id, end_id, inner_end_id, vocabu
         input_data['input_seq_name'] = final_output_name_list
 
         if use_ast:
-            ast_output = [parse_ast_node(code_names) for code_names in final_output_name_list]
+            ast_output = [parse_ast_node(code_names) if changed else
+                          tuple(original_input_data[k][i] for k in ['input_seq_name', 'input_seq', 'adj', 'input_length'])
+                          for i, (code_names, changed) in enumerate(zip(final_output_name_list, is_changed))]
             input_seq_name, input_seq, adj, input_length = list(zip(*ast_output))
             input_data['input_seq_name'] = input_seq_name
             input_data['input_seq'] = input_seq
@@ -10,12 +10,13 @@ from torch.utils.data import Dataset
 from tqdm import tqdm
 
 import config
-from common import torch_util
+from common import torch_util, problem_util
 from common.args_util import to_cuda, get_model
 from common.logger import init_a_file_logger, info
 from common.opt import OpenAIAdam
-from common.torch_util import create_sequence_length_mask, permute_last_dim_to_second, expand_tensor_sequence_len
-from common.util import data_loader, show_process_map, PaddedList, convert_one_token_ids_to_code, filter_token_ids, \
+from common.torch_util import create_sequence_length_mask, permute_last_dim_to_second, expand_tensor_sequence_len, \
+    padded_tensor
+from common.util import data_loader, show_process_map, convert_one_token_ids_to_code, filter_token_ids, \
     compile_c_code_by_gcc, create_token_set, create_token_mask_by_token_set
 from experiment.experiment_util import load_common_error_data, load_common_error_data_sample_100, \
     create_addition_error_data, create_copy_addition_data, load_deepfix_error_data
@@ -448,12 +449,12 @@ class RNNPointerNetworkModel(nn.Module):
 
 
 def parse_input_batch_data(batch_data):
-    error_tokens = to_cuda(torch.LongTensor(PaddedList(batch_data['error_tokens'])))
+    error_tokens = to_cuda(padded_tensor(batch_data['error_tokens']))
     max_input = max(batch_data['error_length'])
     input_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(batch_data['error_length'])), max_len=max_input))
 
     ac_tokens_decoder_input = [bat[:-1] for bat in batch_data['ac_tokens']]
-    ac_tokens = to_cuda(torch.LongTensor(PaddedList(ac_tokens_decoder_input)))
+    ac_tokens = to_cuda(padded_tensor(ac_tokens_decoder_input))
     ac_tokens_length = [len(bat) for bat in ac_tokens_decoder_input]
     max_output = max(ac_tokens_length)
     output_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(ac_tokens_length)), max_len=max_output))
@@ -467,14 +468,14 @@ def parse_input_batch_data(batch_data):
 
 
 def parse_rnn_input_batch_data(batch_data, vocab, do_sample=False, add_value_mask=False):
-    error_tokens = to_cuda(torch.LongTensor(PaddedList(batch_data['error_tokens'])))
+    error_tokens = to_cuda(padded_tensor(batch_data['error_tokens']))
     max_input = max(batch_data['error_length'])
     input_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(batch_data['error_length'])), max_len=max_input))
 
     if not do_sample:
         # ac_tokens_decoder_input = [bat[:-1] for bat in batch_data['ac_tokens']]
         ac_tokens_decoder_input = batch_data['ac_tokens']
-        ac_tokens = to_cuda(torch.LongTensor(PaddedList(ac_tokens_decoder_input)))
+        ac_tokens = to_cuda(padded_tensor(ac_tokens_decoder_input))
         ac_tokens_length = [len(bat) for bat in ac_tokens_decoder_input]
         max_output = max(ac_tokens_length)
         output_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(ac_tokens_length)), max_len=max_output))
@@ -503,17 +504,17 @@ def parse_rnn_input_batch_data(batch_data, vocab, do_sample=False, add_value_mas
 
 def parse_target_batch_data(batch_data):
     ac_tokens_decoder_output = [bat[1:] for bat in batch_data['ac_tokens']]
-    target_ac_tokens = to_cuda(torch.LongTensor(PaddedList(ac_tokens_decoder_output, fill_value=IGNORE_TOKEN)))
+    target_ac_tokens = to_cuda(padded_tensor(ac_tokens_decoder_output, fill_value=IGNORE_TOKEN))
 
     ac_tokens_length = [len(bat) for bat in ac_tokens_decoder_output]
     max_output = max(ac_tokens_length)
     output_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(ac_tokens_length)), max_len=max_output))
 
     pointer_map = [bat[1:] for bat in batch_data['pointer_map']]
-    target_pointer_output = to_cuda(torch.LongTensor(PaddedList(pointer_map, fill_value=IGNORE_TOKEN)))
+    target_pointer_output = to_cuda(padded_tensor(pointer_map, fill_value=IGNORE_TOKEN))
 
     is_copy = [bat[1:] for bat in batch_data['is_copy']]
-    target_is_copy = to_cuda(torch.Tensor(PaddedList(is_copy)))
+    target_is_copy = to_cuda(padded_tensor(is_copy, dtype=torch.float))
 
     return target_is_copy, target_pointer_output, target_ac_tokens, output_mask
 
@@ -875,7 +876,7 @@ def evaluate_multi_step(model, dataset, batch_size, vocab, do_sample=False, prin
                     if torch.sum(~is_copy & end_pos_mask) == 0:
                         break
 
-                output_ids = to_cuda(torch.LongTensor(PaddedList(input_data['error_tokens'])))
+                output_ids = to_cuda(padded_tensor(input_data['error_tokens']))
                 if not no_target:
                     model_target = parse_target_batch_data(target_data)
                     target_is_copy, target_pointer_output, target_ac_tokens, output_mask = model_target
@@ -1134,7 +1135,7 @@ def train_and_evaluate(batch_size, hidden_size, data_type, num_layers, dropout_p
     model = get_model(model)
 
     if load_name is not None:
-        torch_util.load_model(model, load_path, map_location={'cuda:1': 'cuda:0'})
+        problem_util.load_model(model, load_path)
 
     loss_fn = create_combine_loss_fn(average_value=True)
     # optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate)
@@ -12,13 +12,14 @@ import numpy as np
 import more_itertools
 
 import config
-from common import torch_util, util
+from common import torch_util, util, problem_util
 from common.args_util import to_cuda, get_model
 from common.logger import init_a_file_logger, info
 from common.opt import OpenAIAdam
 from common.pycparser_util import tokenize_by_clex_fn
-from common.torch_util import create_sequence_length_mask, permute_last_dim_to_second, expand_tensor_sequence_len
-from common.util import data_loader, show_process_map, PaddedList, convert_one_token_ids_to_code, filter_token_ids, \
+from common.torch_util import create_sequence_length_mask, permute_last_dim_to_second, expand_tensor_sequence_len, \
+    padded_tensor
+from common.util import data_loader, show_process_map, convert_one_token_ids_to_code, filter_token_ids, \
     compile_c_code_by_gcc, create_token_set, create_token_mask_by_token_set, generate_mask, queued_data_loader
 from experiment.experiment_util import load_common_error_data, load_common_error_data_sample_100, \
     create_addition_error_data, create_copy_addition_data, load_deepfix_error_data
@@ -455,12 +456,12 @@ class RNNPointerNetworkModelWithSLKMask(nn.Module):
 
 
 def parse_input_batch_data(batch_data):
-    error_tokens = to_cuda(torch.LongTensor(PaddedList(batch_data['error_tokens'])))
+    error_tokens = to_cuda(padded_tensor(batch_data['error_tokens']))
     max_input = max(batch_data['error_length'])
     input_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(batch_data['error_length'])), max_len=max_input))
 
     ac_tokens_decoder_input = [bat[:-1] for bat in batch_data['ac_tokens']]
-    ac_tokens = to_cuda(torch.LongTensor(PaddedList(ac_tokens_decoder_input)))
+    ac_tokens = to_cuda(padded_tensor(ac_tokens_decoder_input))
     ac_tokens_length = [len(bat) for bat in ac_tokens_decoder_input]
     max_output = max(ac_tokens_length)
     output_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(ac_tokens_length)), max_len=max_output))
@@ -474,14 +475,14 @@ def parse_input_batch_data(batch_data):
 
 
 def parse_rnn_input_batch_data(batch_data, vocab, do_sample=False, add_value_mask=False, transformer=None):
-    error_tokens = to_cuda(torch.LongTensor(PaddedList(batch_data['error_tokens'])))
+    error_tokens = to_cuda(padded_tensor(batch_data['error_tokens']))
     max_input = max(batch_data['error_length'])
     input_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(batch_data['error_length'])), max_len=max_input))
 
     if not do_sample:
         # ac_tokens_decoder_input = [bat[:-1] for bat in batch_data['ac_tokens']]
         ac_tokens_decoder_input = batch_data['ac_tokens']
-        ac_tokens = to_cuda(torch.LongTensor(PaddedList(ac_tokens_decoder_input)))
+        ac_tokens = to_cuda(padded_tensor(ac_tokens_decoder_input))
         ac_tokens_length = [len(bat) for bat in ac_tokens_decoder_input]
         max_output = max(ac_tokens_length)
         output_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(ac_tokens_length)), max_len=max_output))
@@ -512,9 +513,9 @@ def parse_rnn_input_batch_data(batch_data, vocab, do_sample=False, add_value_mas
     value_mask_set_len = batch_data['grammar_mask_length']
     max_seq = max([len(s) for s in value_mask_list])
     max_mask_len = max(more_itertools.collapse(value_mask_set_len))
-    value_mask_set_tensor = to_cuda(torch.LongTensor(PaddedList(value_mask_list, shape=[batch_size, max_seq, max_mask_len])))
+    value_mask_set_tensor = to_cuda(padded_tensor(value_mask_list, shape=[batch_size, max_seq, max_mask_len]))
     # [batch, seq, mask_len]
-    mask_length = to_cuda(torch.LongTensor(PaddedList(value_mask_set_len, shape=[batch_size, max_seq])))
+    mask_length = to_cuda(padded_tensor(value_mask_set_len, shape=[batch_size, max_seq]))
     mask_length_shape = list(mask_length.shape)
     mask_mask = create_sequence_length_mask(mask_length.view(-1)).view(mask_length_shape[0], mask_length_shape[1], -1)
 
@@ -529,23 +530,23 @@ def parse_rnn_input_batch_data(batch_data, vocab, do_sample=False, add_value_mas
 
 def parse_target_batch_data(batch_data):
     ac_tokens_decoder_output = [bat[1:] for bat in batch_data['ac_tokens']]
-    target_ac_tokens = to_cuda(torch.LongTensor(PaddedList(ac_tokens_decoder_output, fill_value=IGNORE_TOKEN)))
+    target_ac_tokens = to_cuda(padded_tensor(ac_tokens_decoder_output, fill_value=IGNORE_TOKEN))
     grammar_id_to_index_dict = [[{m: i for i, m in enumerate(masks)} for masks in grammar_mask_list]
                                 for grammar_mask_list in batch_data['grammar_mask_list']]
     ac_tokens_value_output = [[di[tok] for tok, di in zip(ac_tokens, value_mask_dict)]
                                 for ac_tokens, value_mask_dict in
                                 zip(ac_tokens_decoder_output, grammar_id_to_index_dict)]
-    target_value_output = to_cuda(torch.LongTensor(PaddedList(ac_tokens_value_output, fill_value=IGNORE_TOKEN)))
+    target_value_output = to_cuda(padded_tensor(ac_tokens_value_output, fill_value=IGNORE_TOKEN))
 
     ac_tokens_length = [len(bat) for bat in ac_tokens_decoder_output]
     max_output = max(ac_tokens_length)
     output_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(ac_tokens_length)), max_len=max_output))
 
     pointer_map = [bat[1:] for bat in batch_data['pointer_map']]
-    target_pointer_output = to_cuda(torch.LongTensor(PaddedList(pointer_map, fill_value=IGNORE_TOKEN)))
+    target_pointer_output = to_cuda(padded_tensor(pointer_map, fill_value=IGNORE_TOKEN))
 
     is_copy = [bat[1:] for bat in batch_data['is_copy']]
-    target_is_copy = to_cuda(torch.Tensor(PaddedList(is_copy)))
+    target_is_copy = to_cuda(padded_tensor(is_copy, dtype=torch.float))
 
     return target_is_copy, target_pointer_output, target_value_output, target_ac_tokens, output_mask
 
@@ -921,7 +922,7 @@ def evaluate_multi_step(model, dataset, batch_size, vocab, do_sample=False, prin
                     if torch.sum(~is_copy & end_pos_mask) == 0:
                         break
 
-                output_ids = to_cuda(torch.LongTensor(PaddedList(input_data['error_tokens'])))
+                output_ids = to_cuda(padded_tensor(input_data['error_tokens']))
                 if not no_target:
                     model_target = parse_target_batch_data(target_data)
                     target_is_copy, target_pointer_output, target_value_output, target_ac_tokens, output_mask = model_target
@@ -1185,7 +1186,7 @@ def train_and_evaluate(batch_size, hidden_size, data_type, num_layers, dropout_p
     model = get_model(model)
 
     if load_name is not None:
-        torch_util.load_model(model, load_path, map_location={'cuda:1': 'cuda:0'})
+        problem_util.load_model(model, load_path)
 
     loss_fn = create_combine_loss_fn(average_value=True)
     # optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate)
@@ -20,8 +20,8 @@ from common.logger import init_a_file_logger, info
 from common.opt import OpenAIAdam
 from common.pycparser_util import tokenize_by_clex_fn
 from common.torch_util import create_sequence_length_mask, permute_last_dim_to_second, expand_tensor_sequence_len, \
-    expand_tensor_sequence_to_same, DynamicDecoder, pad_last_dim_of_tensor_list
-from common.util import data_loader, show_process_map, PaddedList, convert_one_token_ids_to_code, filter_token_ids, \
+    expand_tensor_sequence_to_same, DynamicDecoder, pad_last_dim_of_tensor_list, padded_tensor
+from common.util import data_loader, show_process_map, convert_one_token_ids_to_code, filter_token_ids, \
     compile_c_code_by_gcc, create_token_set, create_token_mask_by_token_set, generate_mask, queued_data_loader, \
     CustomerDataSet, OrderedList, create_effect_keyword_ids_set
 from experiment.experiment_util import load_common_error_data, load_common_error_data_sample_100, \
@@ -299,7 +299,7 @@ class IndexPositionEmbedding(nn.Module):
         position_input_index = to_cuda(
             torch.unsqueeze(torch.arange(start_index, start_index + input_sequence_len), dim=0).expand(batch_size, -1)).long()
         if input_mask is not None:
-            position_input_index.masked_fill_(~input_mask, MAX_LENGTH)
+            position_input_index.masked_fill_(~input_mask.bool(), MAX_LENGTH)
         position_input_embedded = self.position_embedding(position_input_index)
         position_input = torch.cat([position_input_embedded, embedded_input], dim=-1)
         return position_input
@@ -310,7 +310,7 @@ class IndexPositionEmbedding(nn.Module):
         position_input_index = to_cuda(
             torch.unsqueeze(torch.arange(0, input_sequence_len), dim=0).expand(batch_size, -1)).long()
         if input_mask is not None:
-            position_input_index.masked_fill_(~input_mask, MAX_LENGTH)
+            position_input_index.masked_fill_(~input_mask.bool(), MAX_LENGTH)
         position_input_embedded = self.position_embedding(position_input_index)
         return position_input_embedded
 
@@ -449,11 +449,11 @@ class RNNPointerNetworkModelWithSLKMask(nn.Module):
         # record_is_nan(pointer_output, 'pointer_output in model: ')
         if pointer_encoder_mask is not None:
             dim_len = len(pointer_output.shape)
-            pointer_output.masked_fill_(~pointer_encoder_mask.view(pointer_encoder_mask.shape[0], *[1 for i in range(dim_len-3)],
+            pointer_output.masked_fill_(~pointer_encoder_mask.bool().view(pointer_encoder_mask.shape[0], *[1 for i in range(dim_len-3)],
                                                                    pointer_encoder_mask.shape[-2], pointer_encoder_mask.shape[-1]),
                                         -float('inf'))
             if decode_mask is not None:
-                pointer_output.masked_fill_(~decode_mask.view(decode_mask.shape[0], decode_mask.shape[1],
+                pointer_output.masked_fill_(~decode_mask.bool().view(decode_mask.shape[0], decode_mask.shape[1],
                                                                            *[1 for i in
                                                                              range(len(pointer_output.shape) - 2)]), 0)
             # pointer_output = torch.where(torch.unsqueeze(encode_mask, dim=1), pointer_output, to_cuda(torch.Tensor([float('-inf')])))
@@ -465,10 +465,10 @@ class RNNPointerNetworkModelWithSLKMask(nn.Module):
         # print('after dynamic linear')
         if value_mask is not None:
             dim_len = len(value_output.shape)
-            value_output.masked_fill_(~value_mask.view(value_mask.shape[0], *[1 for i in range(dim_len - 3)],
+            value_output.masked_fill_(~value_mask.bool().view(value_mask.shape[0], *[1 for i in range(dim_len - 3)],
                                                             value_mask.shape[-2], value_mask.shape[-1]), -float('inf'))
             if decode_mask is not None:
-                value_output.masked_fill_(~decode_mask.view(decode_mask.shape[0], decode_mask.shape[1], *[1 for i in range(len(value_output.shape)-2)]), 0)
+                value_output.masked_fill_(~decode_mask.bool().view(decode_mask.shape[0], decode_mask.shape[1], *[1 for i in range(len(value_output.shape)-2)]), 0)
         return is_copy, value_output, pointer_output, hidden
 
     def forward(self, inputs, input_mask, output, output_mask, inputs_list, value_mask_set_tensor, mask_mask=None, pointer_encoder_mask=None,
@@ -618,7 +618,7 @@ class RNNPointerNetworkModelWithSLKMask(nn.Module):
             mask_mask = create_sequence_length_mask(mask_length.view(-1)).view(batch_size, 1, -1)
             error_list = []
             pointer_list = [[1 for _ in range(c)] for c in copy_length.tolist()]
-            pointer_tensor = torch.ByteTensor(PaddedList(pointer_list, shape=[batch_size, encoder_output.shape[1]])).to(encoder_output.device)
+            pointer_tensor = padded_tensor(pointer_list, shape=[batch_size, encoder_output.shape[1]], dtype=torch.uint8).to(encoder_output.device)
             pointer_mask_tensor = torch.unsqueeze(pointer_tensor, dim=1)
 
         is_copy, value_output, pointer_output, hidden = self.decode_step(decode_input=output_embed,
@@ -678,8 +678,8 @@ class RNNPointerNetworkModelWithSLKMask(nn.Module):
         pointer_mask_tensor = self.create_one_step_pointer_mask(encoder_output, encoder_input_list, slk_mask_list)
         len_list = [[len(one_mask) for one_mask in masks] for masks in slk_mask_list]
         max_mask_len = max(more_itertools.collapse(len_list))
-        slk_mask_tensor = to_cuda(torch.Tensor(PaddedList(slk_mask_list, shape=(batch_size, 1, max_mask_len))).long())
-        mask_length = to_cuda(torch.LongTensor(PaddedList(len_list, shape=[batch_size, 1])))
+        slk_mask_tensor = to_cuda(padded_tensor(slk_mask_list, shape=(batch_size, 1, max_mask_len)))
+        mask_length = to_cuda(padded_tensor(len_list, shape=[batch_size, 1]))
         mask_mask = create_sequence_length_mask(mask_length.view(-1)).view(batch_size, 1, -1)
         return error_list, mask_mask, pointer_mask_tensor, slk_mask_tensor
 
@@ -688,7 +688,7 @@ class RNNPointerNetworkModelWithSLKMask(nn.Module):
         pointer_mask = [[[tok in slk_mask for tok in inp_seq] for slk_mask in slk_mask_seq]
                         for inp_seq, slk_mask_seq in zip(encoder_input_list, slk_mask_list)]
         pointer_mask_tensor = to_cuda(
-            torch.ByteTensor(PaddedList(pointer_mask, shape=[batch_size, 1, encoder_output.shape[1]])))
+            padded_tensor(pointer_mask, shape=[batch_size, 1, encoder_output.shape[1]], dtype=torch.uint8))
         return pointer_mask_tensor
 
     def create_one_step_token_masks(self, ori_input_seq, continue_mask, copy_length=None):
@@ -705,15 +705,15 @@ class RNNPointerNetworkModelWithSLKMask(nn.Module):
             input_set = self.keyword_ids_set | set(inp[:c]) | {self.end_label}
             mask_list += [[sorted(input_set)]]
         mask_len_list = [[len(j) for j in i] for i in mask_list]
-        compatible_tokens = torch.LongTensor(PaddedList(mask_list)).to(ori_input_seq.device)
-        compatible_tokens_length = torch.LongTensor(PaddedList(mask_len_list)).to(ori_input_seq.device)
+        compatible_tokens = padded_tensor(mask_list).to(ori_input_seq.device)
+        compatible_tokens_length = padded_tensor(mask_len_list).to(ori_input_seq.device)
         return compatible_tokens, compatible_tokens_length
 
 
 def create_parse_rnn_input_batch_data_fn(vocab, use_ast=False):
 
     def parse_rnn_input_batch_data(batch_data, do_sample=False, add_value_mask=False):
-        error_tokens = to_cuda(torch.LongTensor(PaddedList(batch_data['error_tokens'])))
+        error_tokens = to_cuda(padded_tensor(batch_data['error_tokens']))
         max_input = max(batch_data['error_length'])
         input_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(batch_data['error_length'])), max_len=max_input))
         copy_length = to_cuda(torch.LongTensor(batch_data['copy_length']))
@@ -721,7 +721,7 @@ def create_parse_rnn_input_batch_data_fn(vocab, use_ast=False):
         if not do_sample:
             # ac_tokens_decoder_input = [bat[:-1] for bat in batch_data['ac_tokens']]
             ac_tokens_decoder_input = batch_data['ac_tokens']
-            ac_tokens = to_cuda(torch.LongTensor(PaddedList(ac_tokens_decoder_input)))
+            ac_tokens = to_cuda(padded_tensor(ac_tokens_decoder_input))
             ac_tokens_length = [len(bat) for bat in ac_tokens_decoder_input]
             max_output = max(ac_tokens_length)
             output_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(ac_tokens_length)), max_len=max_output))
@@ -751,9 +751,9 @@ def create_parse_rnn_input_batch_data_fn(vocab, use_ast=False):
         value_mask_set_len = batch_data['grammar_mask_length']
         max_seq = max([len(s) for s in value_mask_list])
         max_mask_len = max(more_itertools.collapse(value_mask_set_len))
-        value_mask_set_tensor = to_cuda(torch.LongTensor(PaddedList(value_mask_list, shape=[batch_size, max_seq, max_mask_len])))
+        value_mask_set_tensor = to_cuda(padded_tensor(value_mask_list, shape=[batch_size, max_seq, max_mask_len]))
         # [batch, seq, mask_len]
-        mask_length = to_cuda(torch.LongTensor(PaddedList(value_mask_set_len, shape=[batch_size, max_seq])))
+        mask_length = to_cuda(padded_tensor(value_mask_set_len, shape=[batch_size, max_seq]))
         mask_length_shape = list(mask_length.shape)
         mask_mask = create_sequence_length_mask(mask_length.view(-1)).view(mask_length_shape[0], mask_length_shape[1], -1)
 
@@ -761,7 +761,7 @@ def create_parse_rnn_input_batch_data_fn(vocab, use_ast=False):
             pointer_encoder_mask = [[[inp in mask for inp in inp_seq] if cpy else [1 for i in range(len(inp_seq))]for cpy, mask in zip(copy_seq[1:], mask_seq)]
                                     for inp_seq, copy_seq, mask_seq in
                                     zip(batch_data['error_tokens'], batch_data['is_copy'], batch_data['grammar_mask_list'])]
-            pointer_encoder_mask_tensor = to_cuda(torch.ByteTensor(PaddedList(pointer_encoder_mask, shape=[batch_size, max_seq, max_input])))
+            pointer_encoder_mask_tensor = to_cuda(padded_tensor(pointer_encoder_mask, shape=[batch_size, max_seq, max_input], dtype=torch.uint8))
         else:
             pointer_encoder_mask_tensor = None
 
@@ -798,23 +798,23 @@ def create_parse_target_batch_data():
 
     def parse_target_batch_data(batch_data):
         ac_tokens_decoder_output = [bat[1:] for bat in batch_data['ac_tokens']]
-        target_ac_tokens = to_cuda(torch.LongTensor(PaddedList(ac_tokens_decoder_output, fill_value=IGNORE_TOKEN)))
+        target_ac_tokens = to_cuda(padded_tensor(ac_tokens_decoder_output, fill_value=IGNORE_TOKEN))
         grammar_id_to_index_dict = [[{m: i for i, m in enumerate(masks)} for masks in grammar_mask_list]
                                     for grammar_mask_list in batch_data['grammar_mask_list']]
         ac_tokens_value_output = [[di[tok] for tok, di in zip(ac_tokens, value_mask_dict)]
                                     for ac_tokens, value_mask_dict in
                                     zip(ac_tokens_decoder_output, grammar_id_to_index_dict)]
-        target_value_tokens = to_cuda(torch.LongTensor(PaddedList(ac_tokens_value_output, fill_value=IGNORE_TOKEN)))
+        target_value_tokens = to_cuda(padded_tensor(ac_tokens_value_output, fill_value=IGNORE_TOKEN))
 
         ac_tokens_length = [len(bat) for bat in ac_tokens_decoder_output]
         max_output = max(ac_tokens_length)
         output_mask = to_cuda(create_sequence_length_mask(to_cuda(torch.LongTensor(ac_tokens_length)), max_len=max_output))
 
         pointer_map = [bat[1:] for bat in batch_data['pointer_map']]
-        target_pointer_output = to_cuda(torch.LongTensor(PaddedList(pointer_map, fill_value=IGNORE_TOKEN)))
+        target_pointer_output = to_cuda(padded_tensor(pointer_map, fill_value=IGNORE_TOKEN))
 
         is_copy = [bat[1:] for bat in batch_data['is_copy']]
-        target_is_copy = to_cuda(torch.Tensor(PaddedList(is_copy)))
+        target_is_copy = to_cuda(padded_tensor(is_copy, dtype=torch.float))
 
         return target_is_copy, target_pointer_output, target_value_tokens, target_ac_tokens, output_mask
     return parse_target_batch_data
@@ -9,8 +9,9 @@ import config
 import os
 import more_itertools
 
+from common import args_util
 from model.sensibility_baseline.dual_lstm import DualLSTMModelWrapper
-from model.sensibility_baseline.fix import LSTMFixerUpper
+from model.sensibility_baseline.fix import LSTMFixerUpper, BatchFixes
 from model.sensibility_baseline.rnn_pytorch import SensibilityBiRnnModel
 from model.sensibility_baseline.utility_class import Edit
 from vocabulary.word_vocabulary import Vocabulary
@@ -44,6 +45,32 @@ def generate_action_from_edit(edit: Edit, length, empty_id):
         else:
             return index-1, index+1, empty_id
 
+
+def generate_action_arrays(fixes: BatchFixes, lengths, empty_id):
+    """
+    generate_action_from_edit of all the edits of a BatchFixes
+    :param lengths: the length of the file of every edit
+    :return: the (p1, p2, token) arrays
+    """
+    index = fixes.index
+    last = lengths - 1
+    is_insert = fixes.code == 'i'
+    is_delete = fixes.code == 'x'
+    # substitute here
+    sub_index = np.where(index == 0, 1, np.where(index == last, index - 1, index))
+    p1 = sub_index - 1
+    p2 = sub_index + 1
+    # insert before
+    insert_index = np.maximum(index, 1)
+    p1 = np.where(is_insert, insert_index - 1, p1)
+    p2 = np.where(is_insert, insert_index, p2)
+    # delete here
+    p1 = np.where(is_delete, np.where(index == 0, 0, index - 1), p1)
+    p2 = np.where(is_delete, np.where(index == 0, 1, np.where(index == last, last, index + 1)), p2)
+    token = np.where(is_delete, empty_id, fixes.token)
+    return p1, p2, token
+
+
 class FixModel(nn.Module):
     def __init__(self,
                  rnn_model: SensibilityBiRnnModel,
@@ -59,6 +86,8 @@ class FixModel(nn.Module):
     def forward(self,
                 batch_data, do_sample=True, do_beam_search=False,
                 ):
+        if args_util.use_batch_sensibility_fix:
+            return self.forward_batch(batch_data)
         output = []
         ori_input_seq = batch_data['input_seq']
         max_length = max(len(t) for t in ori_input_seq)
@@ -90,6 +119,31 @@ class FixModel(nn.Module):
 
         return p1, p2, is_copy, copy_output, sample_output, self.tokens_set.expand(batch_size, -1).unsqueeze(1)
 
+    def forward_batch(self, batch_data):
+        """
+        the same as forward, but the edits of the batch are created by LSTMFixerUpper.fix_batch
+        """
+        ori_input_seq = batch_data['input_seq']
+        max_length = max(len(t) for t in ori_input_seq)
+        fixes = self.fix_upper.fix_batch(ori_input_seq)
+        file_index = fixes.file_index.tolist()
+        for k in list(batch_data.keys()):
+            batch_data[k] = [batch_data[k][i] for i in file_index]
+        batch_size = len(file_index)
+
+        lengths = np.array([len(t) for t in ori_input_seq], dtype=np.int64)[fixes.file_index]
+        p1_t, p2_t, s_t = (torch.from_numpy(t) for t in generate_action_arrays(fixes, lengths, self.empty_id))
+        rows = torch.arange(batch_size)
+        p1 = torch.zeros((batch_size, max_length),)
+        p2 = torch.zeros((batch_size, max_length),)
+        p1[rows, p1_t] = 1.0
+        p2[rows, p2_t] = 1.0
+        is_copy = torch.ones((batch_size, 1)) * (-1000)
+        copy_output = torch.zeros((batch_size, 1, max_length))
+        sample_output = torch.zeros((batch_size, 1, self.vocabulary.vocabulary_size))
+        sample_output[rows, 0, s_t] = 1.0
+        return p1, p2, is_copy, copy_output, sample_output, self.tokens_set.expand(batch_size, -1).unsqueeze(1)
+
 
 def parse_input_batch_data_fn(batch_data, do_sample):
     return [batch_data]
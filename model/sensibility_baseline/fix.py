@@ -24,8 +24,10 @@ from typing import (Iterable, Iterator, List, NamedTuple, Sequence, Set,
                     SupportsFloat, cast)
 
 import numpy as np
+import torch
 from numpy.linalg import norm  # noqa
 
+from common.util import padded_array
 from vocabulary.word_vocabulary import Vocabulary
 from .dual_lstm import DualLSTMModel
 from .utility_class import SourceVector, clamp, Deletion, Edit, Insertion, Substitution, Vind
@@ -102,6 +104,95 @@ class LSTMFixerUpper:
 
         return tuple(fixes)
 
+    def fix_batch(self, source_ids_list: Sequence[Sequence[Vind]]) -> 'BatchFixes':
+        """
+        The batched version of fix. All the positions of the files are scored in one forward pass by
+        predict_batch, the score of IndexResult and the top suggestions are tensor ops over the batch and the edits
+        are created as index arrays. The edits of every file are the same as fix, in the same order.
+        """
+        forwards, backwards, lengths = self.model.predict_batch(source_ids_list)
+        seq = torch.from_numpy(padded_array(source_ids_list)).to(forwards.device)[:, :forwards.shape[1]]
+        scores = agreement_scores(forwards, backwards, seq, lengths.to(forwards.device) - 1).cpu().numpy()
+        top_forwards = forwards.argmax(dim=-1).cpu().numpy()
+        top_backwards = backwards.argmax(dim=-1).cpu().numpy()
+        seq = seq.cpu().numpy()
+
+        # the same order as sorted(results, key=float)
+        k = min(self.k, scores.shape[1])
+        positions = np.argsort(scores, axis=1, kind='stable')[:, :k]
+        selected = np.arange(k)[None, :] < (lengths.numpy()[:, None] - 1)
+        file_index, rank = np.nonzero(selected)
+        position = positions[file_index, rank]
+
+        # best_suggestions is a set, its iteration order decides the order of the insertions and substitutions
+        suggestions = np.full((len(file_index), 2), -1, dtype=np.int64)
+        for i, (f, p) in enumerate(zip(file_index, position)):
+            one = list({top_forwards[f, p], top_backwards[f, p]})
+            suggestions[i, :len(one)] = one
+        has_second = suggestions[:, 1] >= 0
+        original_token = seq[file_index, position]
+
+        # the slots of one disagreement: insert the suggestions, delete, substitute the suggestions
+        codes = np.array(EDIT_SLOT_CODES)[None, :].repeat(len(file_index), axis=0)
+        tokens = np.stack([suggestions[:, 0], suggestions[:, 1], original_token,
+                           suggestions[:, 0], suggestions[:, 1]], axis=1)
+        valid = np.stack([np.ones_like(has_second), has_second, np.ones_like(has_second),
+                          np.ones_like(has_second), has_second], axis=1)
+        return BatchFixes(file_index=file_index.repeat(len(EDIT_SLOT_CODES))[valid.reshape(-1)],
+                          code=codes[valid],
+                          index=position.repeat(len(EDIT_SLOT_CODES))[valid.reshape(-1)],
+                          token=tokens[valid],
+                          original_token=original_token.repeat(len(EDIT_SLOT_CODES))[valid.reshape(-1)])
+
+
+# the edit codes of the slots of one disagreement in fix
+EDIT_SLOT_CODES = ('i', 'i', 'x', 's', 's')
+
+
+class BatchFixes(NamedTuple):
+    """
+    The edits of a batch of files as index arrays. The edits of a file are contiguous and in the file order.
+    """
+    file_index: np.ndarray
+    # the Edit.code of every edit
+    code: np.ndarray
+    index: np.ndarray
+    # the inserted or replacement token. the original token for a deletion
+    token: np.ndarray
+    original_token: np.ndarray
+
+    def to_edits(self, file_count: int) -> List[Sequence[Edit]]:
+        """
+        :return: the Edit tuples of every file, the same as fix
+        """
+        edits: List[List[Edit]] = [[] for _ in range(file_count)]
+        for f, code, index, token, original_token in zip(self.file_index.tolist(), self.code, self.index.tolist(),
+                                                         self.token.tolist(), self.original_token.tolist()):
+            if code == 'i':
+                edits[f].append(Insertion(index, token))
+            elif code == 'x':
+                edits[f].append(Deletion(index, original_token))
+            else:
+                edits[f].append(Substitution(index, original_token=original_token, replacement=token))
+        return [tuple(e) for e in edits]
+
+
+def agreement_scores(forwards: torch.Tensor, backwards: torch.Tensor, seq: torch.Tensor,
+                     lengths: torch.Tensor) -> torch.Tensor:
+    """
+    float(IndexResult) of every position, the negative cross entropy of the token against both distributions.
+    :param seq: the token ids of [batch, position]
+    :param lengths: the number of positions of every file. The score of the padding positions is inf
+    :return: a tensor of [batch, position]
+    """
+    a = forwards.gather(-1, seq.unsqueeze(-1)).squeeze(-1)
+    b = backwards.gather(-1, seq.unsqueeze(-1)).squeeze(-1)
+    a = torch.where(a == 0, torch.full_like(a, float(epsilon)), a)
+    b = torch.where(b == 0, torch.full_like(b, float(epsilon)), b)
+    scores = -(-torch.log(a) + -torch.log(b))
+    padding = torch.arange(seq.shape[1], device=seq.device)[None, :] >= lengths[:, None]
+    return scores.masked_fill(padding, float('inf'))
+
 
 class IndexResult(SupportsFloat):
     """
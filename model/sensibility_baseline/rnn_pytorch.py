@@ -10,7 +10,6 @@ from common.torch_util import calculate_accuracy_of_code_completion, get_predict
     remove_last_item_in_sequence, reverse_tensor
 from common.util import batch_holder, transform_id_to_token, PaddedList, show_process_map, CustomerDataSet
 from common import util, torch_util
-from sklearn.utils import shuffle
 import sys
 
 from seq2seq.models import EncoderRNN
@@ -179,6 +179,7 @@ def pointer_network_with_ggnn_encoder(is_debug):
 
         'vocabulary': vocabulary,
         # 'transformer': transformer,
+        'use_ast': use_ast,
         'parse_input_batch_data_fn': parse_rnn_input_batch_data,
         'parse_target_batch_data_fn': parse_target_batch_data,
         'expand_output_and_target_fn': slk_expand_output_and_target,
@@ -3813,14 +3814,11 @@ def sensibility_rnn_config2(is_debug):
                                                             'update_embedding': True,
                                                             },
                                          })
-    from common import torch_util
+    from common import problem_util
     import os
     rnn_path = os.path.join(save_model_root, "rnn_baseline", "sensibility_rnn_config1.pkl81")
-    from torch import nn
-    rnn_model = nn.DataParallel(rnn_model.cuda(), device_ids=[0])
-    # torch_util.load_model(rnn_model, rnn_path, map_location={'cuda:1': 'cuda:0'})
-    torch_util.load_model(rnn_model, rnn_path)
-    rnn_model = rnn_model.module.cpu()
+    problem_util.load_model(rnn_model, rnn_path)
+    rnn_model = rnn_model.cpu()
 
     from model.encoder_sample_model import EncoderSampleModel
     from model.encoder_sample_model import create_parse_target_batch_data
@@ -1,5 +1,5 @@
 from common.analyse_include_util import replace_include_with_blank
-from common.pycparser_util import tokenize_by_clex_fn
+from common.args_util import get_tokenize_service
 from read_data.read_filter_data_records import read_distinct_problem_user_compile_success_c_records, \
     read_distinct_problem_user_fake_c_common_records, read_distinct_problem_user_fake_c_random_records, \
     read_distinct_problem_user_c_records, read_deepfix_error_records, read_filter_grammar_sample_test_records, \
@@ -56,18 +56,18 @@ def read_fake_random_c_error_dataset():
 @disk_cache(basename='read_fake_common_c_error_dataset_with_limit_length', directory=CACHE_DATA_PATH)
 def read_fake_common_c_error_dataset_with_limit_length(limit_length=500):
     dfs = read_fake_common_c_error_dataset()
-    tokenize_fn = tokenize_by_clex_fn()
+    tokenize_batch = get_tokenize_service().tokenize_batch
 
-    train, valid, test = [filter_length(df, limit_length, tokenize_fn) for df in dfs]
+    train, valid, test = [filter_length(df, limit_length, batch_tokenize_fn=tokenize_batch) for df in dfs]
     return train, valid, test
 
 
 @disk_cache(basename='read_fake_random_c_error_dataset_with_limit_length', directory=CACHE_DATA_PATH)
 def read_fake_random_c_error_dataset_with_limit_length(limit_length=500):
     dfs = read_fake_random_c_error_dataset()
-    tokenize_fn = tokenize_by_clex_fn()
+    tokenize_batch = get_tokenize_service().tokenize_batch
 
-    train, valid, test = [filter_length(df, limit_length, tokenize_fn) for df in dfs]
+    train, valid, test = [filter_length(df, limit_length, batch_tokenize_fn=tokenize_batch) for df in dfs]
     return train, valid, test
 
 
@@ -75,8 +75,7 @@ def read_fake_random_c_error_dataset_with_limit_length(limit_length=500):
 def read_fake_common_deepfix_error_dataset_with_limit_length(limit_length=500, random_seed=100):
     data_df = read_fake_deepfix_common_error_records()
 
-    tokenize_fn = tokenize_by_clex_fn()
-    data_df = filter_length(data_df, limit_length, tokenize_fn)
+    data_df = filter_length(data_df, limit_length, batch_tokenize_fn=get_tokenize_service().tokenize_batch)
     print('after filter code length: {}'.format(len(data_df)))
 
     valid_df = data_df.sample(frac=0.05, random_state=random_seed)
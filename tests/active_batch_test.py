@@ -0,0 +1,196 @@
+import unittest
+
+import numpy as np
+import torch
+
+from common import args_util
+from common.active_batch import select_batch, scatter_batch, expand_sub_batch_output, active_index_list, unpad_batch
+from common.util import StageTimer
+from model.encoder_sample_model import splice_input_seq
+from train import multi_step_one_batch
+
+
+class FakeFixModel(object):
+    """
+    a model deleting the last token of every program. The forward batch sizes are recorded.
+    """
+    def __init__(self):
+        self.batch_sizes = []
+
+    def forward(self, input_seq, do_sample=True, do_beam_search=False):
+        self.batch_sizes.append(len(input_seq))
+        return torch.tensor([len(s) for s in input_seq]), torch.tensor([s[-1] for s in input_seq])
+
+
+def parse_input_batch_data(input_data, do_sample=True):
+    return [input_data['input_seq']]
+
+
+def create_next_input_batch(input_data, model_input, model_output, continue_list, direct_output=False):
+    lengths, last_ids = model_output
+    original_input_data = input_data.copy()
+    input_data = input_data.copy()
+    input_data['input_seq'] = [s[:-1] for s in input_data['input_seq']]
+    input_data['input_seq_name'] = [n[:-1] for n in input_data['input_seq_name']]
+    for k in input_data.keys():
+        input_data[k] = [i if c else o for o, i, c in zip(original_input_data[k], input_data[k], continue_list)]
+    return input_data, input_data['input_seq'], (lengths, last_ids), input_data['input_seq_name'], continue_list
+
+
+def run_one_batch(batch_data, model, target_lengths, max_step_times=6, parse_input_batch_data_fn=parse_input_batch_data,
+                  create_next_input_batch_fn=create_next_input_batch):
+    """
+    drive multi_step_one_batch as the compile loop does. A code compiles if its length reaches the target length.
+    """
+    generator = multi_step_one_batch(model, batch_data, len(target_lengths), parse_input_batch_data_fn,
+                                     max_step_times, None, '', create_next_input_batch_fn, lambda x: x['includes'],
+                                     False, '', '', 'normal', StageTimer())
+    compile_kwargs = next(generator)
+    try:
+        while True:
+            result_list = [len(code) <= t or r for code, t, r in zip(compile_kwargs['final_output'], target_lengths,
+                                                                      compile_kwargs['result_list'])]
+            continue_list = [c and not r for c, r in zip(compile_kwargs['continue_list'], result_list)]
+            compile_kwargs = generator.send((continue_list, result_list, [0 for _ in result_list]))
+    except StopIteration as e:
+        return e.value
+
+
+class ActiveBatchTest(unittest.TestCase):
+
+    def test_select_and_scatter(self):
+        batch = {'id': ['a', 'b', 'c', 'd'], 'input_seq': [[1], [2], [3], [4]]}
+        index_list = active_index_list([True, False, True, False, True], 4)
+        self.assertEqual(index_list, [0, 2])
+        sub_batch = select_batch(batch, index_list)
+        self.assertEqual(sub_batch, {'id': ['a', 'c'], 'input_seq': [[1], [3]]})
+        sub_batch['input_seq'] = [[5], [6]]
+        self.assertEqual(scatter_batch(batch, sub_batch, index_list)['input_seq'], [[5], [2], [6], [4]])
+        self.assertEqual(batch['input_seq'], [[1], [2], [3], [4]])
+        records = expand_sub_batch_output((torch.tensor([[1, 2], [3, 4]]), torch.tensor(7), ['x', 'y']), index_list, 4)
+        self.assertTrue(torch.equal(records[0], torch.tensor([[1, 2], [0, 0], [3, 4], [0, 0]])))
+        self.assertEqual(records[1].item(), 7)
+        self.assertEqual(records[2], ['x', None, 'y', None])
+
+    def test_select_and_scatter_arrays(self):
+        batch = {'id': ['a', 'b', 'c', 'd'], 'input_length': torch.tensor([3, 4, 5, 6]),
+                 'input_seq': torch.arange(8).view(4, 2), 'mask': np.array([[1, 0], [1, 1], [0, 0], [0, 1]]),
+                 'names': np.array([['x'], ['y'], ['z'], ['w']], dtype=object)}
+        index_list = [1, 3]
+        sub_batch = select_batch(batch, index_list)
+        self.assertEqual(sub_batch['id'], ['b', 'd'])
+        self.assertTrue(torch.equal(sub_batch['input_length'], torch.tensor([4, 6])))
+        self.assertTrue(torch.equal(sub_batch['input_seq'], torch.tensor([[2, 3], [6, 7]])))
+        np.testing.assert_array_equal(sub_batch['mask'], np.array([[1, 1], [0, 1]]))
+        self.assertEqual(sub_batch['names'].tolist(), [['y'], ['w']])
+
+        sub_batch['input_length'] = sub_batch['input_length'] - 1
+        sub_batch['input_seq'] = torch.zeros(2, 2, dtype=torch.long)
+        sub_batch['mask'] = np.ones((2, 2), dtype=np.int64)
+        sub_batch['names'] = np.array([['u'], ['v']], dtype=object)
+        res = scatter_batch(batch, sub_batch, index_list)
+        self.assertTrue(torch.equal(res['input_length'], torch.tensor([3, 3, 5, 5])))
+        self.assertTrue(torch.equal(res['input_seq'], torch.tensor([[0, 1], [0, 0], [4, 5], [0, 0]])))
+        np.testing.assert_array_equal(res['mask'], np.array([[1, 0], [1, 1], [0, 0], [1, 1]]))
+        self.assertEqual(res['names'].tolist(), [['x'], ['u'], ['z'], ['v']])
+        # the whole batch is not changed in place
+        self.assertTrue(torch.equal(batch['input_length'], torch.tensor([3, 4, 5, 6])))
+        np.testing.assert_array_equal(batch['mask'], np.array([[1, 0], [1, 1], [0, 0], [0, 1]]))
+        with self.assertRaises(ValueError):
+            scatter_batch(batch, {'input_seq': torch.zeros(2, 3, dtype=torch.long)}, index_list)
+        res = scatter_batch(batch, {'input_seq': torch.ones(2, 3, dtype=torch.long)}, index_list, fill_value=0)
+        self.assertTrue(torch.equal(res['input_seq'], torch.tensor([[0, 1, 0], [1, 1, 1], [4, 5, 0], [1, 1, 1]])))
+
+    def test_unpad_batch(self):
+        batch = {'id': [0, 1], 'input_seq': torch.tensor([[1, 2, 3], [4, 5, 0]]), 'input_length': torch.tensor([3, 2])}
+        self.assertEqual(unpad_batch(batch, {'input_seq': 'input_length'}),
+                         {'id': [0, 1], 'input_seq': [[1, 2, 3], [4, 5]], 'input_length': [3, 2]})
+
+    def test_splice_input_seq(self):
+        r = np.random.RandomState(0)
+        input_list = [list(r.randint(1, 50, size=r.randint(3, 20))) for _ in range(16)]
+        sample_list = [list(r.randint(1, 50, size=5)) for _ in input_list]
+        p1 = [r.randint(0, len(inp) - 2) for inp in input_list]
+        p2 = [r.randint(a + 1, len(inp)) for a, inp in zip(p1, input_list)]
+        sample_length = [r.randint(0, 6) for _ in input_list]
+        res, length = splice_input_seq(torch.tensor([inp + [0] * (20 - len(inp)) for inp in input_list]),
+                                       torch.tensor([len(inp) for inp in input_list]), torch.tensor(p1),
+                                       torch.tensor(p2), torch.tensor(sample_list), torch.tensor(sample_length))
+        expected = [inp[:a+1] + sample[:l] + inp[b:] for inp, sample, a, b, l in
+                    zip(input_list, sample_list, p1, p2, sample_length)]
+        self.assertEqual(length.tolist(), [len(e) for e in expected])
+        self.assertEqual(res.tolist(), [e + [0] * (res.shape[1] - len(e)) for e in expected])
+
+    def test_incremental_multi_step(self):
+        batch_data = {'id': [0, 1, 2, 3], 'includes': [[] for _ in range(4)], 'error_count': [1, 1, 1, 1],
+                      'input_seq': [list(range(10)) for _ in range(4)],
+                      'input_seq_name': [['t{}'.format(i) for i in range(10)] for _ in range(4)]}
+        target_lengths = [9, 7, 4, 8]
+        incremental = args_util.use_incremental_multi_step
+        try:
+            args_util.use_incremental_multi_step = False
+            model = FakeFixModel()
+            expected = run_one_batch(batch_data, model, target_lengths)
+            self.assertEqual(model.batch_sizes, [4, 4, 4, 4, 4, 4])
+            args_util.use_incremental_multi_step = True
+            model = FakeFixModel()
+            res = run_one_batch(batch_data, model, target_lengths)
+        finally:
+            args_util.use_incremental_multi_step = incremental
+        self.assertEqual(model.batch_sizes, [4, 3, 2, 1, 1, 1])
+        input_data, final_output_list, output_records_list, result_records_list, final_output_name_list, \
+            result_list, sample_steps = res
+        self.assertEqual(input_data, expected[0])
+        self.assertEqual(final_output_list, expected[1])
+        self.assertEqual(res[3:], expected[3:])
+        self.assertEqual(sample_steps, [1, 3, 6, 2])
+        # the records of a sample are the same until it is finished
+        for step, (records, expected_records) in enumerate(zip(output_records_list, expected[2])):
+            for i, s in enumerate(sample_steps):
+                if step < s:
+                    self.assertEqual(records[0][i], expected_records[0][i])
+
+    def test_same_as_whole_batch(self):
+        from tests.repair_server_test import create_engine
+        engine, codes = create_engine(count=8, length=60)
+        samples = [engine.create_sample(c, i) for i, c in enumerate(codes)]
+        batch_data = {k: [s[k] for s in samples] for k in samples[0].keys()}
+        target_lengths = [len(n) - d for n, d in zip(batch_data['input_seq_name'], [2, 4, 8, 12, 16, 24, 32, 48])]
+        input_seq_types = []
+        batch_sizes = []
+
+        def parse_input_batch_data_fn(input_data, do_sample=True):
+            input_seq_types.append(type(input_data['input_seq']))
+            batch_sizes.append(len(input_data['id']))
+            return engine.parse_input_batch_data_fn(input_data, do_sample)
+
+        res = {}
+        incremental = args_util.use_incremental_multi_step
+        engine.model.eval()
+        try:
+            for one_incremental in [False, True]:
+                args_util.use_incremental_multi_step = one_incremental
+                with torch.no_grad():
+                    res[one_incremental] = run_one_batch(batch_data, engine.model, target_lengths, 5,
+                                                         parse_input_batch_data_fn,
+                                                         engine.create_multi_step_next_input_batch_fn)
+        finally:
+            args_util.use_incremental_multi_step = incremental
+        steps = max(res[True][-1])
+        # the input ids stay in the device tensors after the first step
+        self.assertEqual(input_seq_types, ([list] + [torch.Tensor for _ in range(steps - 1)]) * 2)
+        self.assertEqual(batch_sizes[:steps], [8 for _ in range(steps)])
+        self.assertEqual(batch_sizes[steps:], [sum(s > i for s in res[True][-1]) for i in range(steps)])
+        self.assertEqual(res[True][0], res[False][0])
+        self.assertEqual(res[True][1], res[False][1])
+        self.assertEqual(res[True][3:], res[False][3:])
+        self.assertGreater(max(res[True][-1]), 1)
+        self.assertLess(min(res[True][-1]), 5)
+
+
+if __name__ == '__main__':
+    from tests.device_test import benchmark_cpu_multi_step_evaluate
+    for incremental in [False, True]:
+        args_util.use_incremental_multi_step = incremental
+        print('incremental multi step: {}'.format(incremental))
+        benchmark_cpu_multi_step_evaluate(max_step_times=5)
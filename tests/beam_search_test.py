@@ -0,0 +1,138 @@
+import time
+import unittest
+
+import torch
+import torch.nn.functional as F
+
+from common.torch_util import BeamSearchDynamicDecoder
+
+END_LABEL = 0
+START_LABEL = 1
+
+
+def create_markov_decoder(vocabulary_size, batch_size, call_sizes):
+    """
+    a toy decoder. The log probs depend on the last token, the batch item and the hidden. The hidden is the sum of the
+    input tokens, so the result is wrong if the hidden is not reordered with the beams.
+    """
+    transition = torch.randn(vocabulary_size, vocabulary_size)
+    transition[:, END_LABEL] += 1.0
+    batch_bias = torch.randn(batch_size, vocabulary_size)
+    hidden_weight = torch.randn(vocabulary_size) * 0.1
+
+    def decoder_fn(outputs, continue_mask, start_index, hidden, encoder_output, encoder_mask, bias=None):
+        call_sizes.append(outputs.shape[0])
+        hidden = hidden + outputs.view(1, -1, 1).float()
+        log_probs = F.log_softmax(transition[outputs.view(-1)] + bias + hidden[0] * hidden_weight, dim=-1)
+        return log_probs, hidden, []
+
+    def create_beam_next_output_fn(log_probs, continue_mask, beam_size, **kwargs):
+        probs, ids = torch.topk(log_probs, k=beam_size, dim=-1)
+        probs = torch.where(continue_mask.unsqueeze(-1), probs, torch.zeros_like(probs))
+        ids = ids.unsqueeze(-1)
+        return ids, probs.unsqueeze(-1), (ids, )
+
+    return (transition, hidden_weight), batch_bias, decoder_fn, create_beam_next_output_fn
+
+
+def reference_beam_search(transition, bias, beam_size, max_length):
+    transition, hidden_weight = transition
+    # (score, tokens, finished)
+    beams = [(0.0, [START_LABEL], False)]
+    for _ in range(max_length):
+        candidates = []
+        for score, tokens, finished in beams:
+            if finished:
+                candidates.append((score, tokens, True))
+                continue
+            log_probs = F.log_softmax(transition[tokens[-1]] + bias + sum(tokens) * hidden_weight, dim=-1)
+            probs, ids = torch.topk(log_probs, k=beam_size)
+            for p, t in zip(probs.tolist(), ids.tolist()):
+                candidates.append((score + p, tokens + [t], t == END_LABEL))
+        beams = sorted(candidates, key=lambda c: -c[0])[:beam_size]
+        if all(finished for _, _, finished in beams):
+            break
+    return beams
+
+
+class BeamSearchDynamicDecoderTest(unittest.TestCase):
+
+    def test_same_as_reference(self):
+        torch.manual_seed(0)
+        batch_size, vocabulary_size, beam_size, max_length = 6, 12, 4, 8
+        call_sizes = []
+        transition, batch_bias, decoder_fn, create_beam_next_output_fn = \
+            create_markov_decoder(vocabulary_size, batch_size, call_sizes)
+        decoder = BeamSearchDynamicDecoder(START_LABEL, END_LABEL, -1, decoder_fn, create_beam_next_output_fn,
+                                           max_length, beam_size)
+        hidden = torch.zeros(1, batch_size, 1)
+        decoder_output_list, outputs_list, error_stack = decoder.decoder(
+            torch.zeros(batch_size, 1), hidden, torch.ones(batch_size, 1), bias=batch_bias)
+        outputs = torch.cat(outputs_list, dim=2)
+        self.assertTrue(torch.equal(outputs, torch.cat([o[0] for o in decoder_output_list], dim=2)))
+        self.assertEqual(error_stack.shape, (batch_size, beam_size))
+        for b in range(batch_size):
+            ref = reference_beam_search(transition, batch_bias[b], beam_size, max_length)
+            for k, (_, tokens, _) in enumerate(ref):
+                res = outputs[b, k].tolist()
+                res = res[:res.index(END_LABEL) + 1] if END_LABEL in res else res
+                self.assertEqual(res, tokens[1:])
+        # one decoder call in each step and the finished batch items are removed
+        self.assertEqual(call_sizes[0], batch_size)
+        self.assertEqual(len(call_sizes), len(outputs_list))
+        self.assertTrue(all(a >= b for a, b in zip(call_sizes[1:], call_sizes[2:])))
+
+    def test_length_penalty(self):
+        torch.manual_seed(1)
+        batch_size, vocabulary_size, beam_size = 3, 10, 5
+        _, batch_bias, decoder_fn, create_beam_next_output_fn = create_markov_decoder(vocabulary_size, batch_size, [])
+        decoder = BeamSearchDynamicDecoder(START_LABEL, END_LABEL, -1, decoder_fn, create_beam_next_output_fn,
+                                           6, beam_size, length_penalty=1.0)
+        _, outputs_list, _ = decoder.decoder(torch.zeros(batch_size, 1), torch.zeros(1, batch_size, 1),
+                                             torch.ones(batch_size, 1), bias=batch_bias)
+        self.assertEqual(torch.cat(outputs_list, dim=2).shape[:2], (batch_size, beam_size))
+
+
+def benchmark_beam_search(batch_size=16, hidden_size=256, vocabulary_size=1000, max_length=10, repeat=3):
+    """
+    compare the batched beam search with calling the decoder once per beam in each step
+    """
+    torch.manual_seed(0)
+    embedding = torch.nn.Embedding(vocabulary_size, hidden_size)
+    gru = torch.nn.GRU(hidden_size, hidden_size, num_layers=2)
+    output = torch.nn.Linear(hidden_size, vocabulary_size)
+
+    def decoder_fn(outputs, continue_mask, start_index, hidden, encoder_output, encoder_mask):
+        o, hidden = gru(embedding(outputs).permute(1, 0, 2), hidden)
+        return F.log_softmax(output(o[0] + encoder_output), dim=-1), hidden, []
+
+    def create_beam_next_output_fn(log_probs, continue_mask, beam_size, **kwargs):
+        probs, ids = torch.topk(log_probs, k=beam_size, dim=-1)
+        probs = torch.where(continue_mask.unsqueeze(-1), probs, torch.zeros_like(probs))
+        return ids.unsqueeze(-1), probs.unsqueeze(-1), (ids.unsqueeze(-1), )
+
+    encoder_output = torch.randn(batch_size, hidden_size)
+    hidden = torch.zeros(2, batch_size, hidden_size)
+    encoder_mask = torch.ones(batch_size, 1)
+    with torch.no_grad():
+        for beam_size in [1, 2, 5, 10]:
+            decoder = BeamSearchDynamicDecoder(START_LABEL, vocabulary_size + 1, -1, decoder_fn,
+                                               create_beam_next_output_fn, max_length, beam_size)
+            begin = time.time()
+            for _ in range(repeat):
+                decoder.decoder(encoder_output, hidden, encoder_mask)
+            batched_time = (time.time() - begin) / repeat
+
+            begin = time.time()
+            outputs = torch.full((batch_size, 1), START_LABEL, dtype=torch.long)
+            for _ in range(repeat):
+                for _ in range(max_length):
+                    for _ in range(beam_size):
+                        decoder_fn(outputs, None, 0, hidden, encoder_output, encoder_mask)
+            loop_time = (time.time() - begin) / repeat
+            print('beam_size: {}, batched beam search: {:.4f}s, decoder calls in a beam loop: {:.4f}s'.format(
+                beam_size, batched_time, loop_time))
+
+
+if __name__ == '__main__':
+    benchmark_beam_search()
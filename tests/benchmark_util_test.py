@@ -0,0 +1,73 @@
+import os
+import tempfile
+import time
+import unittest
+
+from common.benchmark_util import latency_percentiles, run_stage, save_baseline, load_baseline, \
+    compare_with_baseline, format_results, format_comparison
+from common.pycparser_util import tokenize_by_clex_fn
+from experiment.benchmark_stages import create_synthetic_corpus, run_benchmark_stages
+
+
+class BenchmarkUtilTest(unittest.TestCase):
+
+    def test_latency_percentiles(self):
+        res = latency_percentiles([i / 1000 for i in range(1, 101)])
+        self.assertEqual(list(res.keys()), ['p50_ms', 'p90_ms', 'p99_ms'])
+        self.assertAlmostEqual(res['p50_ms'], 50.5)
+        self.assertAlmostEqual(res['p99_ms'], 99.01)
+
+    def test_run_stage(self):
+        calls = []
+
+        def fn(batch):
+            calls.append(batch)
+            time.sleep(0.001)
+            return sum(batch)
+
+        res, outputs = run_stage('sum', fn, [[1, 2], [3, 4, 5]], warmup=1)
+        self.assertEqual(outputs, [3, 12])
+        # the warmup call is not timed
+        self.assertEqual(len(calls), 3)
+        self.assertEqual((res['calls'], res['items']), (2, 5))
+        self.assertAlmostEqual(res['throughput'], 5 / res['total_time'])
+        self.assertGreater(res['p50_ms'], 0.5)
+        self.assertGreater(res['peak_rss_mb'], 0)
+        self.assertIn('sum', format_results([res]))
+
+    def test_baseline(self):
+        path = os.path.join(tempfile.mkdtemp(), 'baseline', 'baseline.json')
+        self.assertEqual(load_baseline(path), (None, {}))
+        base = {'stage': 'a', 'throughput': 100.0, 'p50_ms': 10.0, 'p90_ms': 20.0, 'peak_rss_mb': 100.0}
+        save_baseline([base], path, {'count': 10})
+        meta, baseline_results = load_baseline(path)
+        self.assertEqual(meta, {'count': 10})
+
+        now = {'stage': 'a', 'throughput': 50.0, 'p50_ms': 5.0, 'p90_ms': 21.0, 'peak_rss_mb': 100.0}
+        comparison = compare_with_baseline([now, dict(base, stage='b')], baseline_results, threshold=0.1)
+        self.assertEqual([(c[1], c[-1]) for c in comparison],
+                         [('throughput', True), ('p50_ms', False), ('p90_ms', False), ('peak_rss_mb', False)])
+        self.assertAlmostEqual(comparison[0][4], -0.5)
+        self.assertAlmostEqual(comparison[1][4], 0.5)
+        self.assertIn('REGRESSION', format_comparison(comparison))
+
+    def test_synthetic_corpus(self):
+        df, vocabulary = create_synthetic_corpus(20, length=60)
+        tokenize_fn = tokenize_by_clex_fn()
+        for code in df['ac_code']:
+            tokens = [tok.value for tok in tokenize_fn(code)]
+            self.assertEqual(tokens, code.split(' '))
+            self.assertTrue(all(vocabulary.word_to_id(t) != vocabulary.word_to_id(vocabulary.unk) for t in tokens))
+        self.assertEqual(list(create_synthetic_corpus(20, length=60)[0]['ac_code']), list(df['ac_code']))
+
+    def test_all_stages(self):
+        results = run_benchmark_stages(['tokenize', 'model_forward', 'insert_items'], count=12, length=60,
+                                       batch_size=4, hidden_size=16)
+        self.assertEqual([r['stage'] for r in results], ['tokenize', 'model_forward', 'insert_items'])
+        self.assertEqual(results[0]['items'], 12)
+        self.assertTrue(all(r['items'] > 0 for r in results))
+
+
+if __name__ == '__main__':
+    results = run_benchmark_stages(count=100)
+    print(format_results(results))
@@ -0,0 +1,115 @@
+import random
+import time
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from error_generation.find_closest_group_data.banded_levenshtein import banded_levenshtein_distance
+from error_generation.find_closest_group_data.closest_candidate_index import ClosestCandidateIndex
+from error_generation.find_closest_group_data.token_level_closest_text import find_closest_token_text, \
+    get_token_value
+from experiment.benchmark_stages import create_synthetic_program
+from tests.levenshtein_test import Token, random_edit
+
+
+def create_synthetic_group(r, ac_count, error_count, length=200):
+    """
+    the accepted codes are edits of some base programs and the error codes are small edits of the accepted codes
+    """
+    bases = [create_synthetic_program(r, length) for _ in range(3)]
+    alphabet = sorted(set(t for base in bases for t in base))
+    ac_list = [random_edit(r, r.choice(bases), r.randint(0, 40), alphabet) for _ in range(ac_count)]
+    error_list = [random_edit(r, r.choice(ac_list), r.randint(1, 15), alphabet) for _ in range(error_count)]
+    return ac_list, error_list
+
+
+def brute_force_closest(index, tokens, max_distance=None, candidate_mask=None):
+    ids = index.interner.intern(tokens)
+    distances = pd.Series([banded_levenshtein_distance(ids, c, max_distance=max_distance)
+                           for c in index.candidate_ids])
+    if candidate_mask is not None:
+        distances = distances[np.asarray(candidate_mask)]
+    if len(distances) == 0:
+        return None, None
+    min_id = distances.idxmin()
+    return int(min_id), int(distances.loc[min_id])
+
+
+class ClosestCandidateIndexTest(unittest.TestCase):
+
+    def test_lower_bounds(self):
+        r = random.Random(1)
+        for _ in range(20):
+            ac_list, error_list = create_synthetic_group(r, 10, 5, length=60)
+            index = ClosestCandidateIndex(ac_list, token_bins=16, qgram_bins=16)
+            for error in error_list:
+                ids = index.interner.intern(error)
+                distances = [banded_levenshtein_distance(ids, c) for c in index.candidate_ids]
+                self.assertTrue(np.all(index.lower_bounds(ids) <= np.array(distances)))
+
+    def test_same_as_brute_force(self):
+        r = random.Random(2)
+        for _ in range(20):
+            ac_list, error_list = create_synthetic_group(r, 20, 10, length=80)
+            # duplicate codes make ties of the min distance
+            ac_list += ac_list[:5]
+            index = ClosestCandidateIndex(ac_list)
+            for error in error_list:
+                max_distance = r.choice([None, 0, 1, 5, 10, 30])
+                mask = [r.random() < 0.8 for _ in ac_list] if r.random() < 0.5 else None
+                self.assertEqual(index.closest(error, max_distance=max_distance, candidate_mask=mask),
+                                 brute_force_closest(index, error, max_distance=max_distance, candidate_mask=mask))
+        self.assertEqual(index.closest(error_list[0], candidate_mask=[False] * len(ac_list)), (None, None))
+        self.assertGreater(index.pruned_count, 0)
+
+    def test_find_closest_token_text(self):
+        r = random.Random(3)
+        ac_list, error_list = create_synthetic_group(r, 15, 10, length=80)
+        includes = ['#include <stdio.h>\n', '#include <math.h>\n']
+        ac_df = pd.DataFrame({'id': list(range(len(ac_list))),
+                              'code': [r.choice(includes) + ' '.join(t) for t in ac_list],
+                              'tokenize': [[Token(t) for t in ac] for ac in ac_list]},
+                             index=list(range(100, 100 + len(ac_list))))
+        index = ClosestCandidateIndex(ac_df['tokenize'], get_token_value)
+        for error in error_list:
+            for max_distance in [None, 10]:
+                one = pd.Series({'code': r.choice(includes) + ' '.join(error),
+                                 'tokenize': [Token(t) for t in error]})
+                res = find_closest_token_text(one.copy(), ac_df, max_distance=max_distance, index=index)
+                expected = find_closest_token_text(one.copy(), ac_df, max_distance=max_distance)
+                self.assertEqual(res['similar_id'], expected['similar_id'])
+                self.assertEqual(res['distance'], expected['distance'])
+                self.assertEqual(res['action_list'], expected['action_list'])
+
+
+def benchmark_closest_candidate_index(group_count=5, ac_count=100, error_count=20, length=300, max_distance=None):
+    r = random.Random(4)
+    groups = [create_synthetic_group(r, ac_count, error_count, length) for _ in range(group_count)]
+    query_count = group_count * error_count
+    print('{} groups of {} accepted codes and {} error codes, {} tokens'.format(group_count, ac_count, error_count,
+                                                                              length))
+
+    begin = time.time()
+    brute_force = []
+    for ac_list, error_list in groups:
+        index = ClosestCandidateIndex(ac_list)
+        brute_force += [brute_force_closest(index, error, max_distance=max_distance) for error in error_list]
+    print('brute force: {} exact distances, {:.1f} queries/s'.format(query_count * ac_count,
+                                                                     query_count / (time.time() - begin)))
+
+    begin = time.time()
+    evaluated_count = 0
+    res = []
+    for ac_list, error_list in groups:
+        index = ClosestCandidateIndex(ac_list)
+        res += [index.closest(error, max_distance=max_distance) for error in error_list]
+        evaluated_count += index.evaluated_count
+    print('index: {} exact distances ({:.1f}% avoided), {:.1f} queries/s including the index build'.format(
+        evaluated_count, 100 * (1 - evaluated_count / (query_count * ac_count)), query_count / (time.time() - begin)))
+    print('same neighbors: {}'.format(res == brute_force))
+
+
+if __name__ == '__main__':
+    benchmark_closest_candidate_index()
+    benchmark_closest_candidate_index(max_distance=101)
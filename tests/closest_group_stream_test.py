@@ -0,0 +1,128 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from common.constants import ACTUAL_C_ERROR_RECORDS
+from common.util import bounded_parallel_imap
+from database.database_util import close_connections
+from error_generation.find_closest_group_data.closest_group_stream import iter_submit_groups, \
+    run_closest_group_stream, load_checkpoint
+
+mined_groups = []
+fail_group = None
+
+
+def fake_find_closest_group(one_group):
+    puid = one_group['problem_user_id'].iloc[0]
+    mined_groups.append(puid)
+    if puid == fail_group:
+        raise RuntimeError('worker crashed in {}'.format(puid))
+    ac_df = one_group[one_group['status'] == 1]
+    error_df = one_group[one_group['status'] != 1].copy()
+    error_df['similar_code'] = ac_df['code'].iloc[0]
+    return error_df, ac_df
+
+
+def fake_transform(one):
+    return [one['id'], one['submit_url'], one['problem_id'], one['user_id'], one['problem_user_id'], one['code'], 0,
+            0, one['similar_code'], '[]', 1]
+
+
+def square(x):
+    return x * x
+
+
+def create_submit_db(path, problem_count=4, user_count=3):
+    con = sqlite3.connect(path)
+    con.execute('CREATE TABLE submit (id TEXT, submit_url TEXT, problem_id TEXT, user_id TEXT, problem_name TEXT, '
+                'language TEXT, status TEXT, code TEXT)')
+    items = []
+    for p in range(problem_count):
+        for u in range(user_count):
+            for k, status in enumerate(['COMPILATION_ERROR', 'OK', 'WRONG_ANSWER', 'OK']):
+                code = '"int main(){{return {};}}"'.format(k)
+                items.append(('{}_{}_{}'.format(p, u, k), 'url', str(p), 'u{}'.format(u), 'P{}'.format(p), 'GNU C',
+                              status, code))
+    # a record of other language and a non ascii one are skipped
+    items.append(('other', 'url', '0', 'u0', 'P0', 'GNU C++', 'OK', '"int main(){}"'))
+    items.append(('ascii', 'url', '0', 'u0', 'P0', 'GNU C', 'OK', '"int main(){中}"'))
+    # insert in a random order, the reader sorts them
+    items.sort(key=lambda x: x[0][::-1])
+    con.executemany('INSERT INTO submit VALUES (?, ?, ?, ?, ?, ?, ?, ?)', items)
+    con.commit()
+    con.close()
+
+
+class ClosestGroupStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        global fail_group
+        fail_group = None
+        del mined_groups[:]
+        self.dir_path = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.dir_path, 'scrapyOJ.db')
+        self.db_path = os.path.join(self.dir_path, 'train_data.db')
+        create_submit_db(self.source_path)
+
+    def tearDown(self):
+        close_connections()
+
+    def read_ids(self):
+        con = sqlite3.connect(self.db_path)
+        ids = sorted(r[0] for r in con.execute('select id from {}'.format(ACTUAL_C_ERROR_RECORDS)))
+        con.close()
+        return ids
+
+    def test_iter_submit_groups(self):
+        groups = list(iter_submit_groups(self.source_path, 'GNU C', status_list=['OK', 'COMPILATION_ERROR']))
+        self.assertEqual([g[:2] for g in groups], [('P{}'.format(p), 'u{}'.format(u)) for p in range(4)
+                                                   for u in range(3)])
+        self.assertEqual([r[0] for r in groups[0][2]], ['0_0_0', '0_0_1', '0_0_3'])
+        self.assertEqual(groups[0][2][0][-2:], (7, 'int main(){return 0;}'))
+        groups = list(iter_submit_groups(self.source_path, 'GNU C', after_key=('P2', 'u0')))
+        self.assertEqual(groups[0][:2], ('P2', 'u1'))
+        self.assertEqual(len(groups), 5)
+
+    def test_parallel_run(self):
+        res = run_closest_group_stream(fake_find_closest_group, fake_transform, self.db_path, ACTUAL_C_ERROR_RECORDS,
+                                       self.source_path, 'GNU C', core_num=2, max_pending=2, commit_group_count=5)
+        self.assertEqual(res, (12, 24))
+        self.assertEqual(len(self.read_ids()), 24)
+
+    def test_bounded_parallel_imap(self):
+        self.assertEqual(list(bounded_parallel_imap(2, square, iter(range(20)), max_pending=3)),
+                         [i * i for i in range(20)])
+        self.assertEqual(list(bounded_parallel_imap(0, square, range(5))), [0, 1, 4, 9, 16])
+
+    def test_resume(self):
+        global fail_group
+        expected_ids = sorted('{}_{}_{}'.format(p, u, k) for p in range(4) for u in range(3) for k in [0, 2])
+
+        fail_group = 'P2_u1'
+        with self.assertRaises(RuntimeError):
+            run_closest_group_stream(fake_find_closest_group, fake_transform, self.db_path, ACTUAL_C_ERROR_RECORDS,
+                                     self.source_path, 'GNU C', core_num=0, commit_group_count=2)
+        # the groups before the last commit are saved with the checkpoint
+        self.assertEqual(load_checkpoint(self.db_path, ACTUAL_C_ERROR_RECORDS), (('P1', 'u2'), 6, 12))
+        self.assertEqual(self.read_ids(), expected_ids[:12])
+
+        fail_group = None
+        del mined_groups[:]
+        res = run_closest_group_stream(fake_find_closest_group, fake_transform, self.db_path, ACTUAL_C_ERROR_RECORDS,
+                                       self.source_path, 'GNU C', core_num=0, commit_group_count=2)
+        self.assertEqual(res, (12, 24))
+        # the saved groups are not mined again
+        self.assertEqual(mined_groups, ['P{}_u{}'.format(p, u) for p in [2, 3] for u in range(3)])
+        self.assertEqual(self.read_ids(), expected_ids)
+        del mined_groups[:]
+
+        # the finished run does nothing
+        res = run_closest_group_stream(fake_find_closest_group, fake_transform, self.db_path, ACTUAL_C_ERROR_RECORDS,
+                                       self.source_path, 'GNU C', core_num=2, commit_group_count=2)
+        self.assertEqual(res, (12, 24))
+        self.assertEqual(len(mined_groups), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
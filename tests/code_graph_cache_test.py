@@ -0,0 +1,149 @@
+import random
+import tempfile
+import time
+import unittest
+
+import config
+from c_parser.ast_parser import create_code_graph, parse_ast_code_graph
+from c_parser.code_graph_cache import CodeGraphCache, CachedCodeGraph, encode_code_graph, decode_code_graph
+from common import args_util
+from experiment.benchmark_stages import create_synthetic_program
+from experiment.experiment_dataset import CombineNodeIterateErrorDataSet
+from tests.columnar_store_test import create_iterate_df
+
+CODES = [
+    'int main ( ) { int a = 1 ; int b = a + 2 ; printf ( "%d" , a + b ) ; return 0 ; }',
+    'int add ( int a , int b ) { return a + b ; } int main ( ) { int c = add ( 1 , 2 ) ; return c ; }',
+    'int main ( ) { int i ; for ( i = 0 ; i < 10 ; i ++ ) { if ( i % 2 ) continue ; } return 0 ; }',
+]
+
+
+def create_token_lists(count=20, seed=1):
+    r = random.Random(seed)
+    token_lists = [code.split(' ') for code in CODES]
+    for _ in range(count):
+        token_lists.append(create_synthetic_program(r, r.randint(10, 200)))
+    return token_lists
+
+
+def graph_or_error(fn, token_list):
+    try:
+        code_graph = fn(token_list)
+    except Exception as e:
+        return type(e).__name__
+    return code_graph.graph, code_graph.graph_length, code_graph.code_length
+
+
+class CodeGraphVocabulary(object):
+    begin_tokens = ['<BEGIN>', '<INNER_BEGIN>']
+    end_tokens = ['<END>', '<INNER_END>']
+
+    def __init__(self):
+        self.word_id = {}
+
+    def word_to_id(self, word):
+        return self.word_id.setdefault(word, len(self.word_id))
+
+
+class CodeGraphCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db_path = tempfile.mkdtemp() + '/cache/code_graph.db'
+
+    def test_encode(self):
+        for token_list in create_token_lists():
+            expected = graph_or_error(create_code_graph, token_list)
+            if isinstance(expected, str):
+                continue
+            graph = decode_code_graph(encode_code_graph(create_code_graph(token_list)))
+            self.assertIsInstance(graph, CachedCodeGraph)
+            self.assertEqual((graph.graph, graph.graph_length, graph.code_length), expected)
+
+    def test_cache(self):
+        token_lists = create_token_lists()
+        cache = CodeGraphCache(self.db_path, lru_size=5)
+        for token_list in token_lists:
+            self.assertEqual(graph_or_error(cache.get_or_parse, token_list),
+                             graph_or_error(create_code_graph, token_list))
+        self.assertEqual(cache.hits, 0)
+        # the last ones are in the LRU
+        graph = cache.get_or_parse(token_lists[-1])
+        self.assertIs(cache.get_or_parse(token_lists[-1]), graph)
+        self.assertLessEqual(len(cache._lru), 5)
+        parsed_count = len(cache)
+        cache.close()
+
+        # the graphs are read from the store by a new cache
+        cache = CodeGraphCache(self.db_path)
+        self.assertEqual(cache.precompute(token_lists), len(token_lists) - parsed_count)
+        for token_list in token_lists:
+            self.assertEqual(graph_or_error(cache.get_or_parse, token_list),
+                             graph_or_error(create_code_graph, token_list))
+        self.assertEqual(cache.hits, parsed_count)
+
+    def test_precompute_workers(self):
+        token_lists = create_token_lists(60, seed=2)
+        cache = CodeGraphCache(self.db_path, core_num=2, shard_size=10)
+        cache.precompute(token_lists)
+        expected = [graph_or_error(create_code_graph, t) for t in token_lists]
+        self.assertEqual(len(cache), len([e for e in expected if not isinstance(e, str)]))
+        self.assertEqual(cache.precompute(token_lists), len(token_lists) - len(cache))
+        self.assertEqual([graph_or_error(cache.get_or_parse, t) for t in token_lists], expected)
+
+    def test_dataset(self):
+        df = create_iterate_df(20, words=['int', 'main', '(', ')', '{', '}', 'a', '=', '1', ';', 'return'])
+        df['error_token_name_list'] = [['<BEGIN>'] + t + ['<END>'] for t in create_token_lists(17)]
+
+        def create_samples():
+            vocab = CodeGraphVocabulary()
+            dataset = CombineNodeIterateErrorDataSet(df.copy(), vocab, 'train', do_flatten=True, use_ast=True)
+            samples = []
+            for i in range(len(dataset)):
+                random.seed(i)
+                try:
+                    samples.append(dataset[i])
+                except Exception as e:
+                    samples.append(type(e).__name__)
+            return samples
+
+        expected = create_samples()
+        old_path = config.code_graph_cache_path
+        args_util.use_code_graph_cache = True
+        config.code_graph_cache_path = self.db_path
+        try:
+            self.assertEqual(create_samples(), expected)
+            self.assertEqual(create_samples(), expected)
+            self.assertEqual(args_util.get_code_graph_cache().misses, 0)
+            self.assertIsInstance(parse_ast_code_graph(CODES[0].split(' ')), CachedCodeGraph)
+        finally:
+            args_util.use_code_graph_cache = False
+            args_util.code_graph_cache = None
+            config.code_graph_cache_path = old_path
+
+
+def benchmark_code_graph_cache(count=500, epochs=3):
+    r = random.Random(1)
+    token_lists = [create_synthetic_program(r, r.randint(50, 300)) for _ in range(count)]
+
+    def run_epochs(fn):
+        begin = time.time()
+        for _ in range(epochs):
+            for token_list in token_lists:
+                try:
+                    fn(token_list).graph
+                except Exception as e:
+                    pass
+        return (time.time() - begin) / epochs
+
+    print('parse every access: {:.3f} s/epoch'.format(run_epochs(create_code_graph)))
+    cache = CodeGraphCache(tempfile.mkdtemp() + '/code_graph.db', lru_size=100)
+    begin = time.time()
+    cache.precompute(token_lists)
+    print('precompute: {:.3f} s'.format(time.time() - begin))
+    print('sqlite store: {:.3f} s/epoch'.format(run_epochs(cache.get_or_parse)))
+    cache.lru_size = count
+    print('LRU: {:.3f} s/epoch'.format(run_epochs(cache.get_or_parse)))
+
+
+if __name__ == '__main__':
+    benchmark_code_graph_cache()
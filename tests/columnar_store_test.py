@@ -0,0 +1,190 @@
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import config
+from common import args_util
+from common.columnar_store import ColumnarStore, ColumnarRows, load_or_create_columnar_store, \
+    evict_columnar_stores
+from experiment.experiment_dataset import CombineNodeIterateErrorDataSet
+
+WORDS = ['int', 'main', '(', ')', '{', '}', 'return', '0', ';', 'a', '=', '+', 'printf', '"%d"', ',']
+
+
+class FakeVocabulary(object):
+    begin_tokens = ['<BEGIN>', '<INNER_BEGIN>']
+    end_tokens = ['<END>', '<INNER_END>']
+
+    def __init__(self, words=WORDS):
+        self.word_id = {w: i for i, w in enumerate(self.begin_tokens + self.end_tokens + words)}
+
+    def word_to_id(self, word):
+        return self.word_id[word]
+
+
+def create_iterate_df(count, seed=1, words=WORDS):
+    """
+    a flatten iterate error DataFrame with the columns read by CombineNodeIterateErrorDataSet
+    """
+    r = random.Random(seed)
+    vocab = FakeVocabulary(words)
+    records = []
+    for i in range(count):
+        names = ['<BEGIN>'] + [r.choice(words) for _ in range(r.randint(5, 60))] + ['<END>']
+        ids = [vocab.word_to_id(n) for n in names]
+        sample_length = r.randint(1, 5)
+        start = r.randint(0, len(ids) - 2)
+        records.append({
+            'id': 'prog_{}'.format(i),
+            'includes': ['stdio.h'] if i % 2 == 0 else [],
+            'distance': r.randint(1, 4),
+            'error_token_id_list': ids,
+            'error_token_name_list': names,
+            'sample_ac_id_list': [r.choice(ids) for _ in range(sample_length)],
+            'is_copy_list': [r.randint(0, 1) for _ in range(sample_length)],
+            'copy_pos_list': [r.randint(0, len(ids) - 1) for _ in range(sample_length)],
+            'sample_mask_list': sorted(set(ids)),
+            'target_ac_token_id_list': ids,
+            'ac_code_ids': ids,
+            'ac_code_name_with_labels': names,
+            'error_pos_list': (start, start + 1),
+            'ac_pos_list': [(start, start + sample_length)],
+        })
+    return pd.DataFrame(records)
+
+
+class ColumnarStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+
+    def test_round_trip(self):
+        df = create_iterate_df(50)
+        df['nested'] = [[[i, -i], [], [2 ** 40]] if i % 3 == 0 else [] for i in range(len(df))]
+        df['score'] = [0.5 * i for i in range(len(df))]
+        df['mixed'] = [None if i % 2 == 0 else [i] for i in range(len(df))]
+        df['array'] = [np.arange(i % 4) for i in range(len(df))]
+        store = load_or_create_columnar_store(df, self.dir_path + '/store')
+        self.assertIsInstance(store.columns['error_token_id_list'].leaves, np.memmap)
+        self.assertEqual(store.columns['error_token_id_list'].leaves.dtype, np.int16)
+        self.assertEqual(store.columns['nested'].leaves.dtype, np.int64)
+        self.assertEqual(store.columns['mixed'].kind, 'object')
+        self.assertEqual(len(store), len(df))
+        for i, (index, row) in enumerate(df.iterrows()):
+            for name in df.columns:
+                if name == 'array':
+                    np.testing.assert_array_equal(store.get(i, name), row[name])
+                    continue
+                value = store.get(i, name)
+                self.assertEqual(value, row[name])
+                self.assertEqual(type(value), type(row[name]))
+        # the saved store is loaded instead of created again
+        self.assertEqual(load_or_create_columnar_store(None, self.dir_path + '/store').get(3, 'id'), 'prog_3')
+
+    def test_fingerprint_and_evict(self):
+        df = create_iterate_df(10)
+        other = create_iterate_df(10, seed=2)
+        dir_path = self.dir_path + '/store-a'
+        load_or_create_columnar_store(df, dir_path, 'a')
+        # a store saved for another content is created again
+        store = load_or_create_columnar_store(other, dir_path, 'b')
+        self.assertEqual(store.get(0, 'error_token_id_list'), other['error_token_id_list'][0])
+        self.assertEqual(ColumnarStore.load_meta(dir_path)['fingerprint'], 'b')
+
+        paths = []
+        for i in range(4):
+            paths.append('{}/prefix-{}'.format(self.dir_path, i))
+            load_or_create_columnar_store(df, paths[-1])
+            time.sleep(0.01)
+        store = ColumnarStore.load(paths[0])
+        self.assertEqual(evict_columnar_stores(self.dir_path, 'prefix-', 2, keep_paths=(paths[1], )), [paths[2]])
+        self.assertEqual(evict_columnar_stores(self.dir_path, 'prefix-', 1), [paths[1], paths[3]])
+        self.assertTrue(ColumnarStore.exists(paths[0]))
+        self.assertTrue(ColumnarStore.exists(dir_path))
+        # the removed store is still readable by the memory mapped arrays
+        self.assertEqual(ColumnarStore.load(paths[0]).get(1, 'id'), store.get(1, 'id'))
+
+    def test_rows(self):
+        store = ColumnarStore.from_df(create_iterate_df(10))
+        rows = ColumnarRows(store)
+        self.assertEqual([r['id'] for r in rows[2:5]], ['prog_2', 'prog_3', 'prog_4'])
+        combined = rows[:2] + rows[8:]
+        self.assertIsInstance(combined, ColumnarRows)
+        self.assertEqual([r['id'] for r in combined], ['prog_0', 'prog_1', 'prog_8', 'prog_9'])
+        self.assertEqual(len(rows + [None]), 11)
+        self.assertEqual(len(random.sample(rows, 3)), 3)
+        self.assertEqual(rows[-1].to_dict()['id'], 'prog_9')
+
+    def test_dataset(self):
+        df = create_iterate_df(40)
+        vocab = FakeVocabulary()
+
+        def create_samples():
+            dataset = CombineNodeIterateErrorDataSet(df.copy(), vocab, 'train', do_flatten=True)
+            samples = []
+            for i in range(len(dataset)):
+                random.seed(i)
+                samples.append(dataset[i])
+            return dataset, samples
+
+        dataset, expected = create_samples()
+        old_path = config.columnar_dataset_path
+        args_util.use_columnar_dataset = True
+        config.columnar_dataset_path = self.dir_path
+        try:
+            dataset, res = create_samples()
+        finally:
+            args_util.use_columnar_dataset = False
+            config.columnar_dataset_path = old_path
+        self.assertIsNone(dataset.data_df)
+        self.assertIsInstance(dataset._samples[0].row['id'], str)
+        self.assertEqual(res, expected)
+
+    def test_dataset_add_samples(self):
+        vocab = FakeVocabulary()
+        old_path = config.columnar_dataset_path
+        args_util.use_columnar_dataset = True
+        config.columnar_dataset_path = self.dir_path
+        try:
+            dataset = CombineNodeIterateErrorDataSet(create_iterate_df(10), vocab, 'train', do_flatten=True)
+            for seed in range(2, 8):
+                dataset.add_samples(create_iterate_df(10, seed=seed))
+            # the same df reuses its store
+            CombineNodeIterateErrorDataSet(create_iterate_df(10, seed=7), vocab, 'train', do_flatten=True)
+        finally:
+            args_util.use_columnar_dataset = False
+            config.columnar_dataset_path = old_path
+        self.assertEqual(len(dataset), 70)
+        self.assertEqual(len(os.listdir(self.dir_path)), config.columnar_dataset_max_stores)
+        self.assertEqual(dataset._samples[0]['id'], 'prog_0')
+
+
+def benchmark_columnar_store(count=20000, word_count=5000):
+    # the ids of a real vocabulary are not the cached small ints
+    words = WORDS + ['v{}'.format(i) for i in range(word_count)]
+    tracemalloc.start()
+    df = create_iterate_df(count, words=words)
+    rows = [row for i, row in df.iterrows()]
+    series_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    store = load_or_create_columnar_store(df, tempfile.mkdtemp() + '/store')
+    print('pandas Series rows: {:.1f} MB, columnar store: {:.1f} MB'.format(series_bytes / 2 ** 20,
+                                                                           store.nbytes() / 2 ** 20))
+    columnar_rows = ColumnarRows(store)
+    for name, samples in [('pandas Series', rows), ('columnar', columnar_rows)]:
+        begin = time.time()
+        for i in range(count):
+            row = samples[i]
+            row['error_token_id_list'] + row['sample_ac_id_list']
+            row['error_token_name_list'][1:-1]
+        print('{} rows: {:.0f} reads/s'.format(name, count / (time.time() - begin)))
+
+
+if __name__ == '__main__':
+    benchmark_columnar_store()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import unittest
+
+from common.compile_cache import CompileCache, compile_cache_key
+
+
+class CompileCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db_path = os.path.join(tempfile.mkdtemp(), 'compile_cache.db')
+
+    def test_normalized_key(self):
+        code = '#include <stdio.h>\nint main ( ) { return 0 ; }'
+        self.assertEqual(compile_cache_key(code), compile_cache_key('  #include <stdio.h>\n\n' + code.split('\n')[1]))
+        self.assertNotEqual(compile_cache_key(code, mode='c'), compile_cache_key(code, mode='c89'))
+
+    def test_get_and_put(self):
+        cache = CompileCache(self.db_path)
+        code_list = ['int main ( ) { return 0 ; }', 'int main ( ) { return 0 }']
+        self.assertEqual(cache.get_many(code_list), [None, None])
+        cache.put_many(code_list, [True, False], [[], ["expected ';' before '}' token"]])
+        self.assertEqual(cache.get_many(code_list), [(True, []), (False, ["expected ';' before '}' token"])])
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 2)
+
+        # a record without error messages is missed when the error messages are needed
+        cache.put('int a', False)
+        self.assertIsNone(cache.get('int a'))
+        self.assertEqual(cache.get('int a', need_errors=False), (False, None))
+        # it doesn't cover the error messages saved before
+        cache.put(code_list[1], False)
+        self.assertEqual(cache.get(code_list[1]), (False, ["expected ';' before '}' token"]))
+
+    def test_evict(self):
+        cache = CompileCache(self.db_path, max_entries=10, evict_check_steps=5)
+        for i in range(30):
+            cache.put('int a{} ;'.format(i), True, [])
+        self.assertEqual(len(cache), 10)
+        self.assertIsNotNone(cache.get('int a29 ;'))
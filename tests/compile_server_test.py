@@ -0,0 +1,96 @@
+import os
+import tempfile
+import time
+import unittest
+
+from common.compile_server import CompileServer, GccCompiler, benchmark_compile
+
+code = r'''
+#include<stdio.h>
+
+int main(){
+    int a=0, b=0;
+    printf("a %d, b %d", a, b);
+    return 0;
+}
+'''
+
+error_code = r'''
+#include<stdio.h>
+
+int main(){
+    int a=0, b=0
+    printf("a %d, b %d", a, b);
+    return 0;
+}
+'''
+
+
+class CompileServerTest(unittest.TestCase):
+
+    def test_local_compile(self):
+        compiler = GccCompiler()
+        res, _ = compiler.compile(code)
+        self.assertTrue(res)
+        res, texts = compiler.compile(error_code)
+        self.assertFalse(res)
+        self.assertIn("main.c:6:5: error: expected ',' or ';' before 'printf'", texts)
+
+    def test_server_compile_many(self):
+        server = CompileServer(2)
+        res_list = server.compile_many([code, error_code, code, 'int main(){return 0}'])
+        server.close()
+        server.join()
+        self.assertEqual([r for r, _ in res_list], [True, False, True, False])
+
+    def test_target_file_path(self):
+        directory = tempfile.mkdtemp()
+        res, _ = GccCompiler().compile(code, target_file_path=os.path.join(directory, 'local.out'))
+        self.assertTrue(res)
+        self.assertTrue(os.path.isfile(os.path.join(directory, 'local.out')))
+        server = CompileServer(1)
+        try:
+            self.assertTrue(server.compile(code, target_file_path=os.path.join(directory, 'server.out'))[0])
+        finally:
+            server.close()
+            server.join()
+        self.assertTrue(os.path.isfile(os.path.join(directory, 'server_{}.out'.format(server._workers[0].pid))))
+
+    def test_dead_worker(self):
+        marker = os.path.join(tempfile.mkdtemp(), 'marker')
+        server = CompileServer(2, poll_seconds=0.1)
+        try:
+            self.assertEqual(server.map(exit_once, [(marker, 1), (marker, 2), (marker, 3)]), [1, 2, 3])
+            self.assertTrue(all(p.is_alive() for p in server._workers))
+        finally:
+            server.close()
+            server.join()
+
+    def test_result_timeout(self):
+        server = CompileServer(1, result_timeout=0.5, poll_seconds=0.1)
+        try:
+            begin = time.time()
+            with self.assertRaises(TimeoutError):
+                server.map(time.sleep, [3])
+            self.assertLess(time.time() - begin, 2)
+        finally:
+            server.terminate()
+
+
+def exit_once(args):
+    """
+    the worker dies at the first call, the resubmitted task returns the value
+    """
+    marker, value = args
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return value
+
+
+if __name__ == '__main__':
+    total_times = 60
+    num_processes = 6
+    res = benchmark_compile([code, error_code], num_processes=num_processes, repeat=total_times // 2)
+    for k, v in res.items():
+        print('{} compile: {:.2f} programs per second'.format(k, v))
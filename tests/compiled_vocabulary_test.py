@@ -0,0 +1,156 @@
+import os
+import random
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from common import args_util
+from common.pycparser_util import tokenize_by_clex_fn
+from experiment.parse_xy_util import create_token_ids_by_name_fn, create_token_ids_of_rows
+from tests.slk_mask_test import CODES, create_vocabulary
+from vocabulary.compiled_vocabulary import load_or_create_compiled_vocabulary, load_compiled_vocabulary, \
+    compiled_vocabulary_path, STRING_CLASS, IDENTIFIER_CLASS
+from vocabulary.transform_vocabulary_and_parser import TransformVocabularyAndSLK
+from vocabulary.word_vocabulary import Vocabulary
+
+
+def token_tuple(tok):
+    return tok.value, tok.type, tok.lineno, tok.lexpos
+
+
+class CompiledVocabularyTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenize_fn = staticmethod(tokenize_by_clex_fn())
+        cls.vocabulary = create_vocabulary(cls.tokenize_fn)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        args_util.use_compiled_vocabulary = False
+        args_util.use_compiled_slk = False
+
+    def test_same_as_transformer(self):
+        expected = TransformVocabularyAndSLK(self.vocabulary, self.tokenize_fn)
+        args_util.use_compiled_vocabulary = True
+        with mock.patch('vocabulary.compiled_vocabulary.CACHE_DATA_PATH', self.directory):
+            transformer = TransformVocabularyAndSLK(self.vocabulary, self.tokenize_fn)
+        self.assertIsNotNone(transformer.compiled_vocabulary)
+        for name in ['string_vocabulary_set', 'constant_vocabulary_set', 'id_vocabulary_set',
+                     'end_label_vocabulary_set', 'keyword_vocabulary_dict', 'pre_defined_c_identifier_library_set',
+                     'pre_defined_c_typeid_library_set']:
+            self.assertEqual(getattr(transformer, name), getattr(expected, name), name)
+        self.assertEqual({i: token_tuple(t) for i, t in transformer.id_to_token_dict.items()},
+                         {i: token_tuple(t) for i, t in expected.id_to_token_dict.items()})
+        self.assertTrue(np.array_equal(transformer.compiled_vocabulary.class_bits(STRING_CLASS),
+                                       expected.string_vocabulary_bits))
+
+        ids_list = self.vocabulary.parse_text_without_pad([[tok.value for tok in self.tokenize_fn(code)]
+                                                           for code in CODES])
+        # the labels of the compiled parser are read from the compiled vocabulary
+        args_util.use_compiled_slk = True
+        self.assertEqual(transformer.get_all_token_mask_train(ids_list), expected.get_all_token_mask_train(ids_list))
+        bad_ids = self.vocabulary.parse_text_without_pad([['int', 'main', '(', ')', '{', 'i', '=', '=', '1', ';']])
+        with self.assertRaises(Exception):
+            transformer.get_all_token_mask_train(bad_ids)
+
+    def test_load(self):
+        calls = []
+
+        def tokenize_fn(code):
+            calls.append(code)
+            return self.tokenize_fn(code)
+
+        compiled = load_or_create_compiled_vocabulary(self.vocabulary, tokenize_fn, directory=self.directory)
+        # every word except the 4 special tokens is tokenized once, and 'unk' for the unk id
+        word_count = self.vocabulary.vocabulary_size - 3
+        self.assertEqual(len(calls), word_count)
+        loaded = load_or_create_compiled_vocabulary(self.vocabulary, tokenize_fn, directory=self.directory)
+        self.assertEqual(len(calls), word_count)
+        self.assertIsInstance(loaded.classes, np.memmap)
+        self.assertFalse(loaded.classes.flags.writeable)
+        words = [self.vocabulary.id_to_word(i) for i in range(self.vocabulary.vocabulary_size)]
+        self.assertEqual(loaded.words(), words)
+        self.assertEqual([loaded.id_to_word(i) for i in range(len(words))], words)
+        self.assertTrue(np.array_equal(loaded.classes, compiled.classes))
+        self.assertIn(self.vocabulary.word_to_id('main'), loaded.class_set(IDENTIFIER_CLASS))
+        self.assertTrue(np.all(loaded.slk_labels == -1))
+
+        other = create_vocabulary(self.tokenize_fn, extra_identifier_count=3)
+        self.assertNotEqual(compiled_vocabulary_path(other, self.directory),
+                            compiled_vocabulary_path(self.vocabulary, self.directory))
+        with open(loaded.path, 'wb') as f:
+            f.write(b'not a vocabulary')
+        with self.assertRaises(ValueError):
+            load_compiled_vocabulary(loaded.path)
+
+
+class ParseTextArrayTest(unittest.TestCase):
+
+    def setUp(self):
+        words = ['w{}'.format(i) for i in range(50)]
+        self.vocabulary = Vocabulary(set(words), {w: i for i, w in enumerate(words)}, ['<BEGIN>', '<INNER_BEGIN>'],
+                                     ['<END>'], '<UNK>', ['<PAD>'])
+        r = random.Random(1)
+        self.texts = [[r.choice(words + ['unknown']) for _ in range(r.randint(0, 20))] for _ in range(30)] + [[]]
+
+    def test_parse_text_to_array(self):
+        for use_position_label in [False, True]:
+            ids, offsets = self.vocabulary.parse_text_to_array(self.texts, use_position_label)
+            self.assertEqual(ids.dtype, np.int64)
+            self.assertEqual([ids[a:b].tolist() for a, b in zip(offsets[:-1], offsets[1:])],
+                             self.vocabulary.parse_text_without_pad(self.texts, use_position_label))
+            self.assertEqual(self.vocabulary.parse_text_to_padded_array(self.texts, use_position_label).tolist(),
+                             self.vocabulary.parse_text(self.texts, use_position_label))
+        ids, offsets = self.vocabulary.parse_text_to_array([])
+        self.assertEqual((len(ids), offsets.tolist()), (0, [0]))
+        self.assertEqual(self.vocabulary.parse_text_to_padded_array([]).shape, (0, 0))
+
+    def test_create_token_ids_of_rows(self):
+        rows = [self.texts[0:3], [], self.texts[3:4], self.texts[4:]]
+        create_token_ids_by_name = create_token_ids_by_name_fn(self.vocabulary)
+        self.assertEqual(create_token_ids_of_rows(self.vocabulary, rows),
+                         tuple(map(list, zip(*[create_token_ids_by_name(r) for r in rows]))))
+
+
+def benchmark_compiled_vocabulary(extra_identifier_count=30000, text_count=2000, text_length=300):
+    from vocabulary.transform_vocabulary_and_parser import create_special_type_vocabulary_mask, \
+        create_ids_to_token_dict
+    tokenize_fn = tokenize_by_clex_fn()
+    vocabulary = create_vocabulary(tokenize_fn, extra_identifier_count)
+    print('vocabulary size: {}'.format(vocabulary.vocabulary_size))
+    begin = time.time()
+    for labels in [['STRING_LITERAL', 'WSTRING_LITERAL'], ['INT_CONST_DEC', 'FLOAT_CONST', 'CHAR_CONST'], ['ID']]:
+        create_special_type_vocabulary_mask(vocabulary, tokenize_fn, labels)
+    create_ids_to_token_dict.__wrapped__(vocabulary, tokenize_fn)
+    print('tokenize the words by the disk_cache builders: {:.3f}s'.format(time.time() - begin))
+    directory = tempfile.mkdtemp()
+    begin = time.time()
+    load_or_create_compiled_vocabulary(vocabulary, tokenize_fn, directory=directory)
+    print('compile the vocabulary: {:.3f}s, {} bytes'.format(
+        time.time() - begin, os.path.getsize(compiled_vocabulary_path(vocabulary, directory))))
+    begin = time.time()
+    compiled = load_or_create_compiled_vocabulary(vocabulary, tokenize_fn, directory=directory)
+    compiled.class_set(IDENTIFIER_CLASS)
+    compiled.create_id_to_token_dict()
+    print('load the compiled vocabulary and create the tables: {:.3f}s'.format(time.time() - begin))
+
+    r = random.Random(1)
+    words = compiled.words()
+    texts = [[r.choice(words) for _ in range(r.randint(1, text_length))] for _ in range(text_count)]
+    for name, fn in [('parse_text', vocabulary.parse_text),
+                     ('parse_text_to_padded_array', vocabulary.parse_text_to_padded_array),
+                     ('parse_text_without_pad', vocabulary.parse_text_without_pad),
+                     ('parse_text_to_array', vocabulary.parse_text_to_array)]:
+        begin = time.time()
+        fn(texts)
+        print('{}: {:.3f}s'.format(name, time.time() - begin))
+
+
+if __name__ == '__main__':
+    benchmark_compiled_vocabulary()
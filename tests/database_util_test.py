@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from common.constants import CPP_TESTCASE_ERROR_RECORDS, DATA_RECORDS_DEEPFIX
+from database import database_util
+from database.database_util import create_table, insert_items, run_sql_statment, run_sql_select_statment, \
+    iter_sql_select_statment, iter_in_statment, get_connection, close_connections, transaction
+
+
+def make_records(n, begin=0):
+    return [('id{}'.format(i), 'url', 'p{}'.format(i % 100), 'u{}'.format(i), 'p{}_u{}'.format(i % 100, i),
+             'int main ( ) { return 0 ; }', 0, '', '', -1) for i in range(begin, begin + n)]
+
+
+class DatabaseUtilTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db_path = os.path.join(tempfile.mkdtemp(), 'test.db')
+        create_table(self.db_path, CPP_TESTCASE_ERROR_RECORDS)
+
+    def tearDown(self):
+        close_connections()
+
+    def test_pooled_wal_connection(self):
+        con = get_connection(self.db_path)
+        self.assertIs(con, get_connection(self.db_path))
+        self.assertEqual(con.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+        other = []
+        t = threading.Thread(target=lambda: other.append(get_connection(self.db_path)))
+        t.start()
+        t.join()
+        self.assertIsNot(con, other[0])
+
+    def test_insert_and_select(self):
+        insert_items(self.db_path, CPP_TESTCASE_ERROR_RECORDS, make_records(2500), batch_size=1000)
+        # insert or ignore
+        insert_items(self.db_path, CPP_TESTCASE_ERROR_RECORDS, iter(make_records(10)))
+        res = run_sql_select_statment(self.db_path, CPP_TESTCASE_ERROR_RECORDS, 'find_distinct_problem_user_id')
+        self.assertEqual(len(res), 2500)
+        streamed = list(iter_sql_select_statment(self.db_path, CPP_TESTCASE_ERROR_RECORDS,
+                                                 'find_distinct_problem_user_id', batch_size=100))
+        self.assertEqual(sorted(streamed), sorted(res))
+
+        # the records are committed and visible to another connection
+        with sqlite3.connect(self.db_path) as con:
+            self.assertEqual(con.execute('SELECT COUNT(*) FROM cpp_testcase_error_records').fetchone()[0], 2500)
+
+    def test_in_statment(self):
+        insert_items(self.db_path, CPP_TESTCASE_ERROR_RECORDS, make_records(3000))
+        ids = ['id{}'.format(i) for i in range(0, 3000, 2)] + ["x' OR '1'='1"]
+        res = list(iter_in_statment(get_connection(self.db_path),
+                                    'SELECT id FROM cpp_testcase_error_records WHERE id IN ({})', ids))
+        self.assertEqual(len(res), 1500)
+
+    def test_transaction(self):
+        with transaction(self.db_path):
+            insert_items(self.db_path, CPP_TESTCASE_ERROR_RECORDS, make_records(10))
+            insert_items(self.db_path, CPP_TESTCASE_ERROR_RECORDS, make_records(10, begin=10))
+        self.assertEqual(len(run_sql_select_statment(self.db_path, CPP_TESTCASE_ERROR_RECORDS,
+                                                     'find_distinct_problem_user_id')), 20)
+        with self.assertRaises(ValueError):
+            with transaction(self.db_path):
+                insert_items(self.db_path, CPP_TESTCASE_ERROR_RECORDS, make_records(10, begin=20))
+                raise ValueError()
+        self.assertEqual(len(run_sql_select_statment(self.db_path, CPP_TESTCASE_ERROR_RECORDS,
+                                                     'find_distinct_problem_user_id')), 20)
+
+    def test_replace_table_name(self):
+        create_table(self.db_path, DATA_RECORDS_DEEPFIX, replace_table_name='sample_records')
+        records = [('id{}'.format(i), '', 'code', 'sample', '[]', '[]', 1, 1, '[]') for i in range(5)]
+        run_sql_statment(self.db_path, DATA_RECORDS_DEEPFIX, 'insert_ignore', records,
+                         replace_table_name='sample_records')
+        count = get_connection(self.db_path).execute('SELECT COUNT(*) FROM sample_records').fetchone()[0]
+        self.assertEqual(count, 5)
+
+
+def _old_insert_items(db_path, records, batch_size):
+    # the old database_util: a new connection and a commit for every call
+    for i in range(0, len(records), batch_size):
+        con = sqlite3.connect(db_path)
+        con.executemany(database_util.sql_dict[CPP_TESTCASE_ERROR_RECORDS]['insert_ignore'],
+                        records[i:i+batch_size])
+        con.commit()
+        con.close()
+
+
+def _new_insert_items(db_path, records, batch_size):
+    for i in range(0, len(records), batch_size):
+        insert_items(db_path, CPP_TESTCASE_ERROR_RECORDS, records[i:i+batch_size])
+
+
+def benchmark_database_util(n=1000000):
+    records = make_records(n)
+    directory = tempfile.mkdtemp()
+    select_sql = 'SELECT * FROM cpp_testcase_error_records'
+
+    # 1000 records per call for all records, 10 records per call (such as the per step saving) for 50000 records
+    for batch_size, count in [(1000, n), (10, 50000)]:
+        old_path = os.path.join(directory, 'old_{}.db'.format(batch_size))
+        con = sqlite3.connect(old_path)
+        con.execute(database_util.sql_dict[CPP_TESTCASE_ERROR_RECORDS]['create'])
+        con.close()
+        begin = time.time()
+        _old_insert_items(old_path, records[:count], batch_size)
+        insert_time = time.time() - begin
+        begin = time.time()
+        con = sqlite3.connect(old_path)
+        select_count = len(con.execute(select_sql).fetchall())
+        con.close()
+        print('old: insert {} records by {} per call {:.2f}s, fetchall {} records {:.2f}s'.format(
+            count, batch_size, insert_time, select_count, time.time() - begin))
+
+        new_path = os.path.join(directory, 'new_{}.db'.format(batch_size))
+        create_table(new_path, CPP_TESTCASE_ERROR_RECORDS)
+        begin = time.time()
+        _new_insert_items(new_path, records[:count], batch_size)
+        insert_time = time.time() - begin
+        begin = time.time()
+        select_count = sum(1 for _ in get_connection(new_path).execute(select_sql))
+        print('pooled wal: insert {} records by {} per call {:.2f}s, stream {} records {:.2f}s'.format(
+            count, batch_size, insert_time, select_count, time.time() - begin))
+
+    batch_path = os.path.join(directory, 'batch.db')
+    create_table(batch_path, CPP_TESTCASE_ERROR_RECORDS)
+    begin = time.time()
+    insert_items(batch_path, CPP_TESTCASE_ERROR_RECORDS, iter(records))
+    print('pooled wal, one call from a generator: insert {} records {:.2f}s'.format(n, time.time() - begin))
+    close_connections()
+
+
+if __name__ == '__main__':
+    benchmark_database_util()
@@ -0,0 +1,118 @@
+import os
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+import torch
+from torch import nn
+
+from common import problem_util
+
+
+class DeviceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gpu_index, self.parallel = problem_util.GPU_INDEX, problem_util.Parallel
+
+    def tearDown(self):
+        problem_util.GPU_INDEX, problem_util.Parallel = self.gpu_index, self.parallel
+
+    def test_cpu_device(self):
+        problem_util.GPU_INDEX = None
+        self.assertEqual(problem_util.get_device(), torch.device('cpu'))
+        m = problem_util.prepare_model(nn.Linear(3, 2))
+        self.assertNotIsInstance(m, nn.DataParallel)
+        self.assertIs(problem_util.unwrap_model(m), m)
+        self.assertEqual(problem_util.to_cuda(torch.ones(2)).device, torch.device('cpu'))
+        if not torch.cuda.is_available():
+            # a gpu index falls back to cpu on a host without gpu
+            problem_util.GPU_INDEX, problem_util.Parallel = 0, True
+            self.assertEqual(problem_util.get_device(), torch.device('cpu'))
+            self.assertNotIsInstance(problem_util.prepare_model(nn.Linear(3, 2)), nn.DataParallel)
+
+    def test_save_and_load(self):
+        problem_util.GPU_INDEX = None
+        path = os.path.join(tempfile.mkdtemp(), 'model.pkl')
+        m = nn.Sequential(nn.Linear(3, 2), nn.ReLU(), nn.Linear(2, 1))
+        problem_util.save_model(m, path)
+        # the checkpoint has the same names as the ones saved from a DataParallel model
+        self.assertTrue(all(k.startswith('module.') for k in torch.load(path)))
+        loaded = nn.Sequential(nn.Linear(3, 2), nn.ReLU(), nn.Linear(2, 1))
+        problem_util.load_model(loaded, path)
+        x = torch.rand(4, 3)
+        self.assertTrue(torch.equal(loaded(x), m(x)))
+        # the checkpoint without the prefix
+        torch.save(m.state_dict(), path)
+        loaded = nn.Sequential(nn.Linear(3, 2), nn.ReLU(), nn.Linear(2, 1))
+        problem_util.load_model(nn.DataParallel(loaded), path)
+        self.assertTrue(torch.equal(loaded(x), m(x)))
+
+    def test_get_model(self):
+        from train import get_model
+        problem_util.GPU_INDEX = None
+        path = os.path.join(tempfile.mkdtemp(), 'model.pkl')
+        m = get_model(nn.Linear, {'in_features': 3, 'out_features': 2}, path)
+        problem_util.save_model(m, path)
+        loaded = get_model(nn.Linear, {'in_features': 3, 'out_features': 2}, path, load_previous=True)
+        self.assertTrue(torch.equal(loaded.weight, m.weight))
+
+    def test_set_num_threads(self):
+        num_threads = torch.get_num_threads()
+        problem_util.set_num_threads(1)
+        self.assertEqual(torch.get_num_threads(), 1)
+        problem_util.set_num_threads(num_threads)
+
+
+def benchmark_cpu_multi_step_evaluate(count=64, length=60, batch_size=16, max_step_times=3, num_threads=None):
+    """
+    load a checkpoint of the benchmark EncoderSampleModel on cpu and run multi_step_evaluate
+    """
+    from experiment.benchmark_stages import create_synthetic_corpus, create_benchmark_model
+    from experiment.experiment_dataset import IterateErrorDataSet
+    from experiment.experiment_util import action_list_sorted_no_reverse
+    from experiment.parse_xy_util import parse_iterative_sample_action_error_code
+    from common.pycparser_util import tokenize_by_clex_fn
+    from model.encoder_sample_model import create_parse_input_batch_data_fn, create_multi_step_next_input_batch_fn
+    from train import get_model, multi_step_evaluate
+    from vocabulary.transform_vocabulary_and_parser import TransformVocabularyAndSLK
+
+    problem_util.GPU_INDEX = None
+    problem_util.set_num_threads(num_threads)
+    torch.manual_seed(1)
+    df, vocabulary = create_synthetic_corpus(count, length=length)
+    tokenize_fn = tokenize_by_clex_fn()
+    keys = ['error_token_id_list', 'sample_error_id_list', 'sample_ac_id_list', 'ac_pos_list', 'error_pos_list',
+            'ac_code_ids', 'is_copy_list', 'copy_pos_list', 'sample_mask_list', 'error_token_name_list',
+            'target_ac_token_id_list', 'ac_code_name_with_labels']
+    outputs = parse_iterative_sample_action_error_code(df.copy(), 'train', vocabulary, action_list_sorted_no_reverse,
+                                                       tokenize_fn, True, False)
+    data_dict = dict(zip(keys, outputs))
+    parsed_df = df.loc[data_dict['error_token_id_list'].index.values]
+    for k in ['includes', 'distance', 'id']:
+        data_dict[k] = parsed_df[k]
+    # the first step of every program is fixed step by step
+    dataset = IterateErrorDataSet(pd.DataFrame(data_dict), vocabulary, 'valid',
+                                  TransformVocabularyAndSLK(vocabulary, tokenize_fn), do_multi_step_sample=True)
+
+    tmp_dir = tempfile.mkdtemp()
+    checkpoint_path = os.path.join(tmp_dir, 'encoder_sample_model.pkl')
+    problem_util.save_model(create_benchmark_model(vocabulary), checkpoint_path)
+    model = get_model(create_benchmark_model, {'vocabulary': vocabulary}, checkpoint_path, load_previous=True)
+
+    w = vocabulary.word_to_id
+    begin = time.time()
+    multi_step_evaluate(model, dataset, batch_size, create_parse_input_batch_data_fn(), None,
+                        max_step_times=max_step_times, vocabulary=vocabulary,
+                        file_path=os.path.join(tmp_dir, 'main.c'),
+                        create_multi_step_next_input_batch_fn=create_multi_step_next_input_batch_fn(
+                            w(vocabulary.begin_tokens[0]), w(vocabulary.end_tokens[0]), w(vocabulary.end_tokens[1]),
+                            vocabulary=vocabulary),
+                        target_file_path=os.path.join(tmp_dir, 'main.out'),
+                        log_file_path=os.path.join(tmp_dir, 'main.log'))
+    print('cpu multi_step_evaluate with {} threads: {:.2f} samples/s'.format(
+        torch.get_num_threads(), len(dataset) / (time.time() - begin)))
+
+
+if __name__ == '__main__':
+    benchmark_cpu_multi_step_evaluate()
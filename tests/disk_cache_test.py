@@ -0,0 +1,214 @@
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from common.disk_cache import disk_cache, data_fingerprint, data_hash, evict_disk_cache
+
+
+def make_df(n):
+    return pd.DataFrame({'id': np.arange(n), 'code': ['int a{} ;'.format(i) for i in range(n)],
+                         'tokens': [['int', 'a{}'.format(i), ';'] for i in range(n)]})
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def test_fingerprint(self):
+        df = make_df(5000)
+        self.assertEqual(data_fingerprint(df, 1, 'a'), data_fingerprint(df.copy(), 1, 'a'))
+        self.assertNotEqual(data_fingerprint(df, 1, 'a'), data_fingerprint(df, 2, 'a'))
+        self.assertNotEqual(data_fingerprint(df), data_fingerprint(df.iloc[1:]))
+        self.assertNotEqual(data_fingerprint(df), data_fingerprint(df[['id', 'code']]))
+        # a sampled row is changed
+        other = df.copy()
+        other.loc[0, 'code'] = 'int b ;'
+        self.assertNotEqual(data_fingerprint(df), data_fingerprint(other))
+        self.assertNotEqual(data_fingerprint(np.zeros(3)), data_fingerprint(np.ones(3)))
+        self.assertEqual(data_fingerprint({'a': 1, 'b': [1, 2]}), data_fingerprint({'b': [1, 2], 'a': 1}))
+
+    def test_full_content_fingerprint(self):
+        df = make_df(5000)
+        # every row is hashed, including the list cells
+        for column, value in [('code', 'int b ;'), ('tokens', ['int', 'b', ';']), ('id', -1)]:
+            other = df.copy()
+            other.at[1234, column] = value
+            self.assertNotEqual(data_fingerprint(df), data_fingerprint(other), column)
+        series = df['code'].copy()
+        series[4321] = 'x'
+        self.assertNotEqual(data_fingerprint(df['code']), data_fingerprint(series))
+        arr = np.zeros(10 ** 6)
+        other = arr.copy()
+        other[12345] = 1
+        self.assertNotEqual(data_fingerprint(arr), data_fingerprint(other))
+
+    def test_set_fingerprint(self):
+        class Point(object):
+            pass
+        self.assertEqual(data_fingerprint({'b', 'a', 1, (2, 'c')}), data_fingerprint({(2, 'c'), 1, 'a', 'b'}))
+        self.assertNotEqual(data_fingerprint({'a', 'b'}), data_fingerprint({'a', 'c'}))
+        self.assertEqual(data_fingerprint({('a', 1): {1, 2}}), data_fingerprint({('a', 1): {2, 1}}))
+        # the set order depends on the string hash seed of the process
+        script = 'from common.disk_cache import data_fingerprint; print(data_fingerprint({"a", "b", "c", "d"}))'
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        outputs = {subprocess.run([sys.executable, '-c', script], cwd=root, stdout=subprocess.PIPE,
+                                  env=dict(os.environ, PYTHONHASHSEED=str(seed))).stdout.strip()
+                   for seed in range(3)}
+        self.assertEqual(outputs, {data_fingerprint({'a', 'b', 'c', 'd'}).encode('utf-8')})
+        with self.assertRaises(TypeError):
+            data_fingerprint({Point()})
+
+    def test_key(self):
+        class Vocab(object):
+            def __init__(self, words):
+                self.words = words
+
+        calls = []
+
+        @disk_cache('key', self.directory, version='1', key=lambda vocab, n: (vocab.words, n))
+        def load(vocab, n):
+            calls.append(n)
+            return len(vocab.words) + n
+
+        with self.assertRaises(TypeError):
+            disk_cache('no_key', self.directory, version='1')(lambda vocab: 0)(Vocab(['a']))
+        self.assertEqual(load(Vocab(['a', 'b']), 1), 3)
+        self.assertEqual(load(Vocab(['a', 'b']), 1), 3)
+        self.assertEqual(load(Vocab(['a', 'b', 'c']), 1), 4)
+        self.assertEqual(calls, [1, 1])
+
+    def test_hit_and_version(self):
+        calls = []
+
+        def load(n, offset=0):
+            calls.append(n)
+            return [i + offset for i in range(n)]
+
+        cached = disk_cache('load', self.directory, version='1')(load)
+        self.assertEqual(cached(3), [0, 1, 2])
+        self.assertEqual(cached(3), [0, 1, 2])
+        self.assertEqual(cached(3, offset=1), [1, 2, 3])
+        self.assertEqual(len(calls), 2)
+
+        cached_v2 = disk_cache('load', self.directory, version='2')(load)
+        cached_v2(3)
+        self.assertEqual(len(calls), 3)
+
+    def test_method(self):
+        class Loader(object):
+            @disk_cache('method', self.directory, method=True, version='1')
+            def load(self, n):
+                return n * 2
+        self.assertEqual(Loader().load(2), 4)
+        self.assertEqual(Loader.load.cache_entry_path(Loader(), 2), Loader.load.cache_entry_path(Loader(), 2))
+
+    def test_chunked_items(self):
+        @disk_cache('items', self.directory, version='1', chunk_rows=300, mmap_mode='r')
+        def load():
+            return make_df(1000), np.arange(100, dtype=np.int64), {'vocab': 10}
+
+        df, arr, info = load()
+        df2, arr2, info2 = load()
+        pd.testing.assert_frame_equal(df, df2)
+        self.assertIsInstance(arr2, np.memmap)
+        np.testing.assert_array_equal(arr, arr2)
+        self.assertEqual(info, info2)
+
+        chunks = list(load.iter_chunks(0))
+        self.assertEqual([len(c) for c in chunks], [300, 300, 300, 100])
+        self.assertEqual(load.load_item(2), {'vocab': 10})
+
+    def test_evict(self):
+        def load(i):
+            return np.zeros(1000, dtype=np.int64) + i
+
+        cached = disk_cache('evict', self.directory, version='1', max_bytes=20000)(load)
+        paths = []
+        for i in range(5):
+            cached(i)
+            paths.append(cached.cache_entry_path(i))
+            time.sleep(0.01)
+        exists = [os.path.exists(p) for p in paths]
+        self.assertTrue(exists[-1])
+        self.assertFalse(exists[0])
+        self.assertEqual(evict_disk_cache(self.directory, 0), [p for p, e in zip(paths, exists) if e])
+
+    def test_legacy_file(self):
+        with open(os.path.join(self.directory, 'legacy-{}.pickle'.format(data_hash(((5, ), ())))), 'wb') as f:
+            pickle.dump('old result', f)
+
+        @disk_cache('legacy', self.directory, version='1')
+        def load(n):
+            return 'new result'
+
+        self.assertEqual(load(5), 'old result')
+        self.assertTrue(os.path.isdir(load.cache_entry_path(5)))
+        self.assertEqual(load(5), 'old result')
+
+    def test_legacy_method_file(self):
+        # the old key of a method is (tuple(kwargs.items()), ), the positional arguments were dropped with self
+        with open(os.path.join(self.directory, 'legacy_method-{}.pickle'.format(data_hash(((), )))), 'wb') as f:
+            pickle.dump('old result', f)
+
+        class Loader(object):
+            @disk_cache('legacy_method', self.directory, method=True, version='1')
+            def load(self, n):
+                return 'new result'
+
+        self.assertEqual(Loader().load(5), 'old result')
+        self.assertEqual(Loader().load(n=5), 'new result')
+
+    def test_false_result(self):
+        calls = []
+
+        @disk_cache('false', self.directory, version='1')
+        def load(n):
+            calls.append(n)
+            return False
+
+        # the computed False is returned without loading the entry
+        with mock.patch('common.disk_cache.DiskCacheEntry.load', side_effect=AssertionError('loaded')):
+            self.assertIs(load(1), False)
+        self.assertIs(load(1), False)
+        self.assertEqual(calls, [1])
+        load(2)
+        self.assertEqual(calls, [1, 2])
+
+
+def benchmark_cache_key(n=200000):
+    df = make_df(n)
+    begin = time.time()
+    data_hash(((df, ), ()))
+    hash_time = time.time() - begin
+    begin = time.time()
+    data_fingerprint(df)
+    fingerprint_time = time.time() - begin
+    print('{} rows. data_hash: {:.3f}s, data_fingerprint: {:.3f}s'.format(n, hash_time, fingerprint_time))
+
+    directory = tempfile.mkdtemp()
+
+    @disk_cache('benchmark', directory, version='1')
+    def load():
+        return df, np.arange(n)
+
+    load()
+    begin = time.time()
+    load()
+    full_time = time.time() - begin
+    begin = time.time()
+    load.load_item(1)
+    item_time = time.time() - begin
+    print('load all items: {:.3f}s, load the array item only: {:.3f}s'.format(full_time, item_time))
+
+
+if __name__ == '__main__':
+    benchmark_cache_key()
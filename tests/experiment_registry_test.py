@@ -0,0 +1,202 @@
+import ast
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+
+from common.experiment_registry import ExperimentRegistry, LazyConfig, StartupTimer, PARAMETERS_CONFIG_PATH, \
+    get_experiment_registry
+
+CONFIG_MODULE = '''
+import collections
+
+calls = []
+
+
+def load_vocabulary():
+    calls.append('vocabulary')
+    return ['<BEGIN>', 'a', 'b']
+
+
+def load_dataset(vocabulary, is_debug):
+    calls.append('dataset')
+    return [[w for w in vocabulary if is_debug or w != 'a']]
+
+
+def small_config(is_debug):
+    calls.append('config')
+    return {'name': 'small', 'vocabulary': load_vocabulary(), 'load_model_name': 'small.pkl'}
+
+
+def lazy_config(is_debug):
+    vocabulary = load_vocabulary()
+    vocabulary.append('<END>')
+    begin_id = vocabulary.index('<BEGIN>')
+    batch_size = 2
+    if is_debug:
+        batch_size = 1
+    datasets = load_dataset(vocabulary, is_debug)
+    train_len = len(datasets[0])
+    return {
+        'name': 'lazy',
+        'batch_size': batch_size,
+        'model_dict': {'vocabulary_size': len(vocabulary), 'begin_id': begin_id},
+        'create_fn': lambda x: x + begin_id,
+        'counter': collections.Counter(vocabulary),
+        'optimizer_dict': {'t_total': train_len // batch_size},
+        'data': datasets,
+    }
+
+
+def other_config(is_debug):
+    return {'name': 'other'}
+'''
+
+
+class ExperimentRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.module_name = 'registry_test_config_{}'.format(os.getpid())
+        self.path = os.path.join(self.tmp_dir, self.module_name + '.py')
+        with open(self.path, 'w') as f:
+            f.write(CONFIG_MODULE)
+        sys.path.insert(0, self.tmp_dir)
+
+    def tearDown(self):
+        sys.path.remove(self.tmp_dir)
+        sys.modules.pop(self.module_name, None)
+
+    def test_names(self):
+        registry = ExperimentRegistry(self.module_name, self.path)
+        self.assertEqual(registry.names(), ['lazy_config', 'other_config', 'small_config'])
+        self.assertNotIn('load_vocabulary', registry)
+        with self.assertRaises(ValueError):
+            registry.get('load_vocabulary', True)
+        self.assertNotIn(self.module_name, sys.modules)
+
+    def test_parameters_config_names(self):
+        with open(PARAMETERS_CONFIG_PATH) as f:
+            tree = ast.parse(f.read())
+        expected = sorted(n.name for n in tree.body if isinstance(n, ast.FunctionDef) and
+                          [a.arg for a in n.args.args] == ['is_debug'])
+        self.assertEqual(ExperimentRegistry().names(), expected)
+        self.assertIn('encoder_sample_config1', expected)
+
+    def test_get(self):
+        registry = ExperimentRegistry(self.module_name, self.path)
+        startup_timer = StartupTimer()
+        with self.assertRaises(ValueError):
+            registry.get('unknown_config', False, startup_timer)
+        p_config = registry.get('small_config', False, startup_timer)
+        self.assertIsInstance(p_config, LazyConfig)
+        self.assertEqual(p_config['name'], 'small')
+        self.assertEqual(registry.source().resolve(['calls'])['calls'], [])
+        self.assertEqual(dict(p_config), {'name': 'small', 'vocabulary': ['<BEGIN>', 'a', 'b'],
+                                          'load_model_name': 'small.pkl'})
+        self.assertEqual(registry.source().resolve(['calls'])['calls'], ['vocabulary'])
+        self.assertNotIn(self.module_name, sys.modules)
+        self.assertEqual(list(startup_timer.phase_time.keys()),
+                         ['parse {}'.format(self.module_name), 'config small_config'])
+
+    def test_lazy_values(self):
+        registry = ExperimentRegistry(self.module_name, self.path)
+        calls = registry.source().resolve(['calls'])['calls']
+        for is_debug in [True, False]:
+            del calls[:]
+            p_config = registry.get('lazy_config', is_debug)
+            p_config['load_model_name'] = 'cmd.pkl'
+            self.assertEqual((p_config['name'], p_config['batch_size']), ('lazy', 1 if is_debug else 2))
+            self.assertEqual(p_config['load_model_name'], 'cmd.pkl')
+            self.assertEqual(calls, [])
+            # the vocabulary is changed by the expression statement before it is read
+            self.assertEqual(p_config['model_dict'], {'vocabulary_size': 4, 'begin_id': 0})
+            self.assertEqual(p_config['create_fn'](1), 1)
+            self.assertEqual(p_config['counter']['<END>'], 1)
+            self.assertEqual(calls, ['vocabulary'])
+            self.assertEqual(p_config['optimizer_dict'], {'t_total': 4 if is_debug else 1})
+            self.assertIs(p_config['data'], p_config['data'])
+            self.assertEqual(calls, ['vocabulary', 'dataset'])
+            self.assertEqual(set(p_config), {'name', 'batch_size', 'model_dict', 'create_fn', 'counter',
+                                             'optimizer_dict', 'data', 'load_model_name'})
+        # only the top level definitions a config uses are executed
+        registry = ExperimentRegistry(self.module_name, self.path)
+        dict(registry.get('small_config', True))
+        self.assertEqual(set(registry.source().namespace) - {'__name__', '__file__', '__builtins__'},
+                         {'calls', 'load_vocabulary'})
+
+    def test_parameters_config_dependencies(self):
+        registry = ExperimentRegistry()
+        p_config = registry.get('encoder_sample_config1', True)
+        vocabulary_statement = p_config.dependencies('vocabulary')
+        self.assertEqual(len(vocabulary_statement), 1)
+        self.assertEqual(p_config.dependencies('name'), [])
+        self.assertNotIn('datasets', set().union(*[p_config._stored[i] for i in p_config.dependencies('model_dict')]))
+        self.assertIn('datasets', set().union(*[p_config._stored[i] for i in p_config.dependencies('data')]))
+        self.assertTrue(set(vocabulary_statement) < set(p_config.dependencies('model_dict')))
+
+    def test_no_vocabulary_of_small_reads(self):
+        import read_data.load_data_vocabulary
+        not_built = mock.Mock(side_effect=AssertionError('the vocabulary is built'))
+        with mock.patch.object(read_data.load_data_vocabulary, 'create_deepfix_common_error_vocabulary', not_built):
+            p_config = ExperimentRegistry().get('encoder_sample_config1', True)
+            self.assertEqual((p_config['name'], p_config['batch_size'], p_config['max_step_times']),
+                             ('encoder_sample_dropout', 6, 10))
+            self.assertEqual(p_config['load_model_name'], 'encoder_sample_dropout_overfitting.pkl')
+            with self.assertRaises(AssertionError):
+                p_config['vocabulary']
+        self.assertNotIn('parameters_config', sys.modules)
+
+    def test_help(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = ('import runpy, sys\n'
+                'sys.argv = ["train.py", "--help"]\n'
+                'try:\n'
+                '    runpy.run_path("train.py", run_name="__main__")\n'
+                'except SystemExit:\n'
+                '    pass\n'
+                'print("parameters_config" in sys.modules)\n')
+        res = subprocess.run([sys.executable, '-c', code], cwd=root, stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, universal_newlines=True)
+        self.assertIn('--config_name', res.stdout)
+        self.assertEqual(res.stdout.split()[-1], 'False')
+
+    def test_startup_timer(self):
+        startup_timer = StartupTimer(time.time() - 1)
+        startup_timer.mark('import')
+        with startup_timer('config'):
+            pass
+        startup_timer.mark('rest')
+        self.assertGreaterEqual(startup_timer.phase_time['import'], 1)
+        self.assertAlmostEqual(sum(startup_timer.phase_time.values()), startup_timer.total(), places=2)
+        self.assertIn('import: ', str(startup_timer))
+
+
+def benchmark_startup(repeat=3):
+    """
+    the cold start wall time of the entry points in new processes
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    commands = [('import torch', ['-c', 'import torch']),
+                ('import parameters_config', ['-c', 'import parameters_config']),
+                ('train.py --help', ['train.py', '--help']),
+                ('train.py unknown config', ['train.py', '--config_name', 'unknown_config']),
+                ('read a config name', ['-c', 'from common.experiment_registry import load_config; '
+                                              'load_config("encoder_sample_config1", True)["name"]']),
+                ('list config names', ['-c', 'from common.experiment_registry import get_experiment_registry; '
+                                             'get_experiment_registry().names()'])]
+    for name, command in commands:
+        times = []
+        for _ in range(repeat):
+            begin = time.time()
+            subprocess.run([sys.executable] + command, cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.time() - begin)
+        print('{}: {:.3f}s'.format(name, min(times)))
+
+
+if __name__ == '__main__':
+    benchmark_startup()
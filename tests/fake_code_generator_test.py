@@ -0,0 +1,146 @@
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from common.compile_server import get_local_compiler
+from common.constants import COMMON_DEEPFIX_ERROR_RECORDS
+from database.database_util import close_connections
+from error_generation.generation_error.fake_code_generator import bracket_balanced, precheck_mutant, \
+    PRECHECK_COMPILE, PRECHECK_ERROR, PRECHECK_UNKNOWN, generate_program_mutants, GenerateStatistics, \
+    run_fake_code_generator
+
+CODE = r'''#include <stdio.h>
+int main() {
+    int a, b, i;
+    scanf("%d %d", &a, &b);
+    for (i = 0; i < a; i++) {
+        b = b + i * 2;
+    }
+    printf("%d\n", b);
+    return 0;
+}
+'''
+
+
+def create_items(count, seed=3):
+    from experiment.benchmark_stages import create_synthetic_program
+    r = random.Random(seed)
+    items = []
+    for i in range(count):
+        code = '#include <stdio.h>\n' + ' '.join(create_synthetic_program(r, 80)).replace(';', ';\n')
+        items.append({'try_count': 0, 'id': 'c{}'.format(i), 'submit_url': '', 'problem_id': 'p{}'.format(i % 3),
+                      'user_id': 'u{}'.format(i), 'problem_user_id': 'p{}_u{}'.format(i % 3, i),
+                      'originalcode': code})
+    return items
+
+
+class FakeCodeGeneratorTest(unittest.TestCase):
+
+    def test_precheck(self):
+        self.assertTrue(bracket_balanced(['int', 'main', '(', ')', '{', 'a', '[', '0', ']', ';', '}']))
+        self.assertFalse(bracket_balanced(['(', '{', ')', '}']))
+        self.assertFalse(bracket_balanced(['{', '{', '}']))
+        ac = ['int', 'main', '(', ')', '{', 'return', '0', ';', '}']
+        tried = set()
+        self.assertEqual(precheck_mutant(ac, ac, tried), PRECHECK_COMPILE)
+        mutant = ['int', 'main', '(', ')', '{', 'return', '0', '}']
+        self.assertEqual(precheck_mutant(ac, mutant, tried), PRECHECK_UNKNOWN)
+        # the same mutant is not compiled again
+        self.assertEqual(precheck_mutant(ac, mutant, tried), PRECHECK_COMPILE)
+        self.assertEqual(precheck_mutant(ac, ['int', 'main', '(', ')', 'return', '0', ';', '}'], tried),
+                         PRECHECK_ERROR)
+
+    def test_generate_program_mutants(self):
+        random.seed(1)
+        statistics = GenerateStatistics()
+        item = {'try_count': 0, 'id': 'a', 'submit_url': '', 'problem_id': 'p', 'user_id': 'u',
+                'problem_user_id': 'p_u', 'originalcode': CODE}
+        res = generate_program_mutants(item, mutants_per_program=3, max_try_count=20, statistics=statistics)
+        self.assertGreater(len(res), 0)
+        self.assertEqual(len(res), statistics.accepted_count)
+        self.assertEqual(len(set(r['code'] for r in res)), len(res))
+        self.assertEqual([r['id'] for r in res], ['a', 'a_1', 'a_2'][:len(res)])
+        for r in res:
+            self.assertIn('#include <stdio.h>', r['code'])
+            self.assertGreater(len(r['action_maplist']), 0)
+            # the precheck accepts only the mutants which gcc refuses too
+            self.assertFalse(get_local_compiler().compile(r['code'])[0])
+        # the original and one mutant compile at least
+        self.assertGreaterEqual(statistics.gcc_count, 1 + statistics.mutant_count -
+                                statistics.precheck_compile_count - statistics.precheck_error_count)
+
+        item['originalcode'] = 'int main() { return 0 }'
+        self.assertEqual(generate_program_mutants(item, statistics=statistics), [])
+
+    def test_run_fake_code_generator(self):
+        db_path = os.path.join(tempfile.mkdtemp(), 'fake.db')
+        items = create_items(12)
+        statistics = run_fake_code_generator(items[:8], db_path, COMMON_DEEPFIX_ERROR_RECORDS, core_num=0,
+                                             chunk_size=3, commit_count=2, seed=1, max_try_count=6)
+        close_connections()
+        con = sqlite3.connect(db_path)
+        rows = con.execute('SELECT id, problem_user_id, code, similar_code FROM common_deepfix_error_records').fetchall()
+        self.assertEqual(len(rows), statistics.accepted_count)
+        self.assertEqual(statistics.program_count, 8)
+        # the saved programs are skipped in the next run
+        statistics = run_fake_code_generator(items, db_path, COMMON_DEEPFIX_ERROR_RECORDS, core_num=0, seed=1,
+                                             max_try_count=6)
+        close_connections()
+        self.assertEqual(statistics.program_count, 12 - len(set(r[1] for r in rows)))
+        con.close()
+
+        # the result doesn't depend on the worker number
+        other_path = os.path.join(tempfile.mkdtemp(), 'fake.db')
+        run_fake_code_generator(items[:8], other_path, COMMON_DEEPFIX_ERROR_RECORDS, core_num=2, chunk_size=3,
+                                seed=1, max_try_count=6)
+        close_connections()
+        con = sqlite3.connect(other_path)
+        other_rows = con.execute('SELECT id, problem_user_id, code, similar_code FROM '
+                                 'common_deepfix_error_records').fetchall()
+        con.close()
+        self.assertEqual(sorted(other_rows), sorted(rows))
+
+
+def benchmark_fake_code_generator(count=60, core_num=0):
+    """
+    compare preprocess_code, which compiles every mutant by gcc, with the batched generator
+    """
+    from common import util
+    from common.pycparser_util import tokenize_by_clex_fn
+    from error_generation.generation_error.code_preprocess import preprocess_code
+    items = create_items(count)
+    gcc_count = [0]
+    compile_c_code_by_gcc = util.compile_c_code_by_gcc
+
+    def count_compile(code, file_path, *args, **kwargs):
+        gcc_count[0] += 1
+        return compile_c_code_by_gcc(code, file_path, *args, **kwargs)
+
+    import error_generation.generation_error.code_preprocess as code_preprocess
+    code_preprocess.compile_c_code_by_gcc = count_compile
+    tokenize_fn = tokenize_by_clex_fn()
+    random.seed(1)
+    begin = time.time()
+    accepted = 0
+    for item in items:
+        if preprocess_code(item['originalcode'], os.path.join(tempfile.gettempdir(), 'code.c'),
+                           tokenize_fn=tokenize_fn)[0] is not None:
+            accepted += 1
+    code_preprocess.compile_c_code_by_gcc = compile_c_code_by_gcc
+    print('preprocess_code: accepted: {}, gcc calls per accepted mutant: {:.2f}, mutants/s: {:.2f}'.format(
+        accepted, gcc_count[0] / max(accepted, 1), accepted / (time.time() - begin)))
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'fake.db')
+    for mutants_per_program in [1, 4]:
+        print('fake code generator with {} mutants per program:'.format(mutants_per_program))
+        run_fake_code_generator(items, db_path, COMMON_DEEPFIX_ERROR_RECORDS, core_num=core_num, seed=1,
+                                mutants_per_program=mutants_per_program, max_try_count=4 * mutants_per_program)
+        close_connections()
+        os.remove(db_path)
+
+
+if __name__ == '__main__':
+    benchmark_fake_code_generator()
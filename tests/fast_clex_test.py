@@ -0,0 +1,125 @@
+import glob
+import io
+import os
+import random
+import time
+import unittest
+
+from c_parser.buffered_clex import BufferedCLex
+from c_parser.fast_clex import FastBufferedCLex
+from common import args_util
+from common.pycparser_util import init_pycparser
+from experiment.benchmark_stages import create_synthetic_program
+
+C_FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'c_parser', 'pycparser',
+                           'examples', 'c_files')
+
+HANDWRITTEN_CODES = [
+    '',
+    ' \t ',
+    '\n\n',
+    'int main(){\n  char *s = "a b\\n";\n  return 0;\n}\n',
+    'typedef struct node { int v; struct node *next; } Node;\nNode *n = 0;',
+    'float f = 1.5e-3f + .5 + 1. + 0x1.8p3 + 0X1P-2;',
+    'long a = 0x1fUL + 0b101 + 0777 + 0 + 123456789LL + 12u;',
+    "char c = 'a', d = '\\n', e = '\\x41', f = L'w'; wchar_t *w = L\"wide\";",
+    'a <<= b >>= c; a->b.c++; --d; x = y ? z : w; p &= q |= r ^= s; t %= u /= v *= w -= k += l;',
+    'if (a <= b && c >= d || e != f && !g) { h = ~i & j | k ^ l; } ...',
+    'int x[10]; x[0] = sizeof(int) % 3 / 2 - 1;',
+    'void _f1(int _a, int A9) { goto end; end: return; }',
+    # the error rules and the illegal characters
+    'int a = 08;',
+    'char *s = "abc\\q";',
+    "char c = 'ab;",
+    "char c = '';",
+    'int a = 1 @ 2;',
+    'int $a;',
+    'int a;\r\nint b;\f',
+    'int 中 = 1;',
+    # the preprocessor lines
+    '#include <stdio.h>\nint main(){}',
+    '# 10 "a.c"\nint a;\n#pragma once\nint b;',
+]
+
+
+def create_corpus(count=40, seed=1):
+    r = random.Random(seed)
+    codes = list(HANDWRITTEN_CODES)
+    for _ in range(count):
+        tokens = create_synthetic_program(r, r.randint(10, 300))
+        codes.append(''.join(t + r.choice([' ', ' ', '\t', '\n', '', '  \n\n ']) for t in tokens))
+    for path in sorted(glob.glob(os.path.join(C_FILES_DIR, '*.c'))):
+        with io.open(path, encoding='utf-8', errors='replace') as f:
+            code = f.read()
+        codes.append(code)
+        # the code without the preprocessor lines is lexed by the table driven path
+        codes.append('\n'.join('' if line.lstrip().startswith('#') else line for line in code.split('\n')))
+    return codes
+
+
+def lex_tuples(lexer, code):
+    """
+    :return: the token tuples and the line number after the code, or the exception type name
+    """
+    lexer.reset_lineno()
+    try:
+        lexer.input(code)
+    except Exception as e:
+        return type(e).__name__
+    return [(t.type, t.value, t.lineno, t.lexpos, filename) for t, filename in lexer.tokens_buffer], lexer.lexer.lineno
+
+
+class FastCLexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ply_lexer = init_pycparser(lexer=BufferedCLex).clex
+        cls.fast_lexer = init_pycparser(lexer=FastBufferedCLex).clex
+        cls.corpus = create_corpus()
+
+    def test_conformance(self):
+        scanned_count = 0
+        for code in self.corpus:
+            expected = lex_tuples(self.ply_lexer, code)
+            self.assertEqual(lex_tuples(self.fast_lexer, code), expected, code)
+            if '#' not in code and self.fast_lexer.tables.scan(code) is not None:
+                scanned_count += 1
+        # most of the corpus doesn't fall back to the PLY lexer
+        self.assertGreater(scanned_count, len(self.corpus) // 2)
+        self.assertIsNone(self.fast_lexer.tables.scan('int a = 08;'))
+
+    def test_parse(self):
+        code = 'typedef int T;\nT f(T a) {\n  T b = a * 2;\n  { int T = 1; b = T; }\n  return b;\n}\n'
+        expected = init_pycparser(lexer=BufferedCLex).parse(code)
+        res = init_pycparser(lexer=FastBufferedCLex).parse(code)
+        expected_buf, res_buf = io.StringIO(), io.StringIO()
+        expected.show(buf=expected_buf, showcoord=True)
+        res.show(buf=res_buf, showcoord=True)
+        self.assertEqual(res_buf.getvalue(), expected_buf.getvalue())
+
+    def test_fast_lexer_switch(self):
+        args_util.use_fast_lexer = True
+        try:
+            self.assertIsInstance(init_pycparser(lexer=BufferedCLex).clex, FastBufferedCLex)
+        finally:
+            args_util.use_fast_lexer = False
+        self.assertNotIsInstance(init_pycparser(lexer=BufferedCLex).clex, FastBufferedCLex)
+
+
+def benchmark_fast_clex(count=2000, length=300):
+    r = random.Random(1)
+    code_list = [' '.join(create_synthetic_program(r, length)) for _ in range(count)]
+    for name, lexer_class in [('ply BufferedCLex', BufferedCLex), ('FastBufferedCLex', FastBufferedCLex)]:
+        lexer = init_pycparser(lexer=lexer_class).clex
+        token_count = 0
+        begin = time.time()
+        for code in code_list:
+            lexer.reset_lineno()
+            lexer.input(code)
+            # read the tokens as tokenize_by_clex does
+            token_count += len(list(zip(*lexer._tokens_buffer))[0])
+        print('{}: {:.0f} tokens/s'.format(name, token_count / (time.time() - begin)))
+
+
+if __name__ == '__main__':
+    benchmark_fast_clex()
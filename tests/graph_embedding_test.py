@@ -0,0 +1,93 @@
+import multiprocessing
+import random
+import resource
+import time
+import unittest
+
+import torch
+
+from common.graph_embedding import GGNNLayer, MultiIterationGraph, GraphEdges
+
+
+def create_ast_like_adjacent_list(batch_size, seq_len):
+    """
+    a random tree for each graph with the edges in both directions, the same as parse_ast_node in the encoder sample model
+    """
+    adj_list = []
+    for _ in range(batch_size):
+        length = random.randint(seq_len // 2, seq_len)
+        tree = [[random.randint(0, i - 1), i] for i in range(1, length)]
+        adj_list.append([[a, b] for a, b in tree] + [[b, a] for a, b in tree])
+    return adj_list
+
+
+def dense_adjacent_matrix(adj_list, seq_len):
+    # the same as the dense path of create_parse_input_batch_data_fn
+    adjacent_tuple = torch.LongTensor([[i] + t for i, one in enumerate(adj_list) for t in one]).t()
+    adjacent_values = torch.ones(adjacent_tuple.shape[1]).long()
+    adjacent_size = torch.Size([len(adj_list), seq_len, seq_len])
+    return torch.sparse_coo_tensor(adjacent_tuple, adjacent_values, adjacent_size).float().to_dense()
+
+
+class GraphEdgesTest(unittest.TestCase):
+
+    def test_same_as_dense(self):
+        torch.manual_seed(0)
+        batch_size, seq_len, hidden_size = 4, 30, 16
+        adj_list = create_ast_like_adjacent_list(batch_size, seq_len)
+        # duplicated edges are counted twice by both the dense and the sparse adjacency
+        adj_list[0].append(adj_list[0][0])
+        edges = GraphEdges.from_adjacent_list(adj_list)
+        dense = dense_adjacent_matrix(adj_list, seq_len)
+        self.assertTrue(torch.equal(edges.to_dense(batch_size, seq_len), dense))
+
+        graph = MultiIterationGraph(GGNNLayer(hidden_size), graph_itr=3)
+        x = torch.randn(batch_size, seq_len, hidden_size, requires_grad=True)
+        dense_o = graph(x, dense)
+        dense_grad, = torch.autograd.grad(dense_o.sum(), x)
+        sparse_o = graph(x, edges)
+        sparse_grad, = torch.autograd.grad(sparse_o.sum(), x)
+        self.assertTrue(torch.allclose(dense_o, sparse_o, atol=1e-5))
+        self.assertTrue(torch.allclose(dense_grad, sparse_grad, atol=1e-5))
+
+    def test_empty_graph(self):
+        edges = GraphEdges.from_adjacent_list([[], []])
+        x = torch.randn(2, 5, 8)
+        self.assertTrue(torch.equal(edges.propagate(x), torch.zeros_like(x)))
+
+
+def _run_one_step(sparse, batch_size, seq_len, hidden_size, graph_itr, repeat):
+    torch.manual_seed(0)
+    random.seed(0)
+    graph = MultiIterationGraph(GGNNLayer(hidden_size), graph_itr=graph_itr)
+    adj_list = create_ast_like_adjacent_list(batch_size, seq_len)
+    base_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    begin = time.time()
+    for _ in range(repeat):
+        if sparse:
+            adj = GraphEdges.from_adjacent_list(adj_list)
+        else:
+            adj = dense_adjacent_matrix(adj_list, seq_len)
+        x = torch.randn(batch_size, seq_len, hidden_size, requires_grad=True)
+        graph(x, adj).sum().backward()
+    step_time = (time.time() - begin) / repeat
+    # ru_maxrss is in KB on linux
+    peak_memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_memory) / 1024
+    return step_time, peak_memory
+
+
+def benchmark_graph_propagate(seq_len_list=(100, 300, 500, 1000, 1500), batch_size=16, hidden_size=128, graph_itr=3,
+                              repeat=2):
+    # run each case in a new process so that the peak memory of one case doesn't hide the others
+    ctx = multiprocessing.get_context('spawn')
+    for seq_len in seq_len_list:
+        res = {}
+        for sparse in [False, True]:
+            with ctx.Pool(1) as pool:
+                res[sparse] = pool.apply(_run_one_step, (sparse, batch_size, seq_len, hidden_size, graph_itr, repeat))
+        print('seq_len: {}, dense: {:.3f}s/step {:.1f}MB, sparse: {:.3f}s/step {:.1f}MB'.format(
+            seq_len, res[False][0], res[False][1], res[True][0], res[True][1]))
+
+
+if __name__ == '__main__':
+    benchmark_graph_propagate()
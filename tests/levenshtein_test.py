@@ -0,0 +1,129 @@
+import random
+import sys
+import time
+import unittest
+
+from error_generation.find_closest_group_data.banded_levenshtein import TokenInterner, banded_levenshtein_distance, \
+    token_level_distance, token_level_distance_and_matrix
+from error_generation.find_closest_group_data.levenshtenin_token_level import levenshtenin_distance
+from error_generation.find_closest_group_data.produce_actions import cal_action_list
+from error_generation.find_closest_group_data.token_level_closest_text import left_move_action, top_move_action, \
+    left_top_move_action, calculate_distance_and_action_between_two_code, generate_equal_fn, get_token_value, \
+    recovery_code
+from experiment.benchmark_stages import create_synthetic_program
+
+
+class Token(object):
+    def __init__(self, value):
+        self.value = value
+
+
+def random_edit(r, tokens, edit_count, alphabet):
+    tokens = list(tokens)
+    for _ in range(edit_count):
+        k = r.random()
+        if k < 0.3 and len(tokens) > 0:
+            del tokens[r.randrange(len(tokens))]
+        elif k < 0.6:
+            tokens.insert(r.randint(0, len(tokens)), r.choice(alphabet))
+        elif len(tokens) > 0:
+            tokens[r.randrange(len(tokens))] = r.choice(alphabet)
+    return tokens
+
+
+def old_distance_and_action(error_tokenize, ac_tokenize, max_distance=None):
+    equal_fn = generate_equal_fn(get_token_value)
+    distance, matrix = levenshtenin_distance(error_tokenize, ac_tokenize, equal_fn=equal_fn, max_distance=max_distance)
+    if max_distance is not None and (distance < 0 or distance >= max_distance):
+        return -1, []
+    return distance, cal_action_list(matrix, error_tokenize, ac_tokenize, left_move_action, top_move_action,
+                                     left_top_move_action, equal_fn, get_token_value)
+
+
+class BandedLevenshteinTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        sys.setrecursionlimit(10000)
+
+    def test_same_as_recursive(self):
+        r = random.Random(1)
+        for _ in range(2000):
+            a = [r.choice('abcd') for _ in range(r.randint(0, 30))]
+            b = random_edit(r, a, r.randint(0, 8), 'abcde')
+            max_distance = r.choice([None, 0, 1, 2, 3, 5, 10])
+            old_distance, old_matrix = levenshtenin_distance(a, b, max_distance=max_distance)
+            distance, matrix = token_level_distance_and_matrix(a, b, max_distance=max_distance)
+            if max_distance is not None and old_distance > max_distance:
+                self.assertGreater(distance, max_distance)
+                self.assertGreater(token_level_distance(a, b, max_distance=max_distance), max_distance)
+                continue
+            self.assertEqual(distance, old_distance)
+            self.assertEqual(token_level_distance(a, b, max_distance=max_distance), old_distance)
+            self.assertEqual(cal_action_list(matrix, a, b, left_move_action, top_move_action, left_top_move_action),
+                             cal_action_list(old_matrix, a, b, left_move_action, top_move_action,
+                                             left_top_move_action))
+
+    def test_calculate_distance_and_action(self):
+        r = random.Random(2)
+        ac = create_synthetic_program(r, 200)
+        alphabet = sorted(set(ac))
+        for _ in range(30):
+            error = random_edit(r, ac, r.randint(0, 12), alphabet)
+            ac_tokens = [Token(t) for t in ac]
+            error_tokens = [Token(t) for t in error]
+            for max_distance in [None, 10]:
+                res = calculate_distance_and_action_between_two_code(error_tokens, ac_tokens,
+                                                                     max_distance=max_distance)
+                self.assertEqual(res, old_distance_and_action(error_tokens, ac_tokens, max_distance))
+                if res[0] >= 0:
+                    self.assertEqual(recovery_code(list(ac), res[1]), error)
+
+    def test_interner(self):
+        interner = TokenInterner(get_token_value)
+        a = interner.intern([Token('int'), Token('a'), Token(['"', 'b', '"'])])
+        b = interner.intern([Token('a'), Token('"b"')])
+        self.assertEqual(a.tolist(), [0, 1, 2])
+        self.assertEqual(b.tolist(), [1, 2])
+        self.assertEqual(banded_levenshtein_distance(a, b), 1)
+        self.assertEqual(banded_levenshtein_distance(a, a[:0], max_distance=2), 3)
+
+
+def benchmark_levenshtein(pair_count=20, max_distance=10):
+    sys.setrecursionlimit(100000)
+    r = random.Random(3)
+    pairs = []
+    for _ in range(pair_count):
+        ac = create_synthetic_program(r, r.randint(500, 1500))
+        pairs.append((random_edit(r, ac, r.randint(1, 20), sorted(set(ac))), ac))
+    print('{} pairs of {}-{} tokens'.format(pair_count, min(len(p[1]) for p in pairs), max(len(p[1]) for p in pairs)))
+
+    for name, fn in [('recursive', lambda a, b: levenshtenin_distance(a, b, max_distance=max_distance)[0]),
+                     ('banded', lambda a, b: token_level_distance(a, b, max_distance=max_distance))]:
+        begin = time.time()
+        for a, b in pairs:
+            fn(a, b)
+        print('{} max_distance={}: {:.1f} distances/s'.format(name, max_distance, pair_count / (time.time() - begin)))
+
+    begin = time.time()
+    for a, b in pairs[:3]:
+        levenshtenin_distance(a, b)
+    print('recursive full matrix: {:.2f} distances/s'.format(3 / (time.time() - begin)))
+    begin = time.time()
+    for a, b in pairs:
+        token_level_distance_and_matrix(a, b)
+    print('iterative full matrix: {:.2f} distances/s'.format(pair_count / (time.time() - begin)))
+
+    # the closest code search interns the tokens once and compares the ids
+    interner = TokenInterner()
+    interned_pairs = [(interner.intern(a), interner.intern(b)) for a, b in pairs]
+    for distance in [max_distance, 100]:
+        begin = time.time()
+        for a_ids, b_ids in interned_pairs:
+            banded_levenshtein_distance(a_ids, b_ids, max_distance=distance)
+        print('interned ids, max_distance={}: {:.1f} distances/s'.format(distance,
+                                                                        pair_count / (time.time() - begin)))
+
+
+if __name__ == '__main__':
+    benchmark_levenshtein()
@@ -0,0 +1,68 @@
+import random
+import time
+import unittest
+from unittest import mock
+
+from common.util import StageTimer
+from train import sequential_multi_step_batches, pipelined_multi_step_batches
+
+
+def fake_compile_code_ids_list(compile_sleep=0.0, **compile_kwargs):
+    """
+    a compile result made of the compile arguments. The sleep shuffles the finish time of the background compiles.
+    """
+    time.sleep(compile_sleep)
+    return [code * 2 + compile_kwargs['step'] for code in compile_kwargs['final_output']]
+
+
+def create_fake_batch_generator(forward_sleep=0.0, compile_sleep_fn=lambda: 0.0):
+    def create_one_batch_generator(batch_data):
+        """
+        the same protocol as multi_step_one_batch: yield the compile arguments of every step, receive the compile
+        result and return the batch result. The batch id decides the step count, batch 0 has no step.
+        """
+        batch_id, codes = batch_data
+        outputs = []
+        for step in range(batch_id % 4):
+            time.sleep(forward_sleep)
+            codes = [c + batch_id for c in codes]
+            compile_res = yield {'final_output': codes, 'step': step, 'compile_sleep': compile_sleep_fn()}
+            outputs.append(compile_res)
+            codes = compile_res
+        return batch_id, outputs
+    return create_one_batch_generator
+
+
+class MultiStepPipelineTest(unittest.TestCase):
+
+    def run_batches(self, run_fn, batches, **kwargs):
+        r = random.Random(1)
+        create_one_batch_generator = create_fake_batch_generator(
+            compile_sleep_fn=lambda: r.choice([0.0, 0.001, 0.005]))
+        with mock.patch('train.compile_code_ids_list', fake_compile_code_ids_list):
+            return list(run_fn(iter(batches), create_one_batch_generator, StageTimer(), **kwargs))
+
+    def test_same_as_sequential(self):
+        batches = [(i, list(range(i % 5))) for i in range(13)]
+        expected = self.run_batches(sequential_multi_step_batches, batches)
+        self.assertEqual([b for b, _ in expected], batches)
+        self.assertEqual([res[0] for _, res in expected], list(range(13)))
+        for pipeline_depth in [1, 2, 3, 20]:
+            res = self.run_batches(pipelined_multi_step_batches, batches, pipeline_depth=pipeline_depth)
+            self.assertEqual(res, expected, pipeline_depth)
+        self.assertEqual(self.run_batches(pipelined_multi_step_batches, []), [])
+
+
+def benchmark_pipeline(batch_count=20, forward_sleep=0.02, compile_sleep=0.02):
+    batches = [(i % 4 or 3, [1, 2, 3]) for i in range(batch_count)]
+    create_one_batch_generator = create_fake_batch_generator(forward_sleep, lambda: compile_sleep)
+    with mock.patch('train.compile_code_ids_list', fake_compile_code_ids_list):
+        for name, run_fn in [('sequential', sequential_multi_step_batches),
+                             ('pipelined', pipelined_multi_step_batches)]:
+            begin = time.time()
+            list(run_fn(iter(batches), create_one_batch_generator, StageTimer()))
+            print('{}: {:.3f}s'.format(name, time.time() - begin))
+
+
+if __name__ == '__main__':
+    benchmark_pipeline()
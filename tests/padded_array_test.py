@@ -0,0 +1,79 @@
+import random
+import time
+import unittest
+
+import numpy as np
+import torch
+
+from common.torch_util import padded_tensor
+from common.util import PaddedList, padded_array, ListShapeErrorException, ShapeDifferentException
+
+
+def random_ragged_list(depth, max_len):
+    if depth == 0:
+        return random.randint(0, 1000)
+    return [random_ragged_list(depth - 1, max_len) for _ in range(random.randint(1, max_len))]
+
+
+def create_deepfix_like_batch(batch_size, max_seq_len=400, max_mask_len=60):
+    """
+    the ragged lists of one batch in the encoder sample model. input_seq is [batch, seq] and compatible_tokens is
+    [batch, seq, mask_len].
+    """
+    input_seq = [[random.randint(0, 5000) for _ in range(random.randint(50, max_seq_len))] for _ in range(batch_size)]
+    compatible_tokens = [[[random.randint(0, 5000) for _ in range(random.randint(1, max_mask_len))]
+                          for _ in range(random.randint(1, 20))] for _ in range(batch_size)]
+    return input_seq, compatible_tokens
+
+
+class PaddedArrayTest(unittest.TestCase):
+
+    def test_same_as_padded_list(self):
+        for depth in range(1, 4):
+            for _ in range(20):
+                l = random_ragged_list(depth, 6)
+                for fill_value in [0, -1]:
+                    res = padded_array(l, fill_value=fill_value)
+                    self.assertEqual(res.tolist(), torch.LongTensor(PaddedList(l, fill_value=fill_value)).tolist())
+
+    def test_shape(self):
+        l = [[1, 2], [3]]
+        self.assertEqual(padded_array(l, shape=[3, 4]).tolist(), [[1, 2, 0, 0], [3, 0, 0, 0], [0, 0, 0, 0]])
+        self.assertEqual(padded_array([[], []]).shape, (2, 0))
+        self.assertEqual(padded_array([], shape=[2, 3]).shape, (2, 3))
+        self.assertRaises(ListShapeErrorException, padded_array, [[1, 2, 3]], shape=[1, 2])
+        self.assertRaises(ListShapeErrorException, padded_array, [[1]], shape=[1])
+        self.assertRaises(ShapeDifferentException, padded_array, [[1, [2]]])
+
+    def test_preallocated_buffer(self):
+        buffer = np.empty((2, 3), dtype=np.int64)
+        res = padded_array([[1, 2], [3]], fill_value=-1, out=buffer)
+        self.assertIs(res, buffer)
+        self.assertEqual(buffer.tolist(), [[1, 2, -1], [3, -1, -1]])
+
+    def test_padded_tensor(self):
+        res = padded_tensor([[1, 0], [1]], dtype=torch.float)
+        self.assertEqual(res.dtype, torch.float)
+        self.assertEqual(res.tolist(), [[1.0, 0.0], [1.0, 0.0]])
+        self.assertEqual(padded_tensor([[True], [False, True]], dtype=torch.uint8).tolist(), [[1, 0], [0, 1]])
+
+
+def benchmark_collate(batch_size, repeat=10):
+    batches = [create_deepfix_like_batch(batch_size) for _ in range(repeat)]
+
+    def run(fn):
+        begin = time.time()
+        for input_seq, compatible_tokens in batches:
+            fn(input_seq)
+            fn(compatible_tokens)
+        return (time.time() - begin) / repeat
+
+    padded_list_time = run(lambda l: torch.LongTensor(PaddedList(l)))
+    padded_tensor_time = run(padded_tensor)
+    print('batch_size: {}, PaddedList: {:.4f}s/batch, padded_tensor: {:.4f}s/batch, speed up: {:.1f}x'.format(
+        batch_size, padded_list_time, padded_tensor_time, padded_list_time / padded_tensor_time))
+
+
+if __name__ == '__main__':
+    for batch_size in [8, 16, 32, 64]:
+        benchmark_collate(batch_size)
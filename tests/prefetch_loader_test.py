@@ -0,0 +1,149 @@
+import random
+import time
+import unittest
+
+import numpy as np
+
+from common import args_util
+from common.prefetch_loader import prefetch_data_loader, cut_index_batches
+from common.util import data_loader, queued_data_loader, CustomerDataSet
+from experiment.experiment_dataset import CombineNodeIterateErrorDataSet
+from tests.columnar_store_test import create_iterate_df, FakeVocabulary
+
+
+class AstVocabulary(FakeVocabulary):
+    def word_to_id(self, word):
+        return self.word_id.setdefault(word, len(self.word_id))
+
+
+def create_dataset(count=200, use_ast=False):
+    vocabulary = AstVocabulary() if use_ast else FakeVocabulary()
+    return CombineNodeIterateErrorDataSet(create_iterate_df(count), vocabulary, 'train', do_flatten=True,
+                                          use_ast=use_ast)
+
+
+def padding_ratio(batches, key='input_seq'):
+    total = 0
+    padded = 0
+    for batch in batches:
+        lengths = [len(s) for s in batch[key]]
+        total += sum(lengths)
+        padded += max(lengths) * len(lengths)
+    return 1 - total / padded
+
+
+class FailedDataSet(CustomerDataSet):
+    def __init__(self):
+        super().__init__(None, None, 'train')
+        self._samples = list(range(10))
+
+    def __getitem__(self, index):
+        if index == 7:
+            raise ValueError('bad sample')
+        return {'x': index}
+
+
+class GlobalRandomDataSet(object):
+    """
+    a dataset without get_sample, drawing from random and np.random
+    """
+    def __getitem__(self, index):
+        return {'x': (index, random.random(), float(np.random.random()))}
+
+    def __len__(self):
+        return 20
+
+
+class PrefetchLoaderTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dataset = create_dataset()
+
+    def test_index_batches(self):
+        batches = cut_index_batches(self.dataset, 16, is_shuffle=True, seed=3)
+        self.assertEqual(sorted(i for b in batches for i in b), list(range(len(self.dataset))))
+        self.assertEqual(cut_index_batches(self.dataset, 16, is_shuffle=True, seed=3), batches)
+        self.assertEqual(len(cut_index_batches(self.dataset, 16, drop_last=True)), len(self.dataset) // 16)
+        self.assertEqual(len(cut_index_batches(self.dataset, 10, epoch_ratio=0.5)), 10)
+        self.assertEqual(cut_index_batches(self.dataset, 16, is_shuffle=False)[0], list(range(16)))
+        bucketed = cut_index_batches(self.dataset, 16, seed=3, length_fn=self.dataset.sample_length)
+        self.assertEqual(sorted(i for b in bucketed for i in b), list(range(len(self.dataset))))
+
+    def test_deterministic(self):
+        expected = list(prefetch_data_loader(self.dataset, 16, num_workers=0, seed=5))
+        self.assertEqual(list(prefetch_data_loader(self.dataset, 16, num_workers=3, prefetch_depth=2, seed=5)),
+                         expected)
+        self.assertEqual(list(prefetch_data_loader(self.dataset, 16, num_workers=2, seed=5)), expected)
+        self.assertNotEqual(list(prefetch_data_loader(self.dataset, 16, num_workers=2, seed=6)), expected)
+        ids = [i for b in expected for i in b['id']]
+        self.assertEqual(sorted(ids), sorted(self.dataset.data_df['id']))
+
+    def test_global_random_untouched(self):
+        for dataset in [self.dataset, GlobalRandomDataSet()]:
+            random.seed(1)
+            np.random.seed(1)
+            expected = random.random(), np.random.random()
+            random.seed(1)
+            np.random.seed(1)
+            batches = list(prefetch_data_loader(dataset, 4, num_workers=0, seed=5))
+            self.assertEqual((random.random(), np.random.random()), expected)
+            self.assertEqual(list(prefetch_data_loader(dataset, 4, num_workers=2, seed=5)), batches)
+
+    def test_length_bucket(self):
+        batches = list(prefetch_data_loader(self.dataset, 16, num_workers=2, seed=5))
+        bucketed = list(prefetch_data_loader(self.dataset, 16, num_workers=2, seed=5, length_bucket=True))
+        self.assertEqual(sorted(i for b in bucketed for i in b['id']), sorted(i for b in batches for i in b['id']))
+        self.assertLess(padding_ratio(bucketed), padding_ratio(batches))
+
+    def test_data_loader_switch(self):
+        expected = next(data_loader(self.dataset, 8, is_shuffle=False))
+        args_util.use_prefetch_loader = True
+        try:
+            batches = list(data_loader(self.dataset, 8, is_shuffle=False, drop_last=True))
+        finally:
+            args_util.use_prefetch_loader = False
+        self.assertEqual(len(batches), len(self.dataset) // 8)
+        self.assertEqual(batches[0].keys(), expected.keys())
+        self.assertEqual(batches[0]['id'], expected['id'])
+
+    def test_worker_error(self):
+        with self.assertRaises(Exception) as cm:
+            list(prefetch_data_loader(FailedDataSet(), 2, num_workers=2, is_shuffle=False))
+        self.assertIn('bad sample', str(cm.exception))
+        # the loader stops its workers when it is closed early
+        loader = prefetch_data_loader(self.dataset, 4, num_workers=2)
+        next(loader)
+        loader.close()
+
+
+def benchmark_prefetch_loader(count=20000, ast_count=2000, batch_size=32):
+    dataset = create_dataset(count)
+    run_loader_benchmark(dataset, batch_size)
+    # the samples parsing the ast code graph cost more than sending the batch from a worker
+    dataset = create_dataset(ast_count, use_ast=True)
+    print('use_ast samples:')
+    run_loader_benchmark(dataset, batch_size)
+
+
+def run_loader_benchmark(dataset, batch_size):
+    loaders = [
+        ('data_loader', lambda: data_loader(dataset, batch_size)),
+        ('queued_data_loader', lambda: queued_data_loader(dataset, batch_size)),
+        ('prefetch 0 worker', lambda: prefetch_data_loader(dataset, batch_size, num_workers=0)),
+        ('prefetch 4 workers', lambda: prefetch_data_loader(dataset, batch_size, num_workers=4)),
+        ('prefetch 4 workers length bucket', lambda: prefetch_data_loader(dataset, batch_size, num_workers=4,
+                                                                          length_bucket=True)),
+    ]
+    results = []
+    for name, create_loader in loaders:
+        random.seed(1)
+        begin = time.time()
+        batches = list(create_loader())
+        results.append('{}: {:.1f} batches/s, padding ratio {:.3f}'.format(
+            name, len(batches) / (time.time() - begin), padding_ratio(batches)))
+    print('\n'.join(results))
+
+
+if __name__ == '__main__':
+    benchmark_prefetch_loader()
@@ -0,0 +1,244 @@
+import os
+import tempfile
+import json
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+import torch
+
+from common import problem_util
+from common.repair_server import LatencyHistogram, RepairEngine, RepairServer, SingleStepRepairEngine, \
+    start_http_server, post_repair, run_load_generator, create_repair_engine_from_config
+
+
+def create_engine(count=8, length=60, seed=100):
+    """
+    :return: (a RepairEngine of the untrained benchmark EncoderSampleModel, the codes of the synthetic corpus)
+    """
+    from experiment.benchmark_stages import create_synthetic_corpus, create_benchmark_model
+    from model.encoder_sample_model import create_parse_input_batch_data_fn, create_multi_step_next_input_batch_fn
+    problem_util.GPU_INDEX = None
+    torch.manual_seed(1)
+    df, vocabulary = create_synthetic_corpus(count, length=length, seed=seed)
+    w = vocabulary.word_to_id
+    tmp_dir = tempfile.mkdtemp()
+    engine = RepairEngine(create_benchmark_model(vocabulary), vocabulary, create_parse_input_batch_data_fn(),
+                          create_multi_step_next_input_batch_fn(w(vocabulary.begin_tokens[0]),
+                                                                w(vocabulary.end_tokens[0]),
+                                                                w(vocabulary.end_tokens[1]), vocabulary=vocabulary),
+                          max_step_times=2, compile_file_path=os.path.join(tmp_dir, 'main.c'),
+                          target_file_path=os.path.join(tmp_dir, 'main.out'),
+                          log_file_path=os.path.join(tmp_dir, 'main.log'))
+    codes = ['\n'.join(includes) + '\n' + code for includes, code in zip(df['includes'], df['ac_code'])]
+    return engine, codes
+
+
+def create_slk_model(vocabulary, hidden_size=64):
+    from model.one_pointer_copy_self_attention_seq2seq_model_gammar_mask_refactor import \
+        RNNPointerNetworkModelWithSLKMask
+    w = vocabulary.word_to_id
+    # the same as pointer_network_with_ggnn_encoder in parameters_config except the size
+    return RNNPointerNetworkModelWithSLKMask(
+        vocabulary_size=vocabulary.vocabulary_size, hidden_size=hidden_size, num_layers=3,
+        start_label=w(vocabulary.begin_tokens[0]), end_label=w(vocabulary.end_tokens[0]), dropout_p=0.2,
+        MAX_LENGTH=500, atte_position_type='content', mask_transformer=None, graph_embedding='mixed',
+        pointer_type='query', no_position_embedding=False, position_embedding_length=1000,
+        graph_parameter={"rnn_parameter": {'vocab_size': vocabulary.vocabulary_size, 'max_len': 500,
+                                           'input_size': hidden_size, 'input_dropout_p': 0.2, 'dropout_p': 0.2,
+                                           'n_layers': 1, 'bidirectional': True, 'rnn_cell': 'gru',
+                                           'variable_lengths': False, 'embedding': None,
+                                           'update_embedding': True},
+                         "graph_type": "ggnn", "graph_itr": 3, "dropout_p": 0.2, "mask_ast_node_in_rnn": False},
+        mask_type='static', vocabulary=vocabulary)
+
+
+def create_single_step_config(count=4, length=40, seed=100):
+    """
+    :return: (the part of the pointer_network_with_ggnn_encoder config read by create_repair_engine_from_config with
+    the untrained small RNNPointerNetworkModelWithSLKMask, the codes of the synthetic corpus)
+    """
+    from experiment.benchmark_stages import create_synthetic_corpus
+    from model.one_pointer_copy_self_attention_seq2seq_model_gammar_mask_refactor import \
+        create_parse_rnn_input_batch_data_fn, create_output_ids
+    problem_util.GPU_INDEX = None
+    torch.manual_seed(1)
+    df, vocabulary = create_synthetic_corpus(count, length=length, seed=seed)
+    # get_model is patched to return 'model' in the tests
+    p_config = {'name': 'single_step', 'load_model_name': 'single_step.pkl', 'model_fn': None, 'model_dict': {},
+                'model': create_slk_model(vocabulary), 'vocabulary': vocabulary, 'use_ast': True,
+                'parse_input_batch_data_fn': create_parse_rnn_input_batch_data_fn(vocabulary, use_ast=True),
+                'create_output_ids_fn': create_output_ids, 'max_step_times': 1,
+                'create_multi_step_next_input_batch_fn': None}
+    codes = ['\n'.join(includes) + '\n' + code for includes, code in zip(df['includes'], df['ac_code'])]
+    return p_config, codes
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_percentile(self):
+        histogram = LatencyHistogram()
+        self.assertEqual(histogram.percentile(50), 0.0)
+        for i in range(1, 101):
+            histogram.add(i / 1000)
+        self.assertEqual(histogram.count, 100)
+        # the bucket bound is at most factor times the latency
+        self.assertGreaterEqual(histogram.percentile(50), 0.05)
+        self.assertLessEqual(histogram.percentile(50), 0.05 * histogram.factor)
+        self.assertAlmostEqual(histogram.percentile(100), 0.1)
+        self.assertEqual(list(histogram.to_dict().keys()), ['count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms',
+                                                            'max_ms'])
+
+
+class RepairServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gpu_index = problem_util.GPU_INDEX
+        self.engine, self.codes = create_engine()
+
+    def tearDown(self):
+        problem_util.GPU_INDEX = self.gpu_index
+
+    def test_same_as_engine(self):
+        expected = self.engine.repair([self.engine.create_sample(c, i) for i, c in enumerate(self.codes)])
+        server = RepairServer(self.engine, max_batch_size=4, max_batch_delay=0.05, bucket_width=1000)
+        futures = [server.submit(c) for c in self.codes]
+        res = [f.result(60) for f in futures]
+        server.close()
+        for r, e in zip(res, expected):
+            self.assertEqual(r['code'], e['code'])
+            self.assertEqual(r['compile'], e['compile'])
+        self.assertEqual(sum(k * v for k, v in server.batch_size_count.items()), len(self.codes))
+        self.assertLessEqual(max(server.batch_size_count.keys()), 4)
+        self.assertEqual(server.latency.count, len(self.codes))
+        with self.assertRaises(ValueError):
+            server.submit('#define N 3\nint main() { return N; }').result(10)
+
+    def test_length_bucket(self):
+        short_code = '#include <stdio.h>\nint main() { return 0 ; }'
+        batches = []
+        repair = self.engine.repair
+
+        def record_repair(samples):
+            batches.append([s['input_length'] for s in samples])
+            return repair(samples)
+
+        self.engine.repair = record_repair
+        server = RepairServer(self.engine, max_batch_size=16, max_batch_delay=0.2, bucket_width=20)
+        futures = [server.submit(c) for c in [short_code, self.codes[0], short_code, self.codes[0]]]
+        for f in futures:
+            f.result(60)
+        server.close()
+        # the short programs don't wait in the batch of the long ones
+        self.assertEqual(len(batches), 2)
+        for b in batches:
+            self.assertEqual(len(set(l // 20 for l in b)), 1)
+
+    def test_http(self):
+        server = RepairServer(self.engine, max_batch_size=4, max_batch_delay=0.01)
+        httpd = start_http_server(server, port=0)
+        url = 'http://{}:{}'.format(*httpd.server_address)
+        res = []
+        threads = [threading.Thread(target=lambda c=c: res.append(post_repair(url, c))) for c in self.codes[:4]]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(res), 4)
+        for r in res:
+            self.assertIn('#include <stdio.h>', r['code'])
+            self.assertIsInstance(r['compile'], bool)
+        httpd.shutdown()
+        server.close()
+        self.assertEqual(server.stats()['latency']['count'], 4)
+
+    def test_http_errors(self):
+        server = RepairServer(self.engine, max_batch_size=4, max_batch_delay=0.01)
+        httpd = start_http_server(server, port=0)
+        url = 'http://{}:{}/repair'.format(*httpd.server_address)
+
+        def post(data):
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=60) as f:
+                    return f.status, json.loads(f.read().decode('utf-8'))
+            except urllib.error.HTTPError as e:
+                return e.code, json.loads(e.read().decode('utf-8'))
+
+        try:
+            self.assertEqual(post(b'{"text": 1}')[0], 400)
+            with mock.patch.object(server, 'repair', side_effect=RuntimeError('model failed')), \
+                    self.assertLogs('repair_server', level='ERROR'):
+                self.assertEqual(post(json.dumps({'code': self.codes[0]}).encode('utf-8')),
+                                 (500, {'error': 'RuntimeError: model failed'}))
+            self.assertEqual(post(json.dumps({'code': self.codes[0]}).encode('utf-8'))[0], 200)
+        finally:
+            httpd.shutdown()
+            server.close()
+
+
+class SingleStepRepairEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gpu_index = problem_util.GPU_INDEX
+        self.p_config, self.codes = create_single_step_config()
+
+    def tearDown(self):
+        problem_util.GPU_INDEX = self.gpu_index
+
+    def create_engine(self):
+        tmp_dir = tempfile.mkdtemp()
+        with mock.patch('common.experiment_registry.load_config', return_value=self.p_config), \
+                mock.patch('train.get_model', return_value=self.p_config['model']) as get_model:
+            engine = create_repair_engine_from_config('single_step', do_compile_pool=False,
+                                                      compile_file_path=os.path.join(tmp_dir, 'main.c'),
+                                                      target_file_path=os.path.join(tmp_dir, 'main.out'),
+                                                      log_file_path=os.path.join(tmp_dir, 'main.log'))
+        self.assertEqual(get_model.call_count, 1)
+        return engine
+
+    def test_create_from_config(self):
+        engine = self.create_engine()
+        self.assertIsInstance(engine, SingleStepRepairEngine)
+        self.assertTrue(engine.use_ast)
+        sample = engine.create_sample(self.codes[0], 1)
+        self.assertEqual(sample['includes'], ['#include <stdio.h>'])
+        self.assertEqual(sample['input_length'], len(sample['error_tokens']))
+        self.assertGreater(len(sample['adj']), 0)
+        with mock.patch('common.experiment_registry.load_config',
+                        return_value=dict(self.p_config, create_output_ids_fn=None)), \
+                self.assertRaises(ValueError):
+            create_repair_engine_from_config('single_step')
+
+    def test_same_as_engine(self):
+        engine = self.create_engine()
+        expected = engine.repair([engine.create_sample(c, i) for i, c in enumerate(self.codes)])
+        self.assertEqual(len(expected), len(self.codes))
+        for e in expected:
+            self.assertIn('#include <stdio.h>', e['code'])
+            self.assertIsInstance(e['compile'], bool)
+            self.assertEqual(e['steps'], 1)
+        server = RepairServer(engine, max_batch_size=4, max_batch_delay=0.05, bucket_width=1000)
+        res = [f.result(120) for f in [server.submit(c) for c in self.codes]]
+        server.close()
+        self.assertEqual([r['code'] for r in res], [e['code'] for e in expected])
+        self.assertEqual([r['compile'] for r in res], [e['compile'] for e in expected])
+
+
+def benchmark_repair_server(count=32, length=150, concurrency_list=(1, 4, 16), request_count=64):
+    """
+    the throughput and p50/p99 latency of the repair server with the concurrent clients
+    """
+    engine, codes = create_engine(count, length)
+    for max_batch_size in [1, 16]:
+        server = RepairServer(engine, max_batch_size=max_batch_size, max_batch_delay=0.02)
+        httpd = start_http_server(server, port=0)
+        print('max batch size {}:'.format(max_batch_size))
+        run_load_generator('http://{}:{}'.format(*httpd.server_address), codes, concurrency_list, request_count)
+        httpd.shutdown()
+        server.close()
+
+
+if __name__ == '__main__':
+    benchmark_repair_server()
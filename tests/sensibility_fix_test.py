@@ -0,0 +1,90 @@
+import random
+import time
+import unittest
+
+import numpy as np
+import torch
+
+from common import args_util, problem_util
+from model.sensibility_baseline.baseline_model import FixModel
+from model.sensibility_baseline.rnn_pytorch import SensibilityBiRnnModel
+from vocabulary.word_vocabulary import Vocabulary
+
+
+def create_fix_model(vocabulary_size=60, hidden_size=32):
+    words = ['w{}'.format(i) for i in range(vocabulary_size - 6)]
+    vocabulary = Vocabulary(set(words), {w: i for i, w in enumerate(words)}, ['<BEGIN>', '<INNER_BEGIN>'],
+                            ['<END>', '<INNER_END>'], '<UNK>', ['<PAD>'])
+    # the same as sensibility_rnn_config2 except the size
+    rnn_model = SensibilityBiRnnModel(vocabulary_size=vocabulary.vocabulary_size, embedding_dim=hidden_size,
+                                      hidden_size=hidden_size,
+                                      encoder_params={'vocab_size': vocabulary.vocabulary_size, 'max_len': 500,
+                                                      'input_size': hidden_size, 'input_dropout_p': 0.2,
+                                                      'dropout_p': 0.2, 'n_layers': 3, 'bidirectional': False,
+                                                      'rnn_cell': 'gru', 'variable_lengths': False,
+                                                      'embedding': None, 'update_embedding': True})
+    model = FixModel(rnn_model, vocabulary)
+    model.eval()
+    return model, vocabulary
+
+
+def create_files(count, vocabulary_size, min_length=5, max_length=60, seed=1):
+    r = random.Random(seed)
+    return [[r.randint(1, vocabulary_size - 1) for _ in range(r.randint(min_length, max_length))]
+            for _ in range(count)]
+
+
+class SensibilityFixTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gpu_index = problem_util.GPU_INDEX
+        problem_util.GPU_INDEX = None
+        torch.manual_seed(1)
+        self.model, self.vocabulary = create_fix_model()
+
+    def tearDown(self):
+        problem_util.GPU_INDEX = self.gpu_index
+        args_util.use_batch_sensibility_fix = False
+
+    def test_fix_batch(self):
+        files = create_files(12, self.vocabulary.vocabulary_size) + [[3, 4]]
+        fix_upper = self.model.fix_upper
+        with torch.no_grad():
+            for k in [1, 3]:
+                fix_upper.k = k
+                expected = [fix_upper.fix(f) for f in files]
+                fixes = fix_upper.fix_batch(files)
+                self.assertEqual(fixes.to_edits(len(files)), expected)
+                self.assertTrue(np.all(np.diff(fixes.file_index) >= 0))
+
+    def test_forward_batch(self):
+        files = create_files(10, self.vocabulary.vocabulary_size)
+        with torch.no_grad():
+            batch_data = {'id': list(range(len(files))), 'input_seq': files}
+            expected_batch_data = dict(batch_data)
+            expected = self.model.forward(expected_batch_data)
+            args_util.use_batch_sensibility_fix = True
+            res_batch_data = dict(batch_data)
+            res = self.model.forward(res_batch_data)
+        self.assertEqual(res_batch_data, expected_batch_data)
+        self.assertEqual(len(res), len(expected))
+        for r, e in zip(res, expected):
+            self.assertTrue(torch.equal(r, e))
+
+
+def benchmark_sensibility_fix(count=128, batch_size=32, vocabulary_size=1000, hidden_size=128):
+    problem_util.GPU_INDEX = None
+    torch.manual_seed(1)
+    model, vocabulary = create_fix_model(vocabulary_size, hidden_size)
+    files = create_files(count, vocabulary.vocabulary_size, min_length=50, max_length=300)
+    for batch_fix in [False, True]:
+        args_util.use_batch_sensibility_fix = batch_fix
+        begin = time.time()
+        with torch.no_grad():
+            for i in range(0, count, batch_size):
+                model.forward({'input_seq': files[i:i+batch_size]})
+        print('batch sensibility fix: {}, {:.2f} files/s'.format(batch_fix, count / (time.time() - begin)))
+
+
+if __name__ == '__main__':
+    benchmark_sensibility_fix()
@@ -0,0 +1,139 @@
+import os
+import time
+import unittest
+
+from c_parser.compiled_slk_parser import CompiledSLKParser
+from c_parser.slk_parser import PackedDynamicSLKParser
+from common import args_util
+from common.analyse_include_util import replace_include_with_blank
+from common.constants import pre_defined_c_tokens, c_standard_library_defined_types
+from common.pycparser_util import tokenize_by_clex_fn, transform_LexToken
+from vocabulary.transform_vocabulary_and_parser import TransformVocabularyAndSLK
+from vocabulary.word_vocabulary import Vocabulary
+
+CODES = [
+    r'''int somme ( int i ) { if ( i != 0 ) { return 0 ; } else if ( i == 1 ) { return 1 ; } else { return ( somme ( i - 1 ) + i ) ; } } int main ( ) { int i , S , n ; scanf ( "%d" , & n ) ; i = 1 ; S = 0 ; do { S = somme ( i ) ; i ++ ; S = S + S ; } while ( S > n ) ; printf ( "%d\n" , i ) ; return 0 ; }''',
+    r'''typedef struct node { int v ; struct node * next ; } node_t ; typedef int my_type ; my_type f ( node_t * p ) { my_type s = 0 ; while ( p ) { s += p -> v ; p = p -> next ; } return s ; } int main ( void ) { node_t a ; size_t b = sizeof ( a ) ; a . v = 1 ; a . next = 0 ; printf ( "%d %c %f" , f ( & a ) , 'x' , 1.5 ) ; return 0 ; }''',
+    r'''int main ( ) { char x [ 99 ] , y [ 99 ] , z [ 99 ] ; int i = 0 , l1 , l2 ; int l , u , B ; scanf ( "%s %s" , x , y ) ; l1 = strlen ( x ) ; l2 = strlen ( y ) ; if ( l1 == l2 ) { for ( i = 0 ; i < l1 ; i ++ ) { if ( x [ i ] >= 97 && x [ i ] <= 122 ) { if ( x [ i ] < y [ i ] ) { B = - 1 ; break ; } else { l = x [ i ] ; u = 122 ; srand ( ( unsigned ) time ( NULL ) ) ; z [ i ] = l + rand ( ) % ( u - l + 1 ) ; } } } } if ( B == - 1 ) { printf ( "%d" , B ) ; } else { printf ( "%s" , z ) ; } return 0 ; }''',
+]
+
+# the real programs of the pycparser examples and tests. Some of them can't be lexed or parsed, the parsers must give
+# the same error for them.
+REAL_CODE_PATHS = ['c_parser/pycparser/examples/c_files/funky.c', 'c_parser/pycparser/examples/c_files/hash.c',
+                   'c_parser/pycparser/examples/c_files/year.c', 'c_parser/pycparser/tests/c_files/example_c_file.c',
+                   'c_parser/pycparser/tests/c_files/simplemain.c', 'c_parser/pycparser/tests/c_files/year.c']
+
+
+def read_real_codes():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    codes = []
+    for path in REAL_CODE_PATHS:
+        with open(os.path.join(root, path), errors='replace') as f:
+            codes.append(replace_include_with_blank(f.read()))
+    return codes
+
+
+def create_vocabulary(tokenize_fn, extra_identifier_count=0, codes=CODES):
+    words = set(pre_defined_c_tokens) | {'size_t', 'FILE', 'unk'}
+    for code in codes:
+        words |= {tok.value for tok in tokenize_fn(code)}
+    words |= {'v{}'.format(i) for i in range(extra_identifier_count)}
+    words = sorted(words)
+    return Vocabulary(set(words), {w: i for i, w in enumerate(words)}, ['<BEGIN>'], ['<END>'], '<UNK>', ['<GAP>'])
+
+
+class CompiledSLKParserTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenize_fn = staticmethod(tokenize_by_clex_fn())
+        cls.vocabulary = create_vocabulary(cls.tokenize_fn)
+        cls.transformer = TransformVocabularyAndSLK(cls.vocabulary, cls.tokenize_fn)
+
+    def test_compatible_terminals(self):
+        parser = PackedDynamicSLKParser()
+        compiled_parser = CompiledSLKParser(parser.slk_constants, parser.label_vocabulary)
+        for code in CODES + [CODES[1][:150]]:
+            tokens = [transform_LexToken(tok) for tok in self.tokenize_fn(code)]
+            labels = [parser.label_vocabulary.get_label_id(tok.type) for tok in tokens]
+            bitsets, typedef_names = compiled_parser.parse(labels, [tok.value for tok in tokens])
+            res, type_id_res = parser.get_all_compatible_token(tokens)
+            self.assertEqual(len(bitsets), len(tokens) + 1)
+            self.assertEqual([set(r) for r in res], [set(compiled_parser.bitset_to_labels(b)) for b in bitsets])
+            self.assertEqual(type_id_res, [set(names) | c_standard_library_defined_types for names in typedef_names])
+
+    def tearDown(self):
+        args_util.use_compiled_slk = False
+
+    def assert_same_mask(self, transformer, ids_list):
+        masks = transformer.get_all_token_mask_train_by_compiled_parser(ids_list)
+        expected = transformer.get_all_token_mask_train_by_dynamic_parser(ids_list)
+        self.assertEqual(masks, expected)
+        for one_masks, one_expected in zip(masks, expected):
+            for m, e in zip(one_masks, one_expected):
+                self.assertEqual(m.stored_set, e.stored_set)
+
+    def test_same_mask(self):
+        ids_list = self.vocabulary.parse_text_without_pad([[tok.value for tok in self.tokenize_fn(code)]
+                                                           for code in CODES])
+        ids_list.append(ids_list[1][:40])
+        self.assert_same_mask(self.transformer, ids_list)
+
+    def test_same_mask_of_real_codes(self):
+        tokens_list = [self.tokenize_fn(code) for code in read_real_codes()]
+        tokens_list = [[tok.value for tok in tokens] for tokens in tokens_list if tokens is not None]
+        vocabulary = create_vocabulary(self.tokenize_fn, codes=[' '.join(tokens) for tokens in tokens_list])
+        transformer = TransformVocabularyAndSLK(vocabulary, self.tokenize_fn)
+        parsed_count = 0
+        for ids in vocabulary.parse_text_without_pad(tokens_list):
+            try:
+                expected = transformer.get_all_token_mask_train_by_dynamic_parser([ids])
+            except Exception as e:
+                with self.assertRaises(Exception) as compiled:
+                    transformer.get_all_token_mask_train_by_compiled_parser([ids])
+                self.assertEqual(str(compiled.exception), str(e))
+                continue
+            parsed_count += 1
+            self.assertEqual(transformer.get_all_token_mask_train_by_compiled_parser([ids]), expected)
+        self.assertGreaterEqual(parsed_count, 4)
+
+    def test_use_compiled_slk(self):
+        transformer = TransformVocabularyAndSLK(self.vocabulary, self.tokenize_fn)
+        ids_list = self.vocabulary.parse_text_without_pad([[tok.value for tok in self.tokenize_fn(CODES[0])]])
+        expected = transformer.get_all_token_mask_train(ids_list)
+        # the dynamic parser is the default
+        self.assertIsNone(transformer._compiled_parser)
+        args_util.use_compiled_slk = True
+        self.assertEqual(transformer.get_all_token_mask_train(ids_list), expected)
+        self.assertIsNotNone(transformer._compiled_parser)
+
+    def test_parse_error(self):
+        ids_list = self.vocabulary.parse_text_without_pad([['int', 'main', '(', ')', '{', 'i', '=', '=', '1', ';']])
+        with self.assertRaises(Exception) as expected:
+            self.transformer.get_all_token_mask_train_by_dynamic_parser(ids_list)
+        with self.assertRaises(Exception) as compiled:
+            self.transformer.get_all_token_mask_train_by_compiled_parser(ids_list)
+        self.assertEqual(str(expected.exception), str(compiled.exception))
+
+
+def benchmark_slk_mask(extra_identifier_count=30000, repeat=20):
+    tokenize_fn = tokenize_by_clex_fn()
+    vocabulary = create_vocabulary(tokenize_fn, extra_identifier_count)
+    transformer = TransformVocabularyAndSLK(vocabulary, tokenize_fn)
+    ids_list = vocabulary.parse_text_without_pad([[tok.value for tok in tokenize_fn(code)] for code in CODES])
+    mask_count = sum(len(ids) + 1 for ids in ids_list) * repeat
+    print('vocabulary size: {}'.format(vocabulary.vocabulary_size))
+
+    for name, fn in [('dynamic parser', transformer.get_all_token_mask_train_by_dynamic_parser),
+                     ('compiled parser', transformer.get_all_token_mask_train_by_compiled_parser),
+                     ('compiled parser mask matrix',
+                      lambda l: [transformer.create_token_mask_matrix(ids) for ids in l])]:
+        fn(ids_list)
+        begin = time.time()
+        for _ in range(repeat):
+            fn(ids_list)
+        print('{}: {:.0f} masks/s'.format(name, mask_count / (time.time() - begin)))
+
+
+if __name__ == '__main__':
+    benchmark_slk_mask()
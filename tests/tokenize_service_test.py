@@ -0,0 +1,123 @@
+import os
+import random
+import tempfile
+import time
+import unittest
+
+from common import args_util
+from common.pycparser_util import tokenize_by_clex_fn
+from common.tokenize_service import TokenizeService
+from experiment.benchmark_stages import create_synthetic_program
+
+
+def create_code_list(count, length=150, seed=1):
+    r = random.Random(seed)
+    code_list = []
+    for _ in range(count):
+        tokens = create_synthetic_program(r, length)
+        # put some tokens in the new lines to check the line and column
+        code_list.append(''.join(t + ('\n' if r.random() < 0.1 else ' ') for t in tokens))
+    return code_list
+
+
+def to_tuples(tokens):
+    if tokens is None:
+        return None
+    return [(t.type, t.value, t.lineno, t.lexpos) for t in tokens]
+
+
+class TokenizeServiceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenize_fn = staticmethod(tokenize_by_clex_fn())
+        cls.code_list = create_code_list(30) + ['', '#include <stdio.h>\nint main(){}', 'int a = "b;',
+                                                 'int main(){\n  char *s = "a b";\n  return 0;\n}']
+
+    def test_same_as_tokenize_by_clex(self):
+        service = TokenizeService()
+        res = service.tokenize_batch(self.code_list)
+        for code, token_array in zip(self.code_list, res):
+            expected = self.tokenize_fn(code)
+            if expected is None:
+                self.assertIsNone(token_array)
+                continue
+            self.assertEqual(to_tuples(token_array.to_tokens()), to_tuples(expected))
+            for tok, column in zip(expected, token_array.columns):
+                self.assertEqual(column, tok.lexpos - code.rfind('\n', 0, tok.lexpos))
+        token_array = res[-1]
+        self.assertEqual(token_array.value_names()[7:10], ['s', '=', '"a b"'])
+        self.assertEqual(list(token_array.lines[7:10]), [2, 2, 2])
+        self.assertEqual(list(token_array.columns[7:10]), [9, 11, 13])
+        # the same value has the same id in all the codes
+        self.assertEqual(res[0].values[0], res[1].values[0])
+
+    def test_cache(self):
+        cache_path = os.path.join(tempfile.mkdtemp(), 'tokenize_cache.db')
+        service = TokenizeService(cache_path=cache_path)
+        expected = service.tokenize_tokens_batch(self.code_list + self.code_list[:3])
+        self.assertEqual(len(service.cache), len(set(self.code_list)))
+        self.assertEqual(service.cache.hits, 0)
+        service.close()
+
+        service = TokenizeService(cache_path=cache_path)
+        service._lex = None
+        res = service.tokenize_tokens_batch(self.code_list + self.code_list[:3])
+        self.assertEqual([to_tuples(t) for t in res], [to_tuples(t) for t in expected])
+        self.assertEqual(service.cache.misses, 0)
+        service.close()
+
+    def test_lexer_version(self):
+        cache_path = os.path.join(tempfile.mkdtemp(), 'tokenize_cache.db')
+        service = TokenizeService(cache_path=cache_path)
+        service.tokenize_batch(self.code_list)
+        args_util.use_fast_lexer = True
+        try:
+            expected = [to_tuples(tokenize_by_clex_fn()(c)) for c in self.code_list]
+            res = service.tokenize_tokens_batch(self.code_list)
+        finally:
+            args_util.use_fast_lexer = False
+        # the tokens of the other lexer are not read from the cache
+        self.assertEqual(service.cache.hits, 0)
+        self.assertEqual(len(service.cache), 2 * len(set(self.code_list)))
+        self.assertEqual([to_tuples(t) for t in res], expected)
+        service.close()
+
+    def test_value_list_of_batch(self):
+        service = TokenizeService()
+        first = service.tokenize_batch(self.code_list[:2])
+        first_names = [t.value_names() for t in first]
+        second = service.tokenize_batch(self.code_list[-1:])
+        self.assertIs(first[0].value_list, first[1].value_list)
+        self.assertIsNot(second[0].value_list, first[0].value_list)
+        self.assertEqual(len(second[0].value_list), len(set(second[0].value_names())))
+        self.assertEqual([t.value_names() for t in first], first_names)
+
+    def test_workers(self):
+        service = TokenizeService(core_num=2, shard_size=4)
+        res = service.tokenize_tokens_batch(self.code_list)
+        service.close()
+        self.assertEqual([to_tuples(t) for t in res], [to_tuples(self.tokenize_fn(c)) for c in self.code_list])
+
+
+def benchmark_tokenize_service(count=2000, core_num=4):
+    code_list = create_code_list(count, length=300)
+    tokenize_fn = tokenize_by_clex_fn()
+    begin = time.time()
+    for code in code_list:
+        tokenize_fn(code)
+    print('tokenize_by_clex: {:.1f} codes/s'.format(count / (time.time() - begin)))
+
+    cache_path = os.path.join(tempfile.mkdtemp(), 'tokenize_cache.db')
+    for name, service in [('service in process', TokenizeService()),
+                          ('service {} workers'.format(core_num), TokenizeService(core_num=core_num)),
+                          ('service cold cache', TokenizeService(core_num=core_num, cache_path=cache_path)),
+                          ('service warm cache', TokenizeService(core_num=core_num, cache_path=cache_path))]:
+        begin = time.time()
+        service.tokenize_batch(code_list)
+        print('{}: {:.1f} codes/s'.format(name, count / (time.time() - begin)))
+        service.close()
+
+
+if __name__ == '__main__':
+    benchmark_tokenize_service()
@@ -1,5 +1,10 @@
+import time
+# the startup phases of __main__ are timed from here
+startup_begin_time = time.time()
+import collections
 import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
 import pandas as pd
@@ -8,16 +13,17 @@ import numpy as np
 from torch import nn, optim
 from tqdm import tqdm
 
-from common import torch_util, problem_util, util
+from common import torch_util, problem_util, util, args_util
 from common.constants import DATA_RECORDS_DEEPFIX
 from common.evaluate_util import CompileResultEvaluate
+from common.active_batch import multi_step_next_batch, unpad_batch
 from common.logger import init_a_file_logger, info
 from common.problem_util import to_cuda
 from common.util import data_loader, compile_code_ids_list, add_pid_to_file_path, save_addition_data, \
-    create_special_tokens_ids, create_special_token_mask_list
+    create_special_tokens_ids, create_special_token_mask_list, StageTimer
 import torch.functional as F
 
-from database.database_util import create_table, insert_items, run_sql_statment
+from database.database_util import create_table, insert_items, run_sql_statment, INSERT_BATCH_SIZE
 from experiment.experiment_dataset import IterateErrorDataSet
 
 IGNORE_TOKEN = -1
@@ -26,46 +32,40 @@ IGNORE_TOKEN = -1
 def get_model(model_fn, model_params, path, load_previous=False, parallel=False, gpu_index=None,
               random_embedding=False, vocabulary=None, has_delimiter=False,
               load_pretrain_model=False, pretrain_model_fn=None, pretrain_model_params=None, pretrain_path=None):
+    """
+    create the model on the device of problem_util.get_device(). parallel and gpu_index are read from problem_util.
+    """
     m = model_fn(
         **model_params
     )
-
-    # to_cuda(m)
-    if parallel:
-        m = nn.DataParallel(m.cuda(), device_ids=[0, 1])
-    elif gpu_index is not None:
-        m = nn.DataParallel(m.cuda(), device_ids=[gpu_index])
-    else:
-        m = nn.DataParallel(m.cuda(), device_ids=[0])
+    m = problem_util.prepare_model(m)
 
     if load_pretrain_model:
-        pre_m = pretrain_model_fn(**pretrain_model_params)
-        pre_m = nn.DataParallel(pre_m.cuda(), device_ids=[gpu_index])
-        torch_util.load_model(pre_m, pretrain_path)
+        pre_m = problem_util.prepare_model(pretrain_model_fn(**pretrain_model_params))
+        problem_util.load_model(pre_m, pretrain_path)
 
-        m_state_dict = m.state_dict()
-        pre_state_dict = pre_m.state_dict()
-        pre_state_dict = {k.replace(r'.discriminator', ''):v for k,v in pre_state_dict.items()}
+        m_state_dict = problem_util.unwrap_model(m).state_dict()
+        pre_state_dict = problem_util.unwrap_model(pre_m).state_dict()
+        # remove the '.discriminator' as the names with the DataParallel prefix 'module.'
+        pre_state_dict = {('.' + k).replace(r'.discriminator', '')[1:]: v for k, v in pre_state_dict.items()}
         pre_state_dict = {k:v for k, v in pre_state_dict.items() if k in m_state_dict}
 
         m_state_dict.update(pre_state_dict)
-        m.load_state_dict(m_state_dict)
+        problem_util.unwrap_model(m).load_state_dict(m_state_dict)
 
     if load_previous:
-        # torch_util.load_model(m, path, map_location={'cuda:0': 'cuda:1'})
-        torch_util.load_model(m, path)
+        problem_util.load_model(m, path)
         print("load previous model from {}".format(path))
     else:
         print("create new model")
-    if gpu_index is None and not parallel:
-        m = m.module.cpu()
     if random_embedding:
+        module = problem_util.unwrap_model(m)
         special_ids = create_special_tokens_ids(vocabulary, has_delimiter=has_delimiter)
         mask_list = create_special_token_mask_list(special_ids, vocabulary.vocabulary_size)
-        embedding_mask = torch.ByteTensor(mask_list).to(m.module.embedding.weight.device)
-        random_tensor = torch.rand(m.module.embedding.weight.size()).to(m.module.embedding.weight.device)
-        m.module.embedding.weight.data = torch.where(torch.unsqueeze(embedding_mask, dim=1),
-                                                     m.module.embedding.weight, random_tensor)
+        embedding_mask = torch.ByteTensor(mask_list).to(module.embedding.weight.device)
+        random_tensor = torch.rand(module.embedding.weight.size()).to(module.embedding.weight.device)
+        module.embedding.weight.data = torch.where(torch.unsqueeze(embedding_mask, dim=1),
+                                                   module.embedding.weight, random_tensor)
     return m
 
 
@@ -73,7 +73,7 @@ def train(model, dataset, batch_size, loss_function, optimizer, clip_norm, epoch
           parse_target_batch_data_fn, create_output_ids_fn, evaluate_obj_list):
     total_loss = to_cuda(torch.Tensor([0]))
     steps = 0
-    for o in evaluate_object_list:
+    for o in evaluate_obj_list:
         o.clear_result()
     model.train()
 
@@ -114,7 +114,7 @@ def evaluate(model, dataset, batch_size, loss_function, parse_input_batch_data_f
     total_loss = to_cuda(torch.Tensor([0]))
     total_batch = to_cuda(torch.Tensor([0]))
     steps = 0
-    for o in evaluate_object_list:
+    for o in evaluate_obj_list:
         o.clear_result()
     model.eval()
 
@@ -211,13 +211,13 @@ def multi_step_evaluate(model, dataset, batch_size, parse_input_batch_data_fn, p
                         do_save_data=False,
                         max_save_distance=None, save_records_to_database=False,
                         db_path='', table_name='', change_output_records_to_batch_fn=None, create_save_database_records_fn=None,
-                        error_stop_type='normal'):
+                        error_stop_type='normal', pipeline_compile=False):
     total_loss = to_cuda(torch.Tensor([0]))
     total_batch = to_cuda(torch.Tensor([0]))
     steps = 0
     compile_evaluator = CompileResultEvaluate()
     compile_evaluator.clear_result()
-    for o in evaluate_object_list:
+    for o in evaluate_obj_list:
         o.clear_result()
 
     model.eval()
@@ -226,102 +226,81 @@ def multi_step_evaluate(model, dataset, batch_size, parse_input_batch_data_fn, p
     tokenize_fn = tokenize_by_clex_fn()
     save_data_dict = {}
     save_records_list = []
+    stage_timer = StageTimer()
+    if save_records_to_database:
+        create_table(db_path, DATA_RECORDS_DEEPFIX, replace_table_name=table_name)
 
     # file_path = add_pid_to_file_path(file_path)
     # target_file_path = add_pid_to_file_path(target_file_path)
 
+    def create_one_batch_generator(batch_data):
+        return multi_step_one_batch(model, batch_data, batch_size, parse_input_batch_data_fn,
+                                    max_step_times=max_step_times, vocabulary=vocabulary, file_path=file_path,
+                                    create_multi_step_next_input_batch_fn=create_multi_step_next_input_batch_fn,
+                                    extract_includes_fn=extract_includes_fn, do_beam_search=do_beam_search,
+                                    target_file_path=target_file_path, log_file_path=log_file_path,
+                                    error_stop_type=error_stop_type, stage_timer=stage_timer)
+
     with tqdm(total=len(dataset)) as pbar:
         with torch.no_grad():
-            for batch_data in data_loader(dataset, batch_size=batch_size, drop_last=False):
-                model.zero_grad()
-
-                input_data = batch_data.copy()
-                final_output_list = []
-                output_records_list = []
-                continue_list = [True for _ in range(batch_size)]
-                result_list = [False for _ in range(batch_size)]
-                result_records_list = []
-                sample_steps = [-1 for _ in range(batch_size)]
-                error_count_list = batch_data['error_count']
-
-                for i in range(max_step_times):
-                    model_input = parse_input_batch_data_fn(input_data, do_sample=True)
-
-                    model_output = model.forward(*model_input, do_sample=True, do_beam_search=do_beam_search)
-
-                    input_data, final_output, output_records, final_output_name_list, continue_list = create_multi_step_next_input_batch_fn(input_data,
-                                                                                                     model_input,
-                                                                                                     model_output,
-                                                                                                     continue_list,
-                                                                                                     do_beam_search)
-                    final_output_list += [final_output]
-                    output_records_list += [output_records]
-
-                    continue_list, result_list, cur_error_count_list = compile_code_ids_list(final_output_name_list, continue_list, result_list, vocabulary=vocabulary,
-                                                                       includes_list=extract_includes_fn(input_data), file_path=file_path,
-                                                                       target_file_path=target_file_path, log_file_path=log_file_path,
-                                                                       do_compile_pool=True, need_transform=False)
-
-                    if error_stop_type == 'oracle':
-                        reject_list = [True if c and n > o else False
-                                              for c, o, n in zip(continue_list, error_count_list, cur_error_count_list)]
-                    elif error_stop_type == 'normal':
-                        reject_list = [False for _ in range(batch_size)]
-                    error_count_list = [n if n < o and n >= 0 else o for o, n in
-                                        zip(error_count_list, cur_error_count_list)]
-                    for i_f, rej in enumerate(reject_list):
-                        if rej:
-                            # use last output
-                            final_output_name_list[i_f] = input_data['last_input_seq_name'][i_f]
-                            continue_list[i_f] = False
-
-                    sample_steps = [i+1 if s == -1 and not c and not r else s for s, c, r in zip(sample_steps, continue_list, reject_list)]
-                    sample_steps = [i if s == -1 and not c and r else s for s, c, r in zip(sample_steps, continue_list, reject_list)]
-
-                    result_records_list += [result_list]
-                    if sum(continue_list) == 0:
-                        break
-                sample_steps = [max_step_times if s == -1 else s for s in sample_steps]
-
-                if do_save_data:
-                    batch_data['input_seq_name'] = batch_data['final_output_name']
-                    save_res_dict = save_addition_data(original_states=batch_data, states=input_data,
-                                                       tokenize_fn=tokenize_fn,
-                                                       batch_size=batch_size, file_path=file_path,
-                                                       target_file_path=target_file_path,
-                                                       vocabulary=vocabulary,
-                                                       max_distande=max_save_distance,
-                                                       only_error=True)
-                    for k, v in save_res_dict.items():
-                        save_data_dict[k] = save_data_dict.get(k, []) + v
-
-                if save_records_to_database:
-                    batch_output_records = change_output_records_to_batch_fn(output_records_list, sample_steps)
-                    records_list = create_save_database_records_fn(batch_data, sample_steps, final_output_name_list, result_list,
-                                                 batch_output_records, input_data)
-                    save_records_list += records_list
-
-                step_output = 'in evaluate step {}: '.format(steps)
-                res = compile_evaluator.add_result(result_list)
-                step_output += res
-                for evaluator in evaluate_obj_list:
-                    # customer evaluator interface
-                    res = evaluator.add_result(result_list, batch_data=batch_data)
+            model.zero_grad()
+            batch_iterator = data_loader(dataset, batch_size=batch_size, drop_last=False)
+            if pipeline_compile:
+                batch_result_iterator = pipelined_multi_step_batches(batch_iterator, create_one_batch_generator,
+                                                                     stage_timer)
+            else:
+                batch_result_iterator = sequential_multi_step_batches(batch_iterator, create_one_batch_generator,
+                                                                      stage_timer)
+            for batch_data, batch_result in batch_result_iterator:
+                input_data, final_output_list, output_records_list, result_records_list, final_output_name_list, \
+                    result_list, sample_steps = batch_result
+
+                with stage_timer('save_and_evaluate'):
+                    if do_save_data:
+                        batch_data['input_seq_name'] = batch_data['final_output_name']
+                        save_res_dict = save_addition_data(original_states=batch_data, states=input_data,
+                                                           tokenize_fn=tokenize_fn,
+                                                           batch_size=batch_size, file_path=file_path,
+                                                           target_file_path=target_file_path,
+                                                           vocabulary=vocabulary,
+                                                           max_distande=max_save_distance,
+                                                           only_error=True)
+                        for k, v in save_res_dict.items():
+                            save_data_dict[k] = save_data_dict.get(k, []) + v
+
+                    if save_records_to_database:
+                        batch_output_records = change_output_records_to_batch_fn(output_records_list, sample_steps)
+                        records_list = create_save_database_records_fn(batch_data, sample_steps, final_output_name_list, result_list,
+                                                     batch_output_records, input_data)
+                        save_records_list += records_list
+                        if len(save_records_list) >= INSERT_BATCH_SIZE:
+                            run_sql_statment(db_path, DATA_RECORDS_DEEPFIX, 'insert_ignore', save_records_list,
+                                             replace_table_name=table_name)
+                            save_records_list = []
+
+                    step_output = 'in evaluate step {}: '.format(steps)
+                    res = compile_evaluator.add_result(result_list)
                     step_output += res
-                # print(step_output)
-                info(step_output)
+                    for evaluator in evaluate_obj_list:
+                        # customer evaluator interface
+                        res = evaluator.add_result(result_list, batch_data=batch_data)
+                        step_output += res
+                    # print(step_output)
+                    info(step_output)
 
-                if print_output and steps % 1 == 0:
-                    print_output_fn(output_records=output_records_list, final_output=final_output_list, batch_data=batch_data,
-                                    step_i=steps, vocabulary=vocabulary, compile_result_list=result_records_list)
+                    if print_output and steps % 1 == 0:
+                        print_output_fn(output_records=output_records_list, final_output=final_output_list, batch_data=batch_data,
+                                        step_i=steps, vocabulary=vocabulary, compile_result_list=result_records_list)
 
 
                 steps += 1
                 pbar.update(batch_size)
     evaluate_obj_list = [compile_evaluator] + evaluate_obj_list
+    info(str(stage_timer))
+    if args_util.get_compile_cache() is not None:
+        info(str(args_util.get_compile_cache()))
 
     if save_records_to_database:
-        create_table(db_path, DATA_RECORDS_DEEPFIX, replace_table_name=table_name)
         run_sql_statment(db_path, DATA_RECORDS_DEEPFIX, 'insert_ignore', save_records_list, replace_table_name=table_name)
 
     if steps == 0:
@@ -331,6 +310,140 @@ def multi_step_evaluate(model, dataset, batch_size, parse_input_batch_data_fn, p
     return evaluate_obj_list, t_loss, save_data_dict
 
 
+def multi_step_one_batch(model, batch_data, batch_size, parse_input_batch_data_fn, max_step_times, vocabulary,
+                         file_path, create_multi_step_next_input_batch_fn, extract_includes_fn, do_beam_search,
+                         target_file_path, log_file_path, error_stop_type, stage_timer):
+    """
+    The multi step repair of one batch. It is a generator which yields the keyword arguments of compile_code_ids_list
+    after every model step and receives the compile result, so the caller decides when and where to compile.
+    :return: the result tuple of the batch as the StopIteration value
+    """
+    input_data = batch_data.copy()
+    final_output_list = []
+    output_records_list = []
+    continue_list = [True for _ in range(batch_size)]
+    result_list = [False for _ in range(batch_size)]
+    result_records_list = []
+    sample_steps = [-1 for _ in range(batch_size)]
+    error_count_list = batch_data['error_count']
+    final_output_name_list = []
+
+    final_output = None
+    for i in range(max_step_times):
+        input_data, final_output, output_records, final_output_name_list, continue_list = \
+            multi_step_next_batch(model, input_data, continue_list, parse_input_batch_data_fn,
+                                  create_multi_step_next_input_batch_fn, do_beam_search=do_beam_search,
+                                  last_final_output=final_output, last_final_output_name_list=final_output_name_list,
+                                  incremental=args_util.use_incremental_multi_step, stage_timer=stage_timer)
+        final_output_list += [final_output]
+        output_records_list += [output_records]
+
+        continue_list, result_list, cur_error_count_list = yield dict(final_output=final_output_name_list,
+                                                                      continue_list=continue_list,
+                                                                      result_list=result_list, vocabulary=vocabulary,
+                                                                      includes_list=extract_includes_fn(input_data),
+                                                                      file_path=file_path,
+                                                                      target_file_path=target_file_path,
+                                                                      log_file_path=log_file_path,
+                                                                      do_compile_pool=True, need_transform=False)
+
+        if error_stop_type == 'oracle':
+            reject_list = [True if c and n > o else False
+                                  for c, o, n in zip(continue_list, error_count_list, cur_error_count_list)]
+        elif error_stop_type == 'normal':
+            reject_list = [False for _ in range(batch_size)]
+        error_count_list = [n if n < o and n >= 0 else o for o, n in
+                            zip(error_count_list, cur_error_count_list)]
+        for i_f, rej in enumerate(reject_list):
+            if rej:
+                # use last output
+                final_output_name_list[i_f] = input_data['last_input_seq_name'][i_f]
+                continue_list[i_f] = False
+
+        sample_steps = [i+1 if s == -1 and not c and not r else s for s, c, r in zip(sample_steps, continue_list, reject_list)]
+        sample_steps = [i if s == -1 and not c and r else s for s, c, r in zip(sample_steps, continue_list, reject_list)]
+
+        result_records_list += [result_list]
+        if sum(continue_list) == 0:
+            break
+    sample_steps = [max_step_times if s == -1 else s for s in sample_steps]
+    # the input ids may be kept in the device tensors between the steps
+    input_data = unpad_batch(input_data, {'input_seq': 'input_length'})
+    return input_data, final_output_list, output_records_list, result_records_list, final_output_name_list, \
+        result_list, sample_steps
+
+
+def timed_compile_code_ids_list(stage_timer, compile_kwargs):
+    with stage_timer('compile'):
+        return compile_code_ids_list(**compile_kwargs)
+
+
+def sequential_multi_step_batches(batch_iterator, create_one_batch_generator, stage_timer):
+    """
+    run the batches one by one and compile in the main thread.
+    :return: a generator of (batch_data, batch result)
+    """
+    for batch_data in batch_iterator:
+        batch_generator = create_one_batch_generator(batch_data)
+        try:
+            compile_kwargs = next(batch_generator)
+            while True:
+                compile_res = timed_compile_code_ids_list(stage_timer, compile_kwargs)
+                compile_kwargs = batch_generator.send(compile_res)
+        except StopIteration as e:
+            yield batch_data, e.value
+
+
+def pipelined_multi_step_batches(batch_iterator, create_one_batch_generator, stage_timer, pipeline_depth=2):
+    """
+    keep pipeline_depth batches in flight. The compile of one batch runs in a background thread (which waits on the
+    compile pool) while the model forward of the other batch runs in the main thread. The batch results are yielded
+    in the order of batch_iterator and are the same as sequential_multi_step_batches.
+    :return: a generator of (batch_data, batch result)
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    pending = collections.deque()
+
+    def advance(item, compile_res=None, first=False):
+        try:
+            if first:
+                compile_kwargs = next(item['generator'])
+            else:
+                compile_kwargs = item['generator'].send(compile_res)
+            item['future'] = executor.submit(timed_compile_code_ids_list, stage_timer, compile_kwargs)
+        except StopIteration as e:
+            item['future'] = None
+            item['result'] = e.value
+
+    batch_iterator = iter(batch_iterator)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < pipeline_depth:
+                try:
+                    batch_data = next(batch_iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                item = {'batch_data': batch_data, 'generator': create_one_batch_generator(batch_data),
+                        'future': None, 'result': None}
+                advance(item, first=True)
+                pending.append(item)
+            if len(pending) == 0:
+                break
+            for item in pending:
+                if item['future'] is None:
+                    continue
+                with stage_timer('compile_wait'):
+                    compile_res = item['future'].result()
+                advance(item, compile_res)
+            while len(pending) > 0 and pending[0]['future'] is None:
+                item = pending.popleft()
+                yield item['batch_data'], item['result']
+    finally:
+        executor.shutdown(wait=True)
+
+
 def sample_and_save(model, dataset, batch_size, loss_function, parse_input_batch_data_fn, parse_target_batch_data_fn,
              do_sample=False, print_output=False, create_output_ids_fn=None, evaluate_obj_list=[],
              expand_output_and_target_fn=None, add_data_record_fn=None, db_path='', table_name=''):
@@ -338,11 +451,12 @@ def sample_and_save(model, dataset, batch_size, loss_function, parse_input_batch
     total_batch = to_cuda(torch.Tensor([0]))
     saved_count = 0
     steps = 1
-    for o in evaluate_object_list:
+    for o in evaluate_obj_list:
         o.clear_result()
     model.eval()
 
     total_saved_list = []
+    create_table(db_path, table_name)
 
     with tqdm(total=len(dataset)) as pbar:
         with torch.no_grad():
@@ -380,7 +494,6 @@ def sample_and_save(model, dataset, batch_size, loss_function, parse_input_batch
                 total_saved_list += saved_list
 
                 if steps % 100 == 0:
-                    create_table(db_path, table_name)
                     insert_items(db_path, table_name, total_saved_list)
                     saved_count += len(total_saved_list)
                     print('saved {} record in total {}. '.format(saved_count, total_batch.item()))
@@ -437,7 +550,6 @@ def sample_and_save(model, dataset, batch_size, loss_function, parse_input_batch
                 steps += 1
                 pbar.update(batch_size)
 
-    create_table(db_path, table_name)
     insert_items(db_path, table_name, total_saved_list)
     saved_count += len(total_saved_list)
     print('saved {} record in total {}. '.format(saved_count, total_batch.item()))
@@ -462,7 +574,7 @@ def train_and_evaluate(model, batch_size, train_dataset, valid_dataset, test_dat
                        max_save_distance=None, addition_step=1, no_addition_step=5,
                        do_save_records_to_database=False, change_output_records_to_batch_fn=None,
                        create_save_database_records_fn=None, just_evaluate=False, log_file_path='main.log',
-                       error_stop_type='normal'):
+                       error_stop_type='normal', pipeline_compile=False):
     valid_loss = 0
     test_loss = 0
     valid_accuracy = 0
@@ -569,7 +681,8 @@ def train_and_evaluate(model, batch_size, train_dataset, valid_dataset, test_dat
                                                                                 db_path=db_path, table_name=table_basename,
                                                                                 change_output_records_to_batch_fn=change_output_records_to_batch_fn,
                                                                                 create_save_database_records_fn=create_save_database_records_fn,
-                                                                                error_stop_type=error_stop_type)
+                                                                                error_stop_type=error_stop_type,
+                                                                                pipeline_compile=pipeline_compile)
             print('previous sample test loss: {}, evaluator : '.format(sample_test_loss))
             info('previous sample test loss: {}, evaluator : '.format(sample_test_loss))
             for evaluator in multi_step_test_evalutor:
@@ -634,7 +747,8 @@ def train_and_evaluate(model, batch_size, train_dataset, valid_dataset, test_dat
                                                                                 log_file_path=log_file_path,
                                                                                 do_save_data=True,
                                                                                 max_save_distance=max_save_distance,
-                                                                                error_stop_type=error_stop_type)
+                                                                                error_stop_type=error_stop_type,
+                                                                                pipeline_compile=pipeline_compile)
             print('addition train sample test loss: {}, evaluator : '.format(sample_test_loss))
             info('addition train sample test loss: {}, evaluator : '.format(sample_test_loss))
             for evaluator in multi_step_test_evalutor:
@@ -693,13 +807,16 @@ def train_and_evaluate(model, batch_size, train_dataset, valid_dataset, test_dat
             info(evaluator)
 
         if not is_debug:
-            torch_util.save_model(model, save_path+str(epoch))
+            problem_util.save_model(model, save_path+str(epoch))
 
 
 if __name__ == '__main__':
-    import parameters_config
     import config
     import argparse
+    from common.experiment_registry import StartupTimer, load_config
+
+    startup_timer = StartupTimer(startup_begin_time)
+    startup_timer.mark('import train')
 
     torch.manual_seed(100)
     torch.cuda.manual_seed_all(100)
@@ -725,16 +842,47 @@ if __name__ == '__main__':
     parser.add_argument("--output_log", type=str, default=None)
     parser.add_argument("--load_model_name", type=str, default=None)
     parser.add_argument("--save_model_name", type=str, default=None)
+    parser.add_argument("--compile_server", type=boolean_string, default=False)
+    parser.add_argument("--compile_cache", type=boolean_string, default=False)
+    parser.add_argument("--sparse_graph", type=boolean_string, default=False)
+    parser.add_argument("--fast_lexer", type=boolean_string, default=False)
+    parser.add_argument("--columnar_dataset", type=boolean_string, default=False)
+    parser.add_argument("--code_graph_cache", type=boolean_string, default=False)
+    parser.add_argument("--prefetch_loader", type=boolean_string, default=False)
+    parser.add_argument("--length_bucket", type=boolean_string, default=False)
+    parser.add_argument("--incremental_multi_step", type=boolean_string, default=True)
+    parser.add_argument("--batch_sensibility_fix", type=boolean_string, default=False)
+    parser.add_argument("--compiled_slk", type=boolean_string, default=False)
+    parser.add_argument("--compiled_vocabulary", type=boolean_string, default=False)
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--num_interop_threads", type=int, default=None)
     args = parser.parse_args()
+    startup_timer.mark('parse args')
     load_previous = args.load_previous
     problem_util.GPU_INDEX = args.gpu
     problem_util.Parallel = args.parallel
+    problem_util.set_num_threads(args.num_threads, args.num_interop_threads)
+    args_util.use_compile_server = args.compile_server
+    args_util.use_compile_cache = args.compile_cache
+    args_util.use_sparse_graph = args.sparse_graph
+    args_util.use_fast_lexer = args.fast_lexer
+    args_util.use_columnar_dataset = args.columnar_dataset
+    args_util.use_code_graph_cache = args.code_graph_cache
+    args_util.use_prefetch_loader = args.prefetch_loader
+    args_util.use_length_bucket = args.length_bucket
+    args_util.use_incremental_multi_step = args.incremental_multi_step
+    args_util.use_batch_sensibility_fix = args.batch_sensibility_fix
+    args_util.use_compiled_slk = args.compiled_slk
+    args_util.use_compiled_vocabulary = args.compiled_vocabulary
     is_debug = args.debug
     just_evaluate = args.just_evaluate
     cmd_load_model_name = args.load_model_name
     cmd_save_model_name = args.save_model_name
 
-    p_config = parameters_config.__dict__.get(args.config_name)(is_debug)
+    try:
+        p_config = load_config(args.config_name, is_debug, startup_timer)
+    except ValueError as e:
+        parser.error(str(e))
     if cmd_load_model_name is not None:
         p_config['load_model_name'] = cmd_load_model_name
     if cmd_save_model_name is not None:
@@ -777,6 +925,7 @@ if __name__ == '__main__':
 
     do_multi_step_sample_evaluate = p_config['do_multi_step_sample_evaluate']
     error_stop_type = p_config.get('error_stop_type', 'normal')
+    pipeline_compile = p_config.get('pipeline_compile', False)
     max_step_times = p_config['max_step_times']
     create_multi_step_next_input_batch_fn = p_config['create_multi_step_next_input_batch_fn']
     compile_file_path = p_config['compile_file_path']
@@ -808,21 +957,22 @@ if __name__ == '__main__':
     pretrain_model_path = p_config.get('pretrain_model_path', None)
     if pretrain_model_path is not None:
         pretrain_model_path = os.path.join(save_root_path, pretrain_model_path)
-    model = get_model(
-        p_config['model_fn'],
-        p_config['model_dict'],
-        model_path,
-        load_previous=load_previous,
-        parallel=problem_util.Parallel,
-        gpu_index=problem_util.GPU_INDEX,
-        vocabulary=vocabulary,
-        random_embedding=random_embedding,
-        has_delimiter=use_ast,
-        load_pretrain_model=load_pretrain_model,
-        pretrain_model_fn=pretrain_model_fn,
-        pretrain_model_params=pretrain_model_params,
-        pretrain_path=pretrain_model_path,
-    )
+    with startup_timer('model'):
+        model = get_model(
+            p_config['model_fn'],
+            p_config['model_dict'],
+            model_path,
+            load_previous=load_previous,
+            parallel=problem_util.Parallel,
+            gpu_index=problem_util.GPU_INDEX,
+            vocabulary=vocabulary,
+            random_embedding=random_embedding,
+            has_delimiter=use_ast,
+            load_pretrain_model=load_pretrain_model,
+            pretrain_model_fn=pretrain_model_fn,
+            pretrain_model_params=pretrain_model_params,
+            pretrain_path=pretrain_model_path,
+        )
 
     train_data, val_data, test_data, ac_copy_data = p_config.get("data")
     if train_data is not None:
@@ -831,6 +981,7 @@ if __name__ == '__main__':
         print("The size of val data: {}".format(len(val_data)))
     if test_data is not None:
         print("The size of test data: {}".format(len(test_data)))
+    startup_timer.report()
     train_and_evaluate(model=model, batch_size=batch_size, train_dataset=train_data, valid_dataset=val_data, test_dataset=test_data,
                        ac_copy_dataset=ac_copy_data,
                        learning_rate=learning_rate, epoches=epoches, saved_name=save_name, train_loss_fn=train_loss_fn,
@@ -856,6 +1007,7 @@ if __name__ == '__main__':
                        just_evaluate=just_evaluate,
                        log_file_path=log_file_path,
                        error_stop_type=error_stop_type,
+                       pipeline_compile=pipeline_compile,
                        )
 
     # test_loss, train_test_loss = evaluate(model, test_data, batch_size, evaluate_object_list,
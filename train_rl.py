@@ -1,3 +1,6 @@
+import time
+# the startup phases of __main__ are timed from here
+startup_begin_time = time.time()
 import itertools
 import os
 import random
@@ -9,8 +12,9 @@ from torch import nn, optim
 from tqdm import tqdm
 import pandas as pd
 
-from common import torch_util, problem_util, util
+from common import torch_util, problem_util, util, args_util
 from common.args_util import get_compile_pool
+from common.active_batch import multi_step_next_batch
 from common.evaluate_util import CompileResultEvaluate
 from common.logger import init_a_file_logger, info
 from common.problem_util import to_cuda
@@ -27,24 +31,18 @@ IGNORE_TOKEN = -1
 
 
 def get_model(model_fn, model_params, path, load_previous=False, parallel=False, gpu_index=None):
+    """
+    create the model on the device of problem_util.get_device(). parallel and gpu_index are read from problem_util.
+    """
     m = model_fn(
         **model_params
     )
-    # to_cuda(m)
-    if parallel:
-        m = nn.DataParallel(m.cuda(), device_ids=[0, 1])
-    elif gpu_index is not None:
-        m = nn.DataParallel(m.cuda(), device_ids=[gpu_index])
-    else:
-        m = nn.DataParallel(m.cuda(), device_ids=[0])
+    m = problem_util.prepare_model(m)
     if load_previous:
-        # torch_util.load_model(m, path, map_location={'cuda:1': 'cuda:0'})
-        torch_util.load_model(m, path)
+        problem_util.load_model(m, path)
         print("load previous model from {}".format(path))
     else:
         print("create new model")
-    if gpu_index is None and not parallel:
-        m = m.module.cpu()
     return m
 
 
@@ -52,7 +50,7 @@ def train(model, dataset, batch_size, loss_function, optimizer, clip_norm, epoch
           parse_target_batch_data_fn, create_output_ids_fn, evaluate_obj_list):
     total_loss = to_cuda(torch.Tensor([0]))
     steps = 0
-    for o in evaluate_object_list:
+    for o in evaluate_obj_list:
         o.clear_result()
     model.train()
 
@@ -91,7 +89,7 @@ def evaluate(model, dataset, batch_size, loss_function, parse_input_batch_data_f
     total_loss = to_cuda(torch.Tensor([0]))
     total_batch = to_cuda(torch.Tensor([0]))
     steps = 0
-    for o in evaluate_object_list:
+    for o in evaluate_obj_list:
         o.clear_result()
     model.eval()
 
@@ -190,7 +188,7 @@ def multi_step_evaluate(model, dataset, batch_size, parse_input_batch_data_fn, p
     steps = 0
     compile_evaluator = CompileResultEvaluate()
     compile_evaluator.clear_result()
-    for o in evaluate_object_list:
+    for o in evaluate_obj_list:
         o.clear_result()
 
     model.eval()
@@ -207,16 +205,15 @@ def multi_step_evaluate(model, dataset, batch_size, parse_input_batch_data_fn, p
                 result_list = [False for i in range(batch_size)]
                 result_records_list = []
 
+                final_output = None
+                final_output_name_list = None
                 for i in range(max_step_times):
-                    model_input = parse_input_batch_data_fn(input_data, do_sample=True)
-
-                    model_output = model.forward(*model_input, do_sample=True, do_beam_search=do_beam_search)
-
-                    input_data, final_output, output_records, final_output_name_list, continue_list = create_multi_step_next_input_batch_fn(input_data,
-                                                                                                     model_input,
-                                                                                                     model_output,
-                                                                                                     continue_list,
-                                                                                                     do_beam_search)
+                    input_data, final_output, output_records, final_output_name_list, continue_list = \
+                        multi_step_next_batch(model, input_data, continue_list, parse_input_batch_data_fn,
+                                              create_multi_step_next_input_batch_fn, do_beam_search=do_beam_search,
+                                              last_final_output=final_output,
+                                              last_final_output_name_list=final_output_name_list,
+                                              incremental=args_util.use_incremental_multi_step)
                     final_output_list += [final_output]
                     output_records_list += [output_records]
 
@@ -256,11 +253,12 @@ def sample_and_save(model, dataset, batch_size, loss_function, parse_input_batch
     total_batch = to_cuda(torch.Tensor([0]))
     saved_count = 0
     steps = 1
-    for o in evaluate_object_list:
+    for o in evaluate_obj_list:
         o.clear_result()
     model.eval()
 
     total_saved_list = []
+    create_table(db_path, table_name)
 
     with tqdm(total=len(dataset)) as pbar:
         with torch.no_grad():
@@ -298,7 +296,6 @@ def sample_and_save(model, dataset, batch_size, loss_function, parse_input_batch
                 total_saved_list += saved_list
 
                 if steps % 100 == 0:
-                    create_table(db_path, table_name)
                     insert_items(db_path, table_name, total_saved_list)
                     saved_count += len(total_saved_list)
                     print('saved {} record in total {}. '.format(saved_count, total_batch.item()))
@@ -355,7 +352,6 @@ def sample_and_save(model, dataset, batch_size, loss_function, parse_input_batch
                 steps += 1
                 pbar.update(batch_size)
 
-    create_table(db_path, table_name)
     insert_items(db_path, table_name, total_saved_list)
     saved_count += len(total_saved_list)
     print('saved {} record in total {}. '.format(saved_count, total_batch.item()))
@@ -707,7 +703,7 @@ def train_and_evaluate(g_model, s_model, environment_dict, agent_dict, batch_siz
             info(evaluator)
 
         if not is_debug:
-            torch_util.save_model(s_model, s_save_path+str(epoch))
+            problem_util.save_model(s_model, s_save_path+str(epoch))
 
         if (epoch+1) % generate_step == 0:
             if do_fast_generate and generate_dataset is not None:
@@ -739,13 +735,16 @@ def train_and_evaluate(g_model, s_model, environment_dict, agent_dict, batch_siz
                     last_generate_list = last_generate_list[1:]
 
             if not is_debug:
-                torch_util.save_model(g_model, g_save_path+str(epoch))
+                problem_util.save_model(g_model, g_save_path+str(epoch))
 
 
 if __name__ == '__main__':
-    import parameters_config
     import config
     import argparse
+    from common.experiment_registry import StartupTimer, load_config
+
+    startup_timer = StartupTimer(startup_begin_time)
+    startup_timer.mark('import train_rl')
 
     torch.manual_seed(100)
     torch.cuda.manual_seed_all(100)
@@ -764,14 +763,45 @@ if __name__ == '__main__':
     parser.add_argument("--parallel", type=boolean_string)
     parser.add_argument("--just_evaluate", type=boolean_string, default=False)
     parser.add_argument("--output_log", type=str, default=None)
+    parser.add_argument("--compile_server", type=boolean_string, default=False)
+    parser.add_argument("--compile_cache", type=boolean_string, default=False)
+    parser.add_argument("--sparse_graph", type=boolean_string, default=False)
+    parser.add_argument("--fast_lexer", type=boolean_string, default=False)
+    parser.add_argument("--columnar_dataset", type=boolean_string, default=False)
+    parser.add_argument("--code_graph_cache", type=boolean_string, default=False)
+    parser.add_argument("--prefetch_loader", type=boolean_string, default=False)
+    parser.add_argument("--length_bucket", type=boolean_string, default=False)
+    parser.add_argument("--incremental_multi_step", type=boolean_string, default=True)
+    parser.add_argument("--batch_sensibility_fix", type=boolean_string, default=False)
+    parser.add_argument("--compiled_slk", type=boolean_string, default=False)
+    parser.add_argument("--compiled_vocabulary", type=boolean_string, default=False)
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--num_interop_threads", type=int, default=None)
     args = parser.parse_args()
+    startup_timer.mark('parse args')
     load_previous = args.load_previous
     problem_util.GPU_INDEX = args.gpu
     problem_util.Parallel = args.parallel
+    problem_util.set_num_threads(args.num_threads, args.num_interop_threads)
+    args_util.use_compile_server = args.compile_server
+    args_util.use_compile_cache = args.compile_cache
+    args_util.use_sparse_graph = args.sparse_graph
+    args_util.use_fast_lexer = args.fast_lexer
+    args_util.use_columnar_dataset = args.columnar_dataset
+    args_util.use_code_graph_cache = args.code_graph_cache
+    args_util.use_prefetch_loader = args.prefetch_loader
+    args_util.use_length_bucket = args.length_bucket
+    args_util.use_incremental_multi_step = args.incremental_multi_step
+    args_util.use_batch_sensibility_fix = args.batch_sensibility_fix
+    args_util.use_compiled_slk = args.compiled_slk
+    args_util.use_compiled_vocabulary = args.compiled_vocabulary
     is_debug = args.debug
     just_evaluate = args.just_evaluate
 
-    p_config = parameters_config.__dict__.get(args.config_name)(is_debug)
+    try:
+        p_config = load_config(args.config_name, is_debug, startup_timer)
+    except ValueError as e:
+        parser.error(str(e))
     epoches = p_config.get("epcohes", 20)
     learning_rate = p_config.get("learning_rate", 20)
     batch_size = p_config.get("batch_size", 32)
@@ -835,22 +865,23 @@ if __name__ == '__main__':
     load_previous_g_model = p_config.get('load_previous_g_model', False)
     s_model_path = os.path.join(save_root_path, p_config['s_load_model_name'])
     g_model_path = os.path.join(save_root_path, p_config['g_load_model_name'])
-    g_model = get_model(
-        p_config['g_model_fn'],
-        p_config['g_model_dict'],
-        g_model_path,
-        load_previous=load_previous_g_model,
-        parallel=problem_util.Parallel,
-        gpu_index=problem_util.GPU_INDEX
-    )
-    s_model = get_model(
-        p_config['s_model_fn'],
-        p_config['s_model_dict'],
-        s_model_path,
-        load_previous=load_previous,
-        parallel=problem_util.Parallel,
-        gpu_index=problem_util.GPU_INDEX
-    )
+    with startup_timer('model'):
+        g_model = get_model(
+            p_config['g_model_fn'],
+            p_config['g_model_dict'],
+            g_model_path,
+            load_previous=load_previous_g_model,
+            parallel=problem_util.Parallel,
+            gpu_index=problem_util.GPU_INDEX
+        )
+        s_model = get_model(
+            p_config['s_model_fn'],
+            p_config['s_model_dict'],
+            s_model_path,
+            load_previous=load_previous,
+            parallel=problem_util.Parallel,
+            gpu_index=problem_util.GPU_INDEX
+        )
 
     train_data, val_data, test_data, _ = p_config.get("data")
     ac_dataset = p_config.get('ac_data')
@@ -860,6 +891,7 @@ if __name__ == '__main__':
         print("The size of val data: {}".format(len(val_data)))
     if test_data is not None:
         print("The size of test data: {}".format(len(test_data)))
+    startup_timer.report()
     train_and_evaluate(g_model=g_model, s_model=s_model, environment_dict=environment_dict, agent_dict=agent_dict,
                        random_agent_dict=random_agent_dict, batch_size=batch_size, train_dataset=train_data,
                        valid_dataset=val_data, test_dataset=test_data,
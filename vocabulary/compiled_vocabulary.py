@@ -0,0 +1,292 @@
+"""
+The token tables of a Vocabulary compiled into one memory mapped file. TransformVocabularyAndSLK built its sets by
+create_string_vocabulary_set, create_constant_vocabulary_set, create_identifier_vocabulary_set and
+create_ids_to_token_dict, which tokenize every word of the vocabulary again by the C lexer (twice a word) behind
+disk_cache. Here every word is tokenized once and the file keeps, for every id:
+    the word, in one utf-8 byte buffer with an offset array,
+    the type, lineno and lexpos of its first lexer token (the type is an index into type_names, -1 if the word can't
+    be tokenized),
+    the SLK terminal label id of the type,
+    the class bits (STRING_CLASS, CONSTANT_CLASS, ...) of the sets of TransformVocabularyAndSLK.
+The file is a json header followed by the 8 bytes aligned arrays. The file name is the fingerprint of the words, so a
+changed vocabulary is compiled to another file.
+"""
+
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from common.constants import pre_defined_c_tokens_map, c_standard_library_defined_identifier, \
+    c_standard_library_defined_types, CACHE_DATA_PATH
+from common.logger import info
+from common.pycparser_util import ValueToken
+
+MAGIC = b'CVOCAB\x00\x01'
+FORMAT_VERSION = 1
+ALIGNMENT = 8
+
+STRING_CLASS = 1
+CONSTANT_CLASS = 2
+IDENTIFIER_CLASS = 4
+KEYWORD_CLASS = 8
+END_LABEL_CLASS = 16
+LIBRARY_IDENTIFIER_CLASS = 32
+LIBRARY_TYPEID_CLASS = 64
+
+# the same labels as create_string_vocabulary_set, create_constant_vocabulary_set and create_identifier_vocabulary_set
+STRING_LABELS = {'STRING_LITERAL', 'WSTRING_LITERAL'}
+CONSTANT_LABELS = {'INT_CONST_DEC', 'INT_CONST_OCT', 'INT_CONST_HEX', 'INT_CONST_BIN', 'FLOAT_CONST',
+                   'HEX_FLOAT_CONST', 'CHAR_CONST', 'WCHAR_CONST'}
+IDENTIFIER_LABELS = {'ID'}
+
+# the unk id is mapped to the token of this word as create_ids_to_token_dict
+UNK_TOKEN_WORD = 'unk'
+
+
+def _special_tokens(vocab):
+    return set(vocab.begin_tokens) | set(vocab.end_tokens) | set(vocab.addition_tokens) | {vocab.unk}
+
+
+def vocabulary_fingerprint(vocab):
+    """
+    :return: the hex digest of the words in the id order and the special tokens
+    """
+    h = hashlib.sha1()
+    h.update(repr((FORMAT_VERSION, vocab.begin_tokens, vocab.end_tokens, vocab.unk, vocab.addition_tokens,
+                   vocab.vocabulary_size)).encode('utf-8'))
+    for i in range(vocab.vocabulary_size):
+        h.update(vocab.id_to_word(i).encode('utf-8'))
+        h.update(b'\x00')
+    return h.hexdigest()
+
+
+class CompiledVocabulary(object):
+    def __init__(self, header, arrays, path=None):
+        self.header = header
+        self.path = path
+        self.vocabulary_size = header['vocabulary_size']
+        self.type_names = header['type_names']
+        self.type_slk_labels = header['type_slk_labels']
+        self.keyword_dict = header['keyword_dict']
+        self.word_offsets = arrays['word_offsets']
+        self.word_bytes = arrays['word_bytes']
+        self.token_types = arrays['token_types']
+        self.token_lineno = arrays['token_lineno']
+        self.token_lexpos = arrays['token_lexpos']
+        self.slk_labels = arrays['slk_labels']
+        self.classes = arrays['classes']
+
+    def id_to_word(self, i):
+        return bytes(self.word_bytes[self.word_offsets[i]:self.word_offsets[i+1] - 1]).decode('utf-8')
+
+    def words(self):
+        return bytes(self.word_bytes).decode('utf-8').split('\x00')[:-1]
+
+    def class_mask(self, class_bit):
+        return (self.classes & class_bit) != 0
+
+    def class_set(self, class_bit):
+        return set(np.flatnonzero(self.class_mask(class_bit)).tolist())
+
+    def class_bits(self, class_bit):
+        """
+        :return: the packed vocabulary bitmask of the class, the same as TransformVocabularyAndSLK.create_vocabulary_bits
+        """
+        return np.packbits(self.class_mask(class_bit))
+
+    def token_of(self, i):
+        """
+        :return: the ValueToken of the id, None if the word can't be tokenized
+        """
+        t = int(self.token_types[i])
+        if t < 0:
+            return None
+        value = self.header['token_values'].get(str(i))
+        return ValueToken(self.id_to_word(i) if value is None else value, self.type_names[t],
+                          int(self.token_lineno[i]), int(self.token_lexpos[i]))
+
+    def create_id_to_token_dict(self):
+        """
+        :return: the same dict as create_ids_to_token_dict
+        """
+        words = self.words()
+        token_values = self.header['token_values']
+        type_names = self.type_names
+        token_types = self.token_types.tolist()
+        token_lineno = self.token_lineno.tolist()
+        token_lexpos = self.token_lexpos.tolist()
+        return {i: ValueToken(token_values.get(str(i), words[i]), type_names[token_types[i]], token_lineno[i],
+                              token_lexpos[i])
+                for i in np.flatnonzero(self.token_types >= 0).tolist()}
+
+    def slk_label_ids(self, token_ids):
+        """
+        :return: the SLK terminal label ids of the tokens, the same as label_vocabulary.get_label_id(token.type).
+        It is -1 if the type is not a terminal.
+        """
+        return self.slk_labels[token_ids].tolist()
+
+
+def _word_token(tokenize_fn, word):
+    tokens = tokenize_fn(word)
+    if tokens is None or len(tokens) == 0:
+        return None
+    if len(tokens) > 1:
+        info('vocabulary tokenize length is {}'.format(len(tokens)))
+    return tokens[0]
+
+
+def _slk_label_id(label_vocabulary, token_type):
+    try:
+        return label_vocabulary.get_label_id(token_type)
+    except ValueError:
+        # the type is not a terminal of the grammar, the parser raises at the token
+        return -1
+
+
+def create_compiled_vocabulary_arrays(vocab, tokenize_fn, label_vocabulary=None):
+    """
+    tokenize every word of vocab once
+    :param label_vocabulary: the label vocabulary of the SLK parser. The slk labels are -1 if None
+    :return: (the header dict, the dict of the arrays)
+    """
+    size = vocab.vocabulary_size
+    special_token = _special_tokens(vocab)
+    unk_id = vocab.word_to_id(vocab.unk)
+    words = [vocab.id_to_word(i) for i in range(size)]
+    type_index = {}
+    token_types = np.full(size, -1, dtype=np.int16)
+    token_lineno = np.zeros(size, dtype=np.int32)
+    token_lexpos = np.zeros(size, dtype=np.int32)
+    classes = np.zeros(size, dtype=np.uint8)
+    token_values = {}
+    for i, word in enumerate(words):
+        if i == unk_id:
+            tok = _word_token(tokenize_fn, UNK_TOKEN_WORD)
+        elif word in special_token:
+            continue
+        else:
+            tok = _word_token(tokenize_fn, word)
+        if tok is None:
+            continue
+        token_types[i] = type_index.setdefault(tok.type, len(type_index))
+        token_lineno[i] = tok.lineno
+        token_lexpos[i] = tok.lexpos
+        if tok.value != word:
+            token_values[str(i)] = tok.value
+        if i == unk_id:
+            continue
+        if tok.type in STRING_LABELS:
+            classes[i] |= STRING_CLASS
+        if tok.type in CONSTANT_LABELS:
+            classes[i] |= CONSTANT_CLASS
+        if tok.type in IDENTIFIER_LABELS:
+            classes[i] |= IDENTIFIER_CLASS
+
+    word_to_id = vocab.word_to_id_dict
+    keyword_dict = {label: word_to_id[word] for label, word in pre_defined_c_tokens_map.items()
+                    if word in word_to_id}
+    for i in keyword_dict.values():
+        classes[i] |= KEYWORD_CLASS
+    classes[vocab.word_to_id(vocab.end_tokens[0])] |= END_LABEL_CLASS
+    for word_set, class_bit in [(c_standard_library_defined_identifier, LIBRARY_IDENTIFIER_CLASS),
+                                (c_standard_library_defined_types, LIBRARY_TYPEID_CLASS)]:
+        for word in word_set:
+            if word in word_to_id:
+                classes[word_to_id[word]] |= class_bit
+
+    type_names = sorted(type_index.keys(), key=type_index.get)
+    type_slk_labels = None
+    slk_labels = np.full(size, -1, dtype=np.int32)
+    if label_vocabulary is not None:
+        type_slk_labels = [_slk_label_id(label_vocabulary, t) for t in type_names]
+        has_type = token_types >= 0
+        slk_labels[has_type] = np.array(type_slk_labels, dtype=np.int32)[token_types[has_type]]
+
+    # every word ends with '\x00', so words() decodes the buffer at once
+    encoded = [w.encode('utf-8') + b'\x00' for w in words]
+    word_offsets = np.zeros(size + 1, dtype=np.int64)
+    word_offsets[1:] = np.cumsum([len(w) for w in encoded])
+    header = {'format_version': FORMAT_VERSION, 'fingerprint': vocabulary_fingerprint(vocab),
+              'vocabulary_size': size, 'type_names': type_names, 'type_slk_labels': type_slk_labels,
+              'keyword_dict': keyword_dict, 'token_values': token_values}
+    arrays = {'word_offsets': word_offsets, 'word_bytes': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+              'token_types': token_types, 'token_lineno': token_lineno, 'token_lexpos': token_lexpos,
+              'slk_labels': slk_labels, 'classes': classes}
+    return header, arrays
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_compiled_vocabulary(header, arrays, path):
+    """
+    write the json header and the arrays into one file. It is written to a temporary file and renamed, so the
+    processes reading the file never see a partial one.
+    """
+    header = dict(header)
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _align(offset + array.nbytes)
+    header['arrays'] = layout
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_begin = _align(len(MAGIC) + 8 + len(header_bytes))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_begin + layout[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_begin + offset)
+    os.replace(tmp_path, path)
+
+
+def load_compiled_vocabulary(path):
+    """
+    :return: the CompiledVocabulary whose arrays are read only views of the memory mapped file
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a compiled vocabulary'.format(path))
+        header_length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    data_begin = _align(len(MAGIC) + 8 + header_length)
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {}
+    for name, layout in header['arrays'].items():
+        dtype = np.dtype(layout['dtype'])
+        begin = data_begin + layout['offset']
+        count = int(np.prod(layout['shape'], dtype=np.int64))
+        arrays[name] = buffer[begin:begin + count * dtype.itemsize].view(dtype).reshape(layout['shape'])
+    return CompiledVocabulary(header, arrays, path)
+
+
+def compiled_vocabulary_path(vocab, directory=None):
+    directory = os.path.join(CACHE_DATA_PATH, 'compiled_vocabulary') if directory is None else directory
+    return os.path.join(directory, '{}.vocab'.format(vocabulary_fingerprint(vocab)))
+
+
+def load_or_create_compiled_vocabulary(vocab, tokenize_fn, label_vocabulary=None, directory=None):
+    """
+    load the compiled file of vocab, or compile and save it if there is no file of the words or its slk labels were
+    created by another label vocabulary
+    """
+    path = compiled_vocabulary_path(vocab, directory)
+    if os.path.exists(path):
+        compiled = load_compiled_vocabulary(path)
+        if label_vocabulary is None or compiled.type_slk_labels == \
+                [_slk_label_id(label_vocabulary, t) for t in compiled.type_names]:
+            return compiled
+    header, arrays = create_compiled_vocabulary_arrays(vocab, tokenize_fn, label_vocabulary)
+    save_compiled_vocabulary(header, arrays, path)
+    return load_compiled_vocabulary(path)
@@ -1,34 +1,67 @@
 import copy
 
+import numpy as np
 import torch
 
+from c_parser.compiled_slk_parser import CompiledSLKParser
 from c_parser.slk_parser import PackedDynamicSLKParser
 from common.constants import pre_defined_c_tokens, pre_defined_c_tokens_map, pre_defined_c_label, \
     pre_defined_c_library_tokens, CACHE_DATA_PATH, c_standard_library_defined_identifier, \
     c_standard_library_defined_types
+from common import args_util
 from common.logger import info
 from common.pycparser_util import transform_LexToken_list, transform_LexToken, tokenize_by_clex_fn
 from common.util import create_token_mask_by_token_set, disk_cache, generate_mask, OrderedList
 from read_data.load_data_vocabulary import create_common_error_vocabulary
+from vocabulary.compiled_vocabulary import load_or_create_compiled_vocabulary, STRING_CLASS, CONSTANT_CLASS, \
+    IDENTIFIER_CLASS, END_LABEL_CLASS, LIBRARY_IDENTIFIER_CLASS, LIBRARY_TYPEID_CLASS, vocabulary_fingerprint
 
 
 class TransformVocabularyAndSLK(object):
 
     def __init__(self, vocab, tokenize_fn):
         self.vocab = vocab
-        self.string_vocabulary_set = create_string_vocabulary_set(vocab, tokenize_fn)
-        self.constant_vocabulary_set = create_constant_vocabulary_set(vocab, tokenize_fn)
-        self.id_vocabulary_set = create_identifier_vocabulary_set(vocab, tokenize_fn)
-        self.end_label_vocabulary_set = create_end_label_vocabulary_set(vocab, tokenize_fn)
-        self.keyword_vocabulary_dict = create_keyword_vocabulary_dict(vocab)
-        self.pre_defined_c_identifier_library_set = create_pre_defined_c_library_identifier_vocabulary_set(vocab)
-        self.pre_defined_c_typeid_library_set = create_pre_defined_c_library_typeid_vocabulary_set(vocab)
-
-        self.id_to_token_dict = create_ids_to_token_dict(vocab, tokenize_fn)
-
         self.parser = PackedDynamicSLKParser()
         self.slk_list = []
 
+        if args_util.use_compiled_vocabulary:
+            compiled = load_or_create_compiled_vocabulary(vocab, tokenize_fn, self.parser.label_vocabulary)
+            self.string_vocabulary_set = compiled.class_set(STRING_CLASS)
+            self.constant_vocabulary_set = compiled.class_set(CONSTANT_CLASS)
+            self.id_vocabulary_set = compiled.class_set(IDENTIFIER_CLASS)
+            self.end_label_vocabulary_set = compiled.class_set(END_LABEL_CLASS)
+            self.keyword_vocabulary_dict = dict(compiled.keyword_dict)
+            self.pre_defined_c_identifier_library_set = compiled.class_set(LIBRARY_IDENTIFIER_CLASS)
+            self.pre_defined_c_typeid_library_set = compiled.class_set(LIBRARY_TYPEID_CLASS)
+            self.id_to_token_dict = compiled.create_id_to_token_dict()
+        else:
+            compiled = None
+            self.string_vocabulary_set = create_string_vocabulary_set(vocab, tokenize_fn)
+            self.constant_vocabulary_set = create_constant_vocabulary_set(vocab, tokenize_fn)
+            self.id_vocabulary_set = create_identifier_vocabulary_set(vocab, tokenize_fn)
+            self.end_label_vocabulary_set = create_end_label_vocabulary_set(vocab, tokenize_fn)
+            self.keyword_vocabulary_dict = create_keyword_vocabulary_dict(vocab)
+            self.pre_defined_c_identifier_library_set = create_pre_defined_c_library_identifier_vocabulary_set(vocab)
+            self.pre_defined_c_typeid_library_set = create_pre_defined_c_library_typeid_vocabulary_set(vocab)
+
+            self.id_to_token_dict = create_ids_to_token_dict(vocab, tokenize_fn)
+        self.compiled_vocabulary = compiled
+
+        # the compiled slk parser is created at the first use of get_all_token_mask_train_by_compiled_parser
+        self._compiled_parser = None
+        # the packed vocabulary bitmask of the sets used by convert_slk_type_to_token_set
+        self.string_vocabulary_bits = self.create_vocabulary_bits(self.string_vocabulary_set)
+        self.constant_vocabulary_bits = self.create_vocabulary_bits(self.constant_vocabulary_set)
+        self.pre_defined_c_typeid_library_bits = self.create_vocabulary_bits(self.pre_defined_c_typeid_library_set)
+        # terminal bitset -> (the vocabulary bitmask of the static part, [has ID, has TYPEID, has STRING, has CONSTANT])
+        self._terminal_mask_cache = {}
+
+    @property
+    def compiled_parser(self):
+        if self._compiled_parser is None:
+            self._compiled_parser = CompiledSLKParser(self.parser.slk_constants, self.parser.label_vocabulary)
+        return self._compiled_parser
+
     def filter_code_ids(self, code_ids, code_length, start_pos):
         code_ids = code_ids.tolist()
         code_length = code_length.tolist()
@@ -115,6 +148,28 @@ class TransformVocabularyAndSLK(object):
         return mask
 
     def get_all_token_mask_train(self, ac_tokens_ids, ac_length=None, start_pos=0):
+        if args_util.use_compiled_slk:
+            return self.get_all_token_mask_train_by_compiled_parser(ac_tokens_ids, ac_length, start_pos)
+        return self.get_all_token_mask_train_by_dynamic_parser(ac_tokens_ids, ac_length, start_pos)
+
+    def get_all_token_mask_train_by_compiled_parser(self, ac_tokens_ids, ac_length=None, start_pos=0):
+        """
+        the same masks as get_all_token_mask_train_by_dynamic_parser, built from the bitsets of the compiled parser
+        """
+        if isinstance(ac_tokens_ids, torch.Tensor):
+            token_ids_list = self.filter_code_ids(ac_tokens_ids, ac_length, start_pos=start_pos)
+        else:
+            token_ids_list = ac_tokens_ids
+        mask_matrix_list = [self.create_token_mask_matrix(token_ids) for token_ids in token_ids_list]
+        token_true_id_res = [[OrderedList(set(np.flatnonzero(mask).tolist())) for mask in mask_matrix]
+                             for mask_matrix in mask_matrix_list]
+        return token_true_id_res
+
+    def get_all_token_mask_train_by_dynamic_parser(self, ac_tokens_ids, ac_length=None, start_pos=0):
+        """
+        the token by token parse of get_all_token_mask_train. It is the default, the compiled parser is used if
+        args_util.use_compiled_slk is True.
+        """
         if isinstance(ac_tokens_ids, torch.Tensor):
             token_ids_list = self.filter_code_ids(ac_tokens_ids, ac_length, start_pos=start_pos)
         else:
@@ -135,6 +190,70 @@ class TransformVocabularyAndSLK(object):
 
         return token_true_id_res
 
+    def create_vocabulary_bits(self, id_set):
+        mask = np.zeros(self.vocab.vocabulary_size, dtype=bool)
+        mask[list(id_set)] = True
+        return np.packbits(mask)
+
+    def _get_terminal_mask(self, terminal_bitset):
+        if terminal_bitset not in self._terminal_mask_cache:
+            slk_type = self.compiled_parser.bitset_to_labels(terminal_bitset)
+            # the part of convert_slk_type_to_token_set which doesn't depend on the code
+            static_set = set()
+            if 'END_OF_SLK_INPUT' in slk_type:
+                static_set |= self.end_label_vocabulary_set
+            if 'ID' in slk_type:
+                static_set |= self.pre_defined_c_identifier_library_set
+            if 'TYPEID' in slk_type:
+                static_set |= self.pre_defined_c_typeid_library_set
+            for t in slk_type:
+                if t in self.keyword_vocabulary_dict.keys():
+                    static_set.add(self.keyword_vocabulary_dict[t])
+            flags = [label in slk_type for label in ('ID', 'TYPEID', 'STRING_LITERAL', 'CONSTANT')]
+            self._terminal_mask_cache[terminal_bitset] = (self.create_vocabulary_bits(static_set), flags)
+        return self._terminal_mask_cache[terminal_bitset]
+
+    def create_token_mask_matrix(self, token_ids):
+        """
+        the grammar mask of all positions of one code by the compiled slk parser. The row i is the same as
+        convert_slk_type_to_token_set of the position i of get_all_token_mask_train_by_dynamic_parser.
+        :return: a bool array [len(token_ids) + 1, vocabulary_size]
+        """
+        tokens = [self.id_to_token_dict[i] for i in token_ids]
+        try:
+            label_vocabulary = self.compiled_parser.label_vocabulary
+            labels = self.compiled_vocabulary.slk_label_ids(token_ids) if self.compiled_vocabulary is not None \
+                else None
+            if labels is None or min(labels, default=0) < 0:
+                # get_label_id raises the error of the token which is not a terminal
+                labels = [label_vocabulary.get_label_id(tok.type) for tok in tokens]
+            terminal_bitsets, typedef_names = self.compiled_parser.parse(labels, [tok.value for tok in tokens])
+        except Exception as e:
+            info(str(e))
+            info(' '.join([tok.value for tok in tokens]))
+            info([tok.type for tok in tokens])
+            raise Exception('slk error: ' + str(e))
+
+        terminal_masks = [self._get_terminal_mask(b) for b in terminal_bitsets]
+        mask = np.stack([m[0] for m in terminal_masks])
+        flags = np.array([m[1] for m in terminal_masks], dtype=bool)
+
+        typeid_bits_dict = {}
+        for names in typedef_names:
+            if names not in typeid_bits_dict:
+                typeid_set = {self.vocab.word_to_id(x) for x in names if x in self.vocab.word_to_id_dict}
+                typeid_bits_dict[names] = self.create_vocabulary_bits(typeid_set) | \
+                                          self.pre_defined_c_typeid_library_bits
+        typeid_bits = np.stack([typeid_bits_dict[names] for names in typedef_names])
+
+        id_set, string_set, constant_set = self.create_id_constant_string_set_id_by_ids(token_ids)
+        id_bits = self.create_vocabulary_bits(id_set - self.pre_defined_c_typeid_library_set)
+        mask |= np.where(flags[:, 0:1], id_bits & ~typeid_bits, 0).astype(np.uint8)
+        mask |= np.where(flags[:, 1:2], typeid_bits, 0).astype(np.uint8)
+        mask |= np.where(flags[:, 2:3], self.create_vocabulary_bits(string_set), 0).astype(np.uint8)
+        mask |= np.where(flags[:, 3:4], self.create_vocabulary_bits(constant_set), 0).astype(np.uint8)
+        return np.unpackbits(mask, axis=1, count=self.vocab.vocabulary_size).astype(bool)
+
     def create_new_slk_iterator(self):
         return self.parser.new()
 
@@ -154,14 +273,19 @@ class TransformVocabularyAndSLK(object):
         return token_id_list
 
 
-@disk_cache(basename='create_string_vocabulary_set', directory=CACHE_DATA_PATH)
+def vocabulary_key(vocab, *args):
+    # the vocabulary is keyed by its words and the other arguments by value
+    return vocabulary_fingerprint(vocab), args
+
+
+@disk_cache(basename='create_string_vocabulary_set', directory=CACHE_DATA_PATH, key=vocabulary_key)
 def create_string_vocabulary_set(vocab, tokenize_fn):
     string_label = ['STRING_LITERAL', 'WSTRING_LITERAL']
     token_set = create_special_type_vocabulary_mask(vocab, tokenize_fn, string_label)
     return token_set
 
 
-@disk_cache(basename='create_constant_vocabulary_set', directory=CACHE_DATA_PATH)
+@disk_cache(basename='create_constant_vocabulary_set', directory=CACHE_DATA_PATH, key=vocabulary_key)
 def create_constant_vocabulary_set(vocab, tokenize_fn):
     constant_label = ['INT_CONST_DEC', 'INT_CONST_OCT', 'INT_CONST_HEX', 'INT_CONST_BIN',
                       'FLOAT_CONST', 'HEX_FLOAT_CONST', 'CHAR_CONST', 'WCHAR_CONST']
@@ -169,21 +293,21 @@ def create_constant_vocabulary_set(vocab, tokenize_fn):
     return token_set
 
 
-@disk_cache(basename='create_identifier_vocabulary_set', directory=CACHE_DATA_PATH)
+@disk_cache(basename='create_identifier_vocabulary_set', directory=CACHE_DATA_PATH, key=vocabulary_key)
 def create_identifier_vocabulary_set(vocab, tokenize_fn):
     constant_label = ['ID']
     token_set = create_special_type_vocabulary_mask(vocab, tokenize_fn, constant_label)
     return token_set
 
 
-@disk_cache(basename='create_end_label_vocabulary_set', directory=CACHE_DATA_PATH)
+@disk_cache(basename='create_end_label_vocabulary_set', directory=CACHE_DATA_PATH, key=vocabulary_key)
 def create_end_label_vocabulary_set(vocab, tokenize_fn):
     end_id = vocab.word_to_id(vocab.end_tokens[0])
     token_set = {end_id}
     return token_set
 
 
-@disk_cache(basename='create_keyword_vocabulary_dict', directory=CACHE_DATA_PATH)
+@disk_cache(basename='create_keyword_vocabulary_dict', directory=CACHE_DATA_PATH, key=vocabulary_key)
 def create_keyword_vocabulary_dict(vocab):
     keyword_dict = {}
     for label, word in pre_defined_c_tokens_map.items():
@@ -192,7 +316,7 @@ def create_keyword_vocabulary_dict(vocab):
     return keyword_dict
 
 
-@disk_cache(basename='create_pre_defined_c_library_identifier_vocabulary_set', directory=CACHE_DATA_PATH)
+@disk_cache(basename='create_pre_defined_c_library_identifier_vocabulary_set', directory=CACHE_DATA_PATH, key=vocabulary_key)
 def create_pre_defined_c_library_identifier_vocabulary_set(vocab):
     library_set = set()
     for word in c_standard_library_defined_identifier:
@@ -201,7 +325,7 @@ def create_pre_defined_c_library_identifier_vocabulary_set(vocab):
     return library_set
 
 
-@disk_cache(basename='create_pre_defined_c_library_typeid_vocabulary_set', directory=CACHE_DATA_PATH)
+@disk_cache(basename='create_pre_defined_c_library_typeid_vocabulary_set', directory=CACHE_DATA_PATH, key=vocabulary_key)
 def create_pre_defined_c_library_typeid_vocabulary_set(vocab):
     library_set = set()
     for word in c_standard_library_defined_types:
@@ -210,7 +334,7 @@ def create_pre_defined_c_library_typeid_vocabulary_set(vocab):
     return library_set
 
 
-@disk_cache(basename='create_ids_to_token_dict', directory=CACHE_DATA_PATH)
+@disk_cache(basename='create_ids_to_token_dict', directory=CACHE_DATA_PATH, key=vocabulary_key)
 def create_ids_to_token_dict(vocab, tokenize_fn):
     special_token = set(vocab.begin_tokens) | set(vocab.end_tokens) | set(vocab.addition_tokens) | {vocab.unk}
     id_to_token_dict = {}
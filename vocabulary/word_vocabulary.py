@@ -1,3 +1,7 @@
+import itertools
+
+import numpy as np
+
 from common import util
 
 
@@ -30,15 +34,11 @@ class Vocabulary(object):
         self.id_to_word_dict[len(self.id_to_word_dict)] = token
 
     def word_to_id(self, word):
-        if word in self.word_to_id_dict.keys():
-            return self.word_to_id_dict[word]
-        else:
-            return self.word_to_id_dict[self.unk]
+        res = self.word_to_id_dict.get(word)
+        return self.word_to_id_dict[self.unk] if res is None else res
 
     def id_to_word(self, i):
-        if i not in self.id_to_word_dict.keys():
-            return self.unk
-        return self.id_to_word_dict[i]
+        return self.id_to_word_dict.get(i, self.unk)
 
     def parse_text(self, texts, use_position_label = False):
         """
@@ -59,6 +59,43 @@ class Vocabulary(object):
         texts = [[self.word_to_id(token) for token in text] for text in texts]
         return texts
 
+    def parse_text_to_array(self, texts, use_position_label=False):
+        """
+        the vectorized parse_text_without_pad of many texts
+        :return: (ids, offsets), the int64 ids of texts[i] are ids[offsets[i]:offsets[i+1]]
+        """
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        get = self.word_to_id_dict.get
+        unk_id = self.word_to_id_dict[self.unk]
+        # the words are looked up by the C loop of map
+        ids = np.fromiter(map(get, itertools.chain.from_iterable(texts), itertools.repeat(unk_id)), dtype=np.int64,
+                          count=int(lengths.sum()))
+        if use_position_label:
+            begin_ids = [self.word_to_id(t) for t in self.begin_tokens]
+            end_ids = [self.word_to_id(t) for t in self.end_tokens]
+            extra = len(begin_ids) + len(end_ids)
+            starts = np.concatenate([[0], np.cumsum(lengths + extra)])
+            res = np.empty(starts[-1], dtype=np.int64)
+            for k, begin_id in enumerate(begin_ids):
+                res[starts[:-1] + k] = begin_id
+            for k, end_id in enumerate(end_ids):
+                res[starts[1:] - len(end_ids) + k] = end_id
+            text_offsets = np.concatenate([[0], np.cumsum(lengths)])
+            res[np.repeat(starts[:-1] + len(begin_ids) - text_offsets[:-1], lengths) + np.arange(len(ids))] = ids
+            return res, starts
+        return ids, np.concatenate([[0], np.cumsum(lengths)])
+
+    def parse_text_to_padded_array(self, texts, use_position_label=False, pad_id=0):
+        """
+        the vectorized parse_text of many texts
+        :return: an int64 array [len(texts), the max length], padded by pad_id
+        """
+        ids, offsets = self.parse_text_to_array(texts, use_position_label)
+        lengths = np.diff(offsets)
+        res = np.full((len(texts), lengths.max() if len(texts) > 0 else 0), pad_id, dtype=np.int64)
+        res[np.arange(res.shape[1]) < lengths[:, None]] = ids
+        return res
+
     @property
     def vocabulary_size(self):
         return len(self.id_to_word_dict)